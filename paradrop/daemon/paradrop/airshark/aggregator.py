@@ -0,0 +1,211 @@
+"""
+Aggregate spectral samples into spectrograms (requires NumPy).
+
+Raw spectral samples arrive at a rate of about 160 KB/s, which is too much
+to send to every web client.  The aggregator groups samples into time bins
+of a client-chosen length using the card's TSF timer and summarizes the
+power of each subcarrier per channel.  Each frame looks like this:
+
+    {
+      "tsf": 1234500000,
+      "resolution": 0.5,
+      "channels": [
+        {
+          "freq": 2437,
+          "count": 210,
+          "min": [...],
+          "max": [...],
+          "avg": [...],
+          "percentile": [...]
+        }
+      ]
+    }
+
+The lists have one value in dBm for each of the 56 subcarriers (see
+SpectrumReader.sc_offsets for their frequencies).  The average is computed
+in linear power and converted back to dBm.
+
+The aggregator keeps running statistics for each channel in the current bin
+instead of the samples themselves, so its memory use does not depend on the
+resolution.  Percentiles are estimated from a histogram of the power of
+each subcarrier with HISTOGRAM_STEP dB buckets.
+"""
+
+from .spectrum_reader import numpy
+
+
+# Round power values to this many decimal places to keep frames small.
+PRECISION = 1
+
+# Range (dBm) and bucket width (dB) of the percentile histograms.  Values
+# outside of the range are counted in the first or last bucket.
+HISTOGRAM_MIN = -160.0
+HISTOGRAM_MAX = 40.0
+HISTOGRAM_STEP = 0.5
+HISTOGRAM_BUCKETS = int((HISTOGRAM_MAX - HISTOGRAM_MIN) / HISTOGRAM_STEP)
+
+
+class ChannelSummary(object):
+    """
+    Running statistics of the power of each subcarrier on one channel.
+    """
+    def __init__(self, subcarriers):
+        self.count = 0
+        self.min = numpy.full(subcarriers, numpy.inf)
+        self.max = numpy.full(subcarriers, -numpy.inf)
+        self.linear_sum = numpy.zeros(subcarriers)
+        self.histogram = numpy.zeros((subcarriers, HISTOGRAM_BUCKETS),
+                                     dtype=numpy.int64)
+
+    def add(self, values):
+        """
+        Add the power values (one row per sample) to the summary.
+        """
+        subcarriers = values.shape[1]
+        self.count += len(values)
+        self.min = numpy.minimum(self.min, values.min(axis=0))
+        self.max = numpy.maximum(self.max, values.max(axis=0))
+        self.linear_sum += numpy.power(10.0, values / 10.0).sum(axis=0)
+
+        buckets = ((values - HISTOGRAM_MIN) / HISTOGRAM_STEP).astype(numpy.int64)
+        buckets = numpy.clip(buckets, 0, HISTOGRAM_BUCKETS - 1)
+        buckets += numpy.arange(subcarriers) * HISTOGRAM_BUCKETS
+        self.histogram += numpy.bincount(buckets.ravel(),
+                minlength=subcarriers * HISTOGRAM_BUCKETS).reshape(
+                        subcarriers, HISTOGRAM_BUCKETS)
+
+    def percentile(self, q):
+        """
+        Estimate the q-th percentile of each subcarrier.
+
+        The result is the center of the bucket that holds the value at that
+        rank, limited to the observed minimum and maximum.
+        """
+        rank = numpy.floor(q / 100.0 * (self.count - 1))
+        cumulative = numpy.cumsum(self.histogram, axis=1)
+        index = numpy.argmax(cumulative > rank, axis=1)
+        values = HISTOGRAM_MIN + (index + 0.5) * HISTOGRAM_STEP
+        return numpy.clip(values, self.min, self.max)
+
+
+class SpectrumAggregator(object):
+    def __init__(self, resolution, percentile=90):
+        """
+        resolution: length of a time bin in seconds.
+        percentile: percentile of the power to report for each subcarrier.
+        """
+        self.resolution = resolution
+        self.percentile = percentile
+
+        # TSF is in microseconds.
+        self.period = max(1, int(resolution * 1000000))
+
+        self.bin = None
+
+        # Map frequency -> ChannelSummary for the current bin.
+        self.channels = {}
+
+    def add(self, samples, power):
+        """
+        Add decoded samples and their power (from SpectrumReader.decode_array
+        and compute_power).
+
+        Returns a list of frames for the time bins that were completed.
+        """
+        frames = []
+        if len(samples) == 0:
+            return frames
+
+        bins = samples['tsf'] // self.period
+
+        # Split the samples into runs that fall in the same bin.  The TSF can
+        # jump backwards (e.g. after a reset), which also ends a bin.
+        breaks = numpy.flatnonzero(bins[1:] != bins[:-1]) + 1
+        starts = [0] + breaks.tolist()
+        ends = breaks.tolist() + [len(samples)]
+
+        for start, end in zip(starts, ends):
+            b = int(bins[start])
+            if self.bin is not None and b != self.bin:
+                frames.append(self.flush())
+            self.bin = b
+
+            freqs = samples['freq'][start:end]
+            values = power[start:end]
+            for freq in numpy.unique(freqs):
+                summary = self.channels.get(int(freq))
+                if summary is None:
+                    summary = ChannelSummary(power.shape[1])
+                    self.channels[int(freq)] = summary
+                summary.add(values[freqs == freq])
+
+        return frames
+
+    def flush(self):
+        """
+        Summarize the current bin and start a new one.
+
+        Returns a frame or None if there are no pending samples.
+        """
+        if len(self.channels) == 0:
+            return None
+
+        frame = {
+            'tsf': self.bin * self.period,
+            'resolution': self.resolution,
+            'channels': []
+        }
+
+        for freq in sorted(self.channels):
+            summary = self.channels[freq]
+            avg = 10 * numpy.log10(summary.linear_sum / summary.count)
+            frame['channels'].append({
+                'freq': freq,
+                'count': summary.count,
+                'min': numpy.round(summary.min, PRECISION).tolist(),
+                'max': numpy.round(summary.max, PRECISION).tolist(),
+                'avg': numpy.round(avg, PRECISION).tolist(),
+                'percentile': numpy.round(summary.percentile(self.percentile),
+                                          PRECISION).tolist()
+            })
+
+        self.bin = None
+        self.channels = {}
+        return frame
+
+
+def merge_frames(first, second):
+    """
+    Combine two consecutive frames into one frame that covers both.
+
+    The minimum, maximum and count-weighted average are exact.  Percentiles cannot
+    be combined exactly, so the larger of the two values is reported.
+    """
+    channels = {}
+    for channel in first['channels']:
+        channels[channel['freq']] = channel
+
+    for channel in second['channels']:
+        prev = channels.get(channel['freq'])
+        if prev is None:
+            channels[channel['freq']] = channel
+            continue
+
+        count = prev['count'] + channel['count']
+        linear = (prev['count'] * numpy.power(10.0, numpy.array(prev['avg']) / 10.0) +
+                  channel['count'] * numpy.power(10.0, numpy.array(channel['avg']) / 10.0)) / count
+        channels[channel['freq']] = {
+            'freq': channel['freq'],
+            'count': count,
+            'min': numpy.minimum(prev['min'], channel['min']).tolist(),
+            'max': numpy.maximum(prev['max'], channel['max']).tolist(),
+            'avg': numpy.round(10 * numpy.log10(linear), PRECISION).tolist(),
+            'percentile': numpy.maximum(prev['percentile'],
+                                        channel['percentile']).tolist()
+        }
+
+    return {
+        'tsf': first['tsf'],
+        'resolution': (second['tsf'] - first['tsf']) / 1000000.0 + second['resolution'],
+        'channels': [channels[freq] for freq in sorted(channels)]
+    }
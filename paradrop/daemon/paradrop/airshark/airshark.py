@@ -7,6 +7,8 @@ from paradrop.base import settings
 from paradrop.lib.utils import pdos
 from paradrop.core.config.airshark import airshark_interface_manager
 from .scanner import Scanner
+from .spectrum_reader import SpectrumReader, numpy
+from .aggregator import SpectrumAggregator
 from .analyzer import AnalyzerProcessProtocol
 
 
@@ -19,6 +21,14 @@ class AirsharkManager(object):
         self.spectrum_observers = []
         self.analyzer_observers = []
 
+        # Observers of aggregated spectrum frames, and one aggregator for
+        # each (resolution, percentile) that observers asked for.
+        self.aggregate_observers = {}
+        self.aggregators = {}
+
+        # Subscriptions of spectrum clients, for statistics.
+        self.subscriptions = []
+
         airshark_interface_manager.add_observer(self)
 
     def status(self):
@@ -74,22 +84,35 @@ class AirsharkManager(object):
     def check_spectrum(self):
         # The bandwidth of the data is about 160k Bytes per second
         ts, data = self.scanner.spectrum_reader.read_samples()
-        if ((data is not None) and (len(self.spectrum_observers) > 0 or self.analyzer_process.isRunning())):
-            if len(self.spectrum_observers) > 0:
-                #for (tsf, max_exp, freq, rssi, noise, max_mag, max_index, bitmap_weight, sdata) in SpectrumReader.decode(data):
-                #    for observer in self.spectrum_observers:
-                #        observer.on_spectrum_data(tsf, max_exp, freq, rssi, noise, max_mag, max_index, bitmap_weight, sdata)
-
-                # Due to performance issue, we have to delegate the packet decoding task to clients
-                # for packet in SpectrumReader.decode(data):
-                #    for observer in self.spectrum_observers:
-                #        observer.on_spectrum_data(packet)
-                for observer in self.spectrum_observers:
-                    observer.on_spectrum_data(data)
-
-            if self.analyzer_process.isRunning():
-                # Forward spectrum data to the airshark analyzer
-                self.analyzer_process.feedSpectrumData(data)
+        if data is None:
+            return
+
+        if len(self.spectrum_observers) > 0:
+            # Clients that ask for raw data decode the packets themselves.
+            for observer in self.spectrum_observers:
+                observer.on_spectrum_data(data)
+
+        if len(self.aggregate_observers) > 0:
+            self.aggregate_spectrum(data)
+
+        if self.analyzer_process.isRunning():
+            # Forward spectrum data to the airshark analyzer
+            self.analyzer_process.feedSpectrumData(data)
+
+    def aggregate_spectrum(self, data):
+        """
+        Decode spectrum data once and pass it to all of the aggregators.
+        """
+        samples = SpectrumReader.decode_array(data)
+        if len(samples) == 0:
+            return
+        power = SpectrumReader.compute_power(samples)
+
+        for key, aggregator in self.aggregators.items():
+            for frame in aggregator.add(samples, power):
+                for observer, observer_key in list(self.aggregate_observers.items()):
+                    if observer_key == key:
+                        observer.on_spectrum_frame(frame)
 
     # TODO: Not sure we need it or not
     def read_raw_samples(self):
@@ -117,3 +140,39 @@ class AirsharkManager(object):
     def remove_analyzer_observer(self, observer):
         if (self.analyzer_observers.count(observer) == 1):
             self.analyzer_observers.remove(observer)
+
+    def add_aggregate_observer(self, observer, resolution, percentile=90):
+        """
+        Send spectrogram frames with the given time resolution (seconds) to
+        the observer's on_spectrum_frame method (requires NumPy).
+        """
+        if numpy is None:
+            raise Exception("Spectrum aggregation requires NumPy")
+
+        key = (resolution, percentile)
+        if key not in self.aggregators:
+            self.aggregators[key] = SpectrumAggregator(resolution, percentile)
+        self.aggregate_observers[observer] = key
+
+    def remove_aggregate_observer(self, observer):
+        key = self.aggregate_observers.pop(observer, None)
+        if key is not None and key not in self.aggregate_observers.values():
+            del self.aggregators[key]
+
+    def add_subscription(self, subscription):
+        if (self.subscriptions.count(subscription) == 0):
+            self.subscriptions.append(subscription)
+
+    def remove_subscription(self, subscription):
+        if (self.subscriptions.count(subscription) == 1):
+            self.subscriptions.remove(subscription)
+
+    def get_spectrum_stats(self):
+        """
+        Return queue depth and drop counters of the spectrum clients and the
+        analyzer.
+        """
+        return {
+            'subscribers': [sub.stats() for sub in self.subscriptions],
+            'analyzer': self.analyzer_process.stats()
+        }
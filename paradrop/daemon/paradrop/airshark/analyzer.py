@@ -1,10 +1,24 @@
+from twisted.internet import interfaces
 from twisted.internet.protocol import ProcessProtocol
+from zope.interface import implementer
+
 from paradrop.base.output import out
 
+
+@implementer(interfaces.IPushProducer)
 class AnalyzerProcessProtocol(ProcessProtocol):
+    """
+    Run the airshark analyzer and feed it spectrum data.
+
+    The protocol is registered as a producer for the analyzer's spectrum
+    pipe.  If the analyzer falls behind and the pipe's buffer fills up,
+    spectrum data is dropped until the buffer drains.
+    """
     def __init__(self, airshark_manager):
         self.ready = False
         self.airshark_manager = airshark_manager
+        self.paused = False
+        self.dropped = 0
 
     def isRunning(self):
         return self.ready
@@ -12,6 +26,11 @@ class AnalyzerProcessProtocol(ProcessProtocol):
     def connectionMade(self):
         out.info('Airshark analyzer process starts')
         self.ready = True
+        self.paused = False
+
+        pipes = getattr(self.transport, 'pipes', {})
+        if 3 in pipes:
+            pipes[3].registerProducer(self, True)
 
     def childDataReceived(self, childFd, data):
         if (childFd == 4):
@@ -27,7 +46,26 @@ class AnalyzerProcessProtocol(ProcessProtocol):
         self.ready = False
 
     def feedSpectrumData(self, data):
-        self.transport.writeToChild(3, data)
+        if self.paused:
+            self.dropped += len(data)
+        else:
+            self.transport.writeToChild(3, data)
+
+    def stats(self):
+        return {
+            'running': self.ready,
+            'paused': self.paused,
+            'dropped_bytes': self.dropped
+        }
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.paused = True
 
     def stop(self):
         self.transport.signalProcess('KILL')
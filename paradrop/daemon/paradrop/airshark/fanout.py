@@ -0,0 +1,200 @@
+"""
+Deliver spectrum data to websocket clients with backpressure.
+
+Each client has a Subscription, which is registered as a streaming producer
+with the client's transport.  When the transport's write buffer fills up,
+Twisted pauses the subscription, and new messages are queued instead of
+being sent.  The queue is bounded, and the subscription's policy decides
+what happens to messages that a slow client cannot keep up with:
+
+latest
+    Keep only the newest message.
+decimate
+    Keep every message until the queue is full, then drop every other
+    queued message, which keeps the whole time span at a lower rate.
+aggregate
+    Merge new messages into the last queued message with a merge function,
+    e.g. concatenate raw samples or combine spectrogram frames.
+
+A client can also ask for a maximum message rate, in which case messages
+that arrive too soon are handled by the same policy.
+"""
+
+from collections import deque
+
+from twisted.internet import interfaces, reactor
+from zope.interface import implementer
+
+from paradrop.base import settings
+from .spectrum_reader import SpectrumReader
+
+
+LATEST = "latest"
+DECIMATE = "decimate"
+AGGREGATE = "aggregate"
+
+POLICIES = [LATEST, DECIMATE, AGGREGATE]
+
+
+def merge_samples(first, second, limit=None):
+    """
+    Concatenate two buffers of raw spectral samples.
+
+    If the result would be longer than limit bytes, the oldest whole samples
+    are dropped.
+    """
+    if limit is None:
+        limit = settings.AIRSHARK_COALESCE_BYTES
+
+    data = first + second
+    excess = len(data) - limit
+    if excess > 0:
+        size = SpectrumReader.hdrsize + SpectrumReader.pktsize
+        excess = ((excess + size - 1) // size) * size
+        data = data[excess:]
+    return data
+
+
+@implementer(interfaces.IPushProducer)
+class Subscription(object):
+    def __init__(self, send, policy=LATEST, max_rate=None, merge=None,
+                 max_queue=None, name=None, clock=None):
+        """
+        send: function that writes one message to the client.
+        policy: one of POLICIES.
+        max_rate: maximum number of messages per second or None.
+        merge: function that merges two messages (aggregate policy).
+        max_queue: maximum number of queued messages.
+        name: name to show in the statistics, e.g. the client address.
+        clock: reactor to use for timing (for testing).
+        """
+        if policy not in POLICIES:
+            raise Exception("Invalid policy: {}".format(policy))
+        if policy == AGGREGATE and merge is None:
+            raise Exception("Aggregate policy requires a merge function")
+
+        if max_queue is None:
+            max_queue = settings.AIRSHARK_QUEUE_LIMIT
+        if clock is None:
+            clock = reactor
+
+        self.send = send
+        self.policy = policy
+        self.max_rate = max_rate
+        self.merge = merge
+        self.max_queue = max(1, max_queue)
+        self.name = name
+        self.clock = clock
+
+        self.queue = deque()
+        self.paused = False
+        self.stopped = False
+        self.last_sent = None
+        self.pending_call = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.merged = 0
+
+    def publish(self, message):
+        """
+        Send the message now if the client is ready or queue it.
+        """
+        if self.stopped:
+            return
+
+        if len(self.queue) == 0 and not self.paused and self._delay() <= 0:
+            self._send(message)
+            return
+
+        if self.policy == LATEST:
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.queue.append(message)
+
+        elif self.policy == DECIMATE:
+            self.queue.append(message)
+            if len(self.queue) > self.max_queue:
+                # Keep the newest message and every other one before it.
+                kept = list(self.queue)[(len(self.queue) - 1) % 2::2]
+                self.dropped += len(self.queue) - len(kept)
+                self.queue = deque(kept)
+
+        elif len(self.queue) > 0:
+            self.queue.append(self.merge(self.queue.pop(), message))
+            self.merged += 1
+
+        else:
+            self.queue.append(message)
+
+        self._schedule()
+
+    def stats(self):
+        """
+        Return a dictionary with the state of the subscription.
+        """
+        return {
+            'name': self.name,
+            'policy': self.policy,
+            'max_rate': self.max_rate,
+            'paused': self.paused,
+            'queue_depth': len(self.queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'merged': self.merged
+        }
+
+    def _delay(self):
+        """
+        Return the time until the next message may be sent.
+        """
+        if self.max_rate is None or self.last_sent is None:
+            return 0
+        return self.last_sent + 1.0 / self.max_rate - self.clock.seconds()
+
+    def _flush(self):
+        self.pending_call = None
+        while len(self.queue) > 0 and not self.paused and not self.stopped:
+            if self._delay() > 0:
+                self._schedule()
+                break
+            self._send(self.queue.popleft())
+
+    def _schedule(self):
+        """
+        Flush the queue when the rate limit allows it.
+
+        While paused, the queue is flushed by resumeProducing instead.
+        """
+        if self.paused or self.stopped or self.pending_call is not None:
+            return
+        self.pending_call = self.clock.callLater(max(0, self._delay()),
+                                                 self._flush)
+
+    def _send(self, message):
+        self.last_sent = self.clock.seconds()
+        self.sent += 1
+        self.send(message)
+
+    def _cancel(self):
+        if self.pending_call is not None and self.pending_call.active():
+            self.pending_call.cancel()
+        self.pending_call = None
+
+    #
+    # IPushProducer interface
+    #
+
+    def pauseProducing(self):
+        self.paused = True
+        self._cancel()
+
+    def resumeProducing(self):
+        self.paused = False
+        self._flush()
+
+    def stopProducing(self):
+        self.stopped = True
+        self.dropped += len(self.queue)
+        self.queue.clear()
+        self._cancel()
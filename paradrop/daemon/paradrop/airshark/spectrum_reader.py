@@ -1,9 +1,39 @@
 from __future__ import print_function
+import math
 import struct
 from datetime import datetime
 
 from twisted.internet.fdesc import setNonBlocking
 
+from paradrop.base.output import out
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Structured layout of one HT20 spectral sample, including the TLV header.
+# All multi-byte fields are big-endian.
+SAMPLE_FIELDS = [
+    ('type', 'u1'),
+    ('length', '>u2'),
+    ('max_exp', 'u1'),
+    ('freq', '>u2'),
+    ('rssi', 'i1'),
+    ('noise', 'i1'),
+    ('max_mag', '>u2'),
+    ('max_index', 'u1'),
+    ('bitmap_weight', 'u1'),
+    ('tsf', '>u8'),
+    ('data', 'u1', (56, ))
+]
+
+if numpy is not None:
+    SAMPLE_DTYPE = numpy.dtype(SAMPLE_FIELDS)
+else:
+    SAMPLE_DTYPE = None
+
 
 class SpectrumReader(object):
 
@@ -14,8 +44,13 @@ class SpectrumReader(object):
     # ieee 802.11 constants
     sc_wide = 0.3125  # in MHz
 
+    # Offset of each of the 56 HT20 subcarriers from the center frequency
+    # (MHz).  There is no subcarrier at the center.
+    sc_offsets = [0.3125 * (i - 28) if i < 28 else 0.3125 * (i - 27)
+                  for i in range(56)]
+
     def __init__(self, path):
-        self.fp = file(path)
+        self.fp = open(path, "rb")
         if not self.fp:
             raise Exception("Cant open file '%s'" % path)
 
@@ -63,46 +98,83 @@ class SpectrumReader(object):
 
                 yield packet
 
-                '''
-                (max_exp, freq, rssi, noise, max_mag, max_index, bitmap_weight, tsf) = \
-                    struct.unpack_from(">BHbbHBBQ", data, pos)
-                pos += 17
-
-                sdata = struct.unpack_from("56B", data, pos)
-                pos += 56
-
-                yield (tsf, max_exp, freq, rssi, noise, max_mag, max_index, bitmap_weight, sdata)
-
-                # calculate power in dBm
-                sumsq_sample = 0
-                samples = []
-                for raw_sample in sdata:
-                    if raw_sample == 0:
-                        sample = 1
-                    else:
-                        sample = raw_sample << max_exp
-                    sumsq_sample += sample*sample
-                    samples.append(sample)
-
-                if sumsq_sample == 0:
-                    sumsq_sample = 1
-                sumsq_sample = 10 * math.log10(sumsq_sample)
-
-                sc_total = 56  # HT20: 56 OFDM subcarriers
-
-                #first_sc = freq - SpectrumReader.sc_wide * (sc_total/2 + 0.5)
-                pwr = {}
-                for i, sample in enumerate(samples):
-                    subcarrier_freq = 0
-                    if i < 28:
-                        subcarrier_freq = freq - SpectrumReader.sc_wide * (28 - i)
-                    else:
-                        subcarrier_freq = freq + SpectrumReader.sc_wide * (i - 27)
-
-                    #subcarrier_freq = first_sc + i*SpectrumReader.sc_wide
-
-                    sigval = noise + rssi + 20 * math.log10(sample) - sumsq_sample
-                    pwr[subcarrier_freq] = sigval
-
-                yield (tsf, freq, noise, rssi, pwr)
-                '''
+    @staticmethod
+    def decode_power(data):
+        """
+        Decode samples and compute power one packet at a time (generator).
+
+        Yields (tsf, freq, noise, rssi, pwr) where pwr maps subcarrier
+        frequency to power in dBm.  This is the pure Python implementation;
+        decode_array and compute_power do the same with NumPy.
+        """
+        for packet in SpectrumReader.decode(data):
+            (max_exp, freq, rssi, noise, max_mag, max_index, bitmap_weight, tsf) = \
+                struct.unpack_from(">BHbbHBBQ", packet, 0)
+            sdata = struct.unpack_from("56B", packet, 17)
+
+            # calculate power in dBm
+            sumsq_sample = 0
+            samples = []
+            for raw_sample in sdata:
+                if raw_sample == 0:
+                    sample = 1
+                else:
+                    sample = raw_sample << max_exp
+                sumsq_sample += sample*sample
+                samples.append(sample)
+
+            if sumsq_sample == 0:
+                sumsq_sample = 1
+            sumsq_sample = 10 * math.log10(sumsq_sample)
+
+            pwr = {}
+            for i, sample in enumerate(samples):
+                subcarrier_freq = freq + SpectrumReader.sc_offsets[i]
+                sigval = noise + rssi + 20 * math.log10(sample) - sumsq_sample
+                pwr[subcarrier_freq] = sigval
+
+            yield (tsf, freq, noise, rssi, pwr)
+
+    @staticmethod
+    def decode_array(data):
+        """
+        Decode a buffer of spectral samples into a NumPy structured array
+        (requires NumPy).
+
+        The array has the fields in SAMPLE_FIELDS, e.g. tsf, freq, rssi,
+        noise, and data (56 magnitude bins).  Like decode, this stops at the
+        first malformed header and discards an incomplete sample at the end
+        of the buffer.
+        """
+        count = len(data) // SAMPLE_DTYPE.itemsize
+        samples = numpy.frombuffer(data, dtype=SAMPLE_DTYPE, count=count)
+
+        valid = (samples['type'] == 1) & \
+                (samples['length'] == SpectrumReader.pktsize)
+        if not valid.all():
+            end = numpy.argmin(valid)
+            out.warn("Skipping {} spectral samples after a malformed "
+                     "header".format(len(samples) - end))
+            samples = samples[:end]
+
+        return samples
+
+    @staticmethod
+    def compute_power(samples):
+        """
+        Compute the power in dBm of each subcarrier (requires NumPy).
+
+        Takes an array from decode_array and returns a float array with one
+        row per sample and one column per subcarrier.  The subcarrier
+        frequencies are freq + sc_offsets.
+        """
+        max_exp = samples['max_exp'].astype(numpy.float64)[:, None]
+        mags = samples['data'].astype(numpy.float64) * numpy.exp2(max_exp)
+        mags[samples['data'] == 0] = 1
+
+        sumsq = numpy.sum(mags * mags, axis=1)
+        sumsq[sumsq == 0] = 1
+
+        base = samples['noise'].astype(numpy.float64) + \
+            samples['rssi'].astype(numpy.float64) - 10 * numpy.log10(sumsq)
+        return base[:, None] + 20 * numpy.log10(mags)
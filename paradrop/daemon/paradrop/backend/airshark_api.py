@@ -24,3 +24,13 @@ class AirsharkApi(object):
         data['software_ready'] = software_ready
         data['airshark_running'] = airshark_running
         return json.dumps(data)
+
+    @routes.route('/spectrum/stats')
+    def spectrum_stats(self, request):
+        """
+        Report queue depth and drop counters for each spectrum client and
+        for the analyzer.
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(self.airshark_manager.get_spectrum_stats())
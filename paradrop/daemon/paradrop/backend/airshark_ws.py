@@ -1,29 +1,89 @@
+import json
+
 from autobahn.twisted.websocket import WebSocketServerProtocol
 from autobahn.twisted.websocket import WebSocketServerFactory
 
+from paradrop.airshark.aggregator import merge_frames
+from paradrop.airshark.fanout import LATEST, Subscription, merge_samples
 from paradrop.base.output import out
 
 class AirsharkSpectrumProtocol(WebSocketServerProtocol):
     def __init__(self, factory):
         WebSocketServerProtocol.__init__(self)
         self.factory = factory
+        self.subscription = None
 
     def onOpen(self):
         out.info('ws /airshark/spectrum connected')
-        self.factory.airshark_manager.add_spectrum_observer(self)
+        manager = self.factory.airshark_manager
+
+        if self.factory.resolution is None:
+            send = self.send_samples
+            merge = merge_samples
+        else:
+            send = self.send_frame
+            merge = merge_frames
+
+        # The transport pauses the subscription when its write buffer is
+        # full, so slow clients get fewer messages instead of an unbounded
+        # buffer.
+        self.subscription = Subscription(send, policy=self.factory.policy,
+                max_rate=self.factory.max_rate, merge=merge,
+                name=str(self.peer))
+
+        # The HTTP channel that handled the upgrade request is still
+        # registered as the producer for the connection, and a transport
+        # accepts only one.
+        if getattr(self.transport, 'producer', None) is not None:
+            self.transport.unregisterProducer()
+        self.transport.registerProducer(self.subscription, True)
+        manager.add_subscription(self.subscription)
+
+        if self.factory.resolution is None:
+            manager.add_spectrum_observer(self)
+        else:
+            manager.add_aggregate_observer(self, self.factory.resolution,
+                    self.factory.percentile)
 
     def on_spectrum_data(self, data):
+        self.subscription.publish(data)
+
+    def on_spectrum_frame(self, frame):
+        self.subscription.publish(frame)
+
+    def send_samples(self, data):
         self.sendMessage(data, True)
 
+    def send_frame(self, frame):
+        self.sendMessage(json.dumps(frame).encode('utf-8'), False)
+
     def onClose(self, wasClean, code, reason):
         out.info('ws /airshark/spectrum disconnected: {}'.format(reason))
-        self.factory.airshark_manager.remove_spectrum_observer(self)
+        manager = self.factory.airshark_manager
+        manager.remove_spectrum_observer(self)
+        manager.remove_aggregate_observer(self)
+        if self.subscription is not None:
+            self.subscription.stopProducing()
+            manager.remove_subscription(self.subscription)
 
 
 class AirsharkSpectrumFactory(WebSocketServerFactory):
-    def __init__(self, airshark_manager, *args, **kwargs):
+    """
+    Stream raw spectral samples, or if a resolution (seconds) is given,
+    aggregated spectrogram frames in JSON.
+
+    The policy (see paradrop.airshark.fanout) decides what happens to
+    messages when the client cannot keep up, and max_rate limits the number
+    of messages per second.
+    """
+    def __init__(self, airshark_manager, resolution=None, percentile=90,
+                 policy=LATEST, max_rate=None, *args, **kwargs):
         WebSocketServerFactory.__init__(self, *args, **kwargs)
         self.airshark_manager = airshark_manager
+        self.resolution = resolution
+        self.percentile = percentile
+        self.policy = policy
+        self.max_rate = max_rate
 
     def buildProtocol(self, addr):
         return AirsharkSpectrumProtocol(self)
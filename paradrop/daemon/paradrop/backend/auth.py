@@ -1,9 +1,14 @@
 import base64
+import collections
 import functools
+import hashlib
+import hmac
 import json
+import os
+import time
 
 from klein import Klein
-from twisted.internet import defer
+from twisted.internet import defer, threads
 
 from paradrop.base import nexus, settings
 from paradrop.base.output import out
@@ -41,23 +46,106 @@ def verify_password(password_manager, userpass):
     return password_manager.verify_password(user_name, password)
 
 
+class CredentialCache(object):
+    """
+    Bounded cache of recently verified Basic auth credentials.
+
+    Entries are keyed by an HMAC of the Authorization header under a random
+    per-process key, so the cache does not hold passwords or unsalted hashes
+    of them.  Entries expire after a fixed time and are also invalidated when
+    the password manager version changes.
+    """
+    def __init__(self, ttl=None, size=None):
+        if ttl is None:
+            ttl = settings.AUTH_CACHE_TTL
+        if size is None:
+            size = settings.AUTH_CACHE_SIZE
+
+        self.ttl = ttl
+        self.size = size
+        self.key = os.urandom(32)
+        self.entries = collections.OrderedDict()
+
+    def digest(self, header):
+        if not isinstance(header, bytes):
+            header = header.encode('utf-8')
+        return hmac.new(self.key, header, hashlib.sha256).digest()
+
+    def add(self, header, version):
+        key = self.digest(header)
+        self.entries.pop(key, None)
+        self.entries[key] = (time.time() + self.ttl, version)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def check(self, header, version):
+        """
+        Check if the header was verified recently under the same version of
+        the password database.
+        """
+        key = self.digest(header)
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return False
+
+        expires, entry_version = entry
+        if expires < time.time() or entry_version != version:
+            del self.entries[key]
+            return False
+
+        return True
+
+    def clear(self):
+        self.entries.clear()
+
+
+credential_cache = CredentialCache()
+
+# Limits the number of password hashes computed concurrently in the thread
+# pool.
+hash_semaphore = defer.DeferredSemaphore(settings.AUTH_HASH_CONCURRENCY)
+
+# Set of chute API tokens and the state of the chute list it was built from.
+bearer_index = {
+    'key': None,
+    'tokens': frozenset()
+}
+
+
 def get_allowed_bearer():
     """
     Return set of allowed bearer tokens.
+
+    The set is rebuilt only when the chute list has changed.
     """
+    chuteStore = ChuteStorage()
+
+    key = (ChuteStorage.generation, id(ChuteStorage.chuteList))
+    if bearer_index['key'] == key:
+        return bearer_index['tokens']
+
     allowed = set()
 
-    chuteStore = ChuteStorage()
     chutes = chuteStore.getChuteList()
     for chute in chutes:
         token = chute.getCache('apiToken')
         if token is not None:
             allowed.add(token)
 
-    return allowed
+    bearer_index['key'] = key
+    bearer_index['tokens'] = frozenset(allowed)
+    return bearer_index['tokens']
 
 
 def check_auth(request, password_manager, token_manager):
+    """
+    Check the Authorization header of a request.
+
+    Returns True or False, or a Deferred that fires with True or False if the
+    password hash needs to be computed.  Hashing is done in the thread pool
+    so that it does not block the reactor.
+    """
     auth_header = request.getHeader('Authorization')
     if auth_header is None:
         return False
@@ -66,7 +154,23 @@ def check_auth(request, password_manager, token_manager):
     if parts[0] == "Basic":
         username, password = get_username_password(parts[1])
         request.user = User(username, "localhost", role="admin")
-        return password_manager.verify_password(username, password)
+
+        # Capture the version before hashing so that a password change while
+        # we are working invalidates the result.
+        version = getattr(password_manager, 'version', None)
+        if credential_cache.check(auth_header, version):
+            return True
+
+        def verified(result):
+            if result:
+                credential_cache.add(auth_header, version)
+            return result
+
+        d = hash_semaphore.run(threads.deferToThread,
+                password_manager.verify_password, username, password)
+        d.addCallback(verified)
+        return d
+
     elif parts[0] == "Bearer":
         token = parts[1]
 
@@ -106,13 +210,19 @@ def requires_auth(func):
     """
     @functools.wraps(func)
     def decorated(self, request, *args, **kwargs):
-        if not check_auth(request, self.password_manager, self.token_manager):
-            out.info('HTTP {} {} {} {}'.format(request.getClientIP(),
-                request.method, request.path, 401))
-            request.setResponseCode(401)
-            request.setHeader("WWW-Authenticate", "Basic realm=\"Login Required\"")
-            return
-        return func(self, request, *args, **kwargs)
+        def handle(allowed):
+            if not allowed:
+                out.info('HTTP {} {} {} {}'.format(request.getClientIP(),
+                    request.method, request.path, 401))
+                request.setResponseCode(401)
+                request.setHeader("WWW-Authenticate", "Basic realm=\"Login Required\"")
+                return
+            return func(self, request, *args, **kwargs)
+
+        result = check_auth(request, self.password_manager, self.token_manager)
+        if isinstance(result, defer.Deferred):
+            return result.addCallback(handle)
+        return handle(result)
     return decorated
 
 
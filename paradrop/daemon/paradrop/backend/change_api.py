@@ -6,6 +6,20 @@ from paradrop.base import pdutils
 from . import cors
 
 
+def dump_update(update, status):
+    result = {
+        'id': update.change_id,
+        'updateClass': update.updateClass,
+        'updateType': update.updateType,
+        'user': update.user.__dict__,
+        'name': getattr(update, 'name', None),
+        'version': getattr(update, 'version', None),
+        'status': status,
+        'timing': update.get_timing()
+    }
+    return result
+
+
 class ChangeApi(object):
     routes = Klein()
 
@@ -28,18 +42,6 @@ class ChangeApi(object):
 
         changes = []
 
-        def dump_update(update, status):
-            result = {
-                'id': update.change_id,
-                'updateClass': update.updateClass,
-                'updateType': update.updateType,
-                'user': update.user.__dict__,
-                'name': getattr(update, 'name', None),
-                'version': getattr(update, 'version', None),
-                'status': status
-            }
-            return result
-
         for update in self.update_manager.active_changes.values():
             changes.append(dump_update(update, 'processing'))
 
@@ -48,6 +50,36 @@ class ChangeApi(object):
 
         return json.dumps(changes)
 
+    @routes.route('/<int:change_id>', methods=['GET'])
+    def get_change(self, request, change_id):
+        """
+        Get information about an active, queued, or recently completed change.
+
+        The result includes timing information for the change: when it was
+        created, started, and completed, and how long it spent waiting in the
+        work queue.
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+
+        update = self.update_manager.find_change(change_id)
+        if update is None:
+            request.setResponseCode(404)
+            return "{}"
+
+        if update.change_id in self.update_manager.active_changes:
+            status = 'processing'
+        elif update.completed:
+            status = 'completed'
+        else:
+            status = 'queued'
+
+        result = dump_update(update, status)
+        if update.completed:
+            result['success'] = update.result.get('success', None)
+
+        return json.dumps(result)
+
     @routes.route('/', methods=['POST'])
     def create_change(self, request):
         """
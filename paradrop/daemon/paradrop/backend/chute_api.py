@@ -6,7 +6,6 @@ Endpoints for these functions can be found under /api/v1/chutes.
 
 import json
 import os
-import re
 import subprocess
 import tarfile
 import tempfile
@@ -19,12 +18,13 @@ from klein import Klein
 from paradrop.base import pdutils, settings
 from paradrop.base.output import out
 from paradrop.core.chute.chute_storage import ChuteStorage
-from paradrop.core.config import resource
+from paradrop.core.config import leases, resource, stations
 from paradrop.core.container.chutecontainer import ChuteContainer
 from paradrop.lib.utils import pdosq
 
 from . import cors
 from . import hostapd_control
+from .lease_ws import LeaseStreamFactory
 
 
 class ChuteCacheEncoder(json.JSONEncoder):
@@ -720,6 +720,12 @@ class ChuteApi(object):
 
         Returns a list of DHCP lease records with the following fields:
 
+        as_of
+          time that the lease file was last updated (seconds since Unix epoch)
+        chute
+          name of the chute
+        network
+          name of the chute network
         expires
           lease expiration time (seconds since Unix epoch)
         mac_addr
@@ -746,11 +752,14 @@ class ChuteApi(object):
 
            [
              {
+               "as_of": 1511806276.2,
+               "chute": "captive-portal",
                "client_id": "01:5c:59:48:7d:b9:e6",
-               "expires": "1511816276",
+               "expires": 1511816276,
                "ip_addr": "192.168.128.64",
                "mac_addr": "5c:59:48:7d:b9:e6",
-               "hostname": "paradrops-iPod"
+               "hostname": "paradrops-iPod",
+               "network": "wifi"
              }
            ]
         """
@@ -769,24 +778,71 @@ class ChuteApi(object):
         leasefile = 'dnsmasq-{}.leases'.format(network)
         path = os.path.join(externalSystemDir, leasefile)
 
-        # The format of the dnsmasq leases file is one entry per line with
-        # space-separated fields.
-        keys = ['expires', 'mac_addr', 'ip_addr', 'hostname', 'client_id']
-
-        try:
-            leases = []
-            with open(path, 'r') as source:
-                for line in source:
-                    parts = line.strip().split()
-                    leases.append(dict(zip(keys, parts)))
-            return json.dumps(leases)
-
-        except IOError:
+        result = leases.index.getFileLeases(path, chute)
+        if result is None:
             # During chute uninstallation, there is a small window where the
             # chute still exists but the leases file has been removed.
             request.setResponseCode(404)
             return "[]"
 
+        return json.dumps(result)
+
+    @routes.route('/<chute>/leases', methods=['GET'])
+    def get_all_leases(self, request, chute):
+        """
+        Get current DHCP leases for all of the chute's networks.
+
+        Returns an object mapping network name to a list of lease records in
+        the same format as /api/v1/chutes/<chute>/networks/<network>/leases.
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+           GET /api/v1/chutes/captive-portal/leases
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+           HTTP/1.1 200 OK
+           Content-Type: application/json
+
+           {
+             "wifi": [
+               {
+                 "as_of": 1511806276.2,
+                 "chute": "captive-portal",
+                 "client_id": "01:5c:59:48:7d:b9:e6",
+                 "expires": 1511816276,
+                 "hostname": "paradrops-iPod",
+                 "ip_addr": "192.168.128.64",
+                 "mac_addr": "5c:59:48:7d:b9:e6",
+                 "network": "wifi"
+               }
+             ]
+           }
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+
+        try:
+            chute_obj = ChuteStorage.chuteList[chute]
+            if not chute_access_allowed(request, chute_obj):
+                return permission_denied(request)
+        except KeyError:
+            request.setResponseCode(404)
+            return "{}"
+
+        # Pick up the lease directory of a chute that was just installed.
+        leases.index.sync()
+
+        result = {}
+        for lease in leases.index.getAll(chute=chute):
+            result.setdefault(lease['network'], []).append(lease)
+
+        return json.dumps(result)
+
     @routes.route('/<chute>/networks/<network>/ssid', methods=['GET'])
     def get_ssid(self, request, chute, network):
         """
@@ -952,11 +1008,69 @@ class ChuteApi(object):
         address = os.path.join(settings.PDCONFD_WRITE_DIR, "hostapd", ifname)
         return hostapd_control.execute(address, command="STATUS")
 
+    @routes.route('/<chute>/stations', methods=['GET'])
+    def get_all_stations(self, request, chute):
+        """
+        Get the connected wireless stations for all of the chute's networks.
+
+        The response maps network name to a list of stations in the same
+        format as /api/v1/chutes/<chute>/networks/<network>/stations.
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+           GET /api/v1/chutes/captive-portal/stations
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+           HTTP/1.1 200 OK
+           Content-Type: application/json
+
+           {
+             "wifi": [
+               {
+                 "mac_addr": "5c:59:48:7d:b9:e6",
+                 "rx_bytes": 12511,
+                 "signal": -45,
+                 ...
+               }
+             ],
+             "guest": []
+           }
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+
+        try:
+            chute_obj = ChuteStorage.chuteList[chute]
+            if not chute_access_allowed(request, chute_obj):
+                return permission_denied(request)
+            networkInterfaces = chute_obj.getCache('networkInterfaces')
+        except KeyError:
+            request.setResponseCode(404)
+            return "{}"
+
+        ifnames = {}
+        for iface in networkInterfaces:
+            if iface['type'].startswith("wifi"):
+                ifnames[iface['name']] = iface['externalIntf']
+
+        d = stations.getService().getAllStations(ifnames)
+        d.addCallback(json.dumps)
+        return d
+
     @routes.route('/<chute>/networks/<network>/stations', methods=['GET'])
     def get_stations(self, request, chute, network):
         """
         Get detailed information about connected wireless stations.
 
+        Times are in milliseconds (connected_time in seconds), signal levels
+        in dBm, and bitrates in MBit/s.  Results may be up to a few seconds
+        old.
+
         **Example request**:
 
         .. sourcecode:: http
@@ -972,24 +1086,26 @@ class ChuteApi(object):
 
            [
              {
-               "rx_packets": "230",
-               "tdls_peer": "no",
-               "authenticated": "yes",
-               "rx_bytes": "12511",
-               "tx_bitrate": "1.0 MBit/s",
-               "tx_retries": "0",
-               "signal": "-45 [-49, -48] dBm",
-               "authorized": "yes",
-               "rx_bitrate": "65.0 MBit/s MCS 7",
-               "mfp": "no",
-               "tx_failed": "0",
-               "inactive_time": "4688 ms",
+               "rx_packets": 230,
+               "tdls_peer": false,
+               "authenticated": true,
+               "rx_bytes": 12511,
+               "tx_bitrate": 1.0,
+               "tx_retries": 0,
+               "signal": -45,
+               "chain_signal": [-49, -48],
+               "authorized": true,
+               "rx_bitrate": 65.0,
+               "mfp": false,
+               "tx_failed": 0,
+               "inactive_time": 4688,
                "mac_addr": "5c:59:48:7d:b9:e6",
-               "tx_bytes": "34176",
-               "wmm_wme": "yes",
+               "tx_bytes": 34176,
+               "wmm_wme": true,
                "preamble": "short",
-               "tx_packets": "88",
-               "signal_avg": "-44 [-48, -47] dBm"
+               "tx_packets": 88,
+               "signal_avg": -44,
+               "chain_signal_avg": [-48, -47]
              }
            ]
         """
@@ -1011,29 +1127,13 @@ class ChuteApi(object):
                 ifname = iface['externalIntf']
                 break
 
-        cmd = ['iw', 'dev', ifname, 'station', 'dump']
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-
-        stations = []
-        current = {}
-
-        for line in proc.stdout:
-            line = line.strip()
-
-            match = re.match("Station\s+(\S+)\s+.*", line)
-            if match is not None:
-                current = {
-                    'mac_addr': match.group(1)
-                }
-                stations.append(current)
-                continue
-
-            match = re.match("(.*):\s+(.*)", line)
-            if match is not None:
-                key = match.group(1).lower().replace(' ', '_').replace('/', '_')
-                current[key] = match.group(2)
+        if ifname is None:
+            request.setResponseCode(404)
+            return "[]"
 
-        return json.dumps(stations)
+        d = stations.getService().getStations(ifname)
+        d.addCallback(json.dumps)
+        return d
 
     @routes.route('/<chute>/networks/<network>/stations/<mac>', methods=['GET'])
     def get_station(self, request, chute, network, mac):
@@ -1054,24 +1154,26 @@ class ChuteApi(object):
            Content-Type: application/json
 
            {
-             "rx_packets": "230",
-             "tdls_peer": "no",
-             "authenticated": "yes",
-             "rx_bytes": "12511",
-             "tx_bitrate": "1.0 MBit/s",
-             "tx_retries": "0",
-             "signal": "-45 [-49, -48] dBm",
-             "authorized": "yes",
-             "rx_bitrate": "65.0 MBit/s MCS 7",
-             "mfp": "no",
-             "tx_failed": "0",
-             "inactive_time": "4688 ms",
+             "rx_packets": 230,
+             "tdls_peer": false,
+             "authenticated": true,
+             "rx_bytes": 12511,
+             "tx_bitrate": 1.0,
+             "tx_retries": 0,
+             "signal": -45,
+             "chain_signal": [-49, -48],
+             "authorized": true,
+             "rx_bitrate": 65.0,
+             "mfp": false,
+             "tx_failed": 0,
+             "inactive_time": 4688,
              "mac_addr": "5c:59:48:7d:b9:e6",
-             "tx_bytes": "34176",
-             "wmm_wme": "yes",
+             "tx_bytes": 34176,
+             "wmm_wme": true,
              "preamble": "short",
-             "tx_packets": "88",
-             "signal_avg": "-44 [-48, -47] dBm"
+             "tx_packets": 88,
+             "signal_avg": -44,
+             "chain_signal_avg": [-48, -47]
            }
         """
         cors.config_cors(request)
@@ -1092,25 +1194,19 @@ class ChuteApi(object):
                 ifname = iface['externalIntf']
                 break
 
-        cmd = ['iw', 'dev', ifname, 'station', 'get', mac]
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-
-        station = {}
-
-        for line in proc.stdout:
-            line = line.strip()
-
-            match = re.match("Station\s+(\S+)\s+.*", line)
-            if match is not None:
-                station['mac_addr'] = match.group(1)
-                continue
+        if ifname is None:
+            request.setResponseCode(404)
+            return "{}"
 
-            match = re.match("(.*):\s+(.*)", line)
-            if match is not None:
-                key = match.group(1).lower().replace(' ', '_').replace('/', '_')
-                station[key] = match.group(2)
+        def send(station):
+            if station is None:
+                request.setResponseCode(404)
+                return "{}"
+            return json.dumps(station)
 
-        return json.dumps(station)
+        d = stations.getService().getStation(ifname, mac)
+        d.addCallback(send)
+        return d
 
     @routes.route('/<chute>/networks/<network>/stations/<mac>', methods=['DELETE'])
     def delete_station(self, request, chute, network, mac):
@@ -1140,6 +1236,7 @@ class ChuteApi(object):
             line = line.strip()
             messages.append(line)
 
+        stations.getService().invalidate(ifname)
         return json.dumps(messages)
 
     @routes.route('/<chute>/networks/<network>/hostapd_control/ws', branch=True, methods=['GET'])
@@ -1163,3 +1260,25 @@ class ChuteApi(object):
         factory = hostapd_control.HostapdControlWSFactory(ctrl_iface)
         factory.setProtocolOptions(autoPingInterval=10, autoPingTimeout=5)
         return WebSocketResource(factory)
+
+    @routes.route('/<chute>/leases/ws', branch=True, methods=['GET'])
+    def lease_stream(self, request, chute):
+        """
+        Stream changes to the chute's DHCP leases over a websocket.
+
+        Each message is a JSON object with the event ("add", "update", or
+        "remove") and the lease record.
+        """
+        try:
+            chute_obj = ChuteStorage.chuteList[chute]
+            if not chute_access_allowed(request, chute_obj):
+                return permission_denied(request)
+        except KeyError:
+            request.setResponseCode(404)
+            return ""
+
+        leases.index.sync()
+
+        factory = LeaseStreamFactory(leases.index, chute=chute)
+        factory.setProtocolOptions(autoPingInterval=10, autoPingTimeout=5)
+        return WebSocketResource(factory)
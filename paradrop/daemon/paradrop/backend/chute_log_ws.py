@@ -1,33 +1,30 @@
+import json
+
 from autobahn.twisted.websocket import WebSocketServerProtocol
 from autobahn.twisted.websocket import WebSocketServerFactory
-from twisted.internet.task import LoopingCall
 
 from paradrop.base.output import out
-from paradrop.core.container.log_provider import LogProvider
+from paradrop.core.container import log_provider
 
 class ChuteLogWsProtocol(WebSocketServerProtocol):
     def __init__(self, factory):
         WebSocketServerProtocol.__init__(self)
         self.factory = factory
-        self.loop = LoopingCall(self.check_log)
-        self.log_provider = None
+        self.subscribed = False
 
     def onOpen(self):
         out.info('ws /chute_logs connected')
-        self.log_provider = LogProvider(self.factory.chute)
-        self.log_provider.attach()
-        self.loop.start(0.5)
+        log_provider.subscribe(self.factory.chute, self.onLog)
+        self.subscribed = True
 
-    def check_log(self):
-        logs = self.log_provider.get_logs()
-        for log in logs:
-            self.sendMessage(log)
+    def onLog(self, log):
+        self.sendMessage(json.dumps(log))
 
     def onClose(self, wasClean, code, reason):
         out.info('ws /chute_logs disconnected: {}'.format(reason))
-        self.loop.stop()
-        self.log_provider.detach()
-        self.log_provider = None
+        if self.subscribed:
+            log_provider.unsubscribe(self.factory.chute, self.onLog)
+            self.subscribed = False
 
 
 class ChuteLogWsFactory(WebSocketServerFactory):
@@ -12,6 +12,7 @@ from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
 from paradrop.base import constants, nexus, settings
 from paradrop.base.output import out
 from paradrop.base.pdutils import timeint
+from paradrop.core.chute.chute_storage import ChuteStorage
 from paradrop.core.config import hostconfig
 from paradrop.core.agent.http import PDServerRequest
 from paradrop.core.agent.provisioning import read_provisioning_result
@@ -246,7 +247,7 @@ class ConfigApi(object):
             wampDeferred = nexus.core.connect(WampSession)
             wampDeferred.addCallback(set_update_fetcher)
 
-            httpDeferred = sendStateReport()
+            httpDeferred = sendStateReport(full=True)
             httpDeferred.addCallback(start_polling)
 
             identDeferred = sendNodeIdentity()
@@ -328,6 +329,41 @@ class ConfigApi(object):
         update = yield self.update_manager.add_update(**update)
         returnValue(json.dumps(update.result))
 
+    @routes.route('/chutes/export', methods=['POST'])
+    def export_chutes(self, request):
+        """
+        Write the stored chute list to a YAML file for inspection.
+
+        The chute list is normally only stored in binary form.  This is
+        intended for debugging purposes.
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+           POST /api/v1/config/chutes/export
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+           HTTP/1.1 200 OK
+           Content-Type: application/json
+
+           {
+             "path": "/etc/paradrop/chutes.yaml"
+           }
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+
+        path = ChuteStorage().exportYaml()
+        if path is None:
+            request.setResponseCode(500)
+            return json.dumps({'message': 'Failed to export chute list'})
+
+        return json.dumps({'path': path})
+
     @routes.route('/pdconf', methods=['GET'])
     def pdconf(self, request):
         """
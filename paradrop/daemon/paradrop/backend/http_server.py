@@ -11,7 +11,11 @@ from twisted.internet.endpoints import serverFromString
 from klein import Klein
 from autobahn.twisted.resource import WebSocketResource
 
+from paradrop.airshark import fanout
+from paradrop.airshark.spectrum_reader import numpy
+from paradrop.base import pdutils, settings
 from paradrop.core.chute.chute_storage import ChuteStorage
+from paradrop.core.config import leases
 from paradrop.core.system.system_status import SystemStatus
 
 from .airshark_api import AirsharkApi
@@ -24,6 +28,7 @@ from .chute_api import ChuteApi
 from .chute_log_ws import ChuteLogWsFactory
 from .config_api import ConfigApi
 from .information_api import InformationApi
+from .lease_ws import LeaseStreamFactory
 from .log_sockjs import LogSockJSFactory
 from .network_api import NetworkApi
 from .paradrop_log_ws import ParadropLogWsFactory
@@ -45,6 +50,17 @@ class HttpServer(object):
         self.token_manager = TokenManager()
         self.airshark_manager = airshark_manager
 
+        # The API objects are created once and shared by all requests.
+        self.audio_api = AudioApi()
+        self.auth_api = AuthApi(self.password_manager, self.token_manager)
+        self.information_api = InformationApi()
+        self.change_api = ChangeApi(self.update_manager)
+        self.config_api = ConfigApi(self.update_manager, self.update_fetcher)
+        self.chute_api = ChuteApi(self.update_manager)
+        self.password_api = PasswordApi(self.password_manager)
+        self.airshark_api = AirsharkApi(self.airshark_manager)
+        self.network_api = NetworkApi()
+
         if portal_dir:
             self.portal_dir = portal_dir
         elif 'SNAP' in os.environ:
@@ -55,54 +71,54 @@ class HttpServer(object):
 
     @app.route('/api/v1/audio', branch=True)
     def api_audio(self, request):
-        return AudioApi().routes.resource()
+        return self.audio_api.routes.resource()
 
 
     @app.route('/api/v1/auth', branch=True)
     def api_auth(self, request):
-        return AuthApi(self.password_manager, self.token_manager).routes.resource()
+        return self.auth_api.routes.resource()
 
 
     @app.route('/api/v1/info', branch=True)
     @requires_auth
     def api_information(self, request):
-        return InformationApi().routes.resource()
+        return self.information_api.routes.resource()
 
 
     @app.route('/api/v1/changes/', branch=True)
     @requires_auth
     def api_changes(self, request):
-        return ChangeApi(self.update_manager).routes.resource()
+        return self.change_api.routes.resource()
 
 
     @app.route('/api/v1/config', branch=True)
     @requires_auth
     def api_configuration(self, request):
-        return ConfigApi(self.update_manager, self.update_fetcher).routes.resource()
+        return self.config_api.routes.resource()
 
 
     @app.route('/api/v1/chutes/', branch=True)
     @requires_auth
     def api_chute(self, request):
-        return ChuteApi(self.update_manager).routes.resource()
+        return self.chute_api.routes.resource()
 
 
     @app.route('/api/v1/password', branch=True)
     @requires_auth
     def api_password(self, request):
-        return PasswordApi(self.password_manager).routes.resource()
+        return self.password_api.routes.resource()
 
 
     @app.route('/api/v1/airshark', branch=True)
     @requires_auth
     def api_airshark(self, request):
-        return AirsharkApi(self.airshark_manager).routes.resource()
+        return self.airshark_api.routes.resource()
 
 
     @app.route('/api/v1/network', branch=True)
     @requires_auth
     def api_network(self, request):
-        return NetworkApi().routes.resource()
+        return self.network_api.routes.resource()
 
 
     @app.route('/snapd/', branch=True)
@@ -165,7 +181,45 @@ class HttpServer(object):
     @requires_auth
     def airshark_spectrum(self, request):
         #cors.config_cors(request)
-        factory = AirsharkSpectrumFactory(self.airshark_manager)
+
+        # Optional query parameters to receive aggregated frames instead of
+        # raw samples, e.g. ?resolution=0.5&percentile=95, and to control
+        # delivery to slow clients, e.g. ?policy=decimate&rate=10
+        resolution = pdutils.getQueryParam(request, "resolution")
+        percentile = pdutils.getQueryParam(request, "percentile")
+        policy = pdutils.getQueryParam(request, "policy")
+        max_rate = pdutils.getQueryParam(request, "rate")
+        try:
+            if resolution is not None:
+                resolution = float(resolution)
+                if not 0 < resolution <= settings.AIRSHARK_MAX_RESOLUTION:
+                    raise ValueError("resolution out of range")
+            percentile = float(percentile) if percentile is not None else 90
+            if not 0 <= percentile <= 100:
+                raise ValueError("percentile must be between 0 and 100")
+            if max_rate is not None:
+                max_rate = float(max_rate)
+                if max_rate <= 0:
+                    raise ValueError("rate must be positive")
+        except ValueError:
+            request.setResponseCode(400)
+            return "Invalid resolution (0 to {} seconds), percentile, or " \
+                   "rate".format(settings.AIRSHARK_MAX_RESOLUTION)
+
+        if policy is None:
+            policy = fanout.LATEST
+        elif policy not in fanout.POLICIES:
+            request.setResponseCode(400)
+            return "Invalid policy, must be one of: {}".format(
+                    ", ".join(fanout.POLICIES))
+
+        if resolution is not None and numpy is None:
+            request.setResponseCode(501)
+            return "Spectrum aggregation is not available"
+
+        factory = AirsharkSpectrumFactory(self.airshark_manager,
+                resolution=resolution, percentile=percentile, policy=policy,
+                max_rate=max_rate)
         factory.setProtocolOptions(autoPingInterval=10, autoPingTimeout=5)
         return WebSocketResource(factory)
 
@@ -177,6 +231,13 @@ class HttpServer(object):
         factory.setProtocolOptions(autoPingInterval=10, autoPingTimeout=5)
         return WebSocketResource(factory)
 
+    @app.route('/ws/leases', branch=True)
+    @requires_auth
+    def lease_stream(self, request):
+        factory = LeaseStreamFactory(leases.index)
+        factory.setProtocolOptions(autoPingInterval=10, autoPingTimeout=5)
+        return WebSocketResource(factory)
+
     @app.route('/ws/changes/<int:change_id>/stream', branch=True)
     @requires_auth
     def change_stream(self, request, change_id):
@@ -6,50 +6,41 @@ Endpoints for these functions can be found under /api/v1/info.
 '''
 import json
 import os
-import platform
-from psutil import virtual_memory
 from klein import Klein
+from twisted.web import http
 
 from paradrop.base import constants
-from paradrop.core.config.devices import detectSystemDevices
-from paradrop.core.system.system_info import getOSVersion, getPackageVersion
+from paradrop.core.system import node_facts
 from paradrop.core.agent.reporting import TelemetryReportBuilder
 from paradrop.lib.utils import pdos
 from . import cors
 
 
+def send_cached(request, body, etag):
+    """
+    Set the ETag of the response and return the body, or an empty body if
+    the client already has this version (304 Not Modified).
+    """
+    if request.setETag(etag.encode('ascii')) == http.CACHED:
+        return ""
+    return body
+
+
 class InformationApi(object):
+    """
+    Hardware and software information comes from the node facts registry,
+    which computes it once and keeps the JSON encoding.  Responses have an
+    ETag so that clients can poll with If-None-Match.
+    """
     routes = Klein()
 
-    def __init__(self):
-        self.vendor = pdos.read_sys_file('/sys/devices/virtual/dmi/id/sys_vendor')
-        self.board = pdos.read_sys_file('/sys/devices/virtual/dmi/id/product_name', default='') \
-                     + ' ' + pdos.read_sys_file('/sys/devices/virtual/dmi/id/product_version', default='')
-        self.cpu = platform.processor()
-        self.memory = virtual_memory().total
-
-        self.wifi = []
-        devices = detectSystemDevices()
-        for wifiDev in devices['wifi']:
-            # Skip unusual devices that are missing the id field.
-            if 'id' not in wifiDev:
-                continue
-
-            self.wifi.append({
-                'id': wifiDev['id'],
-                'macAddr': wifiDev['mac'],
-                'vendorId': wifiDev['vendor'],
-                'deviceId': wifiDev['device'],
-                'slot': wifiDev['slot']
-            })
-
-        self.biosVendor = pdos.read_sys_file('/sys/devices/virtual/dmi/id/bios_vendor')
-        self.biosVersion = pdos.read_sys_file('/sys/devices/virtual/dmi/id/bios_version')
-        self.biosDate = pdos.read_sys_file('/sys/devices/virtual/dmi/id/bios_date')
-        self.osVersion = getOSVersion()
-        self.kernelVersion = platform.system() + '-' + platform.release()
-        self.pdVersion = getPackageVersion('paradrop')
-        self.uptime = int(float(pdos.read_sys_file('/proc/uptime', default='0').split()[0]))
+    def __init__(self, facts=None):
+        if facts is None:
+            facts = node_facts.facts
+        self.facts = facts
+
+        self.features = json.dumps(constants.DAEMON_FEATURES.split())
+        self.featuresETag = node_facts.makeETag(self.features)
 
     @routes.route('/hardware', methods=['GET'])
     def hardware_info(self, request):
@@ -94,13 +85,8 @@ class InformationApi(object):
         """
         cors.config_cors(request)
         request.setHeader('Content-Type', 'application/json')
-        data = dict()
-        data['vendor'] = self.vendor
-        data['board'] = self.board
-        data['cpu'] = self.cpu
-        data['memory'] = self.memory
-        data['wifi'] = self.wifi
-        return json.dumps(data)
+        body, etag = self.facts.getJSON('hardware')
+        return send_cached(request, body, etag)
 
     @routes.route('/software', methods=['GET'])
     def software_info(self, request):
@@ -135,15 +121,13 @@ class InformationApi(object):
         """
         cors.config_cors(request)
         request.setHeader('Content-Type', 'application/json')
-        data = dict()
-        data['biosVendor'] = self.biosVendor
-        data['biosVersion'] = self.biosVersion
-        data['biosDate'] = self.biosDate
-        data['kernelVersion'] = self.kernelVersion
-        data['osVersion'] = self.osVersion
-        data['pdVersion'] = self.pdVersion
-        data['uptime'] = self.uptime
-        return json.dumps(data)
+        data = self.facts.get('software')
+        data['uptime'] = int(float(pdos.read_sys_file('/proc/uptime', default='0').split()[0]))
+
+        # The uptime changes every second, so the ETag only helps clients
+        # that poll more often than that.
+        body = json.dumps(data, sort_keys=True)
+        return send_cached(request, body, node_facts.makeETag(body))
 
     @routes.route('/environment', methods=['GET'])
     def get_environment(self, request):
@@ -227,8 +211,7 @@ class InformationApi(object):
         """
         cors.config_cors(request)
         request.setHeader('Content-Type', 'application/json')
-        features = constants.DAEMON_FEATURES.split()
-        return json.dumps(features)
+        return send_cached(request, self.features, self.featuresETag)
 
     @routes.route('/telemetry', methods=['GET'])
     def get_telemetry(self, request):
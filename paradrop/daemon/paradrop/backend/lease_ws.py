@@ -0,0 +1,41 @@
+import json
+
+from autobahn.twisted.websocket import WebSocketServerProtocol
+from autobahn.twisted.websocket import WebSocketServerFactory
+
+
+class LeaseStreamProtocol(WebSocketServerProtocol):
+    """
+    Send DHCP lease changes to the client as they happen.
+
+    Each message is a JSON object with the event ("add", "update", or
+    "remove") and the lease record.
+    """
+    def __init__(self, factory):
+        WebSocketServerProtocol.__init__(self)
+        self.factory = factory
+
+    def onOpen(self):
+        self.factory.index.addObserver(self.onLeaseChange)
+
+    def onLeaseChange(self, event, lease):
+        if self.factory.chute is not None and lease['chute'] != self.factory.chute:
+            return
+        data = {
+            'event': event,
+            'lease': lease
+        }
+        self.sendMessage(json.dumps(data).encode('utf-8'))
+
+    def onClose(self, wasClean, code, reason):
+        self.factory.index.removeObserver(self.onLeaseChange)
+
+
+class LeaseStreamFactory(WebSocketServerFactory):
+    def __init__(self, index, chute=None, *args, **kwargs):
+        WebSocketServerFactory.__init__(self, *args, **kwargs)
+        self.index = index
+        self.chute = chute
+
+    def buildProtocol(self, addr):
+        return LeaseStreamProtocol(self)
@@ -2,36 +2,31 @@ import json
 
 from autobahn.twisted.websocket import WebSocketServerProtocol
 from autobahn.twisted.websocket import WebSocketServerFactory
-from twisted.internet.task import LoopingCall
 
 from paradrop.base.output import out
-from paradrop.core.container.log_provider import LogProvider
+from paradrop.core.container import log_provider
 
 class LogSockJSProtocol(WebSocketServerProtocol):
     def __init__(self, factory):
         WebSocketServerProtocol.__init__(self)
         self.factory = factory
-        self.loop = LoopingCall(self.check_log)
-        self.log_provider = None
+        self.subscribed = False
 
     def onOpen(self):
         out.info('sockjs /logs connected')
 
-        self.log_provider = LogProvider(self.factory.chute)
-        self.log_provider.attach()
-        self.loop.start(1.0)
+        log_provider.subscribe(self.factory.chute, self.onLog)
+        self.subscribed = True
 
-    def check_log(self):
-        logs = self.log_provider.get_logs()
-        for log in logs:
-            self.sendMessage(json.dumps(log))
+    def onLog(self, log):
+        self.sendMessage(json.dumps(log))
 
     def onClose(self, wasClean, code, reason):
         out.info('sockjs /logs disconnected')
 
-        self.loop.stop()
-        self.log_provider.detach()
-        self.log_provider = None
+        if self.subscribed:
+            log_provider.unsubscribe(self.factory.chute, self.onLog)
+            self.subscribed = False
 
 class LogSockJSFactory(WebSocketServerFactory):
     def __init__(self, chute):
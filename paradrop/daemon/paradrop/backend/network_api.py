@@ -4,13 +4,13 @@ Get information about network devices.
 Endpoints for these functions can be found under /api/v1/network.
 """
 
-import fnmatch
 import json
 import os
 
 from klein import Klein
 
-from paradrop.base import settings
+from paradrop.base import pdutils
+from paradrop.core.config import leases
 from paradrop.lib.utils import parsing
 
 from . import cors
@@ -113,13 +113,83 @@ class NetworkApi(object):
         cors.config_cors(request)
         request.setHeader('Content-Type', 'application/json')
 
-        leases = {}
+        # Pick up the lease directory of a chute that was just installed.
+        leases.index.sync()
 
-        for root, dirs, files in os.walk(settings.RUNTIME_HOME_DIR):
-            for file in fnmatch.filter(files, "dnsmasq-*.leases"):
-                path = os.path.join(root, file)
+        # A device may appear in more than one lease file, so keep the entry
+        # from the most recently updated one.
+        devices = {}
+        for entry in leases.index.getAll():
+            update_lease(devices, entry)
 
-                for entry in read_leases(path):
-                    update_lease(leases, entry)
+        return json.dumps(list(devices.values()))
 
-        return json.dumps(leases.values())
+    @routes.route("/leases", methods=["GET"])
+    def get_leases(self, request):
+        """
+        List or look up DHCP leases across all networks.
+
+        The leases can be filtered with any of the following query
+        parameters.  Lookups by mac_addr, ip_addr, and hostname use an index
+        and are case insensitive.
+
+        mac_addr
+          device MAC address
+        ip_addr
+          device IP address
+        hostname
+          name that the device reported
+        chute
+          name of the chute that owns the network
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+           GET /api/v1/network/leases?mac_addr=5c:59:48:7d:b9:e6
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+           HTTP/1.1 200 OK
+           Content-Type: application/json
+
+           [
+             {
+               "as_of": 1511806276.2,
+               "chute": "captive-portal",
+               "client_id": "01:5c:59:48:7d:b9:e6",
+               "expires": 1511816276,
+               "hostname": "paradrops-iPod",
+               "ip_addr": "192.168.128.64",
+               "mac_addr": "5c:59:48:7d:b9:e6",
+               "network": "wifi"
+             }
+           ]
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+
+        # Pick up the lease directory of a chute that was just installed.
+        leases.index.sync()
+
+        chute = pdutils.getQueryParam(request, "chute")
+
+        result = None
+        for key in leases.INDEX_KEYS:
+            value = pdutils.getQueryParam(request, key)
+            if value is None:
+                continue
+            found = leases.index.find(key, value)
+            if result is None:
+                result = found
+            else:
+                result = [lease for lease in result if lease in found]
+
+        if result is None:
+            result = leases.index.getAll(chute=chute)
+        elif chute is not None:
+            result = [lease for lease in result if lease['chute'] == chute]
+
+        return json.dumps(result)
@@ -7,6 +7,10 @@ from paradrop.lib.utils import pdos
 
 class PasswordManager(object):
     def __init__(self):
+        # Incremented whenever a password changes so that cached credential
+        # checks can be invalidated.
+        self.version = 0
+
         self.password_file = os.path.join(settings.CONFIG_HOME_DIR, 'password')
 
         # Try to parse the password file
@@ -62,6 +66,7 @@ class PasswordManager(object):
         return crypt.crypt(password, salt)
 
     def reset(self):
+        self.version += 1
         self.records = []
         self.records.append({
             'user_name': settings.DEFAULT_PANEL_USERNAME,
@@ -89,6 +94,7 @@ class PasswordManager(object):
         self.records = [x for x in self.records if x['user_name'] != user_name]
 
         if len(self.records) != origin_len:
+            self.version += 1
             self._sync_password_file()
 
     def verify_password(self, user_name, password):
@@ -111,6 +117,7 @@ class PasswordManager(object):
         for i in self.records:
             if i['user_name'] == user_name:
                 i['password_hash'] = self._hash_password(newPassword)
+                self.version += 1
                 self._sync_password_file()
                 return True
 
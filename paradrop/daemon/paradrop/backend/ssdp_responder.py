@@ -8,7 +8,7 @@ import six
 from twisted.internet.protocol import DatagramProtocol
 
 from paradrop.base import settings
-from paradrop.core.system import system_info
+from paradrop.core.system import node_facts
 
 
 SSDP_ADDR = "239.255.255.250"
@@ -61,8 +61,9 @@ class SsdpResponder(DatagramProtocol):
                 request.headers['ST'] in ["ssdp:all", "upnp:rootdevice", PARADROP_URN] and \
                 request.headers['MAN'] == '"ssdp:discover"' and \
                 addr.is_private:
-            os_ver = system_info.getOSVersion()
-            pd_ver = system_info.getPackageVersion("paradrop")
+            software = node_facts.facts.get('software')
+            os_ver = software['osVersion']
+            pd_ver = software['pdVersion']
 
             message = "\r\n".join([
                 "HTTP/1.1 200 OK",
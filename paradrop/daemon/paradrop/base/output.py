@@ -33,6 +33,16 @@ from . import pdutils
 BOLD = '\033[1m'
 LOG_NAME = 'log'
 
+# Sparse index of the current log file.  Each line of the index holds the
+# timestamp and byte offset of a log record, written roughly every
+# INDEX_INTERVAL bytes of log output.
+INDEX_NAME = LOG_NAME + '.index'
+INDEX_INTERVAL = 64 * 1024
+
+# Log records are not written in perfectly increasing timestamp order, so
+# readers start a little before the target time.
+INDEX_SLACK = 60
+
 Level = Enum('Level', 'HEADER, VERBOSE, INFO, PERF, WARN, ERR, SECURITY, FATAL, USAGE')
 
 # Represents formatting information for the specified log type
@@ -108,6 +118,11 @@ class PrintLogThread(threading.Thread):
         self.queue = queue
         self.writer = DailyLogFile(name, path)
 
+        # Track our position in the current log file for the sparse index.
+        self.indexPath = os.path.join(path, INDEX_NAME)
+        self.offset = os.path.getsize(self.writer.path)
+        self.lastIndexed = None
+
         # Don't want this to float around if the rest of the system goes down
         self.setDaemon(True)
 
@@ -116,14 +131,158 @@ class PrintLogThread(threading.Thread):
             result = self.queue.get(block=True)
 
             try:
-                writable = json.dumps(result)
-                self.writer.write(writable + '\n')
-                self.writer.flush()
+                self.writeRecord(result)
             except:
                 pass
 
             self.queue.task_done()
 
+    def writeRecord(self, result):
+        data = (json.dumps(result) + '\n').encode('utf-8')
+
+        rotating = self.writer.shouldRotate()
+        self.writer.write(data)
+        self.writer.flush()
+
+        if rotating:
+            # The record went to a new file (unless the rotation failed), so
+            # recompute our position and start a new index.
+            self.offset = os.path.getsize(self.writer.path) - len(data)
+            self.lastIndexed = None
+            with open(self.indexPath, 'w'):
+                pass
+
+        if self.lastIndexed is None or \
+                self.offset - self.lastIndexed >= INDEX_INTERVAL:
+            with open(self.indexPath, 'a') as index:
+                index.write("{} {}\n".format(result.get('timestamp', 0),
+                                             self.offset))
+            self.lastIndexed = self.offset
+
+        self.offset += len(data)
+
+
+def logFileDate(filename):
+    '''
+    Return the date of a rotated log file as a time tuple, or None if the
+    file is not a rotated log file.
+    '''
+    parts = filename.split('.')
+    if len(parts) != 2 or parts[0] != LOG_NAME:
+        return None
+
+    try:
+        return time.strptime(parts[1], '%Y_%m_%d')
+    except ValueError:
+        return None
+
+
+def findIndexedOffset(logpath, target):
+    '''
+    Use the sparse index to find where to start reading the current log.
+
+    Returns a byte offset in the current log file that precedes all records
+    with timestamps later than target, or 0 if the index cannot help.
+    '''
+    best = None
+    try:
+        with open(os.path.join(logpath, INDEX_NAME), 'r') as index:
+            for line in index:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue
+                timestamp, offset = float(parts[0]), int(parts[1])
+                if timestamp >= target - INDEX_SLACK:
+                    break
+                best = (timestamp, offset)
+    except (IOError, OSError, ValueError):
+        return 0
+
+    if best is None:
+        return 0
+
+    # Make sure the index belongs to this version of the log file by checking
+    # that the record at the offset has the expected timestamp.
+    timestamp, offset = best
+    try:
+        with open(os.path.join(logpath, LOG_NAME), 'rb') as source:
+            source.seek(offset)
+            record = json.loads(source.readline().decode('utf-8'))
+            if record.get('timestamp') == timestamp:
+                return offset
+    except Exception:
+        pass
+
+    return 0
+
+
+def readLogFile(path, target, offset=0):
+    '''
+    Stream records from a log file with timestamps later than target.
+    '''
+    with open(path, 'rb') as source:
+        source.seek(offset)
+        for line in source:
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+            if record.get('timestamp', 0) > target:
+                yield record
+
+
+def readLogsSince(logpath, target, purge=False, limit=None, level=None):
+    '''
+    Stream log records from a log directory (generator).
+
+    Rotated files that end before target are skipped without being opened,
+    and the sparse index is used to skip ahead in the current log file.
+    Records are produced in file order, oldest file first.
+
+    :param limit: maximum number of records to return.
+    :param level: minimum Level (or level name) of records to return.
+    '''
+    if level is not None and not isinstance(level, Level):
+        level = Level[level.upper()]
+
+    rotated = list()
+    for f in os.listdir(logpath):
+        date = logFileDate(f)
+        if date is not None:
+            rotated.append((date, f))
+    rotated.sort()
+
+    def sources():
+        for date, f in rotated:
+            path = os.path.join(logpath, f)
+
+            # The file holds records from one local day, so skip it if that
+            # day ended before the target.
+            end = time.mktime((date.tm_year, date.tm_mon, date.tm_mday + 1,
+                               0, 0, 0, 0, 0, -1))
+            if end + INDEX_SLACK > target:
+                for record in readLogFile(path, target):
+                    yield record
+
+            # delete all files except log once read
+            if purge:
+                os.remove(path)
+
+        path = os.path.join(logpath, LOG_NAME)
+        if os.path.exists(path):
+            offset = findIndexedOffset(logpath, target)
+            for record in readLogFile(path, target, offset):
+                yield record
+
+    count = 0
+    for record in sources():
+        if limit is not None and count >= limit:
+            return
+        if level is not None and record.get('type', 0) < level.value:
+            continue
+        count += 1
+        yield record
+
 
 class OutputRedirect(object):
 
@@ -544,56 +703,35 @@ class Output(object):
         outputObject = self.outputMappings[level.name.lower()]
         return outputObject.formatOutput(message)
 
-    def getLogsSince(self, target, purge=False):
+    def getLogsSince(self, target, purge=False, limit=None, level=None):
         '''
-        Reads all logs and returns their contents. The current log file is not touched.
+        Reads logs with timestamps later than target (generator).
+
+        Only the log files that might contain relevant records are opened,
+        and records are streamed rather than loaded into memory at once.
         Removes old log files if 'purge' is set (though this is a topic for debate...)
 
         The server will be most interested in this call, but it needs to register for
         new logs first, else there's a good chance to see duplicates.
 
-        NOTE: don't open all log files, check to open only the ones that might be relevant.
-        This is certainly a bug and can cause memory issues.
-
         :param target: seconds since the GMT epoch. Method returns logs that have timestamps later than this.
         :type target: float.
         :param purge: deletes the old log files (except today's) if set
         :type purge: bool.
-        :returns: a list of dictionaries containing log information. Not ordered.
+        :param limit: maximum number of logs to return.
+        :type limit: int.
+        :param level: minimum level (e.g. Level.WARN or "warn") of logs to return.
+        :returns: a generator of dictionaries containing log information, oldest file first.
         '''
 
         if not self.logpath:
             out.warn('Asked for log files, but this instance of the output class '
                      'is not currently configured for file logging. '
                      'Call startLogging with a directory first! ')
-            return
-
-        ret = []
-
-        for f in os.listdir(self.logpath):
-            path = self.logpath + '/' + f
-
-            # the current log file is treated differently (no date, no delete)
-            if f != LOG_NAME:
-                t = time.strptime(f.split('.')[1], '%Y_%m_%d')
+            return iter([])
 
-                # dont load those with times earlier than target
-                if t >= target:
-                    with open(path, 'r') as x:
-                        ret += [json.loads(y) for y in x.readlines()]
-
-                # delete all files except log once read
-                if purge:
-                    os.remove(path)
-
-            # current log file is always loaded
-            else:
-                with open(path, 'r') as f:
-                    ret += [json.loads(y) for y in f.readlines()]
-
-        ret = filter(lambda x: x['timestamp'] > target, ret)
-
-        return ret
+        return readLogsSince(self.logpath, target, purge=purge, limit=limit,
+                             level=level)
 
 
     ###############################################################################
@@ -109,6 +109,21 @@ def urlDecodeMe(elem):
         return elem
 
 
+def getQueryParam(request, name):
+    """
+        Returns the first value of a query parameter from a twisted.web
+        request or None if it is missing.  Works with both str and bytes keys.
+    """
+    for key in [name, name.encode('ascii')]:
+        values = request.args.get(key, None)
+        if values:
+            value = values[0]
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            return value
+    return None
+
+
 def jsonPretty(j):
     """
         Returns a string of a JSON object in 'pretty print' format fully indented, and sorted.
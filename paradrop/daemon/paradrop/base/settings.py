@@ -51,17 +51,53 @@ PDSERVER = "https://paradrop.org"
 PDSERVER_MAX_CONCURRENT_REQUESTS = 2
 WAMP_ROUTER = "wss://paradrop.org/ws"
 
+# Send state reports as JSON-Patch deltas against the last report that the
+# server acknowledged.  The node falls back to full reports if the server
+# does not support deltas.
+STATE_REPORT_DELTA = True
+
+# Compress state report bodies with gzip.
+STATE_REPORT_COMPRESS = True
+
+# Telemetry samples are stored in a spool directory until they are uploaded.
+# The spool is made of segment files of at most TELEMETRY_SEGMENT_SIZE bytes,
+# and the oldest segments are discarded when the spool exceeds
+# TELEMETRY_SPOOL_SIZE bytes.
+TELEMETRY_SPOOL_DIR = CONFIG_HOME_DIR + 'telemetry/'
+TELEMETRY_SPOOL_SIZE = 4 * 1024 * 1024
+TELEMETRY_SEGMENT_SIZE = 256 * 1024
+
+# Upload at most TELEMETRY_BATCH_SIZE samples per request.  When there is a
+# backlog, e.g. after an outage, send at most TELEMETRY_MAX_BATCHES requests
+# per upload interval, waiting TELEMETRY_DRAIN_DELAY seconds between them.
+TELEMETRY_BATCH_SIZE = 60
+TELEMETRY_MAX_BATCHES = 10
+TELEMETRY_DRAIN_DELAY = 5
+
 #
 # pdfcd
 #
 PDCONFD_WRITE_DIR = RUNTIME_HOME_DIR + 'pdconfd/'
 PDCONFD_ENABLED = True
 
+# Apply the iptables commands generated in one reload as a single
+# iptables-restore transaction per table instead of one process per rule.
+# Falls back to running the commands individually if the transaction fails.
+PDCONFD_BATCH_IPTABLES = False
+
+# Number of threads pdconfd may use to run commands from independent
+# configuration sections at the same priority level (e.g. starting hostapd
+# for different radios).  Set to 1 to run all commands in order.
+PDCONFD_EXECUTE_WORKERS = 1
+
 #
 # fc
 #
 FC_CHUTESTORAGE_FILE = CONFIG_HOME_DIR + "chutes"
 FC_CHUTESTORAGE_SAVE_TIMER = 0
+# Number of journal records to accumulate before the chute storage journal is
+# compacted into a new snapshot.
+FC_CHUTESTORAGE_JOURNAL_LIMIT = 32
 FC_BOUNCE_UPDATE = None
 
 DEFAULT_LAN_ADDRESS = "10.0.0.1"
@@ -151,12 +187,26 @@ CONTAINER_UID = 999
 # 'run_airshark.sh' script).
 AIRSHARK_INSTALL_DIR = "/snap/airshark/current"
 
+# Maximum number of messages queued for a slow Airshark spectrum client before
+# messages are dropped, and maximum size in bytes of raw samples merged into
+# one message when the client uses the aggregate policy.
+AIRSHARK_QUEUE_LIMIT = 32
+AIRSHARK_COALESCE_BYTES = 256 * 1024
+
+# Longest time bin (seconds) that a client may request for aggregated
+# spectrogram frames.
+AIRSHARK_MAX_RESOLUTION = 60
+
 # Boolean flag to enable/disable concurrent builds for Docker images.  If
 # enabled, the update pipeline will yield during a build to allow another
 # update to make progress. This should improve the experience for multi-user
 # access, but the interleaving of updates could cause subtle issues.
 CONCURRENT_BUILDS = True
 
+# Maximum number of images to pull or build at the same time when installing
+# a chute with multiple services.  Set to 1 to prepare images one at a time.
+IMAGE_PREPARE_CONCURRENCY = 3
+
 # Boolean flag to enable/disable monitor mode interfaces for chutes. This is by
 # default disabled because monitor mode interfaces are dangerous.  They enable
 # malicious chutes to record network traffic, and furthermore, the feature
@@ -164,6 +214,42 @@ CONCURRENT_BUILDS = True
 # implementation that cause system instability.
 ALLOW_MONITOR_MODE = False
 
+# Configure chute network interfaces in-process over netlink (requires the
+# pyroute2 package) instead of running ip commands.  The ip commands are still
+# used if pyroute2 is not installed or a netlink operation fails.
+NETLINK_INTERFACE_SETUP = True
+
+# Downloaded chute source archives are kept in DOWNLOAD_CACHE_DIR so that
+# installing the same version again does not download it again.  The least
+# recently used archives are removed when the cache exceeds
+# DOWNLOAD_CACHE_SIZE bytes.  Set the size to 0 to disable the cache.
+DOWNLOAD_CACHE_DIR = CONFIG_HOME_DIR + 'download-cache/'
+DOWNLOAD_CACHE_SIZE = 256 * 1024 * 1024
+
+# Keep the list of network devices in memory and rescan only when netlink or
+# uevent notifications indicate a change (requires the pyroute2 package).  The
+# list is also rescanned if it is older than DEVICE_INVENTORY_MAX_AGE seconds.
+DEVICE_INVENTORY_WATCH = True
+DEVICE_INVENTORY_MAX_AGE = 300
+
+# Number of chute backend slots to configure in haproxy.  Chutes are assigned
+# to slots through the haproxy runtime API without reloading haproxy.  When
+# more chutes need a slot, the pool is doubled, which requires a reload.
+HAPROXY_CHUTE_SLOTS = 16
+
+# Query wireless station information over nl80211 (requires the pyroute2
+# package) instead of running iw.  Results are cached for STATION_CACHE_TTL
+# seconds per interface.
+STATION_INFO_NETLINK = True
+STATION_CACHE_TTL = 2
+
+# Watch DHCP lease files with inotify and keep the parsed leases in memory.
+# The lease directories are checked for new or removed chutes every
+# LEASE_POLL_INTERVAL seconds, and the files themselves are polled at that
+# interval if inotify is disabled or not available.
+LEASE_INDEX_INOTIFY = True
+LEASE_POLL_INTERVAL = 10
+
 # Check if Docker daemon is in a bad state (process not running but pid file
 # exists).  This does not work in strict confinement.
 CHECK_DOCKER = False
@@ -176,6 +262,17 @@ ZEROTIER_LIB_DIR = "/var/lib/zerotier-one"
 DEFAULT_PANEL_USERNAME = "paradrop"
 DEFAULT_PANEL_PASSWORD = ""
 
+# Successful Basic auth credentials are remembered for this many seconds, so
+# that the password hash does not need to be computed for every request.  The
+# cache holds at most AUTH_CACHE_SIZE credentials.
+AUTH_CACHE_TTL = 300
+AUTH_CACHE_SIZE = 64
+
+# Maximum number of password hashes to compute at the same time.  Hashing is
+# done in worker threads, and this limit keeps a flood of bad login attempts
+# from occupying the whole thread pool.
+AUTH_HASH_CONCURRENCY = 2
+
 # Default wireless settings used for hostconfig generation.  If
 # DEFAULT_WIRELESS_ENABLED is set to False, we will not create an access point
 # by default.
@@ -289,6 +386,8 @@ def updatePaths(configHomeDir, runtimeHomeDir="/var/run/paradrop"):
     mod.LOG_DIR = os.path.join(mod.CONFIG_HOME_DIR, "logs/")
     mod.KEY_DIR = os.path.join(mod.CONFIG_HOME_DIR, "keys/")
     mod.MISC_DIR = os.path.join(mod.CONFIG_HOME_DIR, "misc/")
+    mod.TELEMETRY_SPOOL_DIR = os.path.join(mod.CONFIG_HOME_DIR, "telemetry/")
+    mod.DOWNLOAD_CACHE_DIR = os.path.join(mod.CONFIG_HOME_DIR, "download-cache/")
     mod.CONFIG_FILE = os.path.join(mod.CONFIG_HOME_DIR, "config")
     mod.HOST_CONFIG_FILE = os.path.join(mod.CONFIG_HOME_DIR, "hostconfig.yaml")
     mod.DEFAULT_HOST_CONFIG_FILE = os.path.join(mod.CONFIG_HOME_DIR, "hostconfig.default.yaml")
@@ -1,5 +1,7 @@
 import attr
 import copy
+import hashlib
+import json
 
 import six
 
@@ -225,6 +227,19 @@ class ConfigObject(object):
                 return False
         return True
 
+    def contentDigest(self):
+        """
+        Return a stable digest of the section type and option values.
+
+        Two sections of the same class with equal option values produce the
+        same digest, so this can be used to index sections by content.  The
+        name is deliberately excluded, matching the behavior of optionsMatch.
+        """
+        values = [getattr(self, opdef.name) for opdef in self.options]
+        data = json.dumps([self.getModule(), self.typename, values],
+                          sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
     #
     # The following methods (apply, revert, updateApply, and updateRevert)
     # are the most important for subclasses to override.
@@ -25,6 +25,22 @@ def reload(path):
     return main.configManager.loadConfig(path)
 
 
+def reloadFiles(files):
+    """
+    Reload only the given list of files.
+
+    Sections from other files are kept as they are, except that sections
+    which depend on a changed or removed section are reloaded as well.  This
+    gives the same result as reloadAll when no other files have changed.
+
+    This function blocks until the request completes.  On completion it returns
+    a status string, which is a JSON list of loaded configuration sections with
+    a 'success' field.
+    For critical errors it will return None.
+    """
+    return main.configManager.loadConfig(list(files))
+
+
 def systemStatus():
     """
     Return system status string from pdconf.
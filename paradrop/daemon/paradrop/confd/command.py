@@ -1,10 +1,14 @@
+import collections
 import errno
+import itertools
 import os
 import signal
 import six
 import subprocess
 import time
 
+from multiprocessing.pool import ThreadPool
+
 from paradrop.base.output import out
 
 
@@ -85,6 +89,15 @@ class CommandList(list):
         Commands are first sorted by assigned priority.  Within each priority
         level, the order in which they were added is maintained.
         """
+        for prio, cmd in self.prioritized():
+            yield cmd
+
+    def prioritized(self):
+        """
+        Iterate over (priority, command) tuples in order by priority.
+
+        This uses the same ordering as the commands method.
+        """
         result = list()
         for i in range(len(self)):
             prio, cmd = self[i]
@@ -93,7 +106,97 @@ class CommandList(list):
         result.sort()
 
         for prio, i, cmd in result:
-            yield cmd
+            yield (prio, cmd)
+
+
+def _execute_sequence(commands):
+    """
+    Execute a list of commands in order.
+    """
+    for cmd in commands:
+        cmd.execute()
+
+
+# Programs that modify state shared by the whole system.  Commands that use
+# them must run in order even if they come from different sections, e.g.
+# firewall rules appended to the same chain, or tc changes to one qdisc tree.
+SHARED_RESOURCES = {
+    "ebtables": "xtables",
+    "ip6tables": "xtables",
+    "ip6tables-restore": "xtables",
+    "iptables": "xtables",
+    "iptables-restore": "xtables",
+    "tc": "tc"
+}
+
+
+def _group_commands(level):
+    """
+    Split the commands from one priority level into independent groups.
+
+    Commands from the same section, or that use the same shared resource,
+    end up in the same group.  Each group keeps the original order.
+    """
+    # Map group key (section or resource) -> group number.
+    owner = dict()
+
+    # Map group number -> list of (position, command).
+    groups = collections.OrderedDict()
+
+    for i, cmd in enumerate(level):
+        keys = [("section", id(cmd.parent))]
+        if len(cmd.command) > 0:
+            resource = SHARED_RESOURCES.get(os.path.basename(cmd.command[0]))
+            if resource is not None:
+                keys.append(("resource", resource))
+
+        # Merge any groups that this command connects.
+        found = sorted(set(owner[k] for k in keys if k in owner))
+        if len(found) == 0:
+            group = len(groups)
+            groups[group] = []
+        else:
+            group = found[0]
+            for other in found[1:]:
+                groups[group].extend(groups.pop(other))
+                for k, v in six.iteritems(owner):
+                    if v == other:
+                        owner[k] = group
+
+        for k in keys:
+            owner[k] = group
+        groups[group].append((i, cmd))
+
+    return [[cmd for i, cmd in sorted(group, key=lambda x: x[0])]
+            for group in groups.values()]
+
+
+def execute_concurrently(commands, workers):
+    """
+    Execute commands with independent sections running in parallel.
+
+    commands: ordered list of (priority, Command) tuples.
+    workers: maximum number of threads to use.
+
+    Priority levels are barriers: all commands at one priority level finish
+    before any command at the next level starts.  Within a level, commands
+    are grouped by their parent section, and commands that use a shared
+    resource (see SHARED_RESOURCES) are put in the same group.  Each group
+    runs in order on one thread, while different groups may run at the same
+    time.  Commands with no parent are put in a single group.
+    """
+    pool = ThreadPool(workers)
+    try:
+        for prio, level in itertools.groupby(commands, key=lambda x: x[0]):
+            groups = _group_commands([cmd for _, cmd in level])
+
+            if len(groups) == 1:
+                _execute_sequence(groups[0])
+            else:
+                pool.map(_execute_sequence, groups, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
 
 
 class Command(object):
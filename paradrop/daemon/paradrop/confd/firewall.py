@@ -1,18 +1,213 @@
+import collections
 import ipaddress
+import subprocess
 
 from builtins import str
 
+from paradrop.base.output import out
+
 from .base import ConfigObject, ConfigOption
 from .command import Command
 
 
 IPTABLES_WAIT = "5"
 
+# Map iptables binaries to the restore programs that accept batched rules.
+IPTABLES_RESTORE = {
+    "iptables": "iptables-restore",
+    "ip6tables": "ip6tables-restore"
+}
+
 
 def start_iptables_command(cmd, *args):
     return [cmd, "--wait", IPTABLES_WAIT] + list(args)
 
 
+def parse_iptables_command(command):
+    """
+    Split an iptables command into (binary, table, arguments).
+
+    The --wait option is dropped, and the table defaults to "filter" if it is
+    not specified.  The remaining arguments are what would appear on a line
+    of iptables-restore input.
+    """
+    binary = command[0]
+    table = "filter"
+    args = list()
+
+    i = 1
+    while i < len(command):
+        arg = command[i]
+        if arg in ["--wait", "-w"]:
+            # The wait time is optional.
+            if i + 1 < len(command) and command[i+1].isdigit():
+                i += 1
+        elif arg in ["--table", "-t"]:
+            table = command[i+1]
+            i += 1
+        else:
+            args.append(arg)
+        i += 1
+
+    return binary, table, args
+
+
+def quote_restore_arg(arg):
+    """
+    Quote an argument for iptables-restore input if it contains whitespace.
+    """
+    if arg == "" or any(c.isspace() for c in arg):
+        return '"{}"'.format(arg.replace('"', '\\"'))
+    else:
+        return arg
+
+
+class IptablesRestoreCommand(Command):
+    """
+    Apply a batch of iptables commands with iptables-restore.
+
+    The batch is applied with --noflush and one iptables-restore per table,
+    so that each table is committed as one transaction: either all of its
+    rules are applied or none are.  If iptables-restore fails for a table, we
+    fall back to executing that table's original commands one at a time.
+    Tables that were already committed are not touched again, so the result
+    is the same as if the commands had not been batched.
+    """
+    def __init__(self, binary):
+        command = [IPTABLES_RESTORE[binary], "--wait", IPTABLES_WAIT,
+                   "--noflush"]
+        super(IptablesRestoreCommand, self).__init__(command)
+
+        self.binary = binary
+        self.batched = list()
+
+        # Map table -> list of argument lists, in the order added.
+        self.tables = collections.OrderedDict()
+
+        # Map table -> list of the original commands, in the order added.
+        self.tableCommands = collections.OrderedDict()
+
+    def __contains__(self, s):
+        return any(s in cmd for cmd in self.batched)
+
+    def __str__(self):
+        return "{} <<< {} commands".format(" ".join(self.command),
+                                           len(self.batched))
+
+    def add(self, cmd):
+        """
+        Add an iptables Command object to the batch.
+        """
+        binary, table, args = parse_iptables_command(cmd.command)
+        if binary != self.binary:
+            raise Exception("Cannot add {} command to {} batch".format(
+                binary, self.binary))
+        self.batched.append(cmd)
+        self.tables.setdefault(table, []).append(args)
+        self.tableCommands.setdefault(table, []).append(cmd)
+
+    def getRules(self):
+        """
+        Return the batched rules as a dictionary of table -> argument lists.
+        """
+        return self.tables
+
+    def getInput(self, tables=None):
+        """
+        Generate the input text for iptables-restore.
+
+        tables: list of tables to include (default: all).
+        """
+        if tables is None:
+            tables = self.tables.keys()
+
+        lines = list()
+        for table in tables:
+            lines.append("*{}".format(table))
+            for args in self.tables[table]:
+                lines.append(" ".join(quote_restore_arg(a) for a in args))
+            lines.append("COMMIT")
+        lines.append("")
+        return "\n".join(lines)
+
+    def restore(self, table):
+        """
+        Run iptables-restore for one table and return its exit status.
+        """
+        try:
+            proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    universal_newlines=True)
+            self.pid = proc.pid
+            stdout, stderr = proc.communicate(self.getInput([table]))
+            for line in (stdout + stderr).splitlines():
+                out.verbose("{} {}: {}\n".format(self.command[0], self.pid,
+                                                 line))
+            return proc.returncode
+        except Exception as e:
+            out.info('Command "{}" raised exception {}\n'.format(
+                     " ".join(self.command), e))
+            return e
+
+    def execute(self):
+        success = True
+        self.result = 0
+        for table, commands in self.tableCommands.items():
+            result = self.restore(table)
+            if result == 0:
+                out.verbose('Command "{}" applied {} rules to table {}\n'.format(
+                            " ".join(self.command), len(commands), table))
+                # Record success with each of the original sections.
+                for cmd in commands:
+                    cmd.result = 0
+                    if cmd.parent is not None:
+                        cmd.parent.executed.append(cmd)
+                continue
+
+            # Nothing in the table was committed, so the original commands
+            # can be run as if they had never been batched.
+            out.info('Command "{}" returned {} for table {}, falling back to '
+                     'individual commands\n'.format(" ".join(self.command),
+                                                     result, table))
+            self.result = result
+            for cmd in commands:
+                success = cmd.execute() and success
+
+        return success
+
+    def success(self):
+        return all(cmd.success() for cmd in self.batched)
+
+
+def batch_iptables_commands(commands):
+    """
+    Replace iptables commands with batched iptables-restore commands.
+
+    Takes an ordered list of (priority, Command) tuples and returns a new
+    list in the same form.  All iptables (or ip6tables) commands are
+    collected into a single IptablesRestoreCommand, which takes the position
+    and priority of the first such command.  The relative order of the
+    iptables commands is preserved within each table.  Rules do not depend on
+    the interfaces they reference existing, so moving them ahead of other
+    commands is safe.
+    """
+    result = list()
+    batches = dict()
+
+    for prio, cmd in commands:
+        binary = cmd.command[0] if len(cmd.command) > 0 else None
+        if type(cmd) is not Command or binary not in IPTABLES_RESTORE:
+            result.append((prio, cmd))
+            continue
+
+        if binary not in batches:
+            batches[binary] = IptablesRestoreCommand(binary)
+            result.append((prio, batches[binary]))
+        batches[binary].add(cmd)
+
+    return result
+
+
 class ConfigDefaults(ConfigObject):
     typename = "defaults"
 
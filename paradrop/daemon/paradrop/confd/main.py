@@ -29,5 +29,7 @@ def run_thread(execute=True):
     This function schedules pdconfd to run as a thread and returns immediately.
     """
     global configManager
-    configManager = ConfigManager(settings.PDCONFD_WRITE_DIR, execute)
+    configManager = ConfigManager(settings.PDCONFD_WRITE_DIR, execute,
+            batchIptables=settings.PDCONFD_BATCH_IPTABLES,
+            workers=settings.PDCONFD_EXECUTE_WORKERS)
     reactor.callFromThread(listen, configManager)
@@ -19,7 +19,8 @@ from . import qos
 from . import wireless
 
 from .base import ConfigObject
-from .command import CommandList, ErrorCommand
+from .command import CommandList, ErrorCommand, execute_concurrently
+from .firewall import batch_iptables_commands
 
 
 # Silence pyflakes warning about unused imports.
@@ -55,16 +56,28 @@ def findConfigFiles(search=None):
     If search is a file name (not a path), look for it in the working directory
     first, and the system directory second.  If search is a full path to a
     file, and it exists, then return that file.  If search is a directory,
-    return the files in that directory.
+    return the files in that directory.  If search is a list, return the
+    files found for each of its entries.
     """
     if search is None:
         search = getSystemConfigDir()
 
+    if isinstance(search, (list, tuple, set)):
+        files = list()
+        for item in search:
+            for path in findConfigFiles(item):
+                if path not in files:
+                    files.append(path)
+        return files
+
     files = list()
     if os.path.isfile(search):
         files.append(search)
     elif os.path.isdir(search):
         for fn in os.listdir(search):
+            # Skip hidden files, e.g. temporary files from UCIConfig.save.
+            if fn.startswith("."):
+                continue
             path = os.path.join(search, fn)
             files.append(path)
     else:
@@ -77,13 +90,19 @@ def findConfigFiles(search=None):
 
 class ConfigManager(object):
 
-    def __init__(self, writeDir, execCommands=True):
+    def __init__(self, writeDir, execCommands=True, batchIptables=False,
+                 workers=1):
         """
         writeDir: directory to use for generated config files (e.g. hostapd.conf).
         execCommands: whether or not to run commands (set to False for testing).
+        batchIptables: apply iptables commands with iptables-restore.
+        workers: number of threads for running commands from independent
+        sections at the same priority level (1 runs everything in order).
         """
         self.writeDir = writeDir
         self.execCommands = execCommands
+        self.batchIptables = batchIptables
+        self.workers = workers
 
         # Make sure directory exists.
         pdosq.makedirs(writeDir)
@@ -92,6 +111,11 @@ class ConfigManager(object):
         self.currentConfig = dict()
         self.nextSectionId = 0
 
+        # Map content digest -> list of sections from currentConfig.  This is
+        # maintained alongside currentConfig so that we can find a section
+        # with identical content without scanning every section.
+        self.contentIndex = dict()
+
         # Number of objects requiring IP forwarding.
         # If >0, we need to enable system-wide.
         # If ==0, we can probably disable.
@@ -136,10 +160,20 @@ class ConfigManager(object):
         """
         Execute commands.
 
-        Takes a CommandList object.
+        Takes a CommandList object.  If batchIptables is set, the iptables
+        commands are combined into iptables-restore transactions.  If workers
+        is greater than one, commands at the same priority level that belong
+        to different sections may run in parallel.
         """
-        for cmd in commands.commands():
-            cmd.execute()
+        ordered = commands.prioritized()
+        if self.batchIptables:
+            ordered = batch_iptables_commands(ordered)
+
+        if self.workers > 1:
+            execute_concurrently(list(ordered), self.workers)
+        else:
+            for prio, cmd in ordered:
+                cmd.execute()
 
     def findMatchingConfig(self, config, byName=False):
         """
@@ -147,7 +181,7 @@ class ConfigManager(object):
 
         Returns the matching object or None.
         """
-        # First try by name (faster).
+        # First try by name.
         key = config.getTypeAndName()
 
         if key in self.currentConfig:
@@ -157,13 +191,27 @@ class ConfigManager(object):
             if config.optionsMatch(oldConfig):
                 return oldConfig
 
-        # Loop over them and check by content.
-        for oldConfig in self.currentConfig.values():
+        # Look up by content.  The digest narrows it down to (almost always)
+        # a single candidate, which we confirm with optionsMatch.
+        digest = config.contentDigest()
+        for oldConfig in self.contentIndex.get(digest, []):
             if config.optionsMatch(oldConfig):
                 return oldConfig
 
         return None
 
+    def setCurrentConfig(self, configs):
+        """
+        Replace the current configuration and rebuild the content index.
+
+        configs: dictionary mapping (module, type, name) -> config object.
+        """
+        self.currentConfig = configs
+        self.contentIndex = dict()
+        for config in configs.values():
+            digest = config.contentDigest()
+            self.contentIndex.setdefault(digest, []).append(config)
+
     def loadConfig(self, search=None, execute=True):
         """
         Load configuration files and apply changes to the system.
@@ -267,6 +315,11 @@ class ConfigManager(object):
         # updated configs that are supposed to be removed.
         updatedConfigs -= undoConfigs
 
+        # Sections that are reloaded because a dependency changed are also
+        # applied again in this epoch.
+        for config in updatedConfigs:
+            config.epoch = self.epoch
+
         undoWork = ConfigObject.prioritizeConfigs(updatedConfigs | undoConfigs,
                 reverse=True)
         heapq.heapify(undoWork)
@@ -307,7 +360,7 @@ class ConfigManager(object):
             self.execute(commands)
 
         self.previousCommands = commands
-        self.currentConfig = allConfigs
+        self.setCurrentConfig(allConfigs)
 
         # Wake up anything that was waiting for the first load to complete.
         self.systemUp.set()
@@ -333,7 +386,7 @@ class ConfigManager(object):
             basename = os.path.basename(fn)
 
             uci = UCIConfig(fn)
-            config = uci.readConfig()
+            config = uci.config
 
             for section, options in config:
                 # Sections differ in where they put the name, if they have one.
@@ -419,7 +472,7 @@ class ConfigManager(object):
             self.execute(commands)
 
         self.previousCommands = commands
-        self.currentConfig = dict()
+        self.setCurrentConfig(dict())
         return True
 
     def waitSystemUp(self):
@@ -1,5 +1,10 @@
+import collections
+import subprocess
+
 import six
 
+from paradrop.base.output import out
+
 from .base import ConfigObject, ConfigOption
 from .command import Command
 
@@ -95,6 +100,62 @@ def compute_hfsc_params(classes, capacity):
     return result
 
 
+class TcBatchCommand(Command):
+    """
+    Apply a list of tc commands with a single `tc -batch` process.
+
+    Each line is a tc argument list without the leading "tc".  With -force,
+    tc continues after a failed line and reports failure at the end.  If tc
+    cannot be run at all, we fall back to running the lines one at a time.
+    """
+    def __init__(self, lines, parent=None):
+        super(TcBatchCommand, self).__init__(["tc", "-force", "-batch", "-"],
+                                             parent)
+        self.lines = [[str(v) for v in line] for line in lines]
+
+    def __contains__(self, s):
+        return any(s in " ".join(line) for line in self.lines)
+
+    def __str__(self):
+        return "{} <<< {} commands".format(" ".join(self.command),
+                                           len(self.lines))
+
+    def getInput(self):
+        return "".join(" ".join(line) + "\n" for line in self.lines)
+
+    def execute(self):
+        try:
+            proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    universal_newlines=True)
+            self.pid = proc.pid
+            stdout, stderr = proc.communicate(self.getInput())
+            for line in (stdout + stderr).splitlines():
+                out.verbose("{} {}: {}\n".format(self.command[0], self.pid,
+                                                 line))
+            self.result = proc.returncode
+        except OSError as e:
+            out.info('Command "{}" raised exception {}, falling back to '
+                     'individual commands\n'.format(" ".join(self.command), e))
+            self.result = 0
+            for line in self.lines:
+                cmd = Command(["tc"] + line)
+                if not cmd.execute():
+                    self.result = cmd.result
+
+        if self.result == 0:
+            out.verbose('Command "{}" applied {} commands\n'.format(
+                        " ".join(self.command), len(self.lines)))
+        else:
+            out.info('Command "{}" returned {}\n'.format(
+                     " ".join(self.command), self.result))
+
+        if self.parent is not None:
+            self.parent.executed.append(self)
+
+        return (self.ignoreFailure or self.result == 0)
+
+
 class ConfigInterface(ConfigObject):
     typename = "interface"
 
@@ -106,17 +167,21 @@ class ConfigInterface(ConfigObject):
         ConfigOption(name="download", type=int, default=512)
     ]
 
-    def apply(self, allConfigs):
-        commands = list()
-
-        if not self.enabled:
-            return commands
+    def build_tree(self, allConfigs):
+        """
+        Compute the HFSC qdisc tree for the interface.
 
+        Returns a tuple (root, classes) where root is the tc argument list
+        for the root qdisc (without the "qdisc add" verb), and classes is an
+        ordered dictionary mapping class ID to the argument list for the
+        HFSC class (without the "class add" verb).
+        """
         # Look up the interface section.
         interface = self.lookup(allConfigs, "network", "interface", self.name)
+        ifname = interface.config_ifname
 
-        # Store ifname mainly for the revert command.
-        self.config_ifname = interface.config_ifname
+        # Remember which version of the interface the tree is attached to.
+        self._network_epoch = (interface, interface.epoch)
 
         classes = []
         default_classid = None
@@ -127,14 +192,13 @@ class ConfigInterface(ConfigObject):
 
             traffic_class = self.lookup(allConfigs, "qos", "class", class_name)
             classes.append((class_id, traffic_class))
+        classes.sort(key=lambda x: x[0])
 
-        cmd = ["tc", "qdisc", "add",
-                "dev", self.config_ifname,
-                "root", "handle", "1:",
-                "hfsc"]
+        root = ["dev", ifname, "root", "handle", "1:", "hfsc"]
         if default_classid is not None:
-            cmd.extend(["default", str(default_classid)])
-        commands.append((self.PRIO_CREATE_QDISC, Command(cmd, self)))
+            root.extend(["default", str(default_classid)])
+
+        tree = collections.OrderedDict()
 
         hfsc_params = compute_hfsc_params(classes, self.upload)
         for class_id, traffic_class in classes:
@@ -142,8 +206,7 @@ class ConfigInterface(ConfigObject):
             params = hfsc_params[class_id]
 
             cmd = [
-                "tc", "class", "add",
-                "dev", self.config_ifname,
+                "dev", ifname,
                 "parent", "1:",
                 "classid", full_class_id,
                 "hfsc"
@@ -166,18 +229,36 @@ class ConfigInterface(ConfigObject):
             if params['has_ul']:
                 cmd.extend(["ul", "m2", str(params['ul_m2'])+"kbit"])
 
-            commands.append((self.PRIO_CREATE_QDISC, Command(cmd, self)))
+            tree[class_id] = cmd
 
-            # Add a fair queue to each class so that flows within the same
-            # class receive fair treatment.
-            cmd = [
-                "tc", "qdisc", "add",
-                "dev", self.config_ifname,
-                "parent", full_class_id,
-                "fq_codel", "noecn"
-            ]
-            commands.append((self.PRIO_CREATE_QDISC, Command(cmd, self)))
+        return root, tree
+
+    def make_leaf_qdisc(self, ifname, class_id):
+        # Add a fair queue to each class so that flows within the same class
+        # receive fair treatment.
+        return ["qdisc", "add",
+                "dev", ifname,
+                "parent", "1:{}".format(class_id),
+                "fq_codel", "noecn"]
 
+    def apply(self, allConfigs):
+        commands = list()
+
+        if not self.enabled:
+            return commands
+
+        root, tree = self.build_tree(allConfigs)
+        self._installed = (root, tree)
+
+        # Store ifname mainly for the revert command.
+        self.config_ifname = root[1]
+
+        lines = [["qdisc", "add"] + root]
+        for class_id, args in six.iteritems(tree):
+            lines.append(["class", "add"] + args)
+            lines.append(self.make_leaf_qdisc(self.config_ifname, class_id))
+
+        commands.append((self.PRIO_CREATE_QDISC, TcBatchCommand(lines, self)))
         return commands
 
     def revert(self, allConfigs):
@@ -191,6 +272,70 @@ class ConfigInterface(ConfigObject):
 
         return commands
 
+    def _needs_rebuild(self, new, allConfigs):
+        """
+        Check whether the change requires replacing the whole qdisc tree.
+
+        The tree can only be updated in place if the interface stays enabled,
+        the network interface was not reverted and re-applied (which may
+        delete and recreate the device along with its qdiscs), and the root
+        qdisc (device and default class) stays the same.
+        """
+        if not (self.enabled and new.enabled):
+            return True
+        if getattr(self, '_installed', None) is None:
+            return True
+
+        installed_on = getattr(self, '_network_epoch', None)
+        interface = allConfigs.get(("network", "interface", new.name), None)
+        if installed_on != (interface, getattr(interface, 'epoch', None)):
+            return True
+
+        try:
+            root, tree = new.build_tree(allConfigs)
+        except Exception:
+            # Let apply report the error.
+            return True
+
+        new._pending = (root, tree)
+        return root != self._installed[0]
+
+    def updateRevert(self, new, allConfigs):
+        if self._needs_rebuild(new, allConfigs):
+            new._pending = None
+            return self.revert(allConfigs)
+
+        # The existing tree will be modified in place by updateApply.
+        return []
+
+    def updateApply(self, new, allConfigs):
+        pending = getattr(new, '_pending', None)
+        new._pending = None
+        if pending is None:
+            return new.apply(allConfigs)
+
+        old_tree = self._installed[1]
+        root, tree = pending
+        new._installed = pending
+        new.config_ifname = root[1]
+
+        # Only send the classes that were added, removed, or changed.
+        lines = []
+        for class_id, args in six.iteritems(old_tree):
+            if class_id not in tree:
+                lines.append(["class", "del"] + args[:6])
+        for class_id, args in six.iteritems(tree):
+            if class_id not in old_tree:
+                lines.append(["class", "add"] + args)
+                lines.append(new.make_leaf_qdisc(new.config_ifname, class_id))
+            elif args != old_tree[class_id]:
+                lines.append(["class", "change"] + args)
+
+        commands = list()
+        if len(lines) > 0:
+            commands.append((new.PRIO_CREATE_QDISC, TcBatchCommand(lines, new)))
+        return commands
+
 
 class ConfigClassify(ConfigObject):
     typename = "classify"
@@ -261,9 +406,11 @@ class ConfigClassify(ConfigObject):
 
         return Command(cmd, self)
 
-    def apply(self, allConfigs):
-        self._created_rules = []
-        commands = []
+    def find_rules(self, allConfigs):
+        """
+        Find the (ifname, class_id) pairs that need a CLASSIFY rule.
+        """
+        rules = []
 
         self.lookup(allConfigs, "qos", "class", self.target)
 
@@ -286,15 +433,20 @@ class ConfigClassify(ConfigObject):
                         "interface", interface.name)
 
                 full_class_id = "1:{}".format(class_id)
+                rules.append((network_interface.config_ifname, full_class_id))
 
-                args = (network_interface.config_ifname, full_class_id)
-                cmd = self.make_iptables_cmd("--append", *args)
+        return rules
+
+    def apply(self, allConfigs):
+        commands = []
 
-                # Save these arguments so that we can recreate the iptables
-                # commands in the revert method.
-                self._created_rules.append(args)
+        # Save these arguments so that we can recreate the iptables commands
+        # in the revert method.
+        self._created_rules = self.find_rules(allConfigs)
 
-                commands.append((self.PRIO_IPTABLES_RULE, cmd))
+        for args in self._created_rules:
+            cmd = self.make_iptables_cmd("--append", *args)
+            commands.append((self.PRIO_IPTABLES_RULE, cmd))
 
         return commands
 
@@ -305,6 +457,43 @@ class ConfigClassify(ConfigObject):
             commands.append((-self.PRIO_IPTABLES_RULE, cmd))
         return commands
 
+    def updateRevert(self, new, allConfigs):
+        new._pending_rules = None
+        if not self.optionsMatch(new):
+            return self.revert(allConfigs)
+
+        # Only the interfaces or class IDs changed, so leave the rules that
+        # are still valid in place.
+        try:
+            rules = new.find_rules(allConfigs)
+        except Exception:
+            return self.revert(allConfigs)
+
+        commands = []
+        for args in self._created_rules:
+            if args not in rules:
+                cmd = self.make_iptables_cmd("--delete", *args)
+                commands.append((-self.PRIO_IPTABLES_RULE, cmd))
+
+        new._pending_rules = (self._created_rules, rules)
+        return commands
+
+    def updateApply(self, new, allConfigs):
+        pending = getattr(new, '_pending_rules', None)
+        new._pending_rules = None
+        if pending is None:
+            return new.apply(allConfigs)
+
+        old_rules, rules = pending
+        new._created_rules = rules
+
+        commands = []
+        for args in rules:
+            if args not in old_rules:
+                cmd = new.make_iptables_cmd("--append", *args)
+                commands.append((new.PRIO_IPTABLES_RULE, cmd))
+        return commands
+
 
 class ConfigClassgroup(ConfigObject):
     typename = "classgroup"
@@ -4,6 +4,7 @@ import pycurl
 import re
 import six
 import urllib
+import zlib
 
 import twisted
 from twisted.internet import reactor, threads
@@ -82,6 +83,16 @@ def urlEncodeParams(data):
     return urllib.urlencode(copy, doseq=True)
 
 
+def gzipBody(body):
+    """
+    Return body compressed in gzip format.
+    """
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
 class PDServerResponse(object):
     """
     A PDServerResponse object contains the results of a request to pdserver.
@@ -249,7 +260,9 @@ class TwistedRequestDriver(HTTPRequestDriver):
     def request(self, method, url, body=None):
         def makeRequest(ignored):
             bodyProducer = None
-            if body is not None:
+            if isinstance(body, six.binary_type):
+                bodyProducer = FileBodyProducer(six.BytesIO(body))
+            elif body is not None:
                 bodyProducer = FileBodyProducer(six.StringIO(body))
 
             headers = {}
@@ -297,6 +310,9 @@ class PDServerRequest(object):
 
     Example:
     /routers/{router_id}/states -> /routers/halo06/states
+
+    If compress is True, the request body is sent gzip-compressed with a
+    Content-Encoding header.
     """
 
     # Auth token (JWT): we will automatically request as needed (for the first
@@ -304,11 +320,13 @@ class PDServerRequest(object):
     # requests.
     token = None
 
-    def __init__(self, path, driver=TwistedRequestDriver, headers={}, setAuthHeader=True):
+    def __init__(self, path, driver=TwistedRequestDriver, headers={},
+                 setAuthHeader=True, compress=False):
         self.path = path
         self.driver = driver
         self.headers = headers
         self.setAuthHeader = setAuthHeader
+        self.compress = compress
         self.transportRetries = 0
 
         url = nexus.core.info.pdserver
@@ -363,7 +381,13 @@ class PDServerRequest(object):
             driver.setHeader('Authorization', auth)
         for key, value in six.iteritems(self.headers):
             driver.setHeader(key, value)
-        return driver.request(self.method, self.url, self.body)
+
+        body = self.body
+        if self.compress and body is not None:
+            driver.setHeader('Content-Encoding', 'gzip')
+            body = gzipBody(body)
+
+        return driver.request(self.method, self.url, body)
 
     def receiveResponse(self, response):
         """
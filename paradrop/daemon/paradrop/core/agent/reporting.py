@@ -8,7 +8,9 @@ import json
 import os
 import time
 
+import jsonpatch
 from twisted.internet import reactor
+from twisted.internet.defer import DeferredLock
 
 from paradrop.base.output import out
 from paradrop.base import nexus, settings
@@ -16,7 +18,7 @@ from paradrop.core.chute.chute_storage import ChuteStorage
 from paradrop.core.config import devices, hostconfig, resource, zerotier
 from paradrop.core.container.chutecontainer import ChuteContainer
 from paradrop.core.agent.http import PDServerRequest
-from paradrop.core.system import system_info
+from paradrop.core.system import node_facts
 from paradrop.core.system.system_status import SystemStatus
 from paradrop.lib.misc.governor import GovernorClient
 
@@ -44,15 +46,32 @@ class StateReport(object):
 
 
 class StateReportBuilder(object):
+    @classmethod
+    def getStaticFacts(cls):
+        """
+        Get facts that do not change while the daemon is running from the
+        node facts registry.
+        """
+        software = node_facts.facts.get('software')
+        return {
+            'osVersion': software['osVersion'],
+
+            # We can get the paradrop version from the installed python
+            # package.
+            'paradropVersion': software['pdVersion'],
+
+            'dmi': node_facts.facts.get('dmi')
+        }
+
     def prepare(self):
         report = StateReport()
 
         report.name = nexus.core.info.pdid
 
-        report.osVersion = system_info.getOSVersion()
-
-        # We can get the paradrop version from the installed python package.
-        report.paradropVersion = system_info.getPackageVersion('paradrop')
+        facts = self.getStaticFacts()
+        report.osVersion = facts['osVersion']
+        report.paradropVersion = facts['paradropVersion']
+        report.dmi = facts['dmi']
 
         report.chutes = []
         chuteStore = ChuteStorage()
@@ -96,7 +115,6 @@ class StateReportBuilder(object):
             report.snaps = client.listSnaps()
 
         report.zerotierAddress = zerotier.getAddress()
-        report.dmi = system_info.getDMI()
 
         # Add CPU, memory, disk, and network interface information.  This gives
         # the controller useful debugging information such as high memory or
@@ -204,6 +222,114 @@ class ReportSender(object):
         return d
 
 
+class StateReportSender(ReportSender):
+    """
+    Send state reports as deltas against the last acknowledged report.
+
+    The first report, and any report after the server asks for a resync, is
+    sent in full.  After that, we send a JSON-Patch from the last report that
+    the server accepted along with version numbers for both reports so the
+    server can detect a missing base.  The server asks for a resync by
+    responding with 409 (Conflict) or with "resync": true in the body.  A 404
+    response to a delta means the server does not support them, so we
+    switch to full reports.  Likewise, a 400 or 415 response to a compressed
+    report means the server does not accept compressed bodies, so we switch
+    to uncompressed reports.
+
+    Reports are sent one at a time.  Each report is built when it is its
+    turn to be sent, so a burst of calls results in up-to-date reports and
+    every delta is relative to a report that the server has.
+    """
+    def __init__(self):
+        super(StateReportSender, self).__init__(model="states")
+        self.lock = DeferredLock()
+        self.useDelta = settings.STATE_REPORT_DELTA
+        self.useCompression = settings.STATE_REPORT_COMPRESS
+
+        # Last report acknowledged by the server and its version number.
+        self.acked = None
+        self.version = 0
+
+    def resync(self):
+        """
+        Send the next report in full.
+        """
+        self.acked = None
+
+    def send(self, builder):
+        """
+        Build and send a state report (returns a Deferred).
+        """
+        return self.lock.run(self._send, builder)
+
+    def _send(self, builder, resend=True):
+        report = builder.prepare()
+        version = self.version + 1
+
+        delta = self.useDelta and self.acked is not None
+        compressed = self.useCompression
+        if delta:
+            request = PDServerRequest('/api/routers/{router_id}/states/delta',
+                    compress=self.useCompression)
+            patch = jsonpatch.make_patch(self.acked, report).patch
+            d = request.post(base=self.version, version=version, patch=patch)
+        else:
+            request = PDServerRequest('/api/routers/{router_id}/states',
+                    compress=self.useCompression)
+            body = dict(report)
+            body['version'] = version
+            d = request.post(**body)
+
+        def cbresponse(response):
+            data = response.data if isinstance(response.data, dict) else {}
+
+            if response.success and not data.get('resync', False):
+                self.acked = report
+                self.version = version
+                self.retries = 0
+                self.retryDelay = 1
+                nexus.core.jwt_valid = True
+                return response
+
+            if compressed and response.code in [400, 415]:
+                out.info('Server does not accept compressed state reports\n')
+                self.useCompression = False
+                return self._send(builder, resend=resend)
+
+            if (delta and response.code in [404, 409]) or data.get('resync', False):
+                if response.code == 404:
+                    out.info('Server does not accept state report deltas\n')
+                    self.useDelta = False
+                self.acked = None
+                if resend:
+                    return self._send(builder, resend=False)
+                return response
+
+            out.warn('{} to {} returned code {}'.format(request.method,
+                request.url, response.code))
+            self.scheduleRetry(builder)
+            nexus.core.jwt_valid = False
+            return response
+
+        # Check for connection failures and retry.
+        def cberror(ignored):
+            out.warn('{} to {} failed'.format(request.method, request.url))
+            self.scheduleRetry(builder)
+            nexus.core.jwt_valid = False
+
+        d.addCallback(cbresponse)
+        d.addErrback(cberror)
+        return d
+
+    def scheduleRetry(self, builder):
+        # The next report will contain all changes since the last acknowledged
+        # report, so a retry is just another report.
+        if self.max_retries is None or self.retries < self.max_retries:
+            reactor.callLater(self.retryDelay, self.send, builder)
+            self.retries += 1
+            self.increaseDelay()
+
+
 class NodeIdentitySender(ReportSender):
     def send(self, report):
         request = PDServerRequest('/api/routers/{router_id}')
@@ -248,24 +374,19 @@ def sendNodeIdentity():
     return sender.send(report)
 
 
-def sendStateReport():
-    builder = StateReportBuilder()
-    report = builder.prepare()
+stateReportSender = StateReportSender()
 
-    sender = ReportSender()
-    return sender.send(report)
 
+def sendStateReport(full=False):
+    """
+    Send a state report to the server.
 
-def sendTelemetryReport():
-    # Do not try to send telemetry report if not provisioned.
-    if not nexus.core.provisioned():
-        if not getattr(sendTelemetryReport, 'provisionWarningShown', False):
-            out.warn("Unable to send telemetry report: not provisioned")
-            sendTelemetryReport.provisionWarningShown = True
-        return None
+    If full is True, send the complete report rather than a delta, e.g.
+    because the node has been provisioned with a new identity.
+    """
+    if full:
+        stateReportSender.resync()
 
-    builder = TelemetryReportBuilder()
-    report = builder.prepare()
+    builder = StateReportBuilder()
+    return stateReportSender.send(builder)
 
-    sender = ReportSender(model="telemetry", max_retries=0)
-    return sender.send(report)
@@ -0,0 +1,333 @@
+"""
+Telemetry sampling with a local spool.
+
+Samples are taken on one schedule and written to an on-disk spool, and
+uploads happen on a separate, usually longer, schedule.  Each upload sends a
+batch of samples in one compressed request.  If the controller cannot be
+reached, samples stay in the spool until the connection comes back, and the
+backlog is drained a limited number of batches at a time.
+
+The spool is a directory of numbered segment files.  Each segment holds a
+sequence of records, and each record is a fixed header (timestamp and payload
+length) followed by the zlib-compressed JSON sample.  The total size of the
+spool is bounded: when it grows too large, the oldest segments are removed,
+even if they were not uploaded.  A small cursor file records the position of
+the first sample that has not been acknowledged by the controller.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from twisted.internet import reactor
+
+from paradrop.base import nexus, settings
+from paradrop.base.output import out
+from paradrop.core.agent.http import PDServerRequest
+from paradrop.core.agent.reporting import TelemetryReportBuilder
+from paradrop.lib.utils import pdosq
+
+
+# Record header: timestamp (double) and payload length (unsigned int).
+RECORD_HEADER = struct.Struct("<dI")
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+
+def segmentName(number):
+    return "{:012d}{}".format(number, SEGMENT_SUFFIX)
+
+
+def encodeRecord(timestamp, sample):
+    payload = zlib.compress(json.dumps(sample,
+        separators=(',', ':')).encode('utf-8'))
+    return RECORD_HEADER.pack(timestamp, len(payload)) + payload
+
+
+def decodeRecords(data):
+    """
+    Decode the records in a segment (generator).
+
+    Yields (end offset, timestamp, sample) tuples and stops at the first
+    incomplete or corrupt record.
+    """
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp, length = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + length
+        if end > len(data):
+            return
+        try:
+            sample = json.loads(zlib.decompress(data[start:end]).decode('utf-8'))
+        except Exception:
+            return
+        offset = end
+        yield offset, timestamp, sample
+
+
+class TelemetrySpool(object):
+    """
+    Size-bounded, on-disk queue of telemetry samples.
+    """
+    def __init__(self, path, maxSize, segmentSize):
+        self.path = path
+        self.maxSize = maxSize
+        self.segmentSize = segmentSize
+
+        # Number of samples discarded because the spool was full.
+        self.dropped = 0
+
+        pdosq.makedirs(path)
+
+        # Map segment number -> size in bytes.
+        self.segments = {}
+        for name in os.listdir(path):
+            if name.endswith(SEGMENT_SUFFIX):
+                number = int(name[:-len(SEGMENT_SUFFIX)])
+                self.segments[number] = os.path.getsize(self.segmentPath(number))
+
+        self.cursor = self.readCursor()
+
+        if len(self.segments) > 0:
+            self.repairSegment(max(self.segments))
+
+    def segmentPath(self, number):
+        return os.path.join(self.path, segmentName(number))
+
+    def readCursor(self):
+        """
+        Read the position of the first unacknowledged sample.
+        """
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE), "r") as source:
+                number, offset = source.read().split()
+            return (int(number), int(offset))
+        except Exception:
+            return (min(self.segments) if self.segments else 0, 0)
+
+    def writeCursor(self):
+        path = os.path.join(self.path, CURSOR_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as output:
+            output.write("{} {}".format(*self.cursor))
+        os.rename(tmp, path)
+
+    def repairSegment(self, number):
+        """
+        Truncate a partially written record from the end of a segment.
+        """
+        with open(self.segmentPath(number), "rb") as source:
+            data = source.read()
+
+        valid = 0
+        for valid, timestamp, sample in decodeRecords(data):
+            pass
+
+        if valid < len(data):
+            with open(self.segmentPath(number), "r+b") as output:
+                output.truncate(valid)
+            self.segments[number] = valid
+
+    def size(self):
+        return sum(self.segments.values())
+
+    def append(self, sample, timestamp):
+        """
+        Add a sample to the end of the spool.
+        """
+        record = encodeRecord(timestamp, sample)
+
+        if len(self.segments) == 0:
+            number = self.cursor[0]
+        else:
+            number = max(self.segments)
+            if self.segments[number] > 0 and \
+                    self.segments[number] + len(record) > self.segmentSize:
+                number += 1
+
+        with open(self.segmentPath(number), "ab") as output:
+            output.write(record)
+        self.segments[number] = self.segments.get(number, 0) + len(record)
+
+        self.enforceLimit()
+
+    def enforceLimit(self):
+        """
+        Remove the oldest segments until the spool fits in maxSize.
+        """
+        while len(self.segments) > 1 and self.size() > self.maxSize:
+            number = min(self.segments)
+            if number >= self.cursor[0]:
+                with open(self.segmentPath(number), "rb") as source:
+                    data = source.read()
+                start = self.cursor[1] if number == self.cursor[0] else 0
+                self.dropped += sum(1 for r in decodeRecords(data[start:]))
+                self.cursor = (number + 1, 0)
+                self.writeCursor()
+            self.removeSegment(number)
+
+    def removeSegment(self, number):
+        try:
+            os.remove(self.segmentPath(number))
+        except OSError:
+            pass
+        del self.segments[number]
+
+    def read(self, limit):
+        """
+        Read up to limit samples starting at the cursor.
+
+        Returns (samples, position) where position should be passed to
+        acknowledge after the samples have been delivered.
+        """
+        samples = []
+        position = self.cursor
+
+        for number in sorted(self.segments):
+            if number < position[0]:
+                continue
+
+            start = position[1] if number == position[0] else 0
+            with open(self.segmentPath(number), "rb") as source:
+                source.seek(start)
+                data = source.read()
+
+            for end, timestamp, sample in decodeRecords(data):
+                samples.append(sample)
+                position = (number, start + end)
+                if len(samples) >= limit:
+                    return samples, position
+
+            # Continue at the start of the next segment.
+            if number < max(self.segments):
+                position = (number + 1, 0)
+
+        return samples, position
+
+    def acknowledge(self, position):
+        """
+        Mark all samples before position as delivered.
+        """
+        self.cursor = position
+        self.writeCursor()
+
+        for number in sorted(self.segments):
+            if number < position[0]:
+                self.removeSegment(number)
+
+    def pending(self):
+        """
+        Return True if there are samples that have not been delivered.
+        """
+        number, offset = self.cursor
+        for n, size in self.segments.items():
+            if n > number or (n == number and size > offset):
+                return True
+        return False
+
+
+class TelemetryService(object):
+    """
+    Take telemetry samples and upload them in batches.
+    """
+    def __init__(self, spool=None, builder=None):
+        if spool is None:
+            spool = TelemetrySpool(settings.TELEMETRY_SPOOL_DIR,
+                    settings.TELEMETRY_SPOOL_SIZE,
+                    settings.TELEMETRY_SEGMENT_SIZE)
+        if builder is None:
+            builder = TelemetryReportBuilder()
+
+        self.spool = spool
+        self.builder = builder
+        self.uploading = False
+        self.useBatch = True
+
+    def sample(self):
+        """
+        Take a telemetry sample and add it to the spool.
+        """
+        try:
+            report = self.builder.prepare()
+            self.spool.append(report, report['time'])
+        except Exception as error:
+            out.warn("Failed to take telemetry sample: {}".format(error))
+
+    def upload(self):
+        """
+        Upload spooled samples (returns a Deferred or None).
+
+        At most TELEMETRY_MAX_BATCHES requests are sent by one call.
+        """
+        if self.uploading or not self.spool.pending():
+            return None
+
+        # Do not try to upload telemetry if not provisioned.
+        if not nexus.core.provisioned():
+            return None
+
+        self.uploading = True
+        return self.sendBatch(settings.TELEMETRY_MAX_BATCHES)
+
+    def sendBatch(self, remaining):
+        samples, position = self.spool.read(settings.TELEMETRY_BATCH_SIZE)
+        if len(samples) == 0:
+            self.spool.acknowledge(position)
+            self.uploading = False
+            return None
+
+        if self.useBatch:
+            request = PDServerRequest('/api/routers/{router_id}/telemetry/batch',
+                    compress=True)
+            d = request.post(samples=samples, dropped=self.spool.dropped)
+        else:
+            # The server only accepts single samples, so send the newest one.
+            request = PDServerRequest('/api/routers/{router_id}/telemetry')
+            d = request.post(**samples[-1])
+
+        def cbresponse(response):
+            if response.code == 404 and self.useBatch:
+                out.info('Server does not accept telemetry batches\n')
+                self.useBatch = False
+                return self.sendBatch(remaining)
+
+            if not response.success:
+                out.warn('{} to {} returned code {}'.format(request.method,
+                    request.url, response.code))
+                self.uploading = False
+                return response
+
+            self.spool.acknowledge(position)
+            self.spool.dropped = 0
+
+            if remaining > 1 and self.spool.pending():
+                # Drain the backlog gradually.
+                reactor.callLater(settings.TELEMETRY_DRAIN_DELAY,
+                        self.sendBatch, remaining - 1)
+            else:
+                self.uploading = False
+            return response
+
+        def cberror(ignored):
+            out.warn('{} to {} failed'.format(request.method, request.url))
+            self.uploading = False
+
+        d.addCallback(cbresponse)
+        d.addErrback(cberror)
+        return d
+
+
+service = None
+
+
+def getService():
+    """
+    Return the telemetry service, creating it on first use.
+    """
+    global service
+    if service is None:
+        service = TelemetryService()
+    return service
@@ -4,9 +4,13 @@ from __future__ import print_function
 # Authors: The Paradrop Team
 ###################################################################
 
+import os
+import pickle
 import sys
 
 from paradrop.base import settings
+from paradrop.base.output import out
+from paradrop.lib.utils import pdos, pdosq
 from paradrop.lib.utils.pd_storage import PDStorage
 
 from .chute import Chute
@@ -20,10 +24,28 @@ class ChuteStorage(PDStorage):
         This class holds onto the list of Chutes on this AP.
 
         It implements the PDStorage class which allows us to save the chuteList to disk transparently
+
+        Individual changes (saveChute, deleteChute) are appended to a journal
+        file next to the snapshot rather than rewriting the whole chute list.
+        The journal is compacted into a new snapshot when it grows past
+        FC_CHUTESTORAGE_JOURNAL_LIMIT records or when saveToDisk is called.
     """
     # Class variable of chute list so all instances see the same thing
     chuteList = dict()
 
+    # Storage state is also shared by all instances.
+    _savedDigest = None
+    _savedGeneration = None
+    journalLength = 0
+
+    # Set when replaying the journal stopped at a damaged record.  Records
+    # appended after it would be lost, so the journal must be compacted.
+    journalDamaged = False
+
+    # Incremented whenever a chute is added, replaced, or removed so that
+    # other modules can maintain indexes over the chute list.
+    generation = 0
+
     def __init__(self, filename=None, save_timer=settings.FC_CHUTESTORAGE_SAVE_TIMER):
         if(not filename):
             filename = settings.FC_CHUTESTORAGE_FILE
@@ -34,9 +56,118 @@ class ChuteStorage(PDStorage):
         if(len(ChuteStorage.chuteList) == 0):
             self.loadFromDisk()
 
+    @property
+    def savedDigest(self):
+        return ChuteStorage._savedDigest
+
+    @savedDigest.setter
+    def savedDigest(self, value):
+        ChuteStorage._savedDigest = value
+
+    @property
+    def savedGeneration(self):
+        return ChuteStorage._savedGeneration
+
+    @savedGeneration.setter
+    def savedGeneration(self, value):
+        ChuteStorage._savedGeneration = value
+
+    def getGeneration(self):
+        return ChuteStorage.generation
+
+    def getJournalFile(self):
+        return self.filename + ".journal"
+
+    def appendJournal(self, op, name, chute=None):
+        """
+        Append a change record to the journal.
+
+        op: "save" or "delete"
+        """
+        try:
+            with open(self.getJournalFile(), 'ab') as output:
+                pickle.dump((op, name, chute), output)
+                output.flush()
+                os.fsync(output.fileno())
+            ChuteStorage.journalLength += 1
+        except Exception as e:
+            out.err('Error writing journal %s\n' % (str(e)))
+            self.saveToDisk(force=True)
+            return
+
+        if ChuteStorage.journalLength >= settings.FC_CHUTESTORAGE_JOURNAL_LIMIT:
+            self.saveToDisk()
+
+    def replayJournal(self):
+        """
+        Apply the changes recorded in the journal to the chute list.
+
+        A partially written record at the end of the journal (e.g. from a
+        power loss) is ignored, and journalDamaged is set so that the journal
+        can be compacted.  Returns True if any records were applied.
+        """
+        path = self.getJournalFile()
+        if not pdos.exists(path):
+            return False
+
+        count = 0
+        try:
+            with open(path, 'rb') as source:
+                while True:
+                    try:
+                        op, name, chute = pickle.load(source)
+                    except EOFError:
+                        break
+
+                    if op == "save":
+                        ChuteStorage.chuteList[name] = chute
+                    elif op == "delete":
+                        ChuteStorage.chuteList.pop(name, None)
+                    ChuteStorage.generation += 1
+                    count += 1
+        except Exception as e:
+            out.warn('Ignoring incomplete journal record in %s: %s\n' %
+                     (path, str(e)))
+            ChuteStorage.journalDamaged = True
+
+        ChuteStorage.journalLength = count
+        return count > 0
+
+    def loadFromDisk(self):
+        """
+        Load the snapshot (if any) and then replay the journal.
+        """
+        loaded = PDStorage.loadFromDisk(self)
+        replayed = self.replayJournal()
+
+        # Compact right away so that new records are not appended after the
+        # damaged one, where the next replay would never reach them.
+        if ChuteStorage.journalDamaged:
+            self.saveToDisk(force=True)
+
+        return loaded or replayed
+
+    def saveToDisk(self, force=False):
+        """
+        Write a new snapshot and discard the journal.
+
+        A non-empty journal always forces a new snapshot so that it can be
+        compacted.  Returns True if the snapshot was written.
+        """
+        if ChuteStorage.journalLength > 0:
+            force = True
+
+        written = PDStorage.saveToDisk(self, force=force)
+        if written:
+            pdosq.safe_remove(self.getJournalFile())
+            ChuteStorage.journalLength = 0
+            ChuteStorage.journalDamaged = False
+        return written
+
     def setAttr(self, attr):
         """Save our attr however we want (as class variable for all to see)"""
         ChuteStorage.chuteList = attr
+        ChuteStorage.generation += 1
 
     def getAttr(self):
         """Get our attr (as class variable for all to see)"""
@@ -53,15 +184,17 @@ class ChuteStorage(PDStorage):
     def deleteChute(self, ch):
         """Deletes a chute from the chute storage. Can be sent the chute object, or the chute name."""
         if (isinstance(ch, Chute)):
-            del ChuteStorage.chuteList[ch.name]
+            name = ch.name
         else:
-            del ChuteStorage.chuteList[ch]
-        self.saveToDisk()
+            name = ch
+        del ChuteStorage.chuteList[name]
+        ChuteStorage.generation += 1
+        self.appendJournal("delete", name)
 
     def saveChute(self, ch):
         """
             Saves the chute provided in our internal chuteList.
-            Also since we just received a new chute to hold onto we should save our ChuteList to disk.
+            Also since we just received a new chute to hold onto we should record the change on disk.
         """
         # check if there is a version of the chute already
         oldch = ChuteStorage.chuteList.get(ch.name, None)
@@ -72,11 +205,13 @@ class ChuteStorage(PDStorage):
         else:
             ChuteStorage.chuteList[ch.name] = ch
 
-        self.saveToDisk()
+        ChuteStorage.generation += 1
+        self.appendJournal("save", ch.name, ChuteStorage.chuteList[ch.name])
 
     def clearChuteStorage(self):
         ChuteStorage.chuteList.clear()
-        self.saveToDisk()
+        ChuteStorage.generation += 1
+        self.saveToDisk(force=True)
 
     #
     # Functions we override to implement PDStorage Properly
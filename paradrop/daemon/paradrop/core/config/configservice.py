@@ -26,9 +26,35 @@ def reloadAll(update):
     Reload pdconf configuration files.
     """
     # Note: reloading all config files at once seems safer than individual
-    # files because of cross-dependencies.
+    # files because of cross-dependencies.  This is still used when backing
+    # out of a failed update.
     statusString = client.reloadAll()
+    checkStatus(update, statusString)
 
+
+def reloadChanged(update):
+    """
+    Reload the pdconf configuration files that were written by the update.
+
+    Sections in other files that depend on the changed sections are reloaded
+    by pdconfd as well, so cross-file dependencies are handled the same way
+    as with reloadAll.  If the update did not change any files, there is
+    nothing to reload.
+    """
+    files = sorted(update.changedConfigFiles)
+    if len(files) == 0:
+        out.verbose("No configuration files changed, skipping reload\n")
+        return
+
+    statusString = client.reloadFiles(files)
+    checkStatus(update, statusString)
+    update.changedConfigFiles.clear()
+
+
+def checkStatus(update, statusString):
+    """
+    Raise an exception if configuration sections of the chute failed to load.
+    """
     # Check the status to make sure all configuration sections
     # related to this chute were successfully loaded.
     #
@@ -0,0 +1,208 @@
+"""
+In-memory inventory of network devices.
+
+Scanning sysfs for network and wireless devices takes dozens of small file
+reads, and the device list is needed by host config generation, state
+reports, and the API.  The inventory keeps the result of the last scan and
+only scans again when something may have changed.  A watcher thread listens
+for netlink link and default route changes and for kernel uevents from the
+net and ieee80211 subsystems, and marks the inventory stale when they arrive.
+The inventory is also rescanned if it is older than DEVICE_INVENTORY_MAX_AGE
+in case an event was missed.
+
+The watcher requires the pyroute2 package.  Without it, every call scans
+sysfs as before.
+"""
+
+import copy
+import select
+import threading
+import time
+
+from paradrop.base import settings
+from paradrop.base.output import out
+
+try:
+    from pyroute2 import IPRoute, UeventSocket
+    from pyroute2.netlink.rtnl import RTMGRP_LINK, RTMGRP_IPV4_ROUTE
+except ImportError:
+    IPRoute = None
+    UeventSocket = None
+
+
+# Uevent subsystems that can change the device list.
+UEVENT_SUBSYSTEMS = set(["net", "ieee80211"])
+
+# Seconds to wait before reopening the event sockets after a failure.
+RETRY_DELAY = 5
+
+
+class DeviceInventory(object):
+    """
+    Cached result of a device scan.
+
+    scan: function that returns the device list.
+    ignore: function that returns True for interface names whose events do
+        not affect the device list (e.g. virtual interfaces).
+    """
+    def __init__(self, scan, ignore=None):
+        self.scan = scan
+        self.ignore = ignore
+
+        self.lock = threading.Lock()
+        self.devices = None
+        self.scanTime = 0
+
+        # Incremented for every relevant event so that a scan that overlaps
+        # with an event does not mark the inventory fresh.
+        self.generation = 0
+        self.scanGeneration = -1
+
+        # The cache is only used while the watcher has its event sockets
+        # open.
+        self.running = False
+        self.watching = False
+        self.thread = None
+        self.sockets = []
+
+        # Functions to call when the inventory is invalidated.
+        self.listeners = []
+
+    def get(self):
+        """
+        Return a copy of the device list, scanning only if necessary.
+        """
+        with self.lock:
+            if self.isFresh():
+                return copy.deepcopy(self.devices)
+            generation = self.generation
+
+        devices = self.scan()
+
+        with self.lock:
+            self.devices = devices
+            self.scanTime = time.time()
+            self.scanGeneration = generation
+
+        return copy.deepcopy(devices)
+
+    def isFresh(self):
+        if not self.watching or self.devices is None:
+            return False
+        if self.scanGeneration != self.generation:
+            return False
+        return time.time() < self.scanTime + settings.DEVICE_INVENTORY_MAX_AGE
+
+    def invalidate(self):
+        """
+        Mark the inventory stale so that the next reader scans again.
+        """
+        with self.lock:
+            self.generation += 1
+            listeners = list(self.listeners)
+
+        # Listeners may be called from the watcher thread.
+        for listener in listeners:
+            try:
+                listener()
+            except Exception as error:
+                out.warn("Device inventory listener failed: {}".format(error))
+
+    def addListener(self, listener):
+        """
+        Call the function whenever the device list may have changed.
+        """
+        with self.lock:
+            self.listeners.append(listener)
+
+    def handleLinkMessage(self, msg):
+        """
+        Invalidate the inventory if a netlink message is relevant.
+        """
+        event = msg.get('event', None)
+        if event in ["RTM_NEWLINK", "RTM_DELLINK"]:
+            ifname = msg.get_attr('IFLA_IFNAME')
+            if ifname is not None and self.ignore is not None and \
+                    self.ignore(ifname):
+                return
+            self.invalidate()
+
+        elif event in ["RTM_NEWROUTE", "RTM_DELROUTE"]:
+            # Only the default route determines which interface is the WAN.
+            if msg.get('dst_len', None) == 0:
+                self.invalidate()
+
+    def handleUevent(self, msg):
+        """
+        Invalidate the inventory if a kernel uevent is relevant.
+        """
+        if msg.get('SUBSYSTEM', None) not in UEVENT_SUBSYSTEMS:
+            return
+        ifname = msg.get('INTERFACE', None)
+        if ifname is not None and self.ignore is not None and \
+                self.ignore(ifname):
+            return
+        self.invalidate()
+
+    def start(self):
+        """
+        Start the watcher thread if the event sockets are available.
+        """
+        if self.running or not settings.DEVICE_INVENTORY_WATCH:
+            return
+        if IPRoute is None:
+            out.info("pyroute2 is not installed, device inventory will not be cached\n")
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _open(self):
+        ipr = IPRoute()
+        ipr.bind(groups=RTMGRP_LINK | RTMGRP_IPV4_ROUTE)
+
+        uevents = UeventSocket()
+        uevents.bind()
+
+        self.sockets = [ipr, uevents]
+        self.watching = True
+        return ipr, uevents
+
+    def _close(self):
+        self.watching = False
+        for sock in self.sockets:
+            try:
+                sock.close()
+            except Exception:
+                pass
+        self.sockets = []
+
+    def _watch(self):
+        while self.running:
+            try:
+                ipr, uevents = self._open()
+
+                # Anything could have changed while we were not listening.
+                self.invalidate()
+
+                while self.running:
+                    ready, _, _ = select.select([ipr, uevents], [], [], 1.0)
+                    if ipr in ready:
+                        for msg in ipr.get():
+                            self.handleLinkMessage(msg)
+                    if uevents in ready:
+                        for msg in uevents.get():
+                            self.handleUevent(msg)
+            except Exception as error:
+                if self.running:
+                    out.warn("Device event monitor failed: {}".format(error))
+
+            self._close()
+            self.invalidate()
+
+            if self.running:
+                time.sleep(RETRY_DELAY)
@@ -23,6 +23,8 @@ from paradrop.base import constants, settings
 from paradrop.base.exceptions import DeviceNotFoundException
 from paradrop.lib.utils import datastruct, pdos, uci
 
+from .device_inventory import DeviceInventory
+
 
 IEEE80211_DIR = "/sys/class/ieee80211"
 SYS_DIR = "/sys/class/net"
@@ -52,19 +54,25 @@ def isVirtual(ifname):
     return False
 
 
-def isWAN(ifname):
+def getDefaultRouteInterfaces():
     """
-    Test if an interface is a WAN interface.
+    Return the set of interfaces that have a default route.
     """
+    result = set()
     pattern = re.compile(r"(\w+)\s+(\w+)*")
     routeList = pdos.readFile("/proc/net/route")
     for line in routeList:
         match = pattern.match(line)
-        if match is not None and \
-                match.group(1) == ifname and \
-                match.group(2) == "00000000":
-            return True
-    return False
+        if match is not None and match.group(2) == "00000000":
+            result.add(match.group(1))
+    return result
+
+
+def isWAN(ifname):
+    """
+    Test if an interface is a WAN interface.
+    """
+    return ifname in getDefaultRouteInterfaces()
 
 
 def isWireless(ifname):
@@ -191,6 +199,15 @@ class SysReader(object):
 
 
 def listWiFiDevices():
+    """
+    List the wireless devices on the system.
+
+    The result comes from the device inventory and is cheap to compute.
+    """
+    return [dev for dev in listSystemDevices() if dev['type'] == 'wifi']
+
+
+def scanWiFiDevices():
     # Collect information about the physical devices (e.g. phy0 -> MAC address,
     # device type, PCI slot, etc.) and store as objects in a dictionary.
     devices = dict()
@@ -271,9 +288,19 @@ def listSystemDevices():
     Detect devices on the system.
 
     The result is a single list of dictionaries, each containing information
-    about a network device.
+    about a network device.  It is served from the device inventory, which
+    only scans sysfs again when devices or routes may have changed.  The
+    caller may modify the result.
+    """
+    return inventory.get()
+
+
+def scanSystemDevices():
+    """
+    Scan sysfs for devices on the system (see listSystemDevices).
     """
     devices = list()
+    wanInterfaces = getDefaultRouteInterfaces()
 
     for ifname in pdos.listdir(SYS_DIR):
         if ifname in EXCLUDE_IFACES:
@@ -296,7 +323,7 @@ def listSystemDevices():
             'mac': getMACAddress(ifname)
         }
 
-        if isWAN(ifname):
+        if ifname in wanInterfaces:
             dev['type'] = 'wan'
         elif isWireless(ifname):
             # Detect wireless devices separately.
@@ -306,12 +333,22 @@ def listSystemDevices():
 
         devices.append(dev)
 
-    wifi_devices = listWiFiDevices()
+    wifi_devices = scanWiFiDevices()
     devices.extend(wifi_devices)
 
     return devices
 
 
+def isIgnoredInterface(ifname):
+    """
+    Test if changes to an interface can be ignored by the device inventory.
+    """
+    return isVirtual(ifname) or ifname in EXCLUDE_IFACES
+
+
+inventory = DeviceInventory(scanSystemDevices, ignore=isIgnoredInterface)
+
+
 def resetWirelessDevice(phy, primary_interface):
     """
     Reset a wireless device's interfaces to clean state.
@@ -366,6 +403,11 @@ def flushWirelessInterfaces(phy):
 
 
 def setConfig(chuteName, sections, filepath):
+    """
+    Replace the chute's sections in a UCI file.
+
+    Returns True if the file was changed.
+    """
     cfgFile = uci.UCIConfig(filepath)
 
     # Set the name in the comment field.
@@ -377,9 +419,11 @@ def setConfig(chuteName, sections, filepath):
         cfgFile.delConfigs(oldSections)
         cfgFile.addConfigs(sections)
         cfgFile.save(backupToken="paradrop", internalid=chuteName)
+        return True
     else:
         # Save a backup of the file even though there were no changes.
         cfgFile.backup(backupToken="paradrop")
+        return False
 
 
 def readHostconfigWifi(wifi, networkDevices, builder):
@@ -614,10 +658,15 @@ class UCIBuilder(object):
     def write(self):
         """
         Write all of the configuration sections to files.
+
+        Returns a list of paths of the files that changed.
         """
+        changed = []
         for f in UCIBuilder.FILES:
-            setConfig(constants.RESERVED_CHUTE_NAME, self.contents[f],
-                    uci.getSystemPath(f))
+            path = uci.getSystemPath(f)
+            if setConfig(constants.RESERVED_CHUTE_NAME, self.contents[f], path):
+                changed.append(path)
+        return changed
 
 
 def select_brlan_address(hostConfig):
@@ -799,7 +848,7 @@ def setSystemDevices(update):
         builder.add("firewall", "rule", rule)
 
     # Write all of the changes to UCI files at once.
-    builder.write()
+    update.changedConfigFiles.update(builder.write())
 
 
 def get_hardware_serial():
@@ -1,59 +1,65 @@
 """
 This module is responsible for configuration haproxy.
+
+HAProxy is configured with a fixed frontend and a pool of backend slots.
+Requests are routed to chutes through two map files: one maps chute host
+names to slot backends, and the other maps chute names to the host port used
+for /chutes/<name> redirects.  When chutes start, stop, or change address, the
+ProxyManager updates the maps and slot servers through the haproxy runtime
+API on the stats socket.  HAProxy is only reloaded when the structure of the
+configuration changes (e.g. more slots are needed) or the runtime API cannot
+be used.
 """
 import os
+import socket
 import subprocess
+import threading
 
 from paradrop.base import settings
+from paradrop.base.exceptions import ChuteNotFound
+from paradrop.base.output import out
 from paradrop.core.chute.chute_storage import ChuteStorage
 from paradrop.core.container.chutecontainer import ChuteContainer
 
 
-def generateConfigSections():
-    sections = []
-
-    sections.append({
-        "header": "global",
-        "lines": [
-            "daemon",
-            "maxconn 256",
-        ]
-    })
-
-    sections.append({
-        "header": "defaults",
-        "lines": [
-            "mode http",
-            "timeout connect 5000ms",
-            "timeout client 50000ms",
-            "timeout server 50000ms"
-        ]
-    })
-
-    sections.append({
-        "header": "backend portal",
-        "lines": [
-            "server pd_portal 127.0.0.1:8080 maxconn 256"
-        ]
-    })
-
-    # Custom variables:
-    # - req.querymarker: will be set to the literal "?" if the original request
-    # contains a query string.  We will use this to construct a redirect with a
-    # query string only if needed.
-    # - req.subpath: will be set to the remainder of the path, if anything,
-    # after removing /chutes/<chutename>, e.g. "/chutes/hello-world/index.html"
-    # becomes "/index.html".  This does not include the query string.
-    frontend = {
-        "header": "frontend http-in",
-        "lines": [
-            "bind *:80",
-            "default_backend portal",
-            "http-request set-var(req.querymarker) str(?) if { query -m found }",
-            "http-request set-var(req.subpath) path,regsub(^/chutes/[^/]+,)"
-        ]
-    }
-    sections.append(frontend)
+HOST_MAP_FILE = "haproxy-hosts.map"
+PORT_MAP_FILE = "haproxy-ports.map"
+
+# Name of the server in each slot backend.
+SLOT_SERVER = "web"
+
+# Address for servers in unused slots.  These servers are disabled.
+UNUSED_ADDRESS = "127.0.0.1:1"
+
+# Seconds to wait for a response on the stats socket.
+RUNTIME_TIMEOUT = 5
+
+# Responses to runtime commands that indicate success.  Most commands return
+# an empty response on success, but "set server addr" describes the change.
+RUNTIME_OK = ["changed from", "no need to change"]
+
+
+class RuntimeAPIError(Exception):
+    pass
+
+
+def chuteHostName(name):
+    return "{}.chute.paradrop.org".format(name)
+
+
+def slotBackendName(slot):
+    return "chute_slot{}".format(slot)
+
+
+def getChuteBackends():
+    """
+    Find the web servers of running chutes.
+
+    Returns a dictionary mapping chute name to a dictionary with the container
+    'ip', the web 'port', and the 'hostPort' bound to it, which is None if the
+    port is not published.  Each container is inspected once.
+    """
+    backends = {}
 
     chuteStore = ChuteStorage()
     chutes = chuteStore.getChuteList()
@@ -63,81 +69,343 @@ def generateConfigSections():
             continue
 
         container = ChuteContainer(service.get_container_name())
-        if not container.isRunning():
+        try:
+            info = container.inspect()
+        except ChuteNotFound:
+            continue
+
+        if not info['State']['Running']:
             continue
 
-        # Generate a rule that matches HTTP host header to chute name.
-        frontend['lines'].append("acl host_{} hdr(host) -i {}.chute.paradrop.org".format(
-            chute.name, chute.name))
-        frontend['lines'].append("use_backend {} if host_{}".format(
-            chute.name, chute.name))
-
-        # Generate rules that matches the beginning of the URL.
-        # We need to be careful and either have an exact match
-        # or make sure there is a slash or question mark after the chute name
-        # to avoid mix-ups, e.g. "sticky-board" and "sticky-board-new".
-        frontend['lines'].append("acl path_{} url /chutes/{}".format(
-            chute.name, chute.name))
-        frontend['lines'].append("acl path_{} url_beg /chutes/{}/".format(
-            chute.name, chute.name))
-        frontend['lines'].append("acl path_{} url_beg /chutes/{}?".format(
-            chute.name, chute.name))
-
-        # Try to find a host binding for the web port to redirect:
-        # http://<host addr>/chutes/<chute>/<path> ->
-        # http://<host addr>:<chute port>/<path>
-        #
         # We need to do a lookup because the host port might be dynamically
         # assigned by Docker.
-        #
-        # Use HTTP code 302 for the redirect, which will not be cached by the
-        # web browser.  The port portion of the URL can change whenever the
-        # chute restarts, so we don't want web browsers to cache it.  Browsers
-        # will cache a 301 (Moved Permanently) response.
-        portconf = container.getPortConfiguration(port, "tcp")
-        if len(portconf) > 0:
+        hostPort = None
+        ports = info['NetworkSettings'].get('Ports', None) or {}
+        bindings = ports.get("{}/tcp".format(port), None)
+        if bindings:
             # TODO: Are there other elements in the list?
-            binding = portconf[0]
-            frontend['lines'].append("http-request replace-value Host (.*):(.*) \\1")
-            frontend['lines'].append("http-request redirect location http://%[req.hdr(host)]:{}%[var(req.subpath)]%[var(req.querymarker)]%[query] code 302 if path_{}".format(
-                binding['HostPort'], chute.name))
+            hostPort = bindings[0]['HostPort']
 
-        # Add a server at the chute's IP address.
-        sections.append({
-            "header": "backend {}".format(chute.name),
-            "lines": [
-                "server {} {}:{} maxconn 256".format(chute.name,
-                    container.getIP(), port)
-            ]
-        })
+        backends[chute.name] = {
+            'ip': info['NetworkSettings']['IPAddress'],
+            'port': port,
+            'hostPort': hostPort
+        }
 
-    return sections
+    return backends
 
 
-def writeConfigFile(output):
-    sections = generateConfigSections()
+def formatSections(sections):
+    lines = []
     for section in sections:
-        output.write(section['header'] + "\n")
+        lines.append(section['header'])
         for line in section['lines']:
-            output.write("    " + line + "\n")
-        output.write("\n")
+            lines.append("    " + line)
+        lines.append("")
+    return "\n".join(lines) + "\n"
 
 
-def reconfigureProxy(update):
+def formatMap(entries):
+    return "".join("{} {}\n".format(key, entries[key])
+                   for key in sorted(entries))
+
+
+def writeConfigFile(output, sections):
+    output.write(formatSections(sections))
+
+
+class ProxyManager(object):
     """
-    Reconfigure haproxy with forwarding and redirect rules.
+    Keep the generated haproxy configuration in memory and apply changes to
+    the running haproxy.
     """
-    confFile = os.path.join(settings.RUNTIME_HOME_DIR, "haproxy.conf")
-    pidFile = os.path.join(settings.TMP_DIR, "haproxy.pid")
+    def __init__(self, confDir, runDir):
+        self.confFile = os.path.join(confDir, "haproxy.conf")
+        self.hostMapFile = os.path.join(confDir, HOST_MAP_FILE)
+        self.portMapFile = os.path.join(confDir, PORT_MAP_FILE)
+        self.pidFile = os.path.join(runDir, "haproxy.pid")
+        self.socketPath = os.path.join(runDir, "haproxy.sock")
+
+        self.lock = threading.Lock()
+        self.slotCount = settings.HAPROXY_CHUTE_SLOTS
+
+        # Chute name -> slot number.
+        self.slots = {}
+
+        # State of the running haproxy: chute name -> (slot, ip, port) and the
+        # contents of the two maps.
+        self.servers = {}
+        self.hostMap = {}
+        self.portMap = {}
+
+        # Configuration structure that the running haproxy was loaded with.
+        self.loadedStructure = None
+
+        # Path -> contents of files that we have written.
+        self.written = {}
+
+    def assignSlots(self, backends):
+        """
+        Assign a slot to every chute, keeping existing assignments.
+        """
+        for name in list(self.slots.keys()):
+            if name not in backends:
+                del self.slots[name]
 
-    with open(confFile, "w") as output:
-        writeConfigFile(output)
+        used = set(self.slots.values())
+        free = [i for i in range(1, self.slotCount + 1) if i not in used]
+        free.reverse()
 
-    cmd = ["haproxy", "-f", confFile, "-p", pidFile]
+        for name in sorted(backends.keys()):
+            if name in self.slots:
+                continue
+            if len(free) == 0:
+                free = list(range(self.slotCount * 2, self.slotCount, -1))
+                self.slotCount *= 2
+            self.slots[name] = free.pop()
 
-    if os.path.exists(pidFile):
-        with open(pidFile, "r") as source:
-            pid = source.read().strip()
-            cmd.extend(["-sf", pid])
+    def generateConfigSections(self, backends):
+        sections = []
 
-    subprocess.call(cmd)
+        sections.append({
+            "header": "global",
+            "lines": [
+                "daemon",
+                "maxconn 256",
+                "stats socket {} mode 600 level admin".format(self.socketPath)
+            ]
+        })
+
+        sections.append({
+            "header": "defaults",
+            "lines": [
+                "mode http",
+                "timeout connect 5000ms",
+                "timeout client 50000ms",
+                "timeout server 50000ms"
+            ]
+        })
+
+        sections.append({
+            "header": "backend portal",
+            "lines": [
+                "server pd_portal 127.0.0.1:8080 maxconn 256"
+            ]
+        })
+
+        # Custom variables:
+        # - req.querymarker: will be set to the literal "?" if the original
+        # request contains a query string.  We will use this to construct a
+        # redirect with a query string only if needed.
+        # - req.subpath: will be set to the remainder of the path, if
+        # anything, after removing /chutes/<chutename>, e.g.
+        # "/chutes/hello-world/index.html" becomes "/index.html".  This does
+        # not include the query string.
+        # - req.redirport: will be set to the host port of the chute named in
+        # a /chutes/<chutename> path.  Matching the whole path component
+        # avoids mix-ups, e.g. "sticky-board" and "sticky-board-new".
+        #
+        # Redirect http://<host addr>/chutes/<chute>/<path> to
+        # http://<host addr>:<chute port>/<path>.  Use HTTP code 302 for the
+        # redirect, which will not be cached by the web browser.  The port
+        # portion of the URL can change whenever the chute restarts, so we
+        # don't want web browsers to cache it.  Browsers will cache a 301
+        # (Moved Permanently) response.
+        #
+        # Requests with a chute host name go to the chute's slot backend.  The
+        # port is removed from the Host header first so that
+        # "<chute>.chute.paradrop.org:80" matches the host map as well.
+        sections.append({
+            "header": "frontend http-in",
+            "lines": [
+                "bind *:80",
+                "default_backend portal",
+                "http-request set-var(req.querymarker) str(?) if { query -m found }",
+                "http-request set-var(req.subpath) path,regsub(^/chutes/[^/]+,)",
+                "http-request replace-value Host (.*):.* \\1",
+                "http-request set-var(req.redirport) path,field(3,/),map({}) if {{ path_beg /chutes/ }}".format(
+                    self.portMapFile),
+                "http-request redirect location http://%[req.hdr(host)]:%[var(req.redirport)]%[var(req.subpath)]%[var(req.querymarker)]%[query] code 302 if { var(req.redirport) -m found }",
+                "use_backend %[req.hdr(host),lower,map({},portal)]".format(
+                    self.hostMapFile)
+            ]
+        })
+
+        servers = {}
+        for name, backend in backends.items():
+            servers[self.slots[name]] = "{}:{}".format(backend['ip'],
+                                                       backend['port'])
+
+        for slot in range(1, self.slotCount + 1):
+            if slot in servers:
+                line = "server {} {} maxconn 256".format(SLOT_SERVER,
+                                                         servers[slot])
+            else:
+                line = "server {} {} maxconn 256 disabled".format(SLOT_SERVER,
+                                                                  UNUSED_ADDRESS)
+            sections.append({
+                "header": "backend {}".format(slotBackendName(slot)),
+                "lines": [line]
+            })
+
+        return sections
+
+    def writeFile(self, path, contents):
+        """
+        Write a file if its contents changed.
+        """
+        if self.written.get(path, None) == contents:
+            return
+        tmp = path + ".tmp"
+        with open(tmp, "w") as output:
+            output.write(contents)
+        os.rename(tmp, path)
+        self.written[path] = contents
+
+    def reconfigure(self, backends):
+        """
+        Make haproxy forward to the given chute backends.
+
+        Returns True if haproxy was reloaded, False if the changes were made
+        through the runtime API.
+        """
+        with self.lock:
+            self.assignSlots(backends)
+
+            servers = {}
+            hostMap = {}
+            portMap = {}
+            for name, backend in backends.items():
+                slot = self.slots[name]
+                servers[name] = (slot, backend['ip'], backend['port'])
+                hostMap[chuteHostName(name)] = slotBackendName(slot)
+                if backend['hostPort'] is not None:
+                    portMap[name] = backend['hostPort']
+
+            # The files always reflect the current state so that a reload
+            # picks it up.
+            self.writeFile(self.confFile,
+                    formatSections(self.generateConfigSections(backends)))
+            self.writeFile(self.hostMapFile, formatMap(hostMap))
+            self.writeFile(self.portMapFile, formatMap(portMap))
+
+            structure = formatSections(self.generateConfigSections({}))
+
+            reload = True
+            if structure == self.loadedStructure and \
+                    os.path.exists(self.pidFile):
+                try:
+                    self.updateRuntime(servers, hostMap, portMap)
+                    reload = False
+                except RuntimeAPIError as error:
+                    out.warn("Reloading haproxy: {}\n".format(error))
+
+            if reload:
+                self.reload()
+                self.loadedStructure = structure
+
+            self.servers = servers
+            self.hostMap = hostMap
+            self.portMap = portMap
+            return reload
+
+    def updateRuntime(self, servers, hostMap, portMap):
+        """
+        Apply the difference from the current state through the runtime API.
+        """
+        commands = []
+
+        # Stop routing to removed chutes before their slots are reused.
+        for mapFile, old, new in [(self.hostMapFile, self.hostMap, hostMap),
+                                  (self.portMapFile, self.portMap, portMap)]:
+            for key in sorted(old.keys()):
+                if key not in new:
+                    commands.append("del map {} {}".format(mapFile, key))
+
+        for name in sorted(self.servers.keys()):
+            if name not in servers:
+                slot = self.servers[name][0]
+                commands.append("disable server {}/{}".format(
+                    slotBackendName(slot), SLOT_SERVER))
+
+        for name in sorted(servers.keys()):
+            slot, ip, port = servers[name]
+            server = "{}/{}".format(slotBackendName(slot), SLOT_SERVER)
+            old = self.servers.get(name, None)
+            if old != (slot, ip, port):
+                commands.append("set server {} addr {} port {}".format(
+                    server, ip, port))
+            if old is None or old[0] != slot:
+                commands.append("enable server {}".format(server))
+
+        # Route to new chutes after their servers are enabled.
+        for mapFile, old, new in [(self.hostMapFile, self.hostMap, hostMap),
+                                  (self.portMapFile, self.portMap, portMap)]:
+            for key in sorted(new.keys()):
+                if key not in old:
+                    commands.append("add map {} {} {}".format(mapFile, key,
+                                                              new[key]))
+                elif old[key] != new[key]:
+                    commands.append("set map {} {} {}".format(mapFile, key,
+                                                              new[key]))
+
+        for command in commands:
+            self.runtimeCommand(command)
+
+    def runtimeCommand(self, command):
+        """
+        Send a command to haproxy over the stats socket.
+
+        Raises RuntimeAPIError if haproxy cannot be reached or reports an
+        error.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        chunks = []
+        try:
+            sock.settimeout(RUNTIME_TIMEOUT)
+            sock.connect(self.socketPath)
+            sock.sendall((command + "\n").encode('ascii'))
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                chunks.append(data)
+        except (socket.error, socket.timeout) as error:
+            raise RuntimeAPIError("{}: {}".format(command, error))
+        finally:
+            sock.close()
+
+        response = b"".join(chunks).decode('utf-8', 'replace').strip()
+        if len(response) > 0 and not any(s in response for s in RUNTIME_OK):
+            raise RuntimeAPIError("{}: {}".format(command, response))
+        return response
+
+    def reload(self):
+        cmd = ["haproxy", "-f", self.confFile, "-p", self.pidFile]
+
+        if os.path.exists(self.pidFile):
+            with open(self.pidFile, "r") as source:
+                pid = source.read().strip()
+                cmd.extend(["-sf", pid])
+
+        subprocess.call(cmd)
+
+
+manager = None
+
+
+def getManager():
+    """
+    Return the proxy manager, creating it on first use.
+    """
+    global manager
+    if manager is None:
+        manager = ProxyManager(settings.RUNTIME_HOME_DIR, settings.TMP_DIR)
+    return manager
+
+
+def reconfigureProxy(update):
+    """
+    Reconfigure haproxy with forwarding and redirect rules.
+    """
+    getManager().reconfigure(getChuteBackends())
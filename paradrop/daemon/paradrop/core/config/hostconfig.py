@@ -147,7 +147,8 @@ def generateHostConfig(devices):
     }
     config['telemetry'] = {
         'enabled': True,
-        'interval': 60
+        'interval': 60,
+        'uploadInterval': 300
     }
     config['zerotier'] = {
         'enabled': True,
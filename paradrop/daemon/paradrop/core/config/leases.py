@@ -0,0 +1,377 @@
+"""
+In-memory index of DHCP leases.
+
+dnsmasq keeps the leases for each network in a file named
+dnsmasq-<network>.leases, which is in the chute's externalSystemDir for chute
+networks and in the pdconfd directory for host networks.  Instead of reading
+these files for every request, the index watches the directories with
+inotify and rereads a file only when it changes.  If inotify is not
+available, the files are polled every LEASE_POLL_INTERVAL seconds.
+
+Leases are indexed by MAC address, IP address, and hostname so that a client
+can be found across all networks without reading every file.  Observers are
+notified when a lease is added, updated, or removed.
+
+The index is meant to be used from the reactor thread.
+"""
+
+import collections
+import os
+import re
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.python.filepath import FilePath
+
+from paradrop.base import settings
+from paradrop.base.output import out
+from paradrop.core.chute.chute_storage import ChuteStorage
+from paradrop.lib.utils import parsing
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    inotify = None
+
+
+LEASE_FILE_RE = re.compile(r"^dnsmasq-(.+)\.leases$")
+
+# The format of the dnsmasq leases file is one entry per line with
+# space-separated fields.
+LEASE_KEYS = ['expires', 'mac_addr', 'ip_addr', 'hostname', 'client_id']
+
+# Fields that can be used to look up leases.
+INDEX_KEYS = ['mac_addr', 'ip_addr', 'hostname']
+
+# dnsmasq writes "*" for missing hostname and client_id.
+MISSING_VALUE = "*"
+
+# Seconds to wait after a change notification before reading the file, so
+# that a burst of writes results in one read.
+RELOAD_DELAY = 0.1
+
+
+def readLeaseFile(path):
+    """
+    Read leases from a dnsmasq leases file.
+
+    Returns a list of dictionaries with the fields in LEASE_KEYS and 'as_of',
+    the modification time of the file.
+    """
+    as_of = os.path.getmtime(path)
+
+    leases = []
+    with open(path, "r") as source:
+        for line in source:
+            parts = line.strip().split()
+            if len(parts) < 3:
+                continue
+            entry = dict(zip(LEASE_KEYS, parts))
+            entry['as_of'] = as_of
+            entry['expires'] = parsing.str_to_numeric(entry['expires'])
+            leases.append(entry)
+
+    return leases
+
+
+def leaseChanged(old, new):
+    """
+    Compare two versions of a lease, ignoring the file modification time.
+    """
+    for key in LEASE_KEYS:
+        if old.get(key, None) != new.get(key, None):
+            return True
+    return False
+
+
+class LeaseIndex(object):
+    def __init__(self):
+        # Watched directory -> chute name (None for host networks).
+        self.directories = {}
+
+        # Lease file path -> {'chute', 'network', 'stat', 'leases'}, where
+        # leases is an OrderedDict from MAC address to lease.
+        self.files = {}
+
+        # Field -> value -> {(path, mac_addr): lease}
+        self.indices = dict((key, {}) for key in INDEX_KEYS)
+
+        self.observers = []
+        self.notifier = None
+        self.poller = None
+
+        # Lease file path -> DelayedCall
+        self.pendingChecks = {}
+
+    def start(self):
+        """
+        Start watching the lease directories.
+        """
+        if self.poller is not None:
+            return
+
+        if inotify is not None and settings.LEASE_INDEX_INOTIFY:
+            try:
+                self.notifier = inotify.INotify()
+                self.notifier.startReading()
+            except Exception as error:
+                out.info("Cannot watch lease files ({}), polling instead\n".format(error))
+                self.notifier = None
+
+        self.poller = LoopingCall(self.poll)
+        self.poller.start(settings.LEASE_POLL_INTERVAL)
+
+    def stop(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+        if self.notifier is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+        for call in self.pendingChecks.values():
+            call.cancel()
+        self.pendingChecks = {}
+
+    def addObserver(self, observer):
+        """
+        Register a function to be called with (event, lease) when a lease is
+        added, updated, or removed.  The event is one of "add", "update", or
+        "remove".
+        """
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def removeObserver(self, observer):
+        if observer in self.observers:
+            self.observers.remove(observer)
+
+    def poll(self):
+        """
+        Pick up new and removed chutes, and check files if not using inotify.
+        """
+        self.sync()
+        if self.notifier is None:
+            for directory in list(self.directories.keys()):
+                self.scanDirectory(directory)
+
+    def sync(self):
+        """
+        Update the set of watched directories from the chute list.
+        """
+        wanted = {os.path.normpath(settings.PDCONFD_WRITE_DIR): None}
+        for chute in list(ChuteStorage.chuteList.values()):
+            directory = chute.getCache('externalSystemDir')
+            if directory is not None:
+                wanted[os.path.normpath(directory)] = chute.name
+
+        for directory in list(self.directories.keys()):
+            if directory not in wanted:
+                self.removeDirectory(directory)
+
+        for directory, chute in wanted.items():
+            if directory not in self.directories:
+                self.addDirectory(directory, chute)
+
+    def addDirectory(self, directory, chute):
+        if not os.path.isdir(directory):
+            # Try again on the next sync.
+            return
+
+        if self.notifier is not None:
+            mask = inotify.IN_MODIFY | inotify.IN_CREATE | \
+                inotify.IN_DELETE | inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM
+            try:
+                self.notifier.watch(FilePath(directory), mask=mask,
+                        callbacks=[self.onNotify])
+            except Exception as error:
+                out.warn("Cannot watch {}: {}\n".format(directory, error))
+                return
+
+        self.directories[directory] = chute
+        self.scanDirectory(directory)
+
+    def removeDirectory(self, directory):
+        del self.directories[directory]
+
+        if self.notifier is not None:
+            try:
+                self.notifier.ignore(FilePath(directory))
+            except KeyError:
+                pass
+
+        for path in list(self.files.keys()):
+            if os.path.dirname(path) == directory:
+                self.removeFile(path)
+
+    def scanDirectory(self, directory):
+        """
+        Check all of the lease files in a directory for changes.
+        """
+        chute = self.directories[directory]
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+
+        found = set()
+        for name in names:
+            if LEASE_FILE_RE.match(name) is not None:
+                path = os.path.join(directory, name)
+                found.add(path)
+                self.checkFile(path, chute)
+
+        for path in list(self.files.keys()):
+            if os.path.dirname(path) == directory and path not in found:
+                self.removeFile(path)
+
+    def onNotify(self, ignored, filepath, mask):
+        path = filepath.path
+        if isinstance(path, bytes):
+            path = path.decode('utf-8')
+        if LEASE_FILE_RE.match(os.path.basename(path)) is None:
+            return
+        if path not in self.pendingChecks:
+            self.pendingChecks[path] = reactor.callLater(RELOAD_DELAY,
+                    self._delayedCheck, path)
+
+    def _delayedCheck(self, path):
+        del self.pendingChecks[path]
+        directory = os.path.dirname(path)
+        if directory in self.directories:
+            self.checkFile(path, self.directories[directory])
+
+    def checkFile(self, path, chute):
+        """
+        Reread a lease file if it changed since the last time it was read.
+        """
+        try:
+            stat = os.stat(path)
+            key = (stat.st_ino, stat.st_size, stat.st_mtime)
+            if path in self.files and self.files[path]['stat'] == key:
+                return
+            leases = readLeaseFile(path)
+        except (IOError, OSError):
+            self.removeFile(path)
+            return
+
+        match = LEASE_FILE_RE.match(os.path.basename(path))
+        network = match.group(1) if match is not None else None
+        self.setFile(path, chute, network, key, leases)
+
+    def setFile(self, path, chute, network, stat, leases):
+        old = self.files.get(path, None)
+        oldLeases = old['leases'] if old is not None else {}
+
+        newLeases = collections.OrderedDict()
+        for lease in leases:
+            lease['chute'] = chute
+            lease['network'] = network
+            newLeases[lease['mac_addr']] = lease
+
+        for mac, lease in oldLeases.items():
+            self.unindex(path, lease)
+        for mac, lease in newLeases.items():
+            self.index(path, lease)
+
+        self.files[path] = {
+            'chute': chute,
+            'network': network,
+            'stat': stat,
+            'leases': newLeases
+        }
+
+        for mac, lease in oldLeases.items():
+            if mac not in newLeases:
+                self.notify("remove", lease)
+        for mac, lease in newLeases.items():
+            if mac not in oldLeases:
+                self.notify("add", lease)
+            elif leaseChanged(oldLeases[mac], lease):
+                self.notify("update", lease)
+
+    def removeFile(self, path):
+        old = self.files.pop(path, None)
+        if old is None:
+            return
+        for lease in old['leases'].values():
+            self.unindex(path, lease)
+            self.notify("remove", lease)
+
+    def index(self, path, lease):
+        for key in INDEX_KEYS:
+            value = lease.get(key, MISSING_VALUE)
+            if value == MISSING_VALUE:
+                continue
+            entries = self.indices[key].setdefault(value.lower(), {})
+            entries[(path, lease['mac_addr'])] = lease
+
+    def unindex(self, path, lease):
+        for key in INDEX_KEYS:
+            value = lease.get(key, MISSING_VALUE)
+            if value == MISSING_VALUE:
+                continue
+            entries = self.indices[key].get(value.lower(), {})
+            entries.pop((path, lease['mac_addr']), None)
+            if len(entries) == 0:
+                self.indices[key].pop(value.lower(), None)
+
+    def notify(self, event, lease):
+        for observer in list(self.observers):
+            try:
+                observer(event, dict(lease))
+            except Exception as error:
+                out.warn("Lease observer failed: {}\n".format(error))
+
+    def getFileLeases(self, path, chute=None):
+        """
+        Get the leases from one lease file.
+
+        Returns a list of leases or None if the file does not exist.  A file
+        that is not in a watched directory is read now.
+        """
+        path = os.path.normpath(path)
+        if os.path.dirname(path) not in self.directories:
+            self.checkFile(path, chute)
+
+        entry = self.files.get(path, None)
+        if entry is None:
+            return None
+        return [dict(lease) for lease in entry['leases'].values()]
+
+    def getNetworkLeases(self, chute, network):
+        """
+        Get the leases for a chute network.
+
+        Returns a list of leases or None if the chute or lease file does not
+        exist.
+        """
+        try:
+            directory = ChuteStorage.chuteList[chute].getCache('externalSystemDir')
+        except KeyError:
+            return None
+        if directory is None:
+            return None
+        path = os.path.join(directory, 'dnsmasq-{}.leases'.format(network))
+        return self.getFileLeases(path, chute)
+
+    def find(self, key, value):
+        """
+        Find leases by mac_addr, ip_addr, or hostname (case insensitive).
+        """
+        entries = self.indices[key].get(value.lower(), {})
+        return [dict(lease) for lease in entries.values()]
+
+    def getAll(self, chute=None):
+        """
+        Get all leases, optionally only for the given chute.
+        """
+        result = []
+        for path in sorted(self.files.keys()):
+            entry = self.files[path]
+            if chute is not None and entry['chute'] != chute:
+                continue
+            result.extend(dict(lease) for lease in entry['leases'].values())
+        return result
+
+
+index = LeaseIndex()
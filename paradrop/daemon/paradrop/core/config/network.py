@@ -121,11 +121,10 @@ def chooseSubnet(update, cfg, iface):
             "Router misconfigured: prefix size {} is invalid for network {}".
             format(prefix_size, network))
 
-    subnets = network.subnets(new_prefix=prefix_size)
-    for subnet in subnets:
-        if subnet not in reservations:
-            reservations.add(subnet)
-            return subnet
+    subnet = reservations.nextFree(network, prefix_size)
+    if subnet is not None:
+        reservations.add(subnet)
+        return subnet
 
     raise Exception("Could not find an available subnet")
 
@@ -14,4 +14,5 @@ def revertConfig(update, theType):
     """
     Tell the UCI module to revert changes to the old state of the chute.
     """
-    restoreConfigFile(update.new, theType)
+    path = restoreConfigFile(update.new, theType)
+    update.changedConfigFiles.add(path)
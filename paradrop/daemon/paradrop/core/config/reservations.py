@@ -10,9 +10,12 @@ or uninstall correctly.  The getDeviceReservations function iterates
 over the chute list and returns an up-to-date view of device usage.
 This can be called as needed.
 """
+import bisect
 import collections
 import ipaddress
 
+import six
+
 
 from paradrop.base import constants
 from paradrop.core.config.devices import getWirelessPhyName
@@ -152,53 +155,329 @@ def getInterfaceReservations(exclude=None):
 
 
 class SubnetReservationSet(object):
+    """
+    Set of reserved subnets supporting fast overlap tests.
+
+    Subnets are CIDR blocks, so any two of them are either disjoint or one
+    contains the other.  The set keeps the distinct reserved blocks sorted by
+    address, which finds the blocks inside of a network by bisection and the
+    blocks containing it by looking up its supernets.  It also keeps the
+    reserved address ranges merged into disjoint intervals, so that finding
+    the next free network can skip a whole run of reservations at once.
+    Reserving the same network twice is allowed and counted.
+    """
     def __init__(self):
-        self.reservations = []
+        # Maps (version, first, last) -> number of reservations.
+        self.counts = collections.Counter()
+
+        # Maps IP version to the sorted list of (first, last) of the distinct
+        # reserved blocks.
+        self.blocks = {}
+
+        # Maps IP version to a pair of sorted lists (interval starts and
+        # interval ends) of merged address ranges.
+        self.intervals = {}
 
     def add(self, subnet):
-        self.reservations.append(subnet)
+        key = _subnet_key(subnet)
+        self.counts[key] += 1
+        if self.counts[key] > 1:
+            return
+
+        bisect.insort(self.blocks.setdefault(subnet.version, []), key[1:])
+        self._insert(subnet.version, key[1], key[2])
+
+    def remove(self, subnet):
+        key = _subnet_key(subnet)
+        if key not in self.counts:
+            return
+
+        self.counts[key] -= 1
+        if self.counts[key] > 0:
+            return
+        del self.counts[key]
+
+        version, first, last = key
+        blocks = self.blocks[version]
+        del blocks[bisect.bisect_left(blocks, (first, last))]
+
+        # A reserved supernet still covers the removed block.
+        for supernet in _supernet_keys(version, first, last):
+            if supernet in self.counts:
+                return
+
+        # Otherwise, the rest of the interval that contained the removed
+        # block is still covered by other blocks.  Split it around the
+        # removed block and add back the blocks inside of it.
+        starts, ends = self.intervals[version]
+        i = bisect.bisect_right(starts, first) - 1
+        start, end = starts[i], ends[i]
+        del starts[i]
+        del ends[i]
+        if start < first:
+            self._insert(version, start, first - 1)
+        if last < end:
+            self._insert(version, last + 1, end)
+
+        j = bisect.bisect_left(blocks, (first, ))
+        while j < len(blocks) and blocks[j][0] <= last:
+            self._insert(version, *blocks[j])
+            j += 1
+
+    def _insert(self, version, first, last):
+        starts, ends = self.intervals.setdefault(version, ([], []))
+
+        # Merge with any intervals that overlap or touch the new one.
+        i = bisect.bisect_left(ends, first - 1)
+        j = bisect.bisect_right(starts, last + 1)
+        if i < j:
+            first = min(first, starts[i])
+            last = max(last, ends[j - 1])
+        starts[i:j] = [first]
+        ends[i:j] = [last]
+
+    def copy(self):
+        result = SubnetReservationSet()
+        result.counts = self.counts.copy()
+        for version, blocks in six.iteritems(self.blocks):
+            result.blocks[version] = list(blocks)
+        for version, (starts, ends) in six.iteritems(self.intervals):
+            result.intervals[version] = (list(starts), list(ends))
+        return result
+
+    def findReserved(self, version, first, last, exclude=None):
+        """
+        Find a reserved block that overlaps the block [first, last].
+
+        exclude: Counter of (version, first, last) -> reservations to ignore.
+
+        Returns the (first, last) of a reserved block or None.
+        """
+        def reserved(key):
+            count = self.counts.get(key, 0)
+            if exclude is not None:
+                count -= exclude.get(key, 0)
+            return count > 0
+
+        # Blocks that contain the query block are its supernets.
+        for key in _supernet_keys(version, first, last):
+            if reserved(key):
+                return key[1:]
+
+        # Blocks inside of the query block, including the block itself.
+        blocks = self.blocks.get(version, [])
+        i = bisect.bisect_left(blocks, (first, ))
+        while i < len(blocks) and blocks[i][0] <= last:
+            if reserved((version, ) + blocks[i]):
+                return blocks[i]
+            i += 1
+
+        return None
+
+    def skipReserved(self, version, first, size, exclude=None):
+        """
+        Return the start of the next block of the given size that may be free.
+
+        Returns first if the block starting at first is not reserved.
+        Otherwise, skips the run of merged reservations that blocks it, up
+        to the first excluded block in that run.
+        """
+        block = self.findReserved(version, first, first + size - 1, exclude)
+        if block is None:
+            return first
+
+        starts, ends = self.intervals[version]
+        i = bisect.bisect_right(starts, block[0]) - 1
+        target = ends[i] + 1
+
+        # Space used only by excluded reservations may be free.
+        if exclude is not None:
+            for key in exclude:
+                if key[0] != version or key[2] < first or key[1] > ends[i]:
+                    continue
+                if self.counts.get(key, 0) - exclude[key] <= 0:
+                    target = min(target, max(key[1], block[1] + 1))
+
+        # Round up to the next aligned block.
+        return ((max(target, first + 1) + size - 1) // size) * size
+
+    def nextFree(self, pool, prefixlen, exclude=None, others=()):
+        """
+        Find the first network of the given prefix length in the pool that
+        does not overlap any reservation.
+
+        exclude: Counter of reservations to ignore (see findReserved).
+        others: additional SubnetReservationSets to check.
+
+        Returns None if the pool is exhausted.
+        """
+        size = 1 << (pool.max_prefixlen - prefixlen)
+        pool_first, pool_last = _subnet_range(pool)
+
+        candidate = pool_first
+        while candidate + size - 1 <= pool_last:
+            skip = self.skipReserved(pool.version, candidate, size, exclude)
+            for other in others:
+                if skip == candidate:
+                    skip = other.skipReserved(pool.version, candidate, size)
+
+            if skip == candidate:
+                address = ipaddress.ip_address(candidate)
+                return ipaddress.ip_network(u'{}/{}'.format(address, prefixlen))
+            candidate = skip
+
+        return None
 
     def __contains__(self, subnet):
-        for res in self.reservations:
-            if res.overlaps(subnet):
-                return True
-        return False
+        first, last = _subnet_range(subnet)
+        return self.findReserved(subnet.version, first, last) is not None
 
     def __len__(self):
-        return len(self.reservations)
+        return sum(self.counts.values())
 
 
-def getSubnetReservations(exclude=None):
+class SubnetReservationView(object):
     """
-    Get current set of subnet reservations.
+    Subnet reservations as seen by one chute update.
 
-    Returns an instance of SubnetReservationSet.
+    The view combines the shared reservations, minus the subnets held by the
+    chute being updated, with the subnets that the update adds, without
+    copying or changing the shared set.
+    """
+    def __init__(self, reservations, exclude=()):
+        self.reservations = reservations
+        self.exclude = collections.Counter(_subnet_key(s) for s in exclude)
+        self.added = SubnetReservationSet()
 
-    exclude: name of chute whose reservations should be excluded
+    def add(self, subnet):
+        self.added.add(subnet)
+
+    def remove(self, subnet):
+        self.added.remove(subnet)
+
+    def nextFree(self, pool, prefixlen):
+        return self.reservations.nextFree(pool, prefixlen,
+                exclude=self.exclude, others=[self.added])
+
+    def __contains__(self, subnet):
+        first, last = _subnet_range(subnet)
+        return subnet in self.added or self.reservations.findReserved(
+                subnet.version, first, last, self.exclude) is not None
+
+    def __len__(self):
+        return len(self.reservations) - sum(self.exclude.values()) + \
+            len(self.added)
+
+
+def _subnet_range(subnet):
+    return (int(subnet.network_address), int(subnet.broadcast_address))
+
+
+def _subnet_key(subnet):
+    return (subnet.version, ) + _subnet_range(subnet)
+
+
+def _supernet_keys(version, first, last):
+    """
+    Generate the keys of the blocks that strictly contain [first, last],
+    smallest first.
     """
-    reservations = SubnetReservationSet()
+    bits = 32 if version == 4 else 128
+    prefixlen = bits - (last - first).bit_length()
+    for length in range(prefixlen - 1, -1, -1):
+        size = 1 << (bits - length)
+        yield (version, first - first % size, first - first % size + size - 1)
 
-    if exclude != constants.RESERVED_CHUTE_NAME:
-        hostConfig = prepareHostConfig()
+
+class SubnetIndex(object):
+    """
+    Persistent subnet reservations for the host and all installed chutes.
+
+    The index is filled from the chute list the first time it is used.
+    After that, the update pipeline tells it about each chute that is saved
+    or removed, so only that chute's subnets change.
+    """
+    def __init__(self):
+        self.owners = {}
+        self.reservations = SubnetReservationSet()
+        self.loaded = False
+
+    def setOwner(self, owner, subnets):
+        """
+        Set the subnets held by an owner (chute name), updating the
+        reservation set incrementally.
+        """
+        subnets = tuple(subnets)
+        old = self.owners.get(owner, ())
+        if old == subnets:
+            return
+
+        for subnet in old:
+            self.reservations.remove(subnet)
+        for subnet in subnets:
+            self.reservations.add(subnet)
+
+        if len(subnets) > 0:
+            self.owners[owner] = subnets
+        else:
+            self.owners.pop(owner, None)
+
+    def setHost(self, hostConfig):
+        """
+        Set the subnet of the host LAN from the host configuration.
+        """
+        subnets = []
         ipaddr = datastruct.getValue(hostConfig, 'lan.ipaddr', None)
         netmask = datastruct.getValue(hostConfig, 'lan.netmask', None)
         if ipaddr is not None and netmask is not None:
             network = ipaddress.ip_network(u'{}/{}'.format(ipaddr, netmask),
                     strict=False)
-            reservations.add(network)
+            subnets.append(network)
+        self.setOwner(constants.RESERVED_CHUTE_NAME, subnets)
 
-    for chute in ChuteStorage.chuteList.values():
-        if chute.name == exclude:
-            continue
+    def setChute(self, chute):
+        """
+        Set the subnets held by an installed chute.
+        """
+        interfaces = chute.getCache('networkInterfaces') or []
+        subnets = [iface['subnet'] for iface in interfaces if 'subnet' in iface]
+        self.setOwner(chute.name, subnets)
 
-        for iface in chute.getCache('networkInterfaces'):
-            if 'subnet' not in iface:
-                continue
+    def removeChute(self, name):
+        self.setOwner(name, [])
 
-            subnet = iface['subnet']
-            reservations.add(subnet)
+    def clearChutes(self):
+        for owner in list(self.owners.keys()):
+            if owner != constants.RESERVED_CHUTE_NAME:
+                self.setOwner(owner, [])
 
-    return reservations
+    def load(self):
+        """
+        Fill the index from the chute list if that has not been done yet.
+        """
+        if self.loaded:
+            return
+        for chute in ChuteStorage.chuteList.values():
+            self.setChute(chute)
+        self.loaded = True
+
+
+subnetIndex = SubnetIndex()
+
+
+def getSubnetReservations(exclude=None):
+    """
+    Get current set of subnet reservations.
+
+    Returns a SubnetReservationView.  The caller may add reservations to it
+    without affecting the shared index.
+
+    exclude: name of chute whose reservations should be excluded
+    """
+    subnetIndex.load()
+    subnetIndex.setHost(prepareHostConfig())
+    return SubnetReservationView(subnetIndex.reservations,
+                                 subnetIndex.owners.get(exclude, ()))
 
 
 def getReservations(update):
@@ -1,28 +1,42 @@
 """
 Configure optional additional services such as telemetry.
 """
-from paradrop.core.agent import reporting
+from paradrop.core.agent import telemetry
 from paradrop.lib.utils import datastruct
 
 from twisted.internet.task import LoopingCall
 
 
 telemetry_looping_call = None
+telemetry_upload_call = None
 
 
 def configure_telemetry(update):
     global telemetry_looping_call
+    global telemetry_upload_call
 
     hostConfig = update.cache_get('hostConfig')
 
     enabled = datastruct.getValue(hostConfig, 'telemetry.enabled', False)
     interval = datastruct.getValue(hostConfig, 'telemetry.interval', 60)
+    upload_interval = datastruct.getValue(hostConfig,
+            'telemetry.uploadInterval', 300)
 
-    # Cancel the old looping call.
+    # Cancel the old looping calls.
     if telemetry_looping_call is not None:
         telemetry_looping_call.stop()
         telemetry_looping_call = None
+    if telemetry_upload_call is not None:
+        telemetry_upload_call.stop()
+        telemetry_upload_call = None
 
     if enabled and interval > 0:
-        telemetry_looping_call = LoopingCall(reporting.sendTelemetryReport)
+        service = telemetry.getService()
+
+        # Samples are taken every interval seconds and uploaded in batches
+        # every upload_interval seconds.
+        telemetry_looping_call = LoopingCall(service.sample)
         telemetry_looping_call.start(interval, now=False)
+
+        telemetry_upload_call = LoopingCall(service.upload)
+        telemetry_upload_call.start(max(interval, upload_interval), now=False)
@@ -1,5 +1,6 @@
 """
 """
+from paradrop.core.system import node_facts
 from paradrop.lib.misc.governor import GovernorClient
 
 
@@ -8,3 +9,6 @@ def updateSnap(update):
     result = client.updateSnap(update.name, update.data)
     if 'message' in result:
         update.progress(result['message'])
+
+    # OS and package versions may have changed.
+    node_facts.facts.invalidate('software')
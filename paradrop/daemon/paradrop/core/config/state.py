@@ -1,5 +1,7 @@
 from paradrop.core.chute.chute_storage import ChuteStorage
 
+from .reservations import subnetIndex
+
 
 def saveChute(update):
     """
@@ -8,20 +10,26 @@ def saveChute(update):
     chuteStore = ChuteStorage()
     if update.updateType == "delete":
         chuteStore.deleteChute(update.old)
+        subnetIndex.removeChute(update.old.name)
     else:
         chuteStore.saveChute(update.new)
+        subnetIndex.setChute(chuteStore.getChute(update.new.name))
 
 
 def revertChute(update):
     chuteStore = ChuteStorage()
     if update.updateType == "delete":
         chuteStore.saveChute(update.old)
+        subnetIndex.setChute(chuteStore.getChute(update.old.name))
     elif update.old is not None:
         chuteStore.saveChute(update.old)
+        subnetIndex.setChute(chuteStore.getChute(update.old.name))
     else:
         chuteStore.deleteChute(update.new)
+        subnetIndex.removeChute(update.new.name)
 
 
 def removeAllChutes(update):
     chuteStore = ChuteStorage()
     chuteStore.clearChuteStorage()
+    subnetIndex.clearChutes()
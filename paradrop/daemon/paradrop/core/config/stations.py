@@ -0,0 +1,296 @@
+"""
+Information about wireless stations connected to chute access points.
+
+Station queries run in a worker thread so that they do not block the
+reactor.  They use nl80211 through pyroute2 when it is installed and fall
+back to parsing the output of `iw dev <ifname> station dump`.  Results are
+cached per interface for STATION_CACHE_TTL seconds, and requests for an
+interface that arrive while a query is running share the result of that
+query.
+
+Stations are returned as dictionaries with the same keys as before
+(e.g. "rx_bytes", "signal", "tx_bitrate"), but with numeric values: counters
+and times are integers, signal levels are in dBm, and bitrates are in
+MBit/s.
+"""
+
+import copy
+import re
+import subprocess
+import time
+
+from twisted.internet import defer, threads
+from twisted.python.failure import Failure
+
+from paradrop.base import settings
+from paradrop.base.output import out
+
+try:
+    from pyroute2 import IPRoute, IW
+except ImportError:
+    IPRoute = None
+    IW = None
+
+
+# nl80211 station attributes with integer values and the keys we use for
+# them, which match the field names printed by iw.
+NL80211_COUNTERS = [
+    ('NL80211_STA_INFO_INACTIVE_TIME', 'inactive_time'),
+    ('NL80211_STA_INFO_RX_BYTES', 'rx_bytes'),
+    ('NL80211_STA_INFO_TX_BYTES', 'tx_bytes'),
+    ('NL80211_STA_INFO_RX_BYTES64', 'rx_bytes'),
+    ('NL80211_STA_INFO_TX_BYTES64', 'tx_bytes'),
+    ('NL80211_STA_INFO_RX_PACKETS', 'rx_packets'),
+    ('NL80211_STA_INFO_TX_PACKETS', 'tx_packets'),
+    ('NL80211_STA_INFO_TX_RETRIES', 'tx_retries'),
+    ('NL80211_STA_INFO_TX_FAILED', 'tx_failed'),
+    ('NL80211_STA_INFO_SIGNAL', 'signal'),
+    ('NL80211_STA_INFO_SIGNAL_AVG', 'signal_avg'),
+    ('NL80211_STA_INFO_CHAIN_SIGNAL', 'chain_signal'),
+    ('NL80211_STA_INFO_CHAIN_SIGNAL_AVG', 'chain_signal_avg'),
+    ('NL80211_STA_INFO_CONNECTED_TIME', 'connected_time'),
+]
+
+NL80211_BITRATES = [
+    ('NL80211_STA_INFO_TX_BITRATE', 'tx_bitrate'),
+    ('NL80211_STA_INFO_RX_BITRATE', 'rx_bitrate'),
+]
+
+NL80211_FLAGS = [
+    ('AUTHORIZED', 'authorized'),
+    ('AUTHENTICATED', 'authenticated'),
+    ('ASSOCIATED', 'associated'),
+    ('WME', 'wmm_wme'),
+    ('MFP', 'mfp'),
+    ('TDLS_PEER', 'tdls_peer'),
+]
+
+IW_NUMBER = re.compile(r"^(-?\d+(?:\.\d+)?)")
+IW_CHAINS = re.compile(r"\[([^\]]*)\]")
+
+
+def parseIwValue(key, value):
+    """
+    Convert a value printed by iw to a number or boolean where possible.
+
+    Returns a dictionary of fields, because some values (e.g. "signal: -45
+    [-49, -48] dBm") contain per-chain values as well.
+    """
+    if value in ["yes", "no"]:
+        return {key: value == "yes"}
+
+    match = IW_NUMBER.match(value)
+    if match is None:
+        return {key: value}
+
+    number = match.group(1)
+    result = {key: float(number) if "." in number else int(number)}
+
+    chains = IW_CHAINS.search(value)
+    if chains is not None and key.startswith("signal"):
+        chainKey = "chain_" + key
+        try:
+            result[chainKey] = [int(x) for x in chains.group(1).split(",")]
+        except ValueError:
+            pass
+
+    return result
+
+
+def parseIwStations(lines):
+    """
+    Parse the output of `iw dev <ifname> station dump`.
+    """
+    stations = []
+    current = {}
+
+    for line in lines:
+        line = line.strip()
+
+        match = re.match(r"Station\s+(\S+)\s+.*", line)
+        if match is not None:
+            current = {
+                'mac_addr': match.group(1)
+            }
+            stations.append(current)
+            continue
+
+        match = re.match(r"(.*):\s+(.*)", line)
+        if match is not None:
+            key = match.group(1).lower().replace(' ', '_').replace('/', '_')
+            current.update(parseIwValue(key, match.group(2)))
+
+    return stations
+
+
+def parseNetlinkStation(msg):
+    """
+    Convert an nl80211 station message to a station dictionary.
+    """
+    station = {
+        'mac_addr': msg.get_attr('NL80211_ATTR_MAC')
+    }
+
+    info = msg.get_attr('NL80211_ATTR_STA_INFO')
+    if info is None:
+        return station
+
+    for name, key in NL80211_COUNTERS:
+        value = info.get_attr(name)
+        if value is not None:
+            station[key] = value
+
+    for name, key in NL80211_BITRATES:
+        rate = info.get_attr(name)
+        if rate is None:
+            continue
+        # Bitrates are reported in units of 100 kbit/s.
+        value = rate.get_attr('NL80211_RATE_INFO_BITRATE32')
+        if value is None:
+            value = rate.get_attr('NL80211_RATE_INFO_BITRATE')
+        if value is not None:
+            station[key] = value / 10.0
+
+    flags = info.get_attr('NL80211_STA_INFO_STA_FLAGS')
+    if flags is not None:
+        for name, key in NL80211_FLAGS:
+            station[key] = flags.get(name, False)
+        station['preamble'] = "short" if flags.get('SHORT_PREAMBLE', False) \
+            else "long"
+
+    return station
+
+
+def queryNetlink(ifname):
+    ipr = IPRoute()
+    try:
+        indices = ipr.link_lookup(ifname=ifname)
+    finally:
+        ipr.close()
+    if len(indices) == 0:
+        raise Exception("Interface {} not found".format(ifname))
+
+    iw = IW()
+    try:
+        messages = iw.get_stations(indices[0])
+        return [parseNetlinkStation(msg) for msg in messages]
+    finally:
+        iw.close()
+
+
+def queryIw(ifname):
+    cmd = ['iw', 'dev', ifname, 'station', 'dump']
+    output = subprocess.check_output(cmd)
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+    return parseIwStations(output.splitlines())
+
+
+def queryStations(ifname):
+    """
+    Query the stations connected to an interface (blocking).
+    """
+    if IW is not None and settings.STATION_INFO_NETLINK:
+        try:
+            return queryNetlink(ifname)
+        except Exception as error:
+            out.warn("nl80211 station query on {} failed: {}\n".format(
+                ifname, error))
+    return queryIw(ifname)
+
+
+class StationInfoService(object):
+    """
+    Cached, non-blocking station queries.
+
+    The methods must be called from the reactor thread.  They return
+    Deferreds that fire with copies of the cached data.
+    """
+    def __init__(self, query=queryStations):
+        self.query = query
+
+        # ifname -> (timestamp, list of stations)
+        self.cache = {}
+
+        # ifname -> list of Deferreds waiting for a running query
+        self.pending = {}
+
+    def getStations(self, ifname):
+        """
+        Get the list of stations connected to an interface.
+        """
+        entry = self.cache.get(ifname, None)
+        if entry is not None and \
+                time.time() < entry[0] + settings.STATION_CACHE_TTL:
+            return defer.succeed(copy.deepcopy(entry[1]))
+
+        d = defer.Deferred()
+        if ifname in self.pending:
+            self.pending[ifname].append(d)
+            return d
+
+        self.pending[ifname] = [d]
+        query = threads.deferToThread(self.query, ifname)
+        query.addBoth(self._finish, ifname)
+        return d
+
+    def getStation(self, ifname, mac):
+        """
+        Get one station by MAC address.
+
+        The Deferred fires with None if the station is not connected.
+        """
+        def find(stations):
+            for station in stations:
+                if station['mac_addr'].lower() == mac.lower():
+                    return station
+            return None
+
+        d = self.getStations(ifname)
+        d.addCallback(find)
+        return d
+
+    def getAllStations(self, ifnames):
+        """
+        Get the stations for several interfaces.
+
+        ifnames: dictionary mapping a key (e.g. network name) to interface
+        name.  The Deferred fires with a dictionary mapping the same keys to
+        lists of stations.
+        """
+        keys = list(ifnames.keys())
+        queries = [self.getStations(ifnames[key]) for key in keys]
+
+        d = defer.gatherResults(queries, consumeErrors=True)
+        d.addCallback(lambda results: dict(zip(keys, results)))
+        return d
+
+    def invalidate(self, ifname):
+        """
+        Discard cached results for an interface, e.g. after removing a
+        station.
+        """
+        self.cache.pop(ifname, None)
+
+    def _finish(self, result, ifname):
+        waiters = self.pending.pop(ifname, [])
+        if isinstance(result, Failure):
+            for d in waiters:
+                d.errback(result)
+        else:
+            self.cache[ifname] = (time.time(), result)
+            for d in waiters:
+                d.callback(copy.deepcopy(result))
+
+
+service = None
+
+
+def getService():
+    """
+    Return the station info service, creating it on first use.
+    """
+    global service
+    if service is None:
+        service = StationInfoService()
+    return service
@@ -50,6 +50,7 @@ def setConfig(update, cacheKeys, filepath):
         cfgFile.delConfigs(oldconfigs)
         cfgFile.addConfigs(newconfigs)
         cfgFile.save(backupToken="paradrop", internalid=chute_name)
+        update.changedConfigFiles.add(filepath)
         return True
 
 
@@ -61,7 +62,10 @@ def restoreConfigFile(chute, configname):
     that were made during that update operation.
 
     configname: name of configuration file ("network", "wireless", etc.)
+
+    Returns the path of the restored file.
     """
     filepath = uci.getSystemPath(configname)
     cfgFile = uci.UCIConfig(filepath)
     cfgFile.restore(backupToken="paradrop", saveBackup=False)
+    return filepath
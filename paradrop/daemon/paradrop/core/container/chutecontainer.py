@@ -2,12 +2,14 @@ import docker
 
 from paradrop.base.exceptions import ChuteNotFound, ChuteNotRunning
 
+from . import docker_state
+
 
 class ChuteContainer(object):
     """
     Class for accessing information about a chute's container.
     """
-    def __init__(self, name, docker_url="unix://var/run/docker.sock"):
+    def __init__(self, name, docker_url=docker_state.DOCKER_URL):
         self.name = name
         self.docker_url = docker_url
 
@@ -77,7 +79,13 @@ class ChuteContainer(object):
     def inspect(self):
         """
         Return the full container status from Docker.
+
+        When using the default Docker daemon, this is answered from the shared
+        container state cache.
         """
+        if self.docker_url == docker_state.DOCKER_URL:
+            return docker_state.cache.inspect(self.name)
+
         client = docker.APIClient(base_url=self.docker_url, version='auto')
         try:
             info = client.inspect_container(self.name)
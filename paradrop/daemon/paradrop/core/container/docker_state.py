@@ -0,0 +1,197 @@
+"""
+Shared Docker connection and cached container state.
+
+Creating a Docker client for every operation and inspecting containers on
+demand is slow, especially when the API lists many chutes at once.  This
+module keeps one pooled client for the process and an in-memory copy of the
+inspect output for every container.  The cache is primed from a container
+listing and kept fresh by a thread that follows the Docker events stream, so
+readers can answer from memory without talking to Docker.
+"""
+
+import threading
+import time
+
+import docker
+
+from paradrop.base.exceptions import ChuteNotFound
+from paradrop.base.output import out
+
+
+DOCKER_URL = "unix://var/run/docker.sock"
+
+# Seconds to wait before reconnecting after the events stream fails.
+RETRY_DELAY = 5
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the process-wide DockerClient.
+
+    The client keeps a pool of connections to the Docker daemon, so it can be
+    shared between threads.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = docker.DockerClient(base_url=DOCKER_URL, version='auto')
+        return _client
+
+
+def get_api_client():
+    """
+    Return the low-level APIClient belonging to the shared DockerClient.
+    """
+    return get_client().api
+
+
+class ContainerStateCache(object):
+    """
+    In-memory copy of container inspect output, indexed by container name.
+
+    While the watcher thread is synchronized with Docker, the cache is
+    authoritative: a name that is not in the cache does not exist.  Before the
+    watcher is started, or while it is reconnecting, lookups fall through to
+    Docker.
+    """
+    def __init__(self):
+        self.containers = {}
+        self.lock = threading.Lock()
+        self.synced = False
+        self.running = False
+        self.events = None
+        self.thread = None
+
+    def inspect(self, name):
+        """
+        Return the inspect output for a container.
+
+        Raises ChuteNotFound if the container does not exist.
+        """
+        with self.lock:
+            info = self.containers.get(name, None)
+            if info is not None:
+                return info
+            if self.synced:
+                raise ChuteNotFound("The chute could not be found.")
+
+        try:
+            return get_api_client().inspect_container(name)
+        except docker.errors.NotFound:
+            raise ChuteNotFound("The chute could not be found.")
+
+    def refresh(self, name):
+        """
+        Re-read the state of one container after changing it.
+
+        The events stream will also deliver the change, but this makes it
+        visible to readers immediately.
+        """
+        with self.lock:
+            if not self.synced:
+                return
+
+        try:
+            info = get_api_client().inspect_container(name)
+        except docker.errors.NotFound:
+            info = None
+
+        with self.lock:
+            if info is None:
+                self.containers.pop(name, None)
+            else:
+                self.containers[name] = info
+
+    def sync(self, client):
+        """
+        Replace the cache contents with the current state of all containers.
+        """
+        containers = {}
+        for summary in client.containers(all=True):
+            try:
+                info = client.inspect_container(summary['Id'])
+            except docker.errors.NotFound:
+                continue
+            containers[info['Name'].lstrip('/')] = info
+
+        with self.lock:
+            self.containers = containers
+            self.synced = True
+
+    def handleEvent(self, client, event):
+        """
+        Update the cache from one Docker container event.
+        """
+        action = event.get('Action', event.get('status', ''))
+        if action.startswith("exec_"):
+            return
+
+        cid = event.get('Actor', {}).get('ID', event.get('id', None))
+        if cid is None:
+            return
+
+        try:
+            info = client.inspect_container(cid)
+        except docker.errors.NotFound:
+            info = None
+
+        with self.lock:
+            # Drop any entry for this container, which also takes care of
+            # renamed containers, then add back the current state.
+            for name, old in list(self.containers.items()):
+                if old['Id'] == cid:
+                    del self.containers[name]
+            if info is not None:
+                self.containers[info['Name'].lstrip('/')] = info
+
+    def start(self):
+        """
+        Start the watcher thread.
+        """
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the watcher thread and stop serving from the cache.
+        """
+        self.running = False
+        if self.events is not None:
+            self.events.close()
+
+    def _watch(self):
+        while self.running:
+            try:
+                client = get_api_client()
+
+                # Subscribe before listing so that no change can fall between
+                # the listing and the first event.
+                self.events = client.events(decode=True,
+                        filters={'type': 'container'})
+                self.sync(client)
+
+                for event in self.events:
+                    self.handleEvent(client, event)
+                    if not self.running:
+                        break
+            except Exception as error:
+                if self.running:
+                    out.warn("Docker events stream failed: {}".format(error))
+
+            with self.lock:
+                self.synced = False
+                self.containers = {}
+            self.events = None
+
+            if self.running:
+                time.sleep(RETRY_DELAY)
+
+
+cache = ContainerStateCache()
@@ -13,6 +13,7 @@ import os
 import random
 import re
 import subprocess
+import threading
 import time
 
 import six
@@ -24,6 +25,7 @@ from paradrop.base.output import out
 from paradrop.base import constants, nexus, settings
 from paradrop.core.config.devices import resetWirelessDevice
 
+from . import docker_state, netlink
 from .chutecontainer import ChuteContainer
 from .dockerfile import Dockerfile
 
@@ -125,7 +127,7 @@ def prepare_image(update, service):
     thread and return a Deferred. This will suspend processing of the current
     update until the worker thread finishes.
     """
-    client = docker.APIClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = docker_state.get_api_client()
 
     image_name = service.get_image_name()
 
@@ -149,14 +151,156 @@ def prepare_image(update, service):
                 rm=True, tag=image_name, path=update.workdir)
 
 
+class ServiceProgress(object):
+    """
+    Progress reporting for one service while images are prepared together.
+
+    Messages are prefixed with the service name so that the output of
+    concurrent builds can be told apart.  Raises an exception if preparation
+    was cancelled because another image failed, which stops the build or pull
+    at its next progress message.
+    """
+    def __init__(self, update, name, cancelled):
+        self.update = update
+        self.prefix = "[{}] ".format(name)
+        self.cancelled = cancelled
+
+    def __getattr__(self, name):
+        return getattr(self.update, name)
+
+    def progress(self, message):
+        if self.cancelled.is_set():
+            raise Exception("Cancelled because another image failed")
+        self.update.progress(self.prefix + message)
+
+
+def prepare_images(update, services):
+    """
+    Prepare Docker images for several services in parallel.
+
+    Like prepare_image, this returns a Deferred if CONCURRENT_BUILDS is
+    enabled.
+    """
+    if settings.CONCURRENT_BUILDS:
+        return deferToThread(_prepare_images, update, services)
+    else:
+        return _prepare_images(update, services)
+
+
+def _prepare_images(update, services):
+    """
+    Pull and build images for several services (worker function).
+
+    Each distinct image is pulled only once, including the base images of
+    light services, which are then built without pulling again.  Up to
+    IMAGE_PREPARE_CONCURRENCY images are prepared at a time.  If one fails,
+    the others are stopped and the first error is raised.
+    """
+    client = docker_state.get_api_client()
+    cancelled = threading.Event()
+
+    # Map image name -> Event that is set when the pull has finished.
+    pulled = {}
+
+    # Images that failed to pull.  An image is added before its event is set
+    # so that builds waiting on it never see a failed pull as finished.
+    failed = set()
+
+    # Pulls and builds to run.
+    jobs = []
+    builds = []
+
+    def make_pull(image_name, name):
+        event = threading.Event()
+        pulled[image_name] = event
+
+        def pull():
+            try:
+                _pull_image(ServiceProgress(update, name, cancelled), client,
+                            image_name)
+            except Exception:
+                failed.add(image_name)
+                cancelled.set()
+                raise
+            finally:
+                event.set()
+
+        jobs.append(pull)
+
+    def make_build(service, base_image, inline, **buildArgs):
+        def build():
+            if base_image is not None:
+                pulled[base_image].wait()
+                if base_image in failed or cancelled.is_set():
+                    return
+            _build_image(ServiceProgress(update, service.name, cancelled),
+                         service, client, inline, **buildArgs)
+
+        builds.append(build)
+
+    for service in services:
+        image_name = service.get_image_name()
+
+        if service.type == "image":
+            if image_name not in pulled:
+                make_pull(image_name, service.name)
+            continue
+
+        base_image = None
+        if service.type == "light":
+            base_image = Dockerfile(service).getBaseImage()
+            if base_image not in pulled:
+                make_pull(base_image, service.name)
+
+        if service.type == "inline":
+            make_build(service, base_image, True, rm=True, tag=image_name,
+                       fileobj=service.dockerfile)
+        else:
+            make_build(service, base_image, False, rm=True, tag=image_name,
+                       path=update.workdir, pull=False)
+
+    # Pulls go first so that a build never occupies a worker while the pull
+    # it is waiting for is still queued.
+    jobs.extend(builds)
+
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        while True:
+            with lock:
+                if len(jobs) == 0 or cancelled.is_set():
+                    return
+                job = jobs.pop(0)
+
+            try:
+                job()
+            except Exception as error:
+                with lock:
+                    errors.append(error)
+                cancelled.set()
+
+    workers = []
+    for i in range(min(settings.IMAGE_PREPARE_CONCURRENCY, len(jobs))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+
+    for thread in workers:
+        thread.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+
 def check_image(update, service):
     """
     Check if image exists.
     """
     image_name = service.get_image_name()
 
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock",
-            version='auto')
+    client = docker_state.get_client()
 
     # Raises an exception if the image does not exist.
     client.images.get(image_name)
@@ -166,14 +310,11 @@ def remove_image(update, service):
     """
     Remove a Docker image.
     """
-    client = docker.APIClient(base_url="unix://var/run/docker.sock", version='auto')
-
     image_name = service.get_image_name()
     out.info("Removing image {}\n".format(image_name))
 
     try:
-        client = docker.DockerClient(base_url="unix://var/run/docker.sock",
-                version='auto')
+        client = docker_state.get_client()
         client.images.remove(image=image_name)
     except Exception as error:
         out.warn("Error removing image: {}".format(error))
@@ -183,7 +324,7 @@ def create_bridge(update):
     """
     Create a user-defined bridge network for the chute.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = docker_state.get_client()
     client.networks.create(update.new.name, driver="bridge")
 
 
@@ -191,7 +332,7 @@ def remove_bridge(update):
     """
     Remove the bridge network associated with the chute.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = docker_state.get_client()
     try:
         network = client.networks.get(update.new.name)
         network.remove()
@@ -203,7 +344,7 @@ def start_container(update, service):
     """
     Start running a service in a new container.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = docker_state.get_client()
 
     container_name = service.get_container_name()
     image_name = service.get_image_name()
@@ -231,6 +372,8 @@ def start_container(update, service):
     except docker.errors.NotFound:
         out.warn("Bridge network {} not found; connectivity between containers is limited.".format(update.new.name))
 
+    docker_state.cache.refresh(container_name)
+
 
 def remove_container(update, service):
     """
@@ -240,8 +383,7 @@ def remove_container(update, service):
     out.info("Removing container {}\n".format(container_name))
 
     try:
-        client = docker.DockerClient(base_url="unix://var/run/docker.sock",
-                version='auto')
+        client = docker_state.get_client()
 
         # Grab the last 40 log messages to help with debugging.
         container = client.containers.get(container_name)
@@ -252,6 +394,8 @@ def remove_container(update, service):
     except Exception as error:
         out.warn("Error removing container: {}".format(error))
 
+    docker_state.cache.refresh(container_name)
+
 
 def _build_image(update, service, client, inline, **buildArgs):
     """
@@ -262,7 +406,8 @@ def _build_image(update, service, client, inline, **buildArgs):
     """
     # If this is a light chute, generate a Dockerfile.
     if service.type == "light":
-        buildArgs['pull'] = True
+        # The base image may have been pulled already (see _prepare_images).
+        buildArgs.setdefault('pull', True)
 
         dockerfile = Dockerfile(service)
         valid, reason = dockerfile.isValid()
@@ -351,10 +496,13 @@ def stopChute(update):
     """
     out.info('Attempting to stop chute %s\n' % (update.name))
 
-    c = docker.DockerClient(base_url='unix://var/run/docker.sock', version='auto')
+    c = docker_state.get_client()
     container = c.containers.get(update.name)
     container.stop()
 
+    # Make the new state visible to the rest of the update right away.
+    docker_state.cache.refresh(update.name)
+
 
 def restartChute(update):
     """
@@ -365,10 +513,13 @@ def restartChute(update):
     :returns: None
     """
     out.info('Attempting to restart chute %s\n' % (update.name))
-    c = docker.DockerClient(base_url='unix://var/run/docker.sock', version='auto')
+    c = docker_state.get_client()
     container = c.containers.get(update.name)
     container.start()
 
+    # Make the new state visible to the rest of the update right away.
+    docker_state.cache.refresh(update.name)
+
 
 def getBridgeGateway():
     """
@@ -377,7 +528,7 @@ def getBridgeGateway():
     This is the docker0 IP address; it is the IP address of the host from the
     chute's perspective.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = docker_state.get_client()
 
     network = client.networks.get("bridge")
     for config in network.attrs['IPAM']['Config']:
@@ -527,91 +678,122 @@ def setup_net_interfaces(update):
     # so we need to keep track of them.
     borrowedInterfaces = []
 
-    for iface in interfaces:
-        itype = iface.get('type', 'wifi-ap')
-
-        service = update.new.get_service(iface['service'])
-
-        # We need the container's PID in order to work with Linux namespaces.
-        container = ChuteContainer(service.get_container_name())
-        pid = container.getPID()
+    # Use a netlink session for the whole chute if possible, so that all of
+    # the interface changes are made in-process over shared sockets.
+    session = None
+    if netlink.available():
+        try:
+            session = netlink.NetlinkSession()
+        except Exception as error:
+            out.warn("Netlink unavailable, using ip commands: {}\n".format(error))
 
-        if itype == 'lan' or itype == 'vlan' or itype == 'wifi-ap':
-            IP = iface['ipaddrWithPrefix']
-            internalIntf = iface['internalIntf']
-            externalIntf = iface['externalIntf']
-
-            # Generate a temporary interface name.  It just needs to be unique.
-            # We will rename to the internalIntf name as soon as the interface
-            # is inside the chute.
-            tmpIntf = "tmp{:x}".format(random.getrandbits(32))
-
-            # TODO copy MTU from original interface?
-            cmd = ['ip', 'link', 'add', 'link', externalIntf, 'dev', tmpIntf,
-                    'type', 'macvlan', 'mode', 'bridge']
-            call_retry(cmd, env, tries=1)
-
-            # Bring the interface up.
-            cmd = ['ip', 'link', 'set', tmpIntf, 'up']
-            call_retry(cmd, env, tries=1)
-
-            # Give the new interface to the chute.
-            cmd = ['ip', 'link', 'set', tmpIntf, 'netns', str(pid)]
-            call_retry(cmd, env, tries=1)
-
-            # Rename the interface according to what the chute wants.
-            cmd = ['ip', 'link', 'set', tmpIntf, 'name', internalIntf]
-            call_in_netns(service, env, cmd)
-
-            # Set the IP address.
-            cmd = ['ip', 'addr', 'add', IP, 'dev', internalIntf]
-            call_in_netns(service, env, cmd)
-
-            # Bring the interface up again.
-            cmd = ['ip', 'link', 'set', internalIntf, 'up']
-            call_in_netns(service, env, cmd)
-
-        elif itype == 'wifi-monitor':
-            internalIntf = iface['internalIntf']
-            externalIntf = iface['externalIntf']
-            phyname = iface['phy']
-
-            cmd = ['iw', 'phy', phyname, 'set', 'netns', str(pid)]
-            call_retry(cmd, env, tries=1)
-
-            # Rename the interface inside the container.
-            cmd = ['ip', 'link', 'set', 'dev', externalIntf, 'up', 'name',
-                    internalIntf]
-            call_in_netns(service, env, cmd)
-
-            borrowedInterfaces.append({
-                'type': 'wifi',
-                'pid': pid,
-                'internal': internalIntf,
-                'external': externalIntf,
-                'phy': phyname
-            })
-
-        elif itype == '_lan':
-            # Not currently supported, this mode would allow chutes to take
-            # control of the physical LAN interface directly, rather than the
-            # virtual macvlan interface created above.
-            internalIntf = iface['internalIntf']
-            externalIntf = iface['externalIntf']
-
-            cmd = ['ip', 'link', 'set', 'dev', externalIntf, 'up', 'netns',
-                    str(pid), 'name', internalIntf]
-            call_retry(cmd, env, tries=1)
-
-            borrowedInterfaces.append({
-                'type': 'lan',
-                'pid': pid,
-                'internal': internalIntf,
-                'external': externalIntf
-            })
+    try:
+        for iface in interfaces:
+            itype = iface.get('type', 'wifi-ap')
+
+            service = update.new.get_service(iface['service'])
+
+            # We need the container's PID in order to work with Linux namespaces.
+            container = ChuteContainer(service.get_container_name())
+            pid = container.getPID()
+
+            if itype == 'lan' or itype == 'vlan' or itype == 'wifi-ap':
+                IP = iface['ipaddrWithPrefix']
+                internalIntf = iface['internalIntf']
+                externalIntf = iface['externalIntf']
+
+                if session is not None:
+                    try:
+                        session.add_macvlan(pid, externalIntf, internalIntf, IP)
+                        continue
+                    except Exception as error:
+                        out.warn("Netlink setup of {} failed, using ip commands: {}\n"
+                                .format(internalIntf, error))
+
+                # Generate a temporary interface name.  It just needs to be unique.
+                # We will rename to the internalIntf name as soon as the interface
+                # is inside the chute.
+                tmpIntf = "tmp{:x}".format(random.getrandbits(32))
+
+                # TODO copy MTU from original interface?
+                cmd = ['ip', 'link', 'add', 'link', externalIntf, 'dev', tmpIntf,
+                        'type', 'macvlan', 'mode', 'bridge']
+                call_retry(cmd, env, tries=1)
+
+                # Bring the interface up.
+                cmd = ['ip', 'link', 'set', tmpIntf, 'up']
+                call_retry(cmd, env, tries=1)
+
+                # Give the new interface to the chute.
+                cmd = ['ip', 'link', 'set', tmpIntf, 'netns', str(pid)]
+                call_retry(cmd, env, tries=1)
+
+                # Rename the interface according to what the chute wants.
+                cmd = ['ip', 'link', 'set', tmpIntf, 'name', internalIntf]
+                call_in_netns(service, env, cmd)
+
+                # Set the IP address.
+                cmd = ['ip', 'addr', 'add', IP, 'dev', internalIntf]
+                call_in_netns(service, env, cmd)
+
+                # Bring the interface up again.
+                cmd = ['ip', 'link', 'set', internalIntf, 'up']
+                call_in_netns(service, env, cmd)
+
+            elif itype == 'wifi-monitor':
+                internalIntf = iface['internalIntf']
+                externalIntf = iface['externalIntf']
+                phyname = iface['phy']
+
+                cmd = ['iw', 'phy', phyname, 'set', 'netns', str(pid)]
+                call_retry(cmd, env, tries=1)
+
+                # Rename the interface inside the container.
+                renamed = False
+                if session is not None:
+                    try:
+                        session.rename_link(pid, externalIntf, internalIntf, 'up')
+                        renamed = True
+                    except Exception as error:
+                        out.warn("Netlink rename of {} failed, using ip commands: {}\n"
+                                .format(externalIntf, error))
+
+                if not renamed:
+                    cmd = ['ip', 'link', 'set', 'dev', externalIntf, 'up', 'name',
+                            internalIntf]
+                    call_in_netns(service, env, cmd)
+
+                borrowedInterfaces.append({
+                    'type': 'wifi',
+                    'pid': pid,
+                    'internal': internalIntf,
+                    'external': externalIntf,
+                    'phy': phyname
+                })
+
+            elif itype == '_lan':
+                # Not currently supported, this mode would allow chutes to take
+                # control of the physical LAN interface directly, rather than the
+                # virtual macvlan interface created above.
+                internalIntf = iface['internalIntf']
+                externalIntf = iface['externalIntf']
+
+                cmd = ['ip', 'link', 'set', 'dev', externalIntf, 'up', 'netns',
+                        str(pid), 'name', internalIntf]
+                call_retry(cmd, env, tries=1)
+
+                borrowedInterfaces.append({
+                    'type': 'lan',
+                    'pid': pid,
+                    'internal': internalIntf,
+                    'external': externalIntf
+                })
 
-        else:
-            raise Exception("Unrecognized interface type: {}".format(itype))
+            else:
+                raise Exception("Unrecognized interface type: {}".format(itype))
+    finally:
+        if session is not None:
+            session.close()
 
     update.cache_set('borrowedInterfaces', borrowedInterfaces)
 
@@ -635,13 +817,33 @@ def cleanup_net_interfaces(update):
     if settings.DOCKER_BIN_DIR not in env['PATH']:
         env['PATH'] += ":" + settings.DOCKER_BIN_DIR
 
+    session = None
+    if netlink.available():
+        try:
+            session = netlink.NetlinkSession()
+        except Exception as error:
+            out.warn("Netlink unavailable, using ip commands: {}\n".format(error))
+
+    def netlink_call(method, *args):
+        # Returns True if the operation was done over netlink.
+        if session is None:
+            return False
+        try:
+            getattr(session, method)(*args)
+            return True
+        except Exception as error:
+            out.warn("Netlink cleanup failed, using ip commands: {}\n".format(error))
+            return False
+
     for iface in borrowedInterfaces:
         service = update.new.get_service(iface['service'])
 
         if iface['type'] == 'wifi':
-            cmd = ['ip', 'link', 'set', 'dev', iface['internal'], 'down',
-                    'name', iface['external']]
-            call_in_netns(service, env, cmd, onerror="ignore", pid=iface['pid'])
+            if not netlink_call('rename_link', iface['pid'],
+                    iface['internal'], iface['external'], 'down'):
+                cmd = ['ip', 'link', 'set', 'dev', iface['internal'], 'down',
+                        'name', iface['external']]
+                call_in_netns(service, env, cmd, onerror="ignore", pid=iface['pid'])
 
             cmd = ['iw', 'phy', iface['phy'], 'set', 'netns', '1']
             call_in_netns(service, env, cmd, onerror="ignore", pid=iface['pid'])
@@ -649,9 +851,14 @@ def cleanup_net_interfaces(update):
             resetWirelessDevice(iface['phy'], iface['external'])
 
         elif iface['type'] == 'lan':
-            cmd = ['ip', 'link', 'set', 'dev', iface['internal'], 'down',
-                    'netns', '1', 'name', iface['external']]
-            call_in_netns(service, env, cmd, onerror="ignore", pid=iface['pid'])
+            if not netlink_call('return_link', iface['pid'],
+                    iface['internal'], iface['external']):
+                cmd = ['ip', 'link', 'set', 'dev', iface['internal'], 'down',
+                        'netns', '1', 'name', iface['external']]
+                call_in_netns(service, env, cmd, onerror="ignore", pid=iface['pid'])
+
+    if session is not None:
+        session.close()
 
 
 def call_in_netns(service, env, command, onerror="raise", pid=None):
@@ -683,7 +890,7 @@ def call_in_netns(service, env, command, onerror="raise", pid=None):
         out.warn("nsenter command failed, resorting to docker exec\n")
 
         try:
-            client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+            client = docker_state.get_client()
             container = client.containers.get(container_name)
             container.exec_run(command, user='root')
         except Exception:
@@ -719,12 +926,13 @@ def prepare_environment(update, service):
 
 
 def _setResourceAllocation(allocation):
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = docker_state.get_client()
     for container_name, resources in six.iteritems(allocation):
         out.info("Update chute {} set cpu_shares={}\n".format(
             container_name, resources['cpu_shares']))
         container = client.containers.get(container_name)
         container.update(cpu_shares=resources['cpu_shares'])
+        docker_state.cache.refresh(container_name)
 
         # Using class id 1:1 for prioritized, 1:3 for best effort.
         # Prioritization is implemented in confd/qos.py.  Class-ID is
@@ -765,10 +973,11 @@ def removeAllContainers(update):
 
     :returns: None
     """
-    client = docker.DockerClient(base_url='unix://var/run/docker.sock', version='auto')
+    client = docker_state.get_client()
 
     for container in client.containers.list(all=True):
         try:
             container.remove(force=True)
         except Exception as e:
             update.progress(str(e))
+        docker_state.cache.refresh(container.name)
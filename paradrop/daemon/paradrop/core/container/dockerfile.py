@@ -60,6 +60,15 @@ class Dockerfile(object):
         """
         self.service = service
 
+    def getBaseImage(self):
+        """
+        Return the name of the base image for the Dockerfile.
+
+        Example: amd64/node:8.13
+        """
+        return "{}/{}".format(get_target_machine(),
+                get_target_image(self.service.image))
+
     def getBytesIO(self):
         """
         Geterate a Dockerfile and return as a BytesIO object.
@@ -94,9 +103,7 @@ class Dockerfile(object):
 
         as_root = self.service.requests.get("as-root", False)
 
-        # Example base image: amd64/node:8.13
-        from_image = "{}/{}".format(get_target_machine(),
-                get_target_image(language))
+        from_image = self.getBaseImage()
 
         if isinstance(command, six.string_types):
             cmd_string = command
@@ -0,0 +1,175 @@
+"""
+Persistent cache for downloaded chute sources.
+
+Archives are stored under the SHA-256 digest of their content, so the same
+archive is only stored once even if it was downloaded under different names
+(e.g. a branch name and the commit hash it pointed to).  An index maps cache
+keys, such as a repository and commit or a URL, to the archive digest along
+with the ETag from the server and any meta data about the source.
+
+The cache is bounded by size.  When it grows beyond the limit, the least
+recently used archives are removed.
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+from paradrop.base import settings
+from paradrop.lib.utils import pdosq
+
+
+INDEX_FILE = "index.json"
+ARCHIVE_SUFFIX = ".tar"
+
+
+class DownloadCache(object):
+    def __init__(self, path, maxSize):
+        self.path = path
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+
+        pdosq.makedirs(path)
+
+        try:
+            with open(os.path.join(path, INDEX_FILE), "r") as source:
+                self.index = json.load(source)
+        except Exception:
+            self.index = {}
+
+    def archivePath(self, digest):
+        return os.path.join(self.path, digest + ARCHIVE_SUFFIX)
+
+    def lookup(self, key):
+        """
+        Look up a cache entry.
+
+        Returns a dictionary with the archive 'path', 'digest', 'etag', and
+        'meta', or None if the key is not cached.
+        """
+        with self.lock:
+            entry = self.index.get(key, None)
+            if entry is None:
+                return None
+
+            path = self.archivePath(entry['digest'])
+            try:
+                # Mark the archive as recently used.
+                os.utime(path, None)
+            except OSError:
+                del self.index[key]
+                self.writeIndex()
+                return None
+
+            result = dict(entry)
+            result['path'] = path
+            return result
+
+    def newTempFile(self):
+        """
+        Create a temporary file in the cache directory for a new download.
+
+        Returns a file object.  Pass its name to store to add it to the cache.
+        """
+        return tempfile.NamedTemporaryFile(dir=self.path, prefix="download-",
+                suffix=".tmp", delete=False)
+
+    def store(self, key, digest, tmpPath, etag=None, meta=None):
+        """
+        Add a downloaded archive to the cache under key.
+
+        Returns the path to the archive in the cache.
+        """
+        path = self.archivePath(digest)
+        with self.lock:
+            if os.path.exists(path):
+                os.remove(tmpPath)
+                os.utime(path, None)
+            else:
+                os.rename(tmpPath, path)
+
+            self.index[key] = {
+                'digest': digest,
+                'etag': etag,
+                'meta': meta
+            }
+            self.evict(keep=digest)
+            self.writeIndex()
+
+        return path
+
+    def update(self, key, **fields):
+        """
+        Update fields (e.g. meta) of an existing entry.
+        """
+        with self.lock:
+            if key in self.index:
+                self.index[key].update(fields)
+                self.writeIndex()
+
+    def alias(self, key, existingKey):
+        """
+        Make key refer to the same archive as existingKey.
+        """
+        with self.lock:
+            if existingKey in self.index:
+                self.index[key] = dict(self.index[existingKey])
+                self.writeIndex()
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used archives until the cache fits in maxSize.
+
+        Call with the lock held.
+        """
+        archives = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(ARCHIVE_SUFFIX):
+                continue
+            stat = os.stat(os.path.join(self.path, name))
+            archives.append((stat.st_mtime, name[:-len(ARCHIVE_SUFFIX)],
+                             stat.st_size))
+            total += stat.st_size
+
+        archives.sort()
+        removed = set()
+        for mtime, digest, size in archives:
+            if total <= self.maxSize:
+                break
+            if digest == keep:
+                continue
+            os.remove(self.archivePath(digest))
+            removed.add(digest)
+            total -= size
+
+        if len(removed) > 0:
+            for key in list(self.index.keys()):
+                if self.index[key]['digest'] in removed:
+                    del self.index[key]
+
+    def writeIndex(self):
+        path = os.path.join(self.path, INDEX_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as output:
+            json.dump(self.index, output)
+        os.rename(tmp, path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Return the download cache, or None if caching is disabled.
+    """
+    global _cache
+    if settings.DOWNLOAD_CACHE_SIZE <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = DownloadCache(settings.DOWNLOAD_CACHE_DIR,
+                    settings.DOWNLOAD_CACHE_SIZE)
+        return _cache
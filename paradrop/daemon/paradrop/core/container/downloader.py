@@ -12,6 +12,7 @@ the owner's private repository.  That part is not implemented here.
 """
 
 import base64
+import hashlib
 import json
 import os
 import re
@@ -19,6 +20,7 @@ import shutil
 import subprocess
 import tarfile
 import tempfile
+import threading
 
 import pycurl
 import six
@@ -26,10 +28,118 @@ import six
 
 from paradrop.base import settings
 
+from . import download_cache
+
 
 github_re = re.compile("^(http|https)://github.com/([\w\-]+)/([\w\-\.]+?)(\.git)?$")
 general_url_re = re.compile("(http:\/\/|https:\/\/)(\S+)")
 hash_re = re.compile("^.*-([0-9a-f]+)$")
+commit_re = re.compile("^[0-9a-f]{40}$")
+status_re = re.compile("^HTTP/\S+\s+(\d+)")
+
+
+def checkArchivePath(path):
+    """
+    Raise an exception if an archive path would escape the target directory.
+    """
+    if path.startswith(".."):
+        raise Exception("Archive contains a forbidden path: {}".format(path))
+    elif os.path.isabs(path):
+        raise Exception("Archive contains an absolute path: {}".format(path))
+
+
+def checkExtractPath(root, path):
+    """
+    Raise an exception if path, relative to root, resolves outside of root.
+
+    root must already be a real path.  Links extracted from earlier members
+    are followed, so a chain of links cannot be used to escape.
+    """
+    real = os.path.realpath(os.path.join(root, path))
+    if real != root and not real.startswith(root + os.sep):
+        raise Exception("Archive path resolves outside of the target directory: {}".format(path))
+
+
+class ArchiveReceiver(object):
+    """
+    Receive an archive from curl, saving and extracting it as it arrives.
+
+    The body of a successful (200) response is written to the output file and
+    fed through a pipe to a thread running the extract function, so the
+    archive is extracted while it downloads.  The body of any other response
+    is discarded.
+    """
+    def __init__(self, output, extract):
+        self.output = output
+        self.extract = extract
+        self.digest = hashlib.sha256()
+        self.code = None
+        self.etag = None
+
+        self.pipe = None
+        self.thread = None
+        self.result = None
+        self.error = None
+
+    def header(self, line):
+        if isinstance(line, six.binary_type):
+            line = line.decode('iso-8859-1')
+        line = line.strip()
+
+        # There is a status line for every response, including redirects.
+        match = status_re.match(line)
+        if match is not None:
+            self.code = int(match.group(1))
+            self.etag = None
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            if key.strip().lower() == 'etag':
+                self.etag = value.strip()
+
+    def write(self, data):
+        if self.code != 200:
+            return
+        if self.thread is None:
+            self.start()
+        self.output.write(data)
+        self.digest.update(data)
+        self.pipe.write(data)
+
+    def start(self):
+        readfd, writefd = os.pipe()
+        self.pipe = os.fdopen(writefd, 'wb')
+        reader = os.fdopen(readfd, 'rb')
+
+        def run():
+            try:
+                self.result = self.extract(reader)
+            except Exception as error:
+                self.error = error
+            finally:
+                # Read anything left, e.g. after an error, so that the writer
+                # does not block.
+                while reader.read(65536):
+                    pass
+                reader.close()
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def finish(self):
+        """
+        Wait for extraction to finish.
+
+        Returns the result of the extract function or raises its exception.
+        """
+        if self.pipe is not None:
+            self.pipe.close()
+            self.pipe = None
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
 
 
 class Downloader(object):
@@ -46,6 +156,11 @@ class Downloader(object):
 
         self.workDir = None
 
+        # Keys under which this download is stored in the download cache and
+        # meta data found in the cache.
+        self.cacheKeys = []
+        self.cachedMeta = None
+
     def __enter__(self):
         self.workDir = tempfile.mkdtemp()
         return self
@@ -74,18 +189,126 @@ class Downloader(object):
         meta = self.meta()
         return runDir, meta
 
-    def extract(self):
-        tar = tarfile.open(self.tarFile)
+    def fetchArchive(self, url, key, immutable=False):
+        """
+        Download and extract an archive using the download cache.
+
+        key identifies the archive in the cache.  If immutable is True, a
+        cached copy is used without contacting the server.  Otherwise, the
+        request includes the ETag of the cached copy, if any, so that the
+        server can respond with 304 (Not Modified).
+
+        Returns the directory containing the Dockerfile or chute
+        configuration file.
+        """
+        cache = download_cache.get_cache()
+
+        entry = None
+        if cache is not None:
+            entry = cache.lookup(key)
+            self.cacheKeys.append(key)
+
+        if entry is not None and immutable:
+            return self.extractCached(entry)
+
+        headers = []
+        if entry is not None and entry['etag'] is not None:
+            headers.append("If-None-Match: {}".format(entry['etag']))
+        conn = self._create_curl_conn(url, headers)
+
+        if cache is not None:
+            output = cache.newTempFile()
+        else:
+            output = open(os.path.join(self.workDir, "source.tar"), "wb")
+        self.tarFile = output.name
+
+        receiver = ArchiveReceiver(output, self.extract)
+        conn.setopt(pycurl.HEADERFUNCTION, receiver.header)
+        conn.setopt(pycurl.WRITEFUNCTION, receiver.write)
+
+        try:
+            try:
+                conn.perform()
+            finally:
+                output.close()
+
+            http_code = conn.getinfo(pycurl.HTTP_CODE)
+            if http_code == 304 and entry is not None:
+                receiver.finish()
+                if cache is not None:
+                    os.remove(output.name)
+                return self.extractCached(entry)
+
+            if http_code != 200:
+                raise Exception("Error downloading archive: response {}".format(http_code))
+
+            runDir = receiver.finish()
+        except Exception:
+            try:
+                receiver.finish()
+            except Exception:
+                pass
+            if cache is not None and os.path.exists(output.name):
+                os.remove(output.name)
+            raise
+
+        if cache is not None:
+            self.tarFile = cache.store(key, receiver.digest.hexdigest(),
+                    output.name, etag=receiver.etag)
+
+        return runDir
+
+    def extractCached(self, entry):
+        """
+        Extract an archive from the download cache.
+        """
+        self.tarFile = entry['path']
+        self.cachedMeta = entry.get('meta', None)
+        return self.extract()
+
+    def cacheMeta(self, meta):
+        """
+        Save meta data with the cached archive.
+        """
+        cache = download_cache.get_cache()
+        if cache is not None:
+            for key in self.cacheKeys:
+                cache.update(key, meta=meta)
+
+    def extract(self, fileobj=None):
+        """
+        Extract the archive to the work directory in a single pass.
+
+        The archive is read from fileobj as a stream if it is given, or from
+        self.tarFile otherwise.  Each member is checked for dangerous paths
+        (.. or /) before it is written, and its path and link target are
+        resolved against the links already extracted to make sure they stay
+        inside the work directory.
+        """
+        root = os.path.realpath(self.workDir)
+
+        if fileobj is None:
+            tar = tarfile.open(self.tarFile)
+        else:
+            tar = tarfile.open(fileobj=fileobj, mode="r|*")
 
         # Look for a Dockerfile and also check for dangerous paths (.. or /).
         runPath = None
         for member in tar:
             path = os.path.normpath(member.name)
-            if path.startswith(".."):
-                raise Exception("Archive contains a forbidden path: {}".format(path))
-            elif os.path.isabs(path):
-                raise Exception("Archive contains an absolute path: {}".format(path))
-            elif path.endswith(settings.CHUTE_CONFIG_FILE):
+            checkArchivePath(path)
+            checkExtractPath(root, path)
+
+            # Links must not point outside of the work directory either.
+            if member.issym():
+                target = os.path.join(os.path.dirname(path), member.linkname)
+                checkArchivePath(os.path.normpath(target))
+                checkExtractPath(root, target)
+            elif member.islnk():
+                checkArchivePath(os.path.normpath(member.linkname))
+                checkExtractPath(root, member.linkname)
+
+            if path.endswith(settings.CHUTE_CONFIG_FILE):
                 runPath = path
             elif path.endswith("Dockerfile"):
                 runPath = path
@@ -94,7 +317,9 @@ class Downloader(object):
                 if match is not None:
                     self.commitHash = match.group(1)
 
-        tar.extractall(path=self.workDir)
+            tar.extract(member, path=self.workDir)
+
+        tar.close()
 
         if runPath is None:
             raise Exception("Repository does not contain {} or Dockerfile".format(
@@ -153,11 +378,11 @@ class GithubDownloader(Downloader):
             # Interpret None or empty string as the default, "master".
             self.checkout = "master"
 
-    def _create_curl_conn(self, url):
+    def _create_curl_conn(self, url, headers=[]):
         """
         Create a cURL connection object with useful default settings.
         """
-        headers = []
+        headers = list(headers)
         if self.user is not None and self.secret is not None:
             b64cred = base64.b64encode("{}:{}".format(self.user, self.secret))
             headers.append("Authorization: Basic {}".format(b64cred))
@@ -174,26 +399,34 @@ class GithubDownloader(Downloader):
 
         return conn
 
+    def cacheKey(self, checkout):
+        key = "github:{}/{}@{}".format(self.repo_owner, self.repo_name,
+                                       checkout)
+
+        # Private downloads are cached separately for each user.
+        if self.secret is not None:
+            key += "#{}".format(self.user)
+
+        return key
+
     def download(self):
         url = "https://github.com/{}/{}/tarball/{}".format(
                 self.repo_owner, self.repo_name, self.checkout)
-        conn = self._create_curl_conn(url)
-
-        self.tarFile = os.path.join(self.workDir, "source.tar.gz")
-        with open(self.tarFile, "w") as output:
-            conn.setopt(pycurl.WRITEFUNCTION, output.write)
-            conn.perform()
 
-        http_code = conn.getinfo(pycurl.HTTP_CODE)
-        if http_code != 200:
-            raise Exception("Error downloading archive: response {}".format(http_code))
-
-        return self.extract()
+        # A commit never changes, so if we have it, we can skip the request.
+        # Only a full hash is certain to name a commit rather than a branch
+        # or tag.
+        key = self.cacheKey(self.checkout)
+        immutable = commit_re.match(self.checkout) is not None
+        return self.fetchArchive(url, key, immutable=immutable)
 
     def meta(self):
         """
         Return repository meta data as a dictionary.
         """
+        if self.cachedMeta is not None:
+            return self.cachedMeta
+
         result = {}
 
         if self.commitHash is not None:
@@ -222,15 +455,27 @@ class GithubDownloader(Downloader):
             result['Commit'] = data['commit']
             result['CommitMessage'] = data['commit']['message']
 
+            # Also remember the archive under the full hash of the commit
+            # that the branch or tag pointed to.
+            sha = data.get('sha', None)
+            if sha is not None and sha != self.checkout and \
+                    len(self.cacheKeys) > 0:
+                cache = download_cache.get_cache()
+                if cache is not None:
+                    cache.alias(self.cacheKey(sha), self.cacheKeys[0])
+                    self.cacheKeys.append(self.cacheKey(sha))
+
+            self.cacheMeta(result)
+
         return result
 
 
 class WebDownloader(Downloader):
-    def _create_curl_conn(self, url):
+    def _create_curl_conn(self, url, headers=[]):
         """
         Create a cURL connection object with useful default settings.
         """
-        headers = []
+        headers = list(headers)
         if self.user is not None and self.secret is not None:
             b64cred = base64.b64encode("{}:{}".format(self.user, self.secret))
             headers.append("Authorization: Basic {}".format(b64cred))
@@ -248,18 +493,12 @@ class WebDownloader(Downloader):
         return conn
 
     def download(self):
-        conn = self._create_curl_conn(self.url)
-
-        self.tarFile = os.path.join(self.workDir, "source.tar")
-        with open(self.tarFile, "w") as output:
-            conn.setopt(pycurl.WRITEFUNCTION, output.write)
-            conn.perform()
+        # Private downloads are cached separately for each user.
+        key = "url:{}".format(self.url)
+        if self.user is not None:
+            key += "#{}".format(self.user)
 
-        http_code = conn.getinfo(pycurl.HTTP_CODE)
-        if http_code != 200:
-            raise Exception("Error downloading archive: response {}".format(http_code))
-
-        return self.extract()
+        return self.fetchArchive(self.url, key)
 
     def meta(self):
         """
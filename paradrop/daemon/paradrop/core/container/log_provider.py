@@ -1,96 +1,192 @@
 '''
 Provides messages from container logs (STDOUT and STDERR).
 '''
-import os
-import signal
+import collections
+import threading
 
 import docker
 import six
 
-from multiprocessing import Process, Queue
+from twisted.internet import reactor
 
+from paradrop.base.output import out
 
-def monitor_logs(service_name, container_name, queue, tail=200):
+
+# Number of recent lines to request from Docker and to keep for new
+# subscribers.
+LOG_HISTORY = 200
+
+
+def parse_log_line(service_name, line):
+    """
+    Convert a line from a Docker log stream into a message dictionary.
+
+    Returns None if the line is not in a recognized format.
     """
-    Iterate over log messages from a container and add them to the queue
-    for consumption.  This function will block and wait for new messages
-    from the container.  Use the queue to interface with async code.
+    if six.PY3 and isinstance(line, bytes):
+        line = line.decode('utf-8', 'replace')
 
-    tail: number of lines to retrieve from log history; the string "all"
-    is also valid, but highly discouraged for performance reasons.
+    # I have grown to distrust Docker streaming functions.  It may
+    # return a string; it may return an object.  If it is a string,
+    # separate the timestamp portion from the rest of the message.
+    if isinstance(line, six.string_types):
+        parts = line.split(" ", 1)
+        if len(parts) > 1:
+            return {
+                'service': service_name,
+                'timestamp': parts[0],
+                'message': parts[1].rstrip()
+            }
+
+        else:
+            return {
+                'service': service_name,
+                'message': line.rstrip()
+            }
+    elif isinstance(line, dict):
+        line['service'] = service_name
+        return line
+
+    return None
+
+
+class LogHub(object):
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
-    container = client.containers.get(container_name)
-    output = container.logs(stdout=True, stderr=True,
-                            stream=True, timestamps=True, follow=True,
-                            tail=tail)
-    for line in output:
-        # I have grown to distrust Docker streaming functions.  It may
-        # return a string; it may return an object.  If it is a string,
-        # separate the timestamp portion from the rest of the message.
-        if isinstance(line, six.string_types):
-            parts = line.split(" ", 1)
-            if len(parts) > 1:
-                queue.put({
-                    'service': service_name,
-                    'timestamp': parts[0],
-                    'message': parts[1].rstrip()
-                })
-
-            else:
-                queue.put({
-                    'service': service_name,
-                    'message': line.rstrip()
-                })
-        elif isinstance(line, dict):
-            line['service'] = service_name
-            queue.put(line)
-
-class LogProvider(object):
-    def __init__(self, chute):
+    Share one tail of a chute's container logs among many subscribers.
+
+    Each service's container is followed once, by a single thread, no matter
+    how many subscribers there are.  New lines are delivered to subscribers
+    on the reactor thread as soon as they arrive, and a bounded buffer of
+    recent lines is replayed to each new subscriber.
+
+    Use the module-level subscribe and unsubscribe functions rather than
+    creating instances directly.  The tail stops when the last subscriber
+    leaves.
+    """
+    def __init__(self, chute, history=LOG_HISTORY):
         self.chute = chute
-        self.queue = Queue()
-        self.listening = False
-        self.processes = []
+        self.history = history
+        self.recent = collections.deque(maxlen=history)
+        self.subscribers = []
+        self.streams = []
+        self.threads = []
+        self.running = False
+
+        # Incremented each time we start tailing so that threads left over
+        # from a previous start know to exit.
+        self.generation = 0
 
-    def attach(self):
+    def subscribe(self, callback):
         """
-        Start listening for log messages.
-
-        Log messages in the queue will appear like the following:
-        {
-            'service': 'main',
-            'timestamp': '2017-01-30T15:46:23.009397536Z',
-            'message': 'Something happened'
-        }
+        Add a subscriber.
+
+        callback: function that takes a message dictionary.  It is called for
+        each buffered message immediately and then for each new message.
         """
-        if not self.listening:
-            for service in self.chute.get_services():
-                process = Process(target=monitor_logs,
-                        args=(service.name, service.get_container_name(), self.queue))
-                process.start()
-                self.processes.append(process)
-            self.listening = True
-
-    def get_logs(self):
-        logs = []
-        while not self.queue.empty():
-            msg = self.queue.get()
-            logs.append(msg)
-        return logs
-
-    def detach(self):
+        for msg in list(self.recent):
+            callback(msg)
+        self.subscribers.append(callback)
+
+        if not self.running:
+            self.start()
+
+    def unsubscribe(self, callback):
+        """
+        Remove a subscriber and stop tailing when none remain.
+
+        Returns the number of remaining subscribers.
         """
-        Stop listening for log messages.
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+        if len(self.subscribers) == 0:
+            self.stop()
+        return len(self.subscribers)
 
-        After this is called, no additional messages will be added to the
-        queue.
+    def publish(self, msg):
+        """
+        Deliver a message to all subscribers (called on the reactor thread).
         """
-        if self.listening:
-            # We have to kill the process explicitly with SIGKILL,
-            # terminate() function does not work here.
-            for process in self.processes:
-                os.kill(process.pid, signal.SIGKILL)
-
-            self.processes = []
-            self.listening = False
+        self.recent.append(msg)
+        for callback in list(self.subscribers):
+            try:
+                callback(msg)
+            except Exception as error:
+                out.warn("Error delivering chute log message: {}".format(error))
+
+    def start(self):
+        self.running = True
+        self.generation += 1
+        self.recent.clear()
+        for service in self.chute.get_services():
+            thread = threading.Thread(target=self._follow,
+                    args=(service.name, service.get_container_name(),
+                          self.generation))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+
+        # Closing the stream (supported by newer Docker clients) wakes up the
+        # thread blocked on it.  Otherwise, the thread exits after the next
+        # line arrives.
+        for stream in self.streams:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+
+        self.streams = []
+        self.threads = []
+
+    def _follow(self, service_name, container_name, generation):
+        try:
+            client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+            container = client.containers.get(container_name)
+            stream = container.logs(stdout=True, stderr=True,
+                                    stream=True, timestamps=True, follow=True,
+                                    tail=self.history)
+            self.streams.append(stream)
+
+            for line in stream:
+                if not self.running or generation != self.generation:
+                    break
+                msg = parse_log_line(service_name, line)
+                if msg is not None:
+                    reactor.callFromThread(self.publish, msg)
+        except Exception as error:
+            if self.running:
+                out.warn("Error following logs for {}: {}".format(
+                    container_name, error))
+
+
+# Map chute name -> LogHub for chutes with at least one subscriber.
+hubs = dict()
+
+
+def subscribe(chute, callback):
+    """
+    Subscribe to log messages from a chute's containers.
+
+    Must be called from the reactor thread.  Returns the LogHub.
+    """
+    hub = hubs.get(chute.name, None)
+    if hub is None:
+        hub = LogHub(chute)
+        hubs[chute.name] = hub
+    hub.subscribe(callback)
+    return hub
+
+
+def unsubscribe(chute, callback):
+    """
+    Unsubscribe from a chute's log messages.
+
+    Must be called from the reactor thread.
+    """
+    hub = hubs.get(chute.name, None)
+    if hub is not None and hub.unsubscribe(callback) == 0:
+        del hubs[chute.name]
@@ -0,0 +1,130 @@
+"""
+Configure chute network interfaces over netlink.
+
+This is an in-process alternative to running `ip` commands through
+subprocesses and `nsenter`.  It uses pyroute2 when it is installed and
+enabled (NETLINK_INTERFACE_SETUP).  Callers should fall back to the
+command-based implementation in dockerapi if anything here fails.
+"""
+
+import random
+
+from paradrop.base import settings
+
+try:
+    from pyroute2 import IPRoute, NetNS
+except ImportError:
+    IPRoute = None
+    NetNS = None
+
+
+def available():
+    """
+    Check whether the netlink backend can be used.
+    """
+    return IPRoute is not None and settings.NETLINK_INTERFACE_SETUP
+
+
+class NetlinkSession(object):
+    """
+    Netlink sockets for the host and container namespaces.
+
+    A session is meant to be used for one setup or cleanup pass so that the
+    sockets, particularly the ones for container namespaces, are opened once
+    and shared by all of the interfaces belonging to a chute.
+    """
+    def __init__(self):
+        self.host = IPRoute()
+        self.namespaces = {}
+
+    def close(self):
+        for ns in self.namespaces.values():
+            ns.close()
+        self.namespaces = {}
+        self.host.close()
+
+    def namespace(self, pid):
+        """
+        Get a netlink socket for the network namespace of a process.
+        """
+        if pid not in self.namespaces:
+            self.namespaces[pid] = NetNS("/proc/{}/ns/net".format(pid))
+        return self.namespaces[pid]
+
+    def add_macvlan(self, pid, externalIntf, internalIntf, ipaddrWithPrefix):
+        """
+        Create a macvlan interface on externalIntf and give it to the process
+        namespace as internalIntf with the given address.
+
+        If anything fails, the new interface is removed before the exception
+        is raised again.
+        """
+        address, prefixlen = ipaddrWithPrefix.split('/')
+
+        # Generate a temporary interface name.  It just needs to be unique.
+        # We will rename to the internalIntf name as soon as the interface is
+        # inside the chute.
+        tmpIntf = "tmp{:x}".format(random.getrandbits(32))
+
+        ns = self.namespace(pid)
+        parent = lookup_link(self.host, externalIntf)
+        self.host.link('add', ifname=tmpIntf, kind='macvlan', link=parent,
+                macvlan_mode='bridge')
+
+        # Track where the new interface is and what it is called so that we
+        # can remove it if something fails.
+        owner = self.host
+        name = tmpIntf
+        try:
+            index = lookup_link(self.host, tmpIntf)
+            self.host.link('set', index=index, net_ns_pid=pid)
+
+            owner = ns
+            index = lookup_link(owner, tmpIntf)
+            owner.link('set', index=index, ifname=internalIntf)
+            name = internalIntf
+
+            owner.addr('add', index=index, address=address,
+                    prefixlen=int(prefixlen))
+            owner.link('set', index=index, state='up')
+        except Exception:
+            indices = owner.link_lookup(ifname=name)
+            if len(indices) > 0:
+                owner.link('del', index=indices[0])
+            raise
+
+    def rename_link(self, pid, oldName, newName, state):
+        """
+        Rename an interface inside the process namespace and set its state
+        ("up" or "down").
+        """
+        ns = self.namespace(pid)
+        index = lookup_link(ns, oldName)
+
+        # Interfaces can only be renamed while they are down.
+        if state == 'up':
+            ns.link('set', index=index, ifname=newName)
+            ns.link('set', index=index, state='up')
+        else:
+            ns.link('set', index=index, state='down')
+            ns.link('set', index=index, ifname=newName)
+
+    def return_link(self, pid, internalIntf, externalIntf):
+        """
+        Bring an interface down, rename it, and move it from the process
+        namespace back to the host namespace.
+        """
+        ns = self.namespace(pid)
+        index = lookup_link(ns, internalIntf)
+        ns.link('set', index=index, state='down')
+        ns.link('set', index=index, ifname=externalIntf, net_ns_pid=1)
+
+
+def lookup_link(ipr, ifname):
+    """
+    Return the index of the named interface or raise an exception.
+    """
+    indices = ipr.link_lookup(ifname=ifname)
+    if len(indices) == 0:
+        raise Exception("Interface {} not found".format(ifname))
+    return indices[0]
@@ -82,8 +82,8 @@ def generatePlans(update):
         update.plans.addPlans(plangraph.TELEMETRY_SERVICE,
                               (services.configure_telemetry, ))
 
-        # Reload configuration files
-        todoPlan = (configservice.reloadAll, )
+        # Reload configuration files that were changed by this update
+        todoPlan = (configservice.reloadChanged, )
         update.plans.addPlans(plangraph.RUNTIME_RELOAD_CONFIG, todoPlan)
 
         # Reload configuration files if aborting.  This needs to happen at the
@@ -33,8 +33,8 @@ def generatePlans(update):
     abtPlan = (dhcp.revert_dhcp_settings, )
     update.plans.addPlans(plangraph.RUNTIME_SET_VIRT_DHCP, todoPlan, abtPlan)
 
-    # Reload configuration files
-    todoPlan = (configservice.reloadAll, )
+    # Reload configuration files that were changed by this update
+    todoPlan = (configservice.reloadChanged, )
     update.plans.addPlans(plangraph.RUNTIME_RELOAD_CONFIG, todoPlan)
 
     # Reload configuration files if aborting.  This needs to happen at the
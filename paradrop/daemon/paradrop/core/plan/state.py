@@ -3,6 +3,7 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+from paradrop.base import settings
 from paradrop.base.output import out
 from paradrop.core.chute.chute import Chute
 from paradrop.core.config import state
@@ -102,11 +103,22 @@ def generate_service_plans(update):
 
     This needs to happen after the chute configuration has been parsed.
     """
-    for service in update.new.get_services():
+    services = update.new.get_services()
+
+    # Prepare the images for all services together so that they can be pulled
+    # or built in parallel.
+    parallel = len(services) > 1 and settings.IMAGE_PREPARE_CONCURRENCY > 1
+    if parallel and update.updateType in ["create", "update"]:
+        update.plans.addPlans(plangraph.STATE_BUILD_IMAGE,
+                              (dockerapi.prepare_images, services),
+                              [(dockerapi.remove_image, s) for s in services])
+
+    for service in services:
         if update.updateType in ["create", "update"]:
-            update.plans.addPlans(plangraph.STATE_BUILD_IMAGE,
-                                  (dockerapi.prepare_image, service),
-                                  (dockerapi.remove_image, service))
+            if not parallel:
+                update.plans.addPlans(plangraph.STATE_BUILD_IMAGE,
+                                      (dockerapi.prepare_image, service),
+                                      (dockerapi.remove_image, service))
 
             update.plans.addPlans(plangraph.STATE_CHECK_IMAGE,
                                   (dockerapi.check_image, service))
@@ -0,0 +1,154 @@
+"""
+Registry of facts about the node that rarely change.
+
+Hardware and software information such as the board name, wireless devices,
+BIOS and OS versions takes dozens of small file reads and a package lookup
+to collect.  The registry computes each group of facts the first
+time it is needed and keeps the result, along with its JSON encoding and an
+ETag, until the group is invalidated.
+
+The hardware group is invalidated when the device inventory sees a device
+change (and expires after DEVICE_INVENTORY_MAX_AGE in case an event was
+missed), and the software group is invalidated after a snap update.
+"""
+
+import copy
+import hashlib
+import json
+import platform
+import threading
+import time
+
+from psutil import virtual_memory
+
+from paradrop.base import settings
+from paradrop.core.config import devices
+from paradrop.lib.utils import pdos
+from . import system_info
+
+
+class NodeFacts(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # group -> (compute function, max age in seconds or None)
+        self.providers = {}
+
+        # group -> cache entry (facts, body, etag, time)
+        self.cache = {}
+
+        # Incremented when any group is invalidated so that facts computed
+        # during an invalidation are not stored.
+        self.generation = 0
+
+    def register(self, group, compute, maxAge=None):
+        """
+        Register a function that returns a dictionary of facts.
+        """
+        with self.lock:
+            self.providers[group] = (compute, maxAge)
+            self.cache.pop(group, None)
+
+    def get(self, group):
+        """
+        Return a copy of the facts in a group.
+        """
+        return copy.deepcopy(self._lookup(group)['facts'])
+
+    def getJSON(self, group):
+        """
+        Return the facts in a group encoded as JSON and the ETag of the
+        encoding.
+        """
+        entry = self._lookup(group)
+        return entry['body'], entry['etag']
+
+    def invalidate(self, group=None):
+        """
+        Discard the cached facts of a group or all groups.
+        """
+        with self.lock:
+            self.generation += 1
+            if group is None:
+                self.cache = {}
+            else:
+                self.cache.pop(group, None)
+
+    def _lookup(self, group):
+        with self.lock:
+            compute, maxAge = self.providers[group]
+            entry = self.cache.get(group, None)
+            if entry is not None and (maxAge is None or
+                    time.time() < entry['time'] + maxAge):
+                return entry
+            generation = self.generation
+
+        facts = compute()
+        body = json.dumps(facts, sort_keys=True)
+        entry = {
+            'facts': facts,
+            'body': body,
+            'etag': makeETag(body),
+            'time': time.time()
+        }
+
+        with self.lock:
+            if generation == self.generation:
+                self.cache[group] = entry
+        return entry
+
+
+def makeETag(body):
+    """
+    Make a strong entity tag for a response body.
+    """
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    return '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+
+def getHardwareFacts():
+    board = pdos.read_sys_file('/sys/devices/virtual/dmi/id/product_name', default='') \
+            + ' ' + pdos.read_sys_file('/sys/devices/virtual/dmi/id/product_version', default='')
+
+    wifi = []
+    for wifiDev in devices.detectSystemDevices()['wifi']:
+        # Skip unusual devices that are missing the id field.
+        if 'id' not in wifiDev:
+            continue
+
+        wifi.append({
+            'id': wifiDev['id'],
+            'macAddr': wifiDev['mac'],
+            'vendorId': wifiDev['vendor'],
+            'deviceId': wifiDev['device'],
+            'slot': wifiDev['slot']
+        })
+
+    return {
+        'vendor': pdos.read_sys_file('/sys/devices/virtual/dmi/id/sys_vendor'),
+        'board': board,
+        'cpu': platform.processor(),
+        'memory': virtual_memory().total,
+        'wifi': wifi
+    }
+
+
+def getSoftwareFacts():
+    return {
+        'biosVendor': pdos.read_sys_file('/sys/devices/virtual/dmi/id/bios_vendor'),
+        'biosVersion': pdos.read_sys_file('/sys/devices/virtual/dmi/id/bios_version'),
+        'biosDate': pdos.read_sys_file('/sys/devices/virtual/dmi/id/bios_date'),
+        'kernelVersion': platform.system() + '-' + platform.release(),
+        'osVersion': system_info.getOSVersion(),
+        'pdVersion': system_info.getPackageVersion('paradrop')
+    }
+
+
+facts = NodeFacts()
+facts.register('hardware', getHardwareFacts,
+               maxAge=settings.DEVICE_INVENTORY_MAX_AGE)
+facts.register('software', getSoftwareFacts)
+facts.register('dmi', system_info.getDMI)
+
+devices.inventory.addListener(lambda: facts.invalidate('hardware'))
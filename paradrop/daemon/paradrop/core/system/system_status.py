@@ -136,7 +136,7 @@ class SystemStatus(object):
 
         stats = psutil.net_if_stats()
         for key, value in six.iteritems(stats):
-            interfaces[key] = value.__dict__
+            interfaces[key] = value._asdict()
             interfaces[key]['addresses'] = []
             interfaces[key]['io_counters'] = None
 
@@ -146,14 +146,14 @@ class SystemStatus(object):
                 continue
 
             for addr in value:
-                interfaces[key]['addresses'].append(addr.__dict__)
+                interfaces[key]['addresses'].append(addr._asdict())
 
         traffic = psutil.net_io_counters(pernic=True)
         for key, value in six.iteritems(traffic):
             if key not in interfaces:
                 continue
 
-            interfaces[key]['io_counters'] = value.__dict__
+            interfaces[key]['io_counters'] = value._asdict()
 
         return interfaces
 
@@ -163,10 +163,10 @@ class SystemStatus(object):
         with proc.oneshot():
             proc_info = {
                 'cpu_num': proc.cpu_num(),
-                'cpu_times': proc.cpu_times().__dict__,
+                'cpu_times': proc.cpu_times()._asdict(),
                 'create_time': proc.create_time(),
-                'memory_info': proc.memory_info().__dict__,
-                'num_ctx_switches': proc.num_ctx_switches().__dict__,
+                'memory_info': proc.memory_info()._asdict(),
+                'num_ctx_switches': proc.num_ctx_switches()._asdict(),
                 'num_threads': proc.num_threads()
             }
         return proc_info
@@ -176,13 +176,13 @@ class SystemStatus(object):
         system = {
             'boot_time': psutil.boot_time(),
             'cpu_count': psutil.cpu_count(),
-            'cpu_stats': psutil.cpu_stats().__dict__,
-            'cpu_times': [k.__dict__ for k in psutil.cpu_times(percpu=True)],
-            'disk_io_counters': psutil.disk_io_counters().__dict__,
+            'cpu_stats': psutil.cpu_stats()._asdict(),
+            'cpu_times': [k._asdict() for k in psutil.cpu_times(percpu=True)],
+            'disk_io_counters': psutil.disk_io_counters()._asdict(),
             'disk_usage': [],
-            'net_io_counters': psutil.net_io_counters().__dict__,
-            'swap_memory': psutil.swap_memory().__dict__,
-            'virtual_memory': psutil.virtual_memory().__dict__
+            'net_io_counters': psutil.net_io_counters()._asdict(),
+            'swap_memory': psutil.swap_memory()._asdict(),
+            'virtual_memory': psutil.virtual_memory()._asdict()
         }
 
         partitions = psutil.disk_partitions()
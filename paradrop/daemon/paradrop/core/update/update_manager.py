@@ -3,6 +3,7 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+import collections
 import time
 import threading
 from twisted.internet import defer, threads
@@ -16,6 +17,13 @@ from paradrop.core.chute.restart import reloadChutes
 
 from . import update_object
 
+# Number of completed changes to remember for the changes API.
+COMPLETED_CHANGES_HISTORY = 32
+
+# The worker thread wakes up at least this often (in seconds) to check
+# whether the reactor is still running.
+WAIT_TIMEOUT = 5
+
 
 class UpdateManager:
 
@@ -34,9 +42,17 @@ class UpdateManager:
         self.updateLock = threading.Lock()
         self.updateQueue = []
 
+        # Signalled whenever an update is added to the queue, so that the
+        # worker thread wakes up immediately instead of polling.
+        self.updateCondition = threading.Condition(self.updateLock)
+
         # Map update_id -> update object.
         self.active_changes = {}
 
+        # Recently completed changes (change_id -> update object), oldest
+        # first, so that their results and timing can still be retrieved.
+        self.completed_changes = collections.OrderedDict()
+
         # TODO: Ideally, load this from file so that change IDs are unique
         # across system reboots.
         self.next_change_id = 1
@@ -47,23 +63,42 @@ class UpdateManager:
         # it makes blocking calls and such... so if we *don't* use callInThread
         # then this function WILL BLOCK THE MAIN EVENT LOOP (ie. you cannot send any data)
         #
-        # FIXME: It should be noted that calling updateLock.acquire(), e.g.
-        # from add_update, also blocks the main thread.  Synchronizing access
-        # to the work queue should be reworked.
+        # The lock is only held briefly to push or pop the queue, so calling
+        # add_update from the main thread does not block it for long.
         ###########################################################################################
         self.reactor.callInThread(self._perform_updates)
 
-    def _get_next_update(self):
+    def _enqueue_updates(self, updates):
         """MUTEX: updateLock
-            Returns the size of the local update queue.
+            Append updates to the work queue and wake up the worker thread.
         """
-        self.updateLock.acquire()
-        if(len(self.updateQueue) > 0):
-            # Get first available
-            a = self.updateQueue.pop(0)
-        else:
-            a = None
-        self.updateLock.release()
+        now = time.time()
+        with self.updateCondition:
+            for update in updates:
+                update.queuedTime = now
+                self.updateQueue.append(update)
+            self.updateCondition.notify()
+
+    def _get_next_update(self, timeout=None):
+        """MUTEX: updateLock
+            Returns the next update from the queue or None.
+
+            If timeout is given, wait up to that many seconds for an update
+            to be added to an empty queue.
+        """
+        with self.updateCondition:
+            if len(self.updateQueue) == 0 and timeout is not None:
+                self.updateCondition.wait(timeout)
+
+            if(len(self.updateQueue) > 0):
+                # Get first available
+                a = self.updateQueue.pop(0)
+            else:
+                return None
+
+        if a.queuedTime is not None:
+            a.queueWait += time.time() - a.queuedTime
+            a.queuedTime = None
         return a
 
     def clear_update_list(self):
@@ -93,9 +128,7 @@ class UpdateManager:
         # Convert to Update object before storing.
         updateObj = update_object.parse(update)
 
-        self.updateLock.acquire()
-        self.updateQueue.append(updateObj)
-        self.updateLock.release()
+        self._enqueue_updates([updateObj])
 
         return d
 
@@ -110,7 +143,7 @@ class UpdateManager:
                 "value": network
             })
 
-        self.updateQueue.append(update)
+        self._enqueue_updates([update])
 
     def assign_change_id(self):
         """
@@ -124,18 +157,19 @@ class UpdateManager:
 
     def find_change(self, change_id):
         """
-        Search active and queued changes for the requested change.
+        Search active, queued, and recently completed changes for the
+        requested change.
 
         Returns an Update object or None.
         """
         if change_id in self.active_changes:
             return self.active_changes[change_id]
 
-        for update in self.updateQueue:
+        for update in list(self.updateQueue):
             if update.change_id == change_id:
                 return update
 
-        return None
+        return self.completed_changes.get(change_id, None)
 
     def _make_router_update(self, updateType):
         """
@@ -172,18 +206,17 @@ class UpdateManager:
         # add any chutes that should already be running to the front of the
         # update queue before processing any updates
         startQueue = reloadChutes()
-        self.updateLock.acquire()
-        self.updateQueue.append(self._make_router_update("prehostconfig"))
-        self.updateQueue.append(self._make_router_update("inithostconfig"))
-        self.updateQueue.extend(startQueue)
-        self.updateLock.release()
+        self._enqueue_updates([
+            self._make_router_update("prehostconfig"),
+            self._make_router_update("inithostconfig")
+        ] + list(startQueue))
 
         # Always perform this work
         while self.reactor.running:
-            # Check for new updates
-            change = self._get_next_update()
+            # Wait for new updates.  add_update and resumed updates wake us
+            # up immediately.
+            change = self._get_next_update(timeout=WAIT_TIMEOUT)
             if change is None:
-                time.sleep(1)
                 continue
 
             self._perform_update(change)
@@ -233,11 +266,21 @@ class UpdateManager:
                 # if the build was successful or throws an exception. That
                 # should work but is not very general.
                 def resume(result):
-                    self.updateQueue.append(update)
+                    self._enqueue_updates([update])
                 result.addBoth(resume)
             elif update.change_id in self.active_changes:
-                # Update is done, so remove it from the active list.
+                # Update is done, so move it from the active list to the
+                # history.
                 del self.active_changes[update.change_id]
+                self._record_completed(update)
 
         except Exception as e:
             out.exception(e, True)
+
+    def _record_completed(self, update):
+        """
+        Remember a completed change for later retrieval.
+        """
+        self.completed_changes[update.change_id] = update
+        while len(self.completed_changes) > COMPLETED_CHANGES_HISTORY:
+            self.completed_changes.popitem(last=False)
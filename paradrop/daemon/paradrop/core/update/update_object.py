@@ -79,6 +79,12 @@ class UpdateObject(object):
         # Save a timestamp from when the update object was created.
         self.createdTime = time.time()
 
+        # Set by the update manager when the update is placed in the work
+        # queue.  Time spent waiting in the queue (including after resuming
+        # from a yield) is accumulated in queueWait.
+        self.queuedTime = None
+        self.queueWait = 0.0
+
         # Set to True if this update is delegated to an external program (e.g.
         # pdinstall).  In that case, the external program will be responsible
         # for reporting on the completion status of the update.
@@ -95,6 +101,10 @@ class UpdateObject(object):
         # configuration change.
         self.cache = {}
 
+        # Paths of system configuration (UCI) files written by this update.
+        # Only these files need to be reloaded by pdconfd.
+        self.changedConfigFiles = set()
+
         # Set by the execute function on the first call and used to detect
         # whether its new or has been resumed.
         self.execute_called = False
@@ -275,6 +285,35 @@ class UpdateObject(object):
         self.complete(success=True, message='Chute {} {} success'.format(
             self.name, self.updateType))
 
+    def get_timing(self):
+        """
+        Return timestamps and latency measurements for this update.
+
+        Values are None for stages that have not been reached yet.
+        """
+        created = self.createdTime
+        started = getattr(self, 'startTime', None)
+        completed = getattr(self, 'endTime', None)
+
+        result = {
+            'created': created,
+            'started': started,
+            'completed': completed,
+            'queue_wait': self.queueWait,
+            'start_latency': None,
+            'run_time': None,
+            'total_time': None
+        }
+
+        if started is not None:
+            result['start_latency'] = started - created
+        if completed is not None:
+            result['total_time'] = completed - created
+            if started is not None:
+                result['run_time'] = completed - started
+
+        return result
+
     def add_message_observer(self, observer):
         for msg in self.messages:
             observer.on_message(msg)
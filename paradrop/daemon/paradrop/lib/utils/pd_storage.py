@@ -3,6 +3,7 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+import hashlib
 import os
 import pickle
 from twisted.internet.task import LoopingCall
@@ -26,8 +27,19 @@ class PDStorage(object):
             importAttr(): Takes a payload and returns the properly formatted data
             exportAttr(): Takes the data and returns a payload
             attrSaveable(): Returns True if we should save this attr
+
+        Saves are skipped when the serialized data has not changed since the
+        last save, so the timer does not cause needless writes to flash.
+        Implementers that count their changes can also override
+        getGeneration() so that unchanged data are not even serialized.
     """
 
+    # Digest of the last payload written to disk.
+    savedDigest = None
+
+    # Generation (see getGeneration) of the last payload written to disk.
+    savedGeneration = None
+
     def __init__(self, filename, saveTimer):
         self.filename = filename
         self.saveTimer = saveTimer
@@ -60,30 +72,85 @@ class PDStorage(object):
 
         return False
 
-    def saveToDisk(self):
-        """Saves the data to disk."""
-        out.info('Saving to disk (%s)\n' % (self.filename))
+    def saveToDisk(self, force=False):
+        """
+        Saves the data to disk.
+
+        The file is replaced atomically.  If force is False, the write is
+        skipped when the data have not changed since the last save.
 
+        Returns True if the file was written.
+        """
         # Make sure they want to save
         if(not self.attrSaveable()):
-            return
+            return False
+
+        generation = self.getGeneration()
+        if not force and generation is not None and \
+                generation == self.savedGeneration:
+            return False
 
         # Get whatever the data is
         pyld = self.exportAttr(self.getAttr())
 
-        # Write the file to disk, truncate if it exists
         try:
-            with open(self.filename, 'wb') as output:
-                pickle.dump(pyld, output)
+            data = pickle.dumps(pyld)
+        except Exception as e:
+            out.err('Error serializing data %s\n' % (str(e)))
+            return False
+
+        digest = hashlib.sha1(data).hexdigest()
+        if not force and digest == self.savedDigest:
+            self.savedGeneration = generation
+            return False
+
+        out.info('Saving to disk (%s)\n' % (self.filename))
+
+        # Write to a temporary file and rename it over the old one, so that a
+        # crash never leaves a partially written file.
+        tmpname = self.filename + ".tmp"
+        try:
+            with open(tmpname, 'wb') as output:
+                output.write(data)
+                output.flush()
                 os.fsync(output.fileno())
+            os.rename(tmpname, self.filename)
         except Exception as e:
             out.err('Error writing to disk %s\n' % (str(e)))
+            return False
+
+        self.savedDigest = digest
+        self.savedGeneration = generation
+        return True
+
+    def exportYaml(self, filename=None):
+        """
+        Write the data to a YAML file for human inspection.
+
+        This is only done on request.  The default filename is the storage
+        filename with ".yaml" appended.  Returns the filename, or None if the
+        file could not be written.
+        """
+        if filename is None:
+            filename = self.filename + ".yaml"
 
+        pyld = self.exportAttr(self.getAttr())
         try:
-            with open(self.filename + ".yaml", "w") as output:
+            with open(filename, "w") as output:
                 yaml.dump(pyld, output)
         except Exception as error:
             out.err("Error writing yaml file: {}".format(error))
+            return None
+
+        return filename
+
+    def getGeneration(self):
+        """
+        Return a number that changes whenever the data change, or None.
+
+        By default the data are always serialized and compared by digest.
+        """
+        return None
 
     def attrSaveable(self):
         """THIS SHOULD BE OVERRIDEN BY THE IMPLEMENTER."""
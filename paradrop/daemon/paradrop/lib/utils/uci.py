@@ -3,7 +3,10 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+import hashlib
+import json
 import os
+import threading
 
 import six
 
@@ -106,28 +109,25 @@ def getLineParts(line):
     return [" ".join(g) for g in groups]
 
 
-def chuteConfigsMatch(chutePre, chutePost):
-    """ Takes two lists of objects, and returns whether or not they are identical."""
-    # TODO - currently using a naive implementation by searching over the old configs and the new configs.
-    # Could improve if slow by keep track of matched configs on both sides, deleting from search space
-    # If any objects remain at the end
-    # loop through all old configs, check if they each have a match in the new configs
-    for c1 in chutePre:
-        for c2 in chutePost:
-            if (singleConfigMatches(c1, c2)):
-                break
-        else:
-            # We got through the loop without finding a match, so return false
-           return False
+def sectionDigest(config, options):
+    """
+    Compute a canonical hash of a (config, options) section.
 
-    for c2 in chutePost:
-        for c1 in chutePre:
-            if (singleConfigMatches(c1, c2)):
-                break
-        else:
-            return False
+    Two sections have the same digest if and only if they match according
+    to singleConfigMatches, i.e. they are equal after converting all values
+    to strings.
+    """
+    data = json.dumps(stringify([config, options]), sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
 
-    return True
+
+def chuteConfigsMatch(chutePre, chutePost):
+    """ Takes two lists of objects, and returns whether or not they are identical."""
+    # Every section on either side needs a match on the other side.
+    # Duplicates are not counted.
+    pre = set(sectionDigest(c, o) for c, o in chutePre)
+    post = set(sectionDigest(c, o) for c, o in chutePost)
+    return pre == post
 
 
 def isMatch(a, b):
@@ -223,7 +223,13 @@ class UCIConfig:
         if (not os.path.isfile(self.filepath)):
             open(self.filepath, 'a').close()
 
-        self.config = self.readConfig()
+        entry = store.load(self.filepath)
+        self.config = [copySection(section) for section in entry['sections']]
+
+        # Digest of each section in self.config, and the positions of each
+        # chute's sections, which is valid until self.config is modified.
+        self.digests = list(entry['digests'])
+        self.chutes = entry['chutes']
 
     def __eq__(self, o):
         if(self.filepath != o.filepath):
@@ -306,14 +312,7 @@ class UCIConfig:
 
     def existsConfig(self, config, options):
         """Tests if the (config, options) is in the current config file."""
-        # Search through the config array for matches
-        config = stringify(config)
-        options = stringify(options)
-        for e in self.config:
-            c, o = e
-            if(c == config and o == options):
-                return True
-        return False
+        return sectionDigest(config, options) in self.digests
 
     def addConfigs(self, configs):
         """ Adds a list of tuples to our config """
@@ -329,25 +328,23 @@ class UCIConfig:
 
     def addConfig(self, config, options):
         """Adds the tuple to our config."""
-        if (not self.existsConfig(config, options)):
+        digest = sectionDigest(config, options)
+        if digest not in self.digests:
             self.config.append((config, options))
+            self.digests.append(digest)
+            self.chutes = None
 
     def delConfig(self, config, options):
         """Finds a match to the config input and removes it from the internal config data structure."""
-        config = stringify(config)
-        options = stringify(options)
-
-        # Search through the config array for matches
-        for i, e in enumerate(self.config):
-            c, o = e
-            if(c == config and o == options):
-                break
-        else:
-            # Getting here means we didn't break so no match
+        digest = sectionDigest(config, options)
+        if digest not in self.digests:
             out.verbose('No match to delete, config: %r\n' % (config))
             return
 
+        i = self.digests.index(digest)
         del(self.config[i])
+        del(self.digests[i])
+        self.chutes = None
 
     def backup(self, backupToken):
         """
@@ -374,11 +371,16 @@ class UCIConfig:
                 pdos.copy(backupPath, self.filepath)
             else:
                 pdos.move(backupPath, self.filepath)
+            store.invalidate(self.filepath)
         else:
             # This might be ok if they didn't actually make any changes
             out.warn('Cannot restore, %s missing backup (might be OK if no changes made)\n' % (self.myname))
 
     def getChuteConfigs(self, internalid):
+        # Use the index from the store if we have not made changes.
+        if self.chutes is not None:
+            return [self.config[i] for i in self.chutes.get(internalid, [])]
+
         chuteConfigs = []
         for e in self.config:
             c, o = e
@@ -434,99 +436,208 @@ class UCIConfig:
             # Now add one extra newline before the next set
             output += "\n"
 
-        # Now write to disk
+        # Now write to disk.  Write to a temporary file in the same directory
+        # and rename it, so that readers never see a partially written file.
+        # The name starts with a dot so that pdconfd ignores it.
+        tmpPath = os.path.join(os.path.dirname(self.filepath),
+                               ".{}.tmp".format(self.myname))
         try:
             out.info('Saving %s to disk\n' % (self.filepath))
-            fd = pdos.open(self.filepath, 'w')
+            fd = pdos.open(tmpPath, 'w')
             fd.write(output)
 
             # Guarantee that its written to disk before we close
             fd.flush()
             os.fsync(fd.fileno())
             fd.close()
+
+            os.rename(tmpPath, self.filepath)
+            store.store(self.filepath, output.splitlines())
         except Exception as e:
             out.err('Unable to save new config %s, %s\n' % (self.filepath, str(e)))
-            out.err('Config may be corrupted, backup exists at /tmp/%s\n' % (self.myname))
+            out.err('Previous version remains, backup exists at %s\n' % (settings.UCI_BACKUP_DIR))
+            store.invalidate(self.filepath)
 
 
     def readConfig(self):
         """Reads in the config file."""
-        lines = []
+        entry = store.load(self.filepath)
+        return [copySection(section) for section in entry['sections']]
+
+
+def parseConfig(lines):
+    """
+    Parse the lines of a UCI file.
+
+    Returns a list of (config, options) tuples.
+    """
+    cfg = None
+    opt = None
+    data = []
+
+    # Now we have the data, deal with it
+    for line in lines:
+        line = line.strip()
+
+        # If comment ignore
+        if line.startswith('#'):
+            continue
+
+        l = getLineParts(line)
+
+        #
+        # Config
+        #
+        if(l[0] == 'config'):
+            # Save last config we had
+            if(cfg and opt):
+                data.append((cfg, opt))
+
+            # start a new config
+            cfg = {'type': l[1]}
+
+            # Third element can be comment or name
+            if(len(l) == 3):
+                if (l[2].startswith('#')):
+                    cfg['comment'] = l[2][1:]
+                else:
+                    cfg['name'] = l[2]
+            elif (len(l) == 4):
+                # Four elements, so third is name and 4th is comment
+                    cfg['name'] = l[2]
+                    cfg['comment'] = l[3][1:]
+            opt = {}
+
+        #
+        # Options
+        #
+        elif(l[0] == 'option'):
+            opt[l[1]] = l[2]
+
+        #
+        # List
+        #
+        elif(l[0] == 'list'):
+            # Make sure the key exists and is a list.
+            if l[1] not in opt:
+                opt[l[1]] = []
+            elif not isinstance(opt[l[1]], list):
+                # One line started with "option", another with "list".  If
+                # this is supposed to be a list, they should all start with
+                # "list".
+                raise Exception("Malformed UCI: mixed list/option lines")
+
+            opt[l[1]].append(l[2])
+
+    else:
+        # Also at the end of the loop, save the final config we were making
+        # Make sure cfg,opt aren't None
+        if(None not in (cfg, opt)):
+            data.append((cfg, opt))
+
+    return data
+
+
+def fileKey(st):
+    """
+    Identify a version of a file from its stat result.
+    """
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    return (st.st_ino, st.st_size, mtime)
+
+
+def copySection(section):
+    """
+    Copy a (config, options) tuple so that the copy can be modified.
+    """
+    config, options = section
+    copied = dict()
+    for k, v in six.iteritems(options):
+        if isinstance(v, list):
+            copied[k] = list(v)
+        else:
+            copied[k] = v
+    return (dict(config), copied)
+
+
+class UCIStore(object):
+    """
+    Process-wide cache of parsed UCI files.
+
+    Files are parsed at most once for each version on disk, which is
+    identified by the inode, size, and modification time.  Saved files are
+    replaced atomically, so every save produces a new inode.  For each file,
+    the store also keeps the digest of every section and an index of the
+    sections belonging to each chute (by the comment field).
+
+    The entries returned by load are shared and must not be modified.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = dict()
+
+    def load(self, filepath):
+        """
+        Return the cache entry for a file, parsing it if it has changed.
+
+        The entry is a dictionary with the list of (config, options)
+        'sections', a parallel list of 'digests', and 'chutes', which maps
+        chute names to positions in the list.
+        """
         try:
-            fd = pdos.open(self.filepath, 'r')
+            st = os.stat(filepath)
+        except OSError as e:
+            out.err('Error reading file %s: %s\n' % (filepath, str(e)))
+            raise e
 
-            while(True):
-                line = fd.readline()
-                if(not line):
-                    break
-                lines.append(line)
-            fd.close()
+        key = fileKey(st)
+
+        with self.lock:
+            entry = self.files.get(filepath, None)
+            if entry is not None and entry['key'] == key:
+                return entry
+
+        try:
+            with pdos.open(filepath, 'r') as source:
+                lines = source.readlines()
         except Exception as e:
-            out.err('Error reading file %s: %s\n' % (self.filepath, str(e)))
+            out.err('Error reading file %s: %s\n' % (filepath, str(e)))
             raise e
 
-        cfg = None
-        opt = None
-        data = []
-
-        # Now we have the data, deal with it
-        for line in lines:
-            line = line.strip()
-
-            # If comment ignore
-            if line.startswith('#'):
-                continue
-
-            l = getLineParts(line)
-
-            #
-            # Config
-            #
-            if(l[0] == 'config'):
-                # Save last config we had
-                if(cfg and opt):
-                    data.append((cfg, opt))
-
-                # start a new config
-                cfg = {'type': l[1]}
-
-                # Third element can be comment or name
-                if(len(l) == 3):
-                    if (l[2].startswith('#')):
-                        cfg['comment'] = l[2][1:]
-                    else:
-                        cfg['name'] = l[2]
-                elif (len(l) == 4):
-                    # Four elements, so third is name and 4th is comment
-                        cfg['name'] = l[2]
-                        cfg['comment'] = l[3][1:]
-                opt = {}
-
-            #
-            # Options
-            #
-            elif(l[0] == 'option'):
-                opt[l[1]] = l[2]
-
-            #
-            # List
-            #
-            elif(l[0] == 'list'):
-                # Make sure the key exists and is a list.
-                if l[1] not in opt:
-                    opt[l[1]] = []
-                elif not isinstance(opt[l[1]], list):
-                    # One line started with "option", another with "list".  If
-                    # this is supposed to be a list, they should all start with
-                    # "list".
-                    raise Exception("Malformed UCI: mixed list/option lines")
-
-                opt[l[1]].append(l[2])
+        entry = self.makeEntry(key, parseConfig(lines))
+        with self.lock:
+            self.files[filepath] = entry
+        return entry
+
+    def makeEntry(self, key, sections):
+        digests = [sectionDigest(c, o) for c, o in sections]
+
+        chutes = dict()
+        for i, (c, o) in enumerate(sections):
+            chutes.setdefault(c.get('comment', ''), []).append(i)
+
+        return {
+            'key': key,
+            'sections': sections,
+            'digests': digests,
+            'chutes': chutes
+        }
+
+    def store(self, filepath, lines):
+        """
+        Record the contents of a file that was just written.
+        """
+        key = fileKey(os.stat(filepath))
+        entry = self.makeEntry(key, parseConfig(lines))
+        with self.lock:
+            self.files[filepath] = entry
+
+    def invalidate(self, filepath=None):
+        with self.lock:
+            if filepath is None:
+                self.files = dict()
+            else:
+                self.files.pop(filepath, None)
 
-        else:
-            # Also at the end of the loop, save the final config we were making
-            # Make sure cfg,opt aren't None
-            if(None not in (cfg, opt)):
-                data.append((cfg, opt))
 
-        return data
+store = UCIStore()
@@ -14,6 +14,8 @@ from paradrop.lib.misc.procmon import ProcessMonitor
 from paradrop.core.agent import provisioning
 from paradrop.core.agent.reporting import sendNodeIdentity, sendStateReport
 from paradrop.core.agent.wamp_session import WampSession
+from paradrop.core.config import devices, leases
+from paradrop.core.container import docker_state
 from paradrop.core.update.update_fetcher import UpdateFetcher
 from paradrop.core.update.update_manager import UpdateManager
 from paradrop.airshark.airshark import AirsharkManager
@@ -88,6 +90,15 @@ def main():
     # Start the configuration service as a thread
     confd.main.run_thread(execute=args.execute)
 
+    # Keep an in-memory copy of container state for the API and reporting.
+    docker_state.cache.start()
+
+    # Keep an in-memory inventory of network devices.
+    devices.inventory.start()
+
+    # Keep an in-memory index of DHCP leases.
+    leases.index.start()
+
     airshark_manager = AirsharkManager()
 
     # Globally assign the nexus object so anyone else can access it.
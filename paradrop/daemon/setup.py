@@ -57,6 +57,11 @@ setup(
         'wget>=3.2'
     ],
 
+    extras_require={
+        # Server-side decoding and aggregation of Airshark spectrum data.
+        'airshark': ['numpy']
+    },
+
     python_requires=">=2.7",
 
     classifiers = [
@@ -0,0 +1,70 @@
+"""
+Measure confd reloads of a file with thousands of anonymous sections.
+
+This is not part of the unit tests.  Run it with e.g.
+
+    PYTHONPATH=paradrop/daemon python tests/benchmarks/bench_confd_reload.py --sections 3000
+
+It writes synthetic firewall rules, which are anonymous sections that can
+only be matched by content, loads them, and then times an unchanged reload
+and a reload with one changed section.  No commands are executed.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from paradrop.confd.manager import ConfigManager
+
+
+def write_config(path, count, changed=None):
+    with open(path, "w") as output:
+        for i in range(count):
+            port = 2000 + i
+            if i == changed:
+                port += count
+            output.write("config rule\n")
+            output.write("    option src_ip '10.{}.{}.0/24'\n".format(
+                i // 256 % 256, i % 256))
+            output.write("    option proto 'tcp'\n")
+            output.write("    option dest_port '{}'\n".format(port))
+            output.write("    option family 'ipv4'\n")
+            output.write("    option target 'ACCEPT'\n\n")
+
+
+def timed_load(manager, path):
+    start = timeit.default_timer()
+    manager.loadConfig(search=path, execute=False)
+    elapsed = timeit.default_timer() - start
+    return elapsed, len(list(manager.previousCommands.commands()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sections", type=int, nargs="+", default=[1000, 3000],
+                        help="numbers of sections to test")
+    args = parser.parse_args()
+
+    for count in args.sections:
+        temp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp, "firewall")
+            manager = ConfigManager(writeDir=temp)
+
+            write_config(path, count)
+            initial, commands = timed_load(manager, path)
+            unchanged, unchangedCommands = timed_load(manager, path)
+
+            write_config(path, count, changed=count // 2)
+            changed, changedCommands = timed_load(manager, path)
+
+            print("{} sections: initial load {:.3f} s ({} commands), "
+                  "unchanged reload {:.3f} s ({} commands), "
+                  "one change {:.3f} s ({} commands)".format(count, initial,
+                      commands, unchanged, unchangedCommands, changed,
+                      changedCommands))
+        finally:
+            shutil.rmtree(temp)
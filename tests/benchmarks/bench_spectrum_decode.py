@@ -0,0 +1,70 @@
+"""
+Compare the Python and NumPy spectral sample decoders.
+
+This is not part of the unit tests.  Run it against one or more recorded
+spectral_scan0 captures, e.g.
+
+    PYTHONPATH=paradrop/daemon python tests/benchmarks/bench_spectrum_decode.py capture.bin
+
+For each file, it reports the throughput of SpectrumReader.decode_power (the
+original decoder) and of SpectrumReader.decode_array with compute_power.
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from paradrop.airshark.spectrum_reader import SpectrumReader, numpy
+
+
+def python_decode(data):
+    return sum(1 for sample in SpectrumReader.decode_power(data))
+
+
+def numpy_decode(data):
+    samples = SpectrumReader.decode_array(data)
+    SpectrumReader.compute_power(samples)
+    return len(samples)
+
+
+def measure(decode, data, repeat):
+    """
+    Return the number of samples and the best time of repeat runs.
+    """
+    best = None
+    count = 0
+    for i in range(repeat):
+        start = timeit.default_timer()
+        count = decode(data)
+        elapsed = timeit.default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return count, best
+
+
+def report(name, size, count, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print("  {:<6} {:>8} samples in {:.3f} s: {:>10.0f} samples/s, {:.2f} MB/s".format(
+        name, count, elapsed, count / elapsed, size / elapsed / 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("captures", nargs="+", help="spectral_scan0 capture files")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per decoder; the best is reported")
+    args = parser.parse_args()
+
+    if numpy is None:
+        parser.error("NumPy is required")
+
+    for path in args.captures:
+        with open(path, "rb") as source:
+            data = source.read()
+
+        print("{} ({} bytes)".format(path, len(data)))
+        count, python_time = measure(python_decode, data, args.repeat)
+        report("Python", len(data), count, python_time)
+        count, numpy_time = measure(numpy_decode, data, args.repeat)
+        report("NumPy", len(data), count, numpy_time)
+        print("  speedup {:.1f}x".format(python_time / max(numpy_time, 1e-9)))
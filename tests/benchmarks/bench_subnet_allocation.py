@@ -0,0 +1,70 @@
+"""
+Measure subnet allocation cost against the number of reservations.
+
+This is not part of the unit tests.  Run it with e.g.
+
+    PYTHONPATH=paradrop/daemon python tests/benchmarks/bench_subnet_allocation.py --counts 100 1000 10000
+
+For each count, it fills a SubnetIndex with that many chutes holding one
+network each and reports the average cost of finding the next free network,
+of finding one for an update that excludes an installed chute, and of
+adding and removing a chute in the index.
+"""
+from __future__ import print_function
+
+import argparse
+import ipaddress
+import timeit
+
+from paradrop.core.config.reservations import SubnetIndex, \
+        SubnetReservationView
+
+
+POOL = ipaddress.ip_network(u'10.0.0.0/8')
+PREFIXLEN = 24
+
+
+def average(func, repeat):
+    start = timeit.default_timer()
+    for i in range(repeat):
+        func()
+    return (timeit.default_timer() - start) / repeat
+
+
+def run(count, repeat):
+    index = SubnetIndex()
+    for i in range(count):
+        subnet = index.reservations.nextFree(POOL, PREFIXLEN)
+        index.setOwner("chute{}".format(i), [subnet])
+
+    middle = "chute{}".format(count // 2)
+    nextFree = average(lambda: index.reservations.nextFree(POOL, PREFIXLEN),
+                       repeat)
+    excluded = average(lambda: SubnetReservationView(index.reservations,
+                       index.owners[middle]).nextFree(POOL, PREFIXLEN), repeat)
+
+    subnet = index.reservations.nextFree(POOL, PREFIXLEN)
+
+    def addRemove():
+        index.setOwner("new", [subnet])
+        index.removeChute("new")
+
+    update = average(addRemove, repeat)
+
+    print("{:>7} reservations: nextFree {:.1f} us, nextFree excluding a "
+          "chute {:.1f} us, add and remove a chute {:.1f} us".format(
+              len(index.reservations), nextFree * 1e6, excluded * 1e6,
+              update * 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--counts", type=int, nargs="+",
+                        default=[100, 1000, 10000],
+                        help="numbers of reserved networks to test")
+    parser.add_argument("--repeat", type=int, default=1000,
+                        help="operations to average over")
+    args = parser.parse_args()
+
+    for count in args.counts:
+        run(count, args.repeat)
@@ -0,0 +1,62 @@
+"""
+Measure the cost of taking one telemetry sample.
+
+This is not part of the unit tests.  Run it on a node with e.g.
+
+    PYTHONPATH=paradrop/daemon python tests/benchmarks/bench_telemetry_sample.py --samples 100
+
+It calls TelemetryService.sample against a temporary spool, so the real spool
+is not touched, and reports the average wall time and CPU time per sample,
+how much of it is spent building the report, and the spool size afterwards.
+"""
+from __future__ import print_function
+
+import argparse
+import shutil
+import tempfile
+import time
+import timeit
+
+from paradrop.core.agent import telemetry
+
+
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    cpu_time = time.clock
+
+
+def average(func, count):
+    """
+    Return the average wall and CPU time of count calls.
+    """
+    wall = timeit.default_timer()
+    cpu = cpu_time()
+    for i in range(count):
+        func()
+    return ((timeit.default_timer() - wall) / count,
+            (cpu_time() - cpu) / count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--samples", type=int, default=100,
+                        help="samples to average over")
+    args = parser.parse_args()
+
+    temp = tempfile.mkdtemp()
+    try:
+        spool = telemetry.TelemetrySpool(temp, 4 * 1024 * 1024, 256 * 1024)
+        service = telemetry.TelemetryService(spool=spool)
+
+        prepareWall, prepareCpu = average(service.builder.prepare, args.samples)
+        sampleWall, sampleCpu = average(service.sample, args.samples)
+
+        print("report only: {:.2f} ms wall, {:.2f} ms CPU".format(
+            prepareWall * 1e3, prepareCpu * 1e3))
+        print("sample:      {:.2f} ms wall, {:.2f} ms CPU".format(
+            sampleWall * 1e3, sampleCpu * 1e3))
+        print("spool: {} bytes ({} bytes per sample)".format(
+            spool.size(), spool.size() // max(args.samples, 1)))
+    finally:
+        shutil.rmtree(temp)
@@ -0,0 +1,195 @@
+from mock import MagicMock
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises
+from twisted.internet.task import Clock
+
+from paradrop.airshark import fanout
+from paradrop.airshark.analyzer import AnalyzerProcessProtocol
+from paradrop.airshark.spectrum_reader import SpectrumReader, numpy
+
+
+def make_subscription(**kwargs):
+    sent = []
+    clock = Clock()
+    sub = fanout.Subscription(sent.append, clock=clock, **kwargs)
+    return sub, sent, clock
+
+
+def test_Subscription_latest():
+    sub, sent, clock = make_subscription()
+
+    sub.publish(1)
+    assert sent == [1]
+
+    sub.pauseProducing()
+    for i in range(2, 10):
+        sub.publish(i)
+    assert sent == [1]
+
+    stats = sub.stats()
+    assert stats['paused']
+    assert stats['queue_depth'] == 1
+    assert stats['dropped'] == 7
+
+    sub.resumeProducing()
+    assert sent == [1, 9]
+    assert sub.stats()['queue_depth'] == 0
+
+    sub.stopProducing()
+    sub.publish(10)
+    assert sent == [1, 9]
+
+
+def test_Subscription_decimate():
+    sub, sent, clock = make_subscription(policy=fanout.DECIMATE, max_queue=4)
+
+    sub.pauseProducing()
+    for i in range(5):
+        sub.publish(i)
+
+    # The fifth message overflowed the queue, so every other one is dropped,
+    # keeping the newest.
+    assert list(sub.queue) == [0, 2, 4]
+    assert sub.dropped == 2
+
+    sub.resumeProducing()
+    assert sent == [0, 2, 4]
+
+
+def test_Subscription_aggregate():
+    assert_raises(Exception, fanout.Subscription, MagicMock(),
+                  policy=fanout.AGGREGATE)
+    assert_raises(Exception, fanout.Subscription, MagicMock(),
+                  policy="bogus")
+
+    sub, sent, clock = make_subscription(policy=fanout.AGGREGATE,
+                                         merge=lambda a, b: a + b)
+
+    sub.pauseProducing()
+    sub.publish([1])
+    sub.publish([2])
+    sub.publish([3])
+    assert sub.stats()['merged'] == 2
+
+    sub.resumeProducing()
+    assert sent == [[1, 2, 3]]
+    assert sub.dropped == 0
+
+
+def test_Subscription_max_rate():
+    sub, sent, clock = make_subscription(max_rate=2)
+
+    sub.publish(1)
+    sub.publish(2)
+    sub.publish(3)
+    assert sent == [1]
+
+    clock.advance(0.25)
+    assert sent == [1]
+
+    clock.advance(0.25)
+    assert sent == [1, 3]
+    assert sub.dropped == 1
+
+    # Nothing is sent while paused, even after the interval.
+    sub.publish(4)
+    sub.pauseProducing()
+    clock.advance(1)
+    assert sent == [1, 3]
+    sub.resumeProducing()
+    assert sent == [1, 3, 4]
+
+
+def test_Subscription_paused_during_send():
+    sent = []
+    clock = Clock()
+
+    def send(message):
+        sent.append(message)
+        if len(sent) == 2:
+            sub.pauseProducing()
+
+    sub = fanout.Subscription(send, policy=fanout.DECIMATE, clock=clock)
+    sub.pauseProducing()
+    for i in range(4):
+        sub.publish(i)
+
+    # The transport pauses the producer again after the second write.
+    sub.resumeProducing()
+    assert sent == [0, 1]
+    assert sub.stats()['queue_depth'] == 2
+
+
+def test_merge_samples():
+    size = SpectrumReader.hdrsize + SpectrumReader.pktsize
+    first = b"a" * size * 3
+    second = b"b" * size * 2
+
+    assert fanout.merge_samples(first, second) == first + second
+
+    # Only whole samples are dropped, oldest first.
+    data = fanout.merge_samples(first, second, limit=size * 3 + 10)
+    assert data == b"a" * size + second
+
+
+def test_merge_frames():
+    if numpy is None:
+        raise SkipTest("requires numpy")
+
+    from paradrop.airshark.aggregator import merge_frames
+
+    first = {
+        'tsf': 0,
+        'resolution': 0.5,
+        'channels': [
+            {'freq': 2412, 'count': 1, 'min': [-70.0], 'max': [-50.0],
+             'avg': [-60.0],
+             'percentile': [-55.0]}
+        ]
+    }
+    second = {
+        'tsf': 500000,
+        'resolution': 0.5,
+        'channels': [
+            {'freq': 2412, 'count': 1, 'min': [-75.0], 'max': [-40.0],
+             'avg': [-60.0],
+             'percentile': [-58.0]},
+            {'freq': 2437, 'count': 3, 'min': [-90.0], 'max': [-70.0],
+             'avg': [-80.0],
+             'percentile': [-75.0]}
+        ]
+    }
+
+    frame = merge_frames(first, second)
+    assert frame['tsf'] == 0
+    assert frame['resolution'] == 1.0
+    assert [c['freq'] for c in frame['channels']] == [2412, 2437]
+
+    channel = frame['channels'][0]
+    assert channel['count'] == 2
+    assert channel['min'] == [-75.0]
+    assert channel['max'] == [-40.0]
+    assert channel['avg'] == [-60.0]
+    assert channel['percentile'] == [-55.0]
+    assert frame['channels'][1] == second['channels'][1]
+
+
+def test_AnalyzerProcessProtocol_backpressure():
+    proto = AnalyzerProcessProtocol(MagicMock())
+    proto.transport = MagicMock()
+    proto.transport.pipes = {3: MagicMock()}
+
+    proto.connectionMade()
+    proto.transport.pipes[3].registerProducer.assert_called_once_with(proto, True)
+
+    proto.feedSpectrumData(b"abc")
+    proto.transport.writeToChild.assert_called_once_with(3, b"abc")
+
+    proto.pauseProducing()
+    proto.feedSpectrumData(b"defg")
+    assert proto.transport.writeToChild.call_count == 1
+    assert proto.stats()['dropped_bytes'] == 4
+
+    proto.resumeProducing()
+    proto.feedSpectrumData(b"h")
+    assert proto.transport.writeToChild.call_count == 2
@@ -0,0 +1,178 @@
+import random
+import struct
+
+from mock import MagicMock, patch
+from nose.plugins.skip import SkipTest
+
+from paradrop.airshark import airshark
+from paradrop.airshark import aggregator as aggregator_module
+from paradrop.airshark.aggregator import SpectrumAggregator
+from paradrop.airshark.spectrum_reader import SpectrumReader, numpy
+
+
+def make_samples(count, freqs=[2412, 2437, 2462], tsf_step=1000, seed=1):
+    """
+    Generate a buffer of HT20 spectral samples in the ath9k format.
+    """
+    rand = random.Random(seed)
+    data = []
+    for i in range(count):
+        header = struct.pack(">BH", 1, SpectrumReader.pktsize)
+        freq = freqs[i % len(freqs)]
+        rssi = rand.randint(-10, 40)
+        noise = rand.randint(-100, -90)
+        mags = [rand.randint(0, 255) for j in range(56)]
+        if i % 97 == 0:
+            mags = [0] * 56
+        body = struct.pack(">BHbbHBBQ", rand.randint(0, 3), freq, rssi, noise,
+                max(mags), mags.index(max(mags)), 0, i * tsf_step)
+        data.append(header + body + struct.pack("56B", *mags))
+    return b"".join(data)
+
+
+def require_numpy():
+    if numpy is None:
+        raise SkipTest("requires numpy")
+
+
+def test_decode_array():
+    require_numpy()
+
+    data = make_samples(50)
+    samples = SpectrumReader.decode_array(data)
+    power = SpectrumReader.compute_power(samples)
+    assert len(samples) == 50
+    assert power.shape == (50, 56)
+
+    expected = list(SpectrumReader.decode_power(data))
+    assert len(expected) == 50
+    for i, (tsf, freq, noise, rssi, pwr) in enumerate(expected):
+        assert samples['tsf'][i] == tsf
+        assert samples['freq'][i] == freq
+        assert samples['noise'][i] == noise
+        assert samples['rssi'][i] == rssi
+        for j, offset in enumerate(SpectrumReader.sc_offsets):
+            assert abs(power[i, j] - pwr[freq + offset]) < 1e-9
+
+    # Incomplete sample at the end is discarded.
+    samples = SpectrumReader.decode_array(data[:-10])
+    assert len(samples) == 49
+
+    # Decoding stops at a malformed header.
+    corrupt = bytearray(data)
+    corrupt[76 * 10] = 2
+    with patch("paradrop.airshark.spectrum_reader.out") as out:
+        samples = SpectrumReader.decode_array(bytes(corrupt))
+        assert out.warn.call_count == 1
+    assert len(samples) == 10
+    assert len(list(SpectrumReader.decode(bytes(corrupt)))) == 10
+
+
+def test_SpectrumAggregator():
+    require_numpy()
+
+    # 100 samples, 1 ms apart, on three channels.
+    data = make_samples(100)
+    samples = SpectrumReader.decode_array(data)
+    power = SpectrumReader.compute_power(samples)
+
+    aggregator = SpectrumAggregator(0.025, percentile=50)
+
+    frames = aggregator.add(samples[:60], power[:60])
+    assert [f['tsf'] for f in frames] == [0, 25000]
+    frames.extend(aggregator.add(samples[60:], power[60:]))
+    frames.append(aggregator.flush())
+    assert [f['tsf'] for f in frames] == [0, 25000, 50000, 75000]
+    assert aggregator.flush() is None
+
+    channels = frames[0]['channels']
+    assert [c['freq'] for c in channels] == [2412, 2437, 2462]
+    assert sum(c['count'] for c in channels) == 25
+
+    # Check one subcarrier against a direct computation.
+    values = power[0:25][samples['freq'][0:25] == 2437][:, 10]
+    assert channels[1]['min'][10] == round(values.min(), 1)
+    assert channels[1]['max'][10] == round(values.max(), 1)
+    avg = 10 * numpy.log10(numpy.mean(numpy.power(10.0, values / 10.0)))
+    assert channels[1]['avg'][10] == round(avg, 1)
+    assert channels[1]['max'][10] >= channels[1]['avg'][10]
+
+    # The percentile is estimated to within half a histogram bucket.
+    median = numpy.percentile(values, 50, method='lower')
+    assert abs(channels[1]['percentile'][10] - median) <= \
+        aggregator_module.HISTOGRAM_STEP / 2 + 0.05
+
+
+def test_SpectrumAggregator_long_bin():
+    require_numpy()
+
+    # Samples in a long bin are summarized as they arrive instead of being
+    # kept until the bin ends.
+    aggregator = SpectrumAggregator(60, percentile=100)
+    for i in range(10):
+        data = make_samples(100, seed=i)
+        samples = SpectrumReader.decode_array(data)
+        power = SpectrumReader.compute_power(samples)
+        assert aggregator.add(samples, power) == []
+
+    assert sorted(aggregator.channels) == [2412, 2437, 2462]
+    summary = aggregator.channels[2412]
+    assert summary.count == 340
+    assert summary.histogram.sum() == 340 * 56
+
+    # The 100th percentile is in the same bucket as the maximum.
+    frame = aggregator.flush()
+    for channel in frame['channels']:
+        for p, m in zip(channel['percentile'], channel['max']):
+            assert m - aggregator_module.HISTOGRAM_STEP / 2 - 0.05 <= p <= m
+
+
+@patch("paradrop.airshark.airshark.airshark_interface_manager")
+def test_AirsharkManager_aggregate(airshark_interface_manager):
+    require_numpy()
+
+    manager = airshark.AirsharkManager()
+    manager.scanner = MagicMock()
+    manager.analyzer_process = MagicMock()
+    manager.analyzer_process.isRunning.return_value = False
+
+    raw = MagicMock()
+    fast = MagicMock()
+    slow = MagicMock()
+    manager.add_spectrum_observer(raw)
+    manager.add_aggregate_observer(fast, 0.01)
+    manager.add_aggregate_observer(slow, 0.05)
+
+    data = make_samples(100)
+    manager.scanner.spectrum_reader.read_samples.return_value = (None, data)
+    manager.check_spectrum()
+
+    raw.on_spectrum_data.assert_called_once_with(data)
+    assert fast.on_spectrum_frame.call_count == 9
+    assert slow.on_spectrum_frame.call_count == 1
+
+    manager.remove_aggregate_observer(fast)
+    manager.remove_aggregate_observer(slow)
+    assert len(manager.aggregators) == 0
+
+
+def test_decode_array_many():
+    """
+    Test that the NumPy decoder agrees with the Python decoder on a long
+    capture, including samples with all-zero magnitudes.
+    """
+    require_numpy()
+
+    data = make_samples(1000)
+    samples = SpectrumReader.decode_array(data)
+    power = SpectrumReader.compute_power(samples)
+
+    expected = list(SpectrumReader.decode_power(data))
+    assert len(samples) == len(expected) == 1000
+
+    expected_power = numpy.array([
+        [pwr[freq + offset] for offset in SpectrumReader.sc_offsets]
+        for tsf, freq, noise, rssi, pwr in expected
+    ])
+    assert numpy.allclose(power, expected_power)
+    assert list(samples['tsf']) == [e[0] for e in expected]
@@ -0,0 +1,51 @@
+from autobahn.twisted.resource import WebSocketResource
+from mock import MagicMock
+from twisted.internet.address import IPv4Address
+from twisted.internet.testing import StringTransport
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from paradrop.airshark.fanout import Subscription
+from paradrop.backend.airshark_ws import AirsharkSpectrumFactory
+
+
+HANDSHAKE = (
+    b"GET /spectrum HTTP/1.1\r\n"
+    b"Host: localhost\r\n"
+    b"Upgrade: websocket\r\n"
+    b"Connection: Upgrade\r\n"
+    b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+    b"Sec-WebSocket-Version: 13\r\n"
+    b"\r\n"
+)
+
+
+def test_AirsharkSpectrumProtocol_open():
+    manager = MagicMock()
+
+    root = Resource()
+    root.putChild(b"spectrum",
+                  WebSocketResource(AirsharkSpectrumFactory(manager)))
+    site = Site(root)
+
+    # The HTTP channel registers itself as the producer for the connection
+    # before the request is upgraded.
+    transport = StringTransport(peerAddress=IPv4Address("TCP", "127.0.0.1", 8000))
+    channel = site.buildProtocol(transport.getPeer())
+    transport.protocol = channel
+    channel.makeConnection(transport)
+    assert transport.producer is not None
+
+    channel.dataReceived(HANDSHAKE)
+    assert b"101 Switching Protocols" in transport.value()
+
+    assert isinstance(transport.producer, Subscription)
+    assert transport.streaming
+    manager.add_subscription.assert_called_once_with(transport.producer)
+    assert manager.add_spectrum_observer.call_count == 1
+
+    # Samples published to the subscription are written to the connection.
+    protocol = manager.add_spectrum_observer.call_args[0][0]
+    transport.clear()
+    protocol.on_spectrum_data(b"samples")
+    assert transport.value().endswith(b"samples")
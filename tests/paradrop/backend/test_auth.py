@@ -65,3 +65,83 @@ def test_AuthApi_post_local(nexus):
     result = json.loads(response)
     assert result['success'] is False
     assert result.get('token', None) is None
+
+
+def test_CredentialCache():
+    cache = auth.CredentialCache(ttl=60, size=2)
+
+    assert not cache.check("Basic abc", 1)
+    cache.add("Basic abc", 1)
+    assert cache.check("Basic abc", 1)
+
+    # Password database changed.
+    assert not cache.check("Basic abc", 2)
+    assert not cache.check("Basic abc", 1)
+
+    # Oldest entries are evicted first.
+    cache.add("Basic a", 1)
+    cache.add("Basic b", 1)
+    cache.add("Basic c", 1)
+    assert len(cache.entries) == 2
+    assert not cache.check("Basic a", 1)
+    assert cache.check("Basic c", 1)
+
+    # Expired entries are not used.
+    cache.ttl = -1
+    cache.add("Basic d", 1)
+    assert not cache.check("Basic d", 1)
+
+
+@patch('paradrop.backend.auth.get_username_password')
+@patch('paradrop.backend.auth.threads')
+def test_check_auth_basic(threads, get_username_password):
+    from twisted.internet import defer
+
+    threads.deferToThread.side_effect = lambda f, *args: defer.succeed(f(*args))
+    get_username_password.return_value = ('paradrop', 'password')
+
+    auth.credential_cache.clear()
+
+    request = MagicMock()
+    request.getHeader.return_value = "Basic cGFyYWRyb3A6cGFzc3dvcmQ="
+
+    password_manager = MagicMock()
+    password_manager.version = 1
+    password_manager.verify_password.return_value = True
+
+    results = []
+    auth.check_auth(request, password_manager, None).addCallback(results.append)
+    assert results == [True]
+
+    # The second check should be answered from the cache.
+    assert auth.check_auth(request, password_manager, None) is True
+    assert password_manager.verify_password.call_count == 1
+
+    # Changing the password invalidates the cached result.
+    password_manager.version = 2
+    password_manager.verify_password.return_value = False
+    auth.check_auth(request, password_manager, None).addCallback(results.append)
+    assert results == [True, False]
+    assert password_manager.verify_password.call_count == 2
+
+    auth.credential_cache.clear()
+
+
+@patch('paradrop.backend.auth.ChuteStorage')
+def test_get_allowed_bearer(ChuteStorage):
+    chute = MagicMock()
+    chute.getCache.return_value = "token1"
+
+    ChuteStorage.generation = 1
+    ChuteStorage.chuteList = {'chute': chute}
+    ChuteStorage.return_value.getChuteList.return_value = [chute]
+
+    assert "token1" in auth.get_allowed_bearer()
+    assert "token1" in auth.get_allowed_bearer()
+    assert chute.getCache.call_count == 1
+
+    # Chute list changed.
+    chute.getCache.return_value = "token2"
+    ChuteStorage.generation = 2
+    assert "token2" in auth.get_allowed_bearer()
+    assert "token1" not in auth.get_allowed_bearer()
@@ -4,6 +4,7 @@ import tarfile
 
 from mock import MagicMock, patch
 from nose.tools import assert_raises
+from twisted.internet import defer
 
 from paradrop.backend import chute_api
 from paradrop.core.auth.user import User
@@ -503,68 +504,80 @@ class TestChuteApi(object):
                 self.interface['name'])
         assert result == "OK"
 
-    @patch("paradrop.backend.chute_api.subprocess.Popen")
+    @patch("paradrop.backend.chute_api.stations.getService")
     @patch("paradrop.backend.chute_api.ChuteStorage")
-    def test_get_stations(self, ChuteStorage, Popen):
+    def test_get_stations(self, ChuteStorage, getService):
         ChuteStorage.chuteList = {
             self.chute.name: self.chute
         }
 
-        proc = MagicMock()
-        Popen.return_value = proc
-        proc.stdout = [
-            "Station 12:34:56:78:9a:bc (on wlan0)",
-            "	inactive time:  304 ms",
-            "	rx bytes:       18816",
-            "	rx packets:     75",
-            "	tx bytes:       5386",
-            "	tx packets:     21",
-            "	signal:         -29 dBm",
-            "	tx bitrate:     54.0 MBit/s"
-        ]
+        station = {
+            'mac_addr': '12:34:56:78:9a:bc',
+            'rx_bytes': 18816,
+            'signal': -29,
+            'tx_bitrate': 54.0
+        }
+
+        service = MagicMock()
+        service.getStations.return_value = defer.succeed([station])
+        service.getAllStations.return_value = defer.succeed({
+            self.interface['name']: [station]
+        })
+        getService.return_value = service
 
         request = MagicMock()
         request.user = User.get_internal_user()
 
-        result = self.api.get_stations(request, self.chute.name,
+        results = []
+        d = self.api.get_stations(request, self.chute.name,
                 self.interface['name'])
-        stations = json.loads(result)
+        d.addCallback(results.append)
+        stations = json.loads(results[0])
         assert len(stations) == 1
         assert stations[0]['mac_addr'] == '12:34:56:78:9a:bc'
-        assert stations[0]['rx_bytes'] == '18816'
-        assert stations[0]['signal'] == '-29 dBm'
-        assert stations[0]['tx_bitrate'] == '54.0 MBit/s'
-
-    @patch("paradrop.backend.chute_api.subprocess.Popen")
+        assert stations[0]['rx_bytes'] == 18816
+        service.getStations.assert_called_once_with('vwlan0')
+
+        d = self.api.get_all_stations(request, self.chute.name)
+        d.addCallback(results.append)
+        networks = json.loads(results[1])
+        assert networks[self.interface['name']][0]['signal'] == -29
+        service.getAllStations.assert_called_once_with({
+            self.interface['name']: 'vwlan0'
+        })
+
+    @patch("paradrop.backend.chute_api.stations.getService")
     @patch("paradrop.backend.chute_api.ChuteStorage")
-    def test_get_station(self, ChuteStorage, Popen):
+    def test_get_station(self, ChuteStorage, getService):
         ChuteStorage.chuteList = {
             self.chute.name: self.chute
         }
 
-        proc = MagicMock()
-        Popen.return_value = proc
-        proc.stdout = [
-            "Station 12:34:56:78:9a:bc (on wlan0)",
-            "	inactive time:  304 ms",
-            "	rx bytes:       18816",
-            "	rx packets:     75",
-            "	tx bytes:       5386",
-            "	tx packets:     21",
-            "	signal:         -29 dBm",
-            "	tx bitrate:     54.0 MBit/s"
-        ]
+        service = MagicMock()
+        service.getStation.return_value = defer.succeed({
+            'mac_addr': '12:34:56:78:9a:bc',
+            'rx_bytes': 18816
+        })
+        getService.return_value = service
 
         request = MagicMock()
         request.user = User.get_internal_user()
 
-        result = self.api.get_station(request, self.chute.name,
+        results = []
+        d = self.api.get_station(request, self.chute.name,
                 self.interface['name'], '12:34:56:78:9a:bc')
-        station = json.loads(result)
+        d.addCallback(results.append)
+        station = json.loads(results[0])
         assert station['mac_addr'] == '12:34:56:78:9a:bc'
-        assert station['rx_bytes'] == '18816'
-        assert station['signal'] == '-29 dBm'
-        assert station['tx_bitrate'] == '54.0 MBit/s'
+        assert station['rx_bytes'] == 18816
+
+        # Station is not connected.
+        service.getStation.return_value = defer.succeed(None)
+        d = self.api.get_station(request, self.chute.name,
+                self.interface['name'], '12:34:56:78:9a:bd')
+        d.addCallback(results.append)
+        assert results[1] == "{}"
+        request.setResponseCode.assert_called_with(404)
 
     @patch("paradrop.backend.chute_api.subprocess.Popen")
     @patch("paradrop.backend.chute_api.ChuteStorage")
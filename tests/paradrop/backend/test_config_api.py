@@ -0,0 +1,21 @@
+import json
+
+from mock import MagicMock, patch
+
+from paradrop.backend.config_api import ConfigApi
+
+
+@patch("paradrop.backend.config_api.ChuteStorage")
+def test_export_chutes(ChuteStorage):
+    api = ConfigApi(MagicMock(), MagicMock())
+
+    ChuteStorage.return_value.exportYaml.return_value = "/tmp/chutes.yaml"
+    request = MagicMock()
+    body = api.export_chutes(request)
+    assert json.loads(body) == {'path': '/tmp/chutes.yaml'}
+    assert not request.setResponseCode.called
+
+    ChuteStorage.return_value.exportYaml.return_value = None
+    request = MagicMock()
+    api.export_chutes(request)
+    request.setResponseCode.assert_called_once_with(500)
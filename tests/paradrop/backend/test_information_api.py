@@ -0,0 +1,51 @@
+import json
+
+from mock import MagicMock
+from twisted.web import http
+
+from paradrop.backend.information_api import InformationApi
+from paradrop.core.system import node_facts
+
+
+def make_request(etag=None):
+    request = MagicMock()
+    request.setETag.side_effect = lambda tag: \
+        http.CACHED if tag == etag else None
+    return request
+
+
+def test_hardware_info():
+    facts = node_facts.NodeFacts()
+    facts.register('hardware', lambda: {'cpu': 'x86_64'})
+    api = InformationApi(facts)
+
+    request = make_request()
+    body = api.hardware_info(request)
+    assert json.loads(body) == {'cpu': 'x86_64'}
+
+    # A client that has the current version gets an empty body.
+    etag = request.setETag.call_args[0][0]
+    request = make_request(etag)
+    assert api.hardware_info(request) == ""
+
+
+def test_software_info():
+    facts = node_facts.NodeFacts()
+    facts.register('software', lambda: {'pdVersion': '1.0'})
+    api = InformationApi(facts)
+
+    request = make_request()
+    data = json.loads(api.software_info(request))
+    assert data['pdVersion'] == '1.0'
+    assert 'uptime' in data
+
+
+def test_get_features():
+    api = InformationApi(MagicMock())
+
+    request = make_request()
+    features = json.loads(api.get_features(request))
+    assert isinstance(features, list)
+
+    request = make_request(api.featuresETag.encode('ascii'))
+    assert api.get_features(request) == ""
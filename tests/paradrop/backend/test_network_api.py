@@ -62,10 +62,46 @@ def test_update_lease():
     assert len(leases) == 3
 
 
-def test_NetworkApi_get_devices():
+@patch("paradrop.backend.network_api.os.walk")
+@patch("paradrop.backend.network_api.leases.index")
+def test_NetworkApi_get_devices(index, walk):
     api = network_api.NetworkApi()
 
+    old = {'mac_addr': '00:11:22:33:44:55', 'ip_addr': '10.0.0.100',
+           'as_of': 1}
+    new = {'mac_addr': '00:11:22:33:44:55', 'ip_addr': '192.168.128.130',
+           'as_of': 2}
+    other = {'mac_addr': '66:77:88:99:aa:bb', 'ip_addr': '10.0.0.101',
+             'as_of': 1}
+    index.getAll.return_value = [new, old, other]
+
+    request = MagicMock()
+    data = json.loads(api.get_devices(request))
+
+    # Devices are served from the lease index, keeping the newest lease for
+    # each MAC address, without scanning the filesystem.
+    assert sorted(data, key=lambda d: d['mac_addr']) == [new, other]
+    assert index.sync.called
+    assert not walk.called
+
+
+@patch("paradrop.backend.network_api.leases.index")
+def test_NetworkApi_get_leases(index):
+    api = network_api.NetworkApi()
+
+    lease1 = {'mac_addr': '00:11:22:33:44:55', 'ip_addr': '10.0.0.100',
+              'chute': None}
+    lease2 = {'mac_addr': '00:11:22:33:44:55', 'ip_addr': '192.168.128.130',
+              'chute': 'test'}
+    index.getAll.return_value = [lease1, lease2]
+    index.find.return_value = [lease1, lease2]
+
     request = MagicMock()
+    request.args = {}
+    data = json.loads(api.get_leases(request))
+    assert len(data) == 2
 
-    data = api.get_devices(request)
-    assert data is not None
+    request.args = {b'mac_addr': [b'00:11:22:33:44:55'], b'chute': [b'test']}
+    data = json.loads(api.get_leases(request))
+    index.find.assert_called_once_with('mac_addr', '00:11:22:33:44:55')
+    assert data == [lease2]
@@ -92,3 +92,55 @@ if __name__ == '__main__':
 
     # with pdutils.Timer('Native') as t:
     #     [json.dumps(x) for x in dicts]
+
+
+def test_readLogsSince_index():
+    '''
+    Make sure the sparse index, file selection and filters return the same
+    records as a full scan would.
+    '''
+    import tempfile
+    from six.moves.queue import Queue
+
+    logpath = tempfile.mkdtemp()
+    try:
+        now = time.time()
+        day = 24 * 60 * 60
+
+        # An old rotated file that should never be opened.
+        oldName = output.LOG_NAME + '.' + time.strftime('%Y_%m_%d',
+                time.localtime(now - 10 * day))
+        with open(os.path.join(logpath, oldName), 'w') as f:
+            f.write('not json\n')
+
+        queue = Queue()
+        writer = output.PrintLogThread(logpath, queue, output.LOG_NAME)
+
+        original = output.INDEX_INTERVAL
+        output.INDEX_INTERVAL = 256
+        try:
+            for i in range(200):
+                level = output.Level.WARN if i % 2 else output.Level.INFO
+                writer.writeRecord({'timestamp': now - 200 + i,
+                                    'type': level.value,
+                                    'message': 'message {}'.format(i)})
+        finally:
+            output.INDEX_INTERVAL = original
+
+        # The index should let us skip most of the file.
+        assert output.findIndexedOffset(logpath, now - 10) > 0
+        assert output.findIndexedOffset(logpath, 0) == 0
+
+        logs = list(output.readLogsSince(logpath, now - 50))
+        assert [x['timestamp'] for x in logs] == [now - 200 + i for i in range(151, 200)]
+
+        logs = list(output.readLogsSince(logpath, now - 50, limit=5, level='warn'))
+        assert len(logs) == 5
+        assert all(x['type'] == output.Level.WARN.value for x in logs)
+
+        # A stale index must not cause records to be skipped.
+        with open(os.path.join(logpath, output.INDEX_NAME), 'w') as f:
+            f.write("{} 100\n".format(now - 1000))
+        assert len(list(output.readLogsSince(logpath, now - 50))) == 49
+    finally:
+        shutil.rmtree(logpath)
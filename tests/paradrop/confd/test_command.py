@@ -82,3 +82,50 @@ def test_KillCommand(execute):
     
     command.execute()
     assert not execute.called
+
+
+def test_execute_concurrently():
+    """
+    Test parallel execution of commands within a priority level
+    """
+    import threading
+    from paradrop.confd.command import FunctionCommand, execute_concurrently
+
+    radio0 = MagicMock()
+    radio1 = MagicMock()
+    started = [threading.Event(), threading.Event()]
+    finished = list()
+
+    def rendezvous(mine, other):
+        # Only succeeds if the other section's command runs at the same time.
+        started[mine].set()
+        result = started[other].wait(5)
+        finished.append(mine)
+        return result
+
+    def after():
+        return sorted(finished)
+
+    first = FunctionCommand(radio0, rendezvous, 0, 1)
+    second = FunctionCommand(radio1, rendezvous, 1, 0)
+    third = FunctionCommand(radio0, after)
+
+    commands = [(10, first), (10, second), (20, third)]
+    execute_concurrently(commands, 2)
+
+    assert first.result
+    assert second.result
+
+    # The next priority level should not start until the previous one is
+    # complete.
+    assert third.result == [0, 1]
+
+    # Commands from the same section run in order on one thread.
+    order = list()
+    commands = [
+        (10, FunctionCommand(radio0, order.append, "a")),
+        (10, FunctionCommand(radio0, order.append, "b")),
+        (10, FunctionCommand(radio0, order.append, "c"))
+    ]
+    execute_concurrently(commands, 4)
+    assert order == ["a", "b", "c"]
@@ -1,4 +1,4 @@
-from mock import MagicMock
+from mock import MagicMock, patch
 
 from paradrop.confd import firewall
 
@@ -192,3 +192,166 @@ def test_ConfigRules():
 
     commands = config.revert(allConfigs)
     assert len(commands) == 1
+
+
+FIREWALL_CONFIG = """
+config interface wan
+    option ifname 'eth0'
+    option proto 'dhcp'
+
+config interface lan
+    option ifname 'eth1'
+    option proto 'static'
+    option ipaddr '192.168.1.1'
+    option netmask '255.255.255.0'
+
+config defaults
+    option input 'ACCEPT'
+    option output 'ACCEPT'
+    option forward 'REJECT'
+
+config zone
+    option name 'wan'
+    option network 'wan'
+    option masq '1'
+    option conntrack '1'
+
+config zone
+    option name 'lan'
+    option network 'lan'
+
+config forwarding
+    option src 'lan'
+    option dest 'wan'
+
+config redirect
+    option src 'wan'
+    option proto 'tcpudp'
+    option src_dport '8080'
+    option dest_ip '192.168.1.100'
+    option dest_port '80'
+
+config rule
+    option name 'allow ssh'
+    option src 'wan'
+    option proto 'tcp'
+    option dest_port '22'
+    option target 'ACCEPT'
+"""
+
+
+def get_rule_sets(commands):
+    """
+    Collect the iptables rules from a list of (priority, command) tuples.
+
+    Returns a dictionary mapping (binary, table) -> list of arguments.
+    """
+    import shlex
+
+    rules = dict()
+    for prio, cmd in commands:
+        if isinstance(cmd, firewall.IptablesRestoreCommand):
+            table = None
+            for line in cmd.getInput().splitlines():
+                if line.startswith("*"):
+                    table = line[1:]
+                elif line == "COMMIT" or len(line) == 0:
+                    continue
+                else:
+                    key = (cmd.binary, table)
+                    rules.setdefault(key, []).append(shlex.split(line))
+        elif cmd.command[0] in firewall.IPTABLES_RESTORE:
+            binary, table, args = firewall.parse_iptables_command(cmd.command)
+            rules.setdefault((binary, table), []).append(args)
+    return rules
+
+
+def test_batch_iptables_commands():
+    """
+    Test that batched and individual modes generate the same rule set
+    """
+    import os
+    import tempfile
+
+    from paradrop.confd.manager import ConfigManager
+
+    temp = tempfile.mkdtemp()
+    confFile = os.path.join(temp, "firewall")
+    with open(confFile, "w") as output:
+        output.write(FIREWALL_CONFIG)
+
+    manager = ConfigManager(writeDir=temp, execCommands=False)
+    manager.loadConfig(search=confFile)
+
+    individual = list(manager.previousCommands.prioritized())
+    batched = firewall.batch_iptables_commands(individual)
+
+    # Non-iptables commands (e.g. sysctl) pass through unchanged, and there
+    # should be one restore command each for iptables and ip6tables.
+    restores = [cmd for prio, cmd in batched
+                if isinstance(cmd, firewall.IptablesRestoreCommand)]
+    assert len(restores) == 2
+    assert len(batched) < len(individual)
+    assert any("sysctl" in cmd for prio, cmd in batched)
+
+    expected = get_rule_sets(individual)
+    assert len(expected) == 4
+    assert get_rule_sets(batched) == expected
+
+    # Rules with spaces in their comments must survive quoting.
+    assert any('"zone wan default"' in cmd.getInput() for cmd in restores)
+
+    # Reverting the configuration should produce the same rule set as well.
+    manager.unload(execute=False)
+    individual = list(manager.previousCommands.prioritized())
+    batched = firewall.batch_iptables_commands(individual)
+    assert get_rule_sets(batched) == get_rule_sets(individual)
+
+
+@patch("paradrop.confd.command.Command.execute")
+@patch("paradrop.confd.firewall.subprocess")
+def test_IptablesRestoreCommand(subprocess, execute):
+    """
+    Test the IptablesRestoreCommand success and fallback paths
+    """
+    parent = MagicMock()
+    parent.executed = []
+
+    commands = [
+        firewall.Command(firewall.start_iptables_command("iptables",
+            "--table", "filter", "--new", "zone_lan_input"), parent),
+        firewall.Command(firewall.start_iptables_command("iptables",
+            "--table", "nat", "--new", "zone_lan_prerouting"), parent)
+    ]
+
+    restore = firewall.IptablesRestoreCommand("iptables")
+    for cmd in commands:
+        restore.add(cmd)
+
+    assert restore.getInput() == ("*filter\n--new zone_lan_input\nCOMMIT\n"
+                                  "*nat\n--new zone_lan_prerouting\nCOMMIT\n")
+
+    proc = subprocess.Popen.return_value
+    proc.communicate.return_value = ("", "")
+    proc.returncode = 0
+
+    assert restore.execute()
+    assert restore.success()
+    assert len(parent.executed) == 2
+    assert not execute.called
+
+    # Each table is restored separately.
+    inputs = [c[0][0] for c in proc.communicate.call_args_list]
+    assert inputs == ["*filter\n--new zone_lan_input\nCOMMIT\n",
+                      "*nat\n--new zone_lan_prerouting\nCOMMIT\n"]
+
+    # If the nat table fails, only its commands are executed individually,
+    # because the filter table was already committed.
+    failing = MagicMock()
+    failing.communicate.return_value = ("", "")
+    failing.returncode = 1
+    subprocess.Popen.side_effect = [proc, failing]
+
+    assert restore.execute()
+    assert execute.call_count == 1
+    assert len(parent.executed) == 3
@@ -165,3 +165,232 @@ def test_manager_execute(execute):
             iwDev = i
         i += 1
     assert kill < addrDel and addrDel < iwDev
+
+
+def test_reload_many_sections():
+    """
+    Test reloading a configuration file with many anonymous sections
+    """
+    from paradrop.confd.base import ConfigObject
+    from paradrop.confd.manager import ConfigManager
+
+    temp = tempfile.mkdtemp()
+    confFile = os.path.join(temp, "firewall")
+
+    # Anonymous sections (e.g. firewall rules) receive new internal names
+    # every time they are read, so they can only be matched by content.
+    def write_config(count, changed=None):
+        with open(confFile, "w") as output:
+            for i in range(count):
+                port = 2000 + i
+                if i == changed:
+                    port += count
+                output.write("config rule\n")
+                output.write("    option src_ip '10.{}.{}.0/24'\n".format(
+                    i // 256, i % 256))
+                output.write("    option proto 'tcp'\n")
+                output.write("    option dest_port '{}'\n".format(port))
+                output.write("    option family 'ipv4'\n")
+                output.write("    option target 'ACCEPT'\n\n")
+
+    manager = ConfigManager(writeDir=temp)
+
+    write_config(500)
+    manager.loadConfig(search=confFile, execute=False)
+    assert len(manager.currentConfig) == 500
+    assert len(manager.contentIndex) == 500
+
+    # Reloading an unchanged file should match every section and produce no
+    # commands.  Each section is compared with the one section that has the
+    # same content rather than with every section.
+    optionsMatch = ConfigObject.optionsMatch
+    calls = []
+
+    def countingOptionsMatch(self, other):
+        calls.append(self)
+        return optionsMatch(self, other)
+
+    with patch.object(ConfigObject, "optionsMatch", countingOptionsMatch):
+        manager.loadConfig(search=confFile, execute=False)
+    assert len(manager.currentConfig) == 500
+    assert len(list(manager.previousCommands.commands())) == 0
+    assert len(calls) <= 2 * 500
+
+    # Changing one section should only remove the old rule and add the new
+    # one.
+    write_config(500, changed=42)
+    manager.loadConfig(search=confFile, execute=False)
+    commands = [str(cmd) for cmd in manager.previousCommands.commands()]
+    assert len(commands) == 2
+    assert "--delete" in commands[0] and "2042" in commands[0]
+    assert "--append" in commands[1] and "2542" in commands[1]
+
+    shutil.rmtree(temp)
+
+
+@patch("paradrop.confd.command.Command.execute")
+def test_manager_execute_workers(execute):
+    """
+    Test the manager execute method with a worker pool
+    """
+    from paradrop.confd.manager import ConfigManager
+
+    manager = ConfigManager(writeDir="/tmp", workers=4)
+
+    source = os.path.join(CONFIG_DIR, "multi_ap")
+    manager.loadConfig(search=source, execute=True)
+    assert execute.call_count == len(manager.previousCommands)
+
+
+def test_manager_execute_workers_rule_order():
+    """
+    Test that firewall rules keep their order with a worker pool
+    """
+    import random
+    import threading
+    import time
+    from paradrop.confd.command import Command
+    from paradrop.confd.manager import ConfigManager
+
+    temp = tempfile.mkdtemp()
+    confFile = os.path.join(temp, "firewall")
+    with open(confFile, "w") as output:
+        for i in range(20):
+            output.write("config rule\n")
+            output.write("    option src 'lan'\n")
+            output.write("    option proto 'tcp'\n")
+            output.write("    option dest_port '{}'\n".format(2000 + i))
+            output.write("    option target 'ACCEPT'\n\n")
+
+    lock = threading.Lock()
+    executed = []
+
+    def execute(cmd):
+        # Give other threads a chance to run out of order.
+        time.sleep(random.random() * 0.005)
+        with lock:
+            executed.append(str(cmd))
+        return True
+
+    manager = ConfigManager(writeDir=temp, workers=4)
+    with patch.object(Command, "execute", autospec=True) as mock_execute:
+        mock_execute.side_effect = execute
+        manager.loadConfig(search=confFile, execute=True)
+
+    expected = [str(cmd) for cmd in manager.previousCommands.commands()
+                if cmd.command[0] == "iptables"]
+    assert len(expected) == 20
+    assert [cmd for cmd in executed if cmd.startswith("iptables")] == expected
+
+    shutil.rmtree(temp)
+
+
+def test_reload_changed_files():
+    """
+    Test reloading a subset of files with a dependency between files
+    """
+    from paradrop.confd.manager import ConfigManager, findConfigFiles
+
+    temp = tempfile.mkdtemp()
+    networkFile = os.path.join(temp, "network")
+    dhcpFile = os.path.join(temp, "dhcp")
+
+    def write_network(ipaddr):
+        with open(networkFile, "w") as output:
+            output.write("config interface lan\n")
+            output.write("    option ifname 'eth1'\n")
+            output.write("    option proto 'static'\n")
+            output.write("    option ipaddr '{}'\n".format(ipaddr))
+            output.write("    option netmask '255.255.255.0'\n\n")
+
+    write_network("192.168.1.1")
+    with open(dhcpFile, "w") as output:
+        output.write("config dnsmasq\n")
+        output.write("    option interface 'lan'\n\n")
+        output.write("config dhcp lan\n")
+        output.write("    option interface 'lan'\n")
+        output.write("    option start '100'\n")
+        output.write("    option limit '50'\n")
+        output.write("    option leasetime '12h'\n\n")
+
+    assert findConfigFiles([networkFile, dhcpFile, networkFile]) == \
+        [networkFile, dhcpFile]
+
+    manager = ConfigManager(writeDir=temp)
+    manager.loadConfig(search=[networkFile, dhcpFile], execute=False)
+    assert len(manager.currentConfig) == 3
+
+    # Only the network file changed, but the dnsmasq instance from the dhcp
+    # file depends on the interface, so it should be restarted as well.
+    write_network("192.168.2.1")
+    manager.loadConfig(search=[networkFile], execute=False)
+    assert len(manager.currentConfig) == 3
+
+    commands = [str(cmd) for cmd in manager.previousCommands.commands()]
+    assert any("ip addr change 192.168.2.1" in cmd for cmd in commands)
+
+    # The old dnsmasq instance is stopped before the new one starts.
+    kills = [i for i, cmd in enumerate(commands) if cmd.startswith("kill")]
+    starts = [i for i, cmd in enumerate(commands) if cmd.startswith("dnsmasq")]
+    assert len(kills) == 1
+    assert len(starts) == 1
+    assert kills[0] < starts[0]
+
+    # Nothing changed.
+    manager.loadConfig(search=[networkFile], execute=False)
+    assert len(list(manager.previousCommands.commands())) == 0
+
+    shutil.rmtree(temp)
+
+
+def test_reload_recreated_qos_device():
+    """
+    Test that the QoS tree is rebuilt when its device is recreated
+    """
+    from paradrop.confd.manager import ConfigManager
+
+    temp = tempfile.mkdtemp()
+    networkFile = os.path.join(temp, "network")
+    qosFile = os.path.join(temp, "qos")
+
+    def write_network(proto):
+        with open(networkFile, "w") as output:
+            output.write("config interface lan\n")
+            output.write("    option type 'bridge'\n")
+            output.write("    option ifname 'eth1'\n")
+            output.write("    option proto '{}'\n".format(proto))
+            if proto == "static":
+                output.write("    option ipaddr '192.168.1.1'\n")
+                output.write("    option netmask '255.255.255.0'\n")
+            output.write("\n")
+
+    write_network("static")
+    with open(qosFile, "w") as output:
+        output.write("config interface lan\n")
+        output.write("    option enabled '1'\n")
+        output.write("    option classgroup 'Default'\n\n")
+        output.write("config classgroup Default\n")
+        output.write("    option classes 'Normal'\n")
+        output.write("    option default 'Normal'\n\n")
+        output.write("config class Normal\n")
+        output.write("    option priority '10'\n\n")
+
+    manager = ConfigManager(writeDir=temp)
+    manager.loadConfig(search=[networkFile, qosFile], execute=False)
+
+    # Changing the protocol deletes and recreates the bridge, which takes its
+    # qdiscs with it, so the whole tree must be installed again.
+    write_network("dhcp")
+    manager.loadConfig(search=[networkFile], execute=False)
+
+    commands = [str(cmd) for cmd in manager.previousCommands.commands()]
+    assert "ip link delete br-lan" in commands
+    assert "ip link add name br-lan type bridge" in commands
+
+    batches = [cmd for cmd in manager.previousCommands.commands()
+               if "-batch" in cmd.command]
+    assert len(batches) == 1
+    verbs = [line[:2] for line in batches[0].lines]
+    assert verbs == [["qdisc", "add"], ["class", "add"], ["qdisc", "add"]]
+
+    shutil.rmtree(temp)
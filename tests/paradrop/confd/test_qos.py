@@ -1,10 +1,10 @@
-from mock import MagicMock
+from mock import MagicMock, patch
 
 
 from paradrop.confd import network, qos
 
 
-def test_qos():
+def make_configs():
     net_iface = network.ConfigInterface()
     net_iface.name = "wan"
     net_iface.ifname = ["eth0"]
@@ -64,10 +64,170 @@ def test_qos():
     net_iface.setup()
     group.setup()
 
+    return allConfigs
+
+
+def test_qos():
+    allConfigs = make_configs()
+    qos_iface = allConfigs[("qos", "interface", "wan")]
+
     commands = qos_iface.apply(allConfigs)
     for cmd in commands:
         print(cmd[1])
-    assert len(commands) > 0
+    assert len(commands) == 1
+
+    # Root qdisc, two classes, and two leaf qdiscs in one batch.
+    batch = commands[0][1]
+    assert isinstance(batch, qos.TcBatchCommand)
+    assert len(batch.lines) == 5
+    assert batch.lines[0][:2] == ["qdisc", "add"]
+    assert "default 1" in batch.getInput()
+
+    commands = qos_iface.revert(allConfigs)
+    assert len(commands) == 1
+    assert "del" in commands[0][1]
+
+
+def test_qos_update_class():
+    allConfigs = make_configs()
+    qos_iface = allConfigs[("qos", "interface", "wan")]
+    classify = allConfigs[("qos", "classify", "other-2")]
+
+    qos_iface.apply(allConfigs)
+    classify.apply(allConfigs)
+
+    # Changing one class should modify that class in place.
+    allConfigs[("qos", "class", "Special")].avgrate = 30
+
+    assert qos_iface.updateRevert(qos_iface, allConfigs) == []
+    commands = qos_iface.updateApply(qos_iface, allConfigs)
+    assert len(commands) == 1
+    lines = commands[0][1].lines
+    assert len(lines) == 1
+    assert lines[0][:2] == ["class", "change"]
+    assert "1:2" in lines[0]
+
+    # Nothing changed for the classify rules.
+    assert classify.updateRevert(classify, allConfigs) == []
+    assert classify.updateApply(classify, allConfigs) == []
+
+    # No changes at all should produce no commands.
+    assert qos_iface.updateRevert(qos_iface, allConfigs) == []
+    assert qos_iface.updateApply(qos_iface, allConfigs) == []
+
+
+def test_qos_update_classgroup():
+    allConfigs = make_configs()
+    qos_iface = allConfigs[("qos", "interface", "wan")]
+    classify = allConfigs[("qos", "classify", "other-2")]
+    group = allConfigs[("qos", "classgroup", "Group")]
+
+    qos_iface.apply(allConfigs)
+    classify.apply(allConfigs)
+
+    # Adding a class should add the class and its leaf qdisc.
+    extra = qos.ConfigClass()
+    extra.name = "Extra"
+    extra.avgrate = 10
+    extra.priority = 5
+    allConfigs[("qos", "class", "Extra")] = extra
+    group.classes = "Default Special Extra"
+    group.setup()
+
+    assert qos_iface.updateRevert(qos_iface, allConfigs) == []
+    commands = qos_iface.updateApply(qos_iface, allConfigs)
+    lines = commands[0][1].lines
+    verbs = [line[:2] for line in lines]
+    assert ["class", "add"] in verbs
+    assert ["qdisc", "add"] in verbs
+    assert "1:3" in lines[0]
+
+    # Removing the Special class should delete it and its classify rule.
+    group.classes = "Default Extra"
+    group.setup()
+
+    assert qos_iface.updateRevert(qos_iface, allConfigs) == []
+    commands = qos_iface.updateApply(qos_iface, allConfigs)
+    verbs = [line[:2] for line in commands[0][1].lines]
+    assert ["class", "del"] in verbs
+
+    commands = classify.updateRevert(classify, allConfigs)
+    assert len(commands) == 1
+    assert "--delete" in commands[0][1]
+    assert classify.updateApply(classify, allConfigs) == []
+
+    # Changing the default class changes the root qdisc, so rebuild.
+    group.default = "Extra"
+    group.setup()
+
+    commands = qos_iface.updateRevert(qos_iface, allConfigs)
+    assert len(commands) == 1
+    commands = qos_iface.updateApply(qos_iface, allConfigs)
+    assert commands[0][1].lines[0][:2] == ["qdisc", "add"]
+
+
+def test_qos_update_network_interface():
+    allConfigs = make_configs()
+    qos_iface = allConfigs[("qos", "interface", "wan")]
+    net_iface = allConfigs[("network", "interface", "wan")]
+
+    qos_iface.apply(allConfigs)
+
+    # The network interface was reloaded because one of its own dependencies
+    # changed, so the device may have been recreated without its qdiscs.
+    net_iface.epoch += 1
+
+    commands = qos_iface.updateRevert(qos_iface, allConfigs)
+    assert len(commands) == 1
+    commands = qos_iface.updateApply(qos_iface, allConfigs)
+    assert len(commands[0][1].lines) == 5
+    assert commands[0][1].lines[0][:2] == ["qdisc", "add"]
+
+    # Same when the network interface section is replaced.
+    replacement = network.ConfigInterface()
+    replacement.name = "wan"
+    replacement.ifname = ["eth0"]
+    replacement.setup()
+    allConfigs[("network", "interface", "wan")] = replacement
+
+    assert len(qos_iface.updateRevert(qos_iface, allConfigs)) == 1
+    commands = qos_iface.updateApply(qos_iface, allConfigs)
+    assert commands[0][1].lines[0][:2] == ["qdisc", "add"]
+
+    # Afterwards, an unrelated change is applied in place again.
+    allConfigs[("qos", "class", "Special")].avgrate = 30
+    assert qos_iface.updateRevert(qos_iface, allConfigs) == []
+
+
+@patch("paradrop.confd.qos.subprocess")
+def test_TcBatchCommand(subprocess):
+    proc = MagicMock()
+    proc.communicate.return_value = ("", "")
+    proc.returncode = 0
+    subprocess.Popen.return_value = proc
+
+    parent = MagicMock()
+    parent.executed = []
+
+    cmd = qos.TcBatchCommand([
+        ["qdisc", "add", "dev", "eth0", "root", "handle", "1:", "hfsc"],
+        ["class", "del", "dev", "eth0", "classid", 1]
+    ], parent)
+
+    assert "eth0" in cmd
+    assert cmd.execute()
+    assert parent.executed == [cmd]
+    assert cmd.success()
+    proc.communicate.assert_called_once_with(
+        "qdisc add dev eth0 root handle 1: hfsc\n"
+        "class del dev eth0 classid 1\n")
+
+    # Fall back to individual commands if tc -batch cannot run.
+    subprocess.Popen.side_effect = OSError()
+    with patch("paradrop.confd.qos.Command.execute") as execute:
+        execute.return_value = True
+        assert cmd.execute()
+        assert execute.call_count == 2
 
 
 def test_compute_hfsc_params():
@@ -1,3 +1,6 @@
+import json
+import zlib
+
 from mock import patch, MagicMock
 
 from paradrop.core.agent import http
@@ -79,3 +82,19 @@ def test_PDServerRequest_receiveResponse(nexus):
     request.receiveResponse(response)
     driver.setHeader.assert_called_with('Authorization', 'Bearer token2')
     driver.request.assert_called()
+
+
+@patch("paradrop.core.agent.http.nexus")
+def test_PDServerRequest_compress(nexus):
+    driver = MagicMock()
+    driver_factory = MagicMock()
+    driver_factory.return_value = driver
+
+    request = http.PDServerRequest("test", driver=driver_factory,
+            compress=True)
+    request.post(var=42)
+    driver.setHeader.assert_any_call('Content-Encoding', 'gzip')
+
+    args = driver.request.call_args[0]
+    body = zlib.decompress(args[2], 16 + zlib.MAX_WBITS)
+    assert json.loads(body.decode('utf-8')) == {'var': 42}
@@ -0,0 +1,135 @@
+from mock import patch, MagicMock
+
+from paradrop.core.agent import reporting
+from paradrop.core.system import node_facts
+
+
+def fake_deferred(*args, **kwargs):
+    """
+    Returns a fake deferred object whose addCallback method immediately fires
+    with the given arguments.
+    """
+    deferred = MagicMock()
+    deferred.result = None
+
+    def call_callback(cb):
+        deferred.result = cb(*args, **kwargs)
+    deferred.addCallback.side_effect = call_callback
+    return deferred
+
+
+def make_response(code, data=None):
+    response = MagicMock()
+    response.code = code
+    response.success = (code >= 200 and code < 300)
+    response.data = data
+    return response
+
+
+@patch("paradrop.core.system.node_facts.system_info")
+def test_StateReportBuilder_getStaticFacts(system_info):
+    system_info.getOSVersion.return_value = "Ubuntu 4.4.0"
+    system_info.getPackageVersion.return_value = "0.13.0"
+    system_info.getDMI.return_value = {'bios_vendor': 'coreboot'}
+
+    node_facts.facts.invalidate()
+    node_facts.facts.register('software', node_facts.getSoftwareFacts)
+    node_facts.facts.register('dmi', system_info.getDMI)
+
+    facts = reporting.StateReportBuilder.getStaticFacts()
+    assert facts['dmi'] == system_info.getDMI.return_value
+    assert facts['osVersion'] == system_info.getOSVersion.return_value
+
+    # The facts should be computed only once.
+    reporting.StateReportBuilder.getStaticFacts()
+    assert system_info.getDMI.call_count == 1
+    assert system_info.getOSVersion.call_count == 1
+
+    node_facts.facts.register('dmi', node_facts.system_info.getDMI)
+
+
+@patch("paradrop.core.agent.reporting.reactor")
+@patch("paradrop.core.agent.reporting.nexus")
+@patch("paradrop.core.agent.reporting.PDServerRequest")
+def test_StateReportSender(PDServerRequest, nexus, reactor):
+    builder = MagicMock()
+    request = MagicMock()
+    PDServerRequest.return_value = request
+
+    sender = reporting.StateReportSender()
+    sender.useDelta = True
+
+    # First report is sent in full.
+    builder.prepare.return_value = {'name': 'node', 'chutes': []}
+    request.post.return_value = fake_deferred(make_response(200))
+    sender._send(builder)
+    assert PDServerRequest.call_args[0][0].endswith('/states')
+    request.post.assert_called_with(name='node', chutes=[], version=1)
+    assert sender.version == 1
+
+    # Second report is a delta against the first.
+    builder.prepare.return_value = {'name': 'node', 'chutes': ['a']}
+    request.post.return_value = fake_deferred(make_response(200))
+    sender._send(builder)
+    assert PDServerRequest.call_args[0][0].endswith('/states/delta')
+    request.post.assert_called_with(base=1, version=2, patch=[
+        {'op': 'add', 'path': '/chutes/0', 'value': 'a'}
+    ])
+    assert sender.acked == {'name': 'node', 'chutes': ['a']}
+
+    # Server asks for a resync, so we send the full report again.
+    request.post.return_value = fake_deferred(make_response(409))
+    sender._send(builder, resend=False)
+    assert sender.acked is None
+    assert sender.version == 2
+
+    request.post.return_value = fake_deferred(make_response(200))
+    sender._send(builder)
+    request.post.assert_called_with(name='node', chutes=['a'], version=3)
+
+    # Server does not support deltas.
+    request.post.return_value = fake_deferred(make_response(404))
+    sender._send(builder, resend=False)
+    assert sender.useDelta is False
+    assert sender.acked is None
+
+    # Failures do not change the acknowledged report and schedule a retry.
+    sender.acked = {'name': 'node', 'chutes': []}
+    request.post.return_value = fake_deferred(make_response(500))
+    sender._send(builder)
+    assert sender.acked == {'name': 'node', 'chutes': []}
+    assert reactor.callLater.called
+
+
+@patch("paradrop.core.agent.reporting.reactor")
+@patch("paradrop.core.agent.reporting.nexus")
+@patch("paradrop.core.agent.reporting.PDServerRequest")
+def test_StateReportSender_compression(PDServerRequest, nexus, reactor):
+    builder = MagicMock()
+    builder.prepare.return_value = {'name': 'node', 'chutes': []}
+
+    request = MagicMock()
+    PDServerRequest.return_value = request
+
+    sender = reporting.StateReportSender()
+    sender.useCompression = True
+
+    # The server rejects the compressed body, so the report is sent again
+    # without compression, and later reports are not compressed either.
+    request.post.side_effect = [
+        fake_deferred(make_response(415)),
+        fake_deferred(make_response(200))
+    ]
+    sender._send(builder)
+    assert [c[1]['compress'] for c in PDServerRequest.call_args_list] == \
+        [True, False]
+    assert sender.useCompression is False
+    assert sender.version == 1
+    assert not reactor.callLater.called
+
+    # Other errors with uncompressed reports are retried as before.
+    request.post.side_effect = None
+    request.post.return_value = fake_deferred(make_response(400))
+    sender._send(builder)
+    assert PDServerRequest.call_args[1]['compress'] is False
+    assert reactor.callLater.called
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+
+from mock import patch, MagicMock
+
+from paradrop.core.agent import telemetry
+
+
+def fake_deferred(*args, **kwargs):
+    """
+    Returns a fake deferred object whose addCallback method immediately fires
+    with the given arguments.
+    """
+    def call_callback(cb):
+        cb(*args, **kwargs)
+    deferred = MagicMock()
+    deferred.addCallback.side_effect = call_callback
+    return deferred
+
+
+def make_sample(i):
+    return {
+        'time': float(i),
+        'system': {'cpu_count': 4},
+        'chutes': [],
+        'network': [{'name': 'eth0', 'bytes_sent': i * 1000}]
+    }
+
+
+def test_TelemetrySpool():
+    path = tempfile.mkdtemp()
+    try:
+        spool = telemetry.TelemetrySpool(path, 100000, 1000)
+        assert not spool.pending()
+
+        for i in range(50):
+            spool.append(make_sample(i), float(i))
+        assert spool.pending()
+        assert len(spool.segments) > 1
+
+        samples, position = spool.read(20)
+        assert [s['time'] for s in samples] == list(range(20))
+
+        # Reading again without acknowledging returns the same samples.
+        samples, position = spool.read(20)
+        assert samples[0]['time'] == 0
+        spool.acknowledge(position)
+
+        # The spool should resume from the cursor after a restart.
+        spool = telemetry.TelemetrySpool(path, 100000, 1000)
+        samples, position = spool.read(100)
+        assert [s['time'] for s in samples] == list(range(20, 50))
+        spool.acknowledge(position)
+        assert not spool.pending()
+        assert len(spool.segments) == 1
+
+        # A partial record at the end of the spool is discarded.
+        spool.append(make_sample(50), 50.0)
+        number = max(spool.segments)
+        with open(spool.segmentPath(number), "ab") as output:
+            output.write(b"\x00\x01\x02")
+        spool = telemetry.TelemetrySpool(path, 100000, 1000)
+        spool.append(make_sample(51), 51.0)
+        samples, position = spool.read(100)
+        assert [s['time'] for s in samples] == [50, 51]
+    finally:
+        shutil.rmtree(path)
+
+
+def test_TelemetrySpool_limit():
+    path = tempfile.mkdtemp()
+    try:
+        spool = telemetry.TelemetrySpool(path, 2000, 500)
+        for i in range(200):
+            spool.append(make_sample(i), float(i))
+
+        # Oldest samples are dropped to keep the spool bounded.
+        assert spool.size() <= 2000 + 500
+        assert spool.dropped > 0
+
+        samples, position = spool.read(1000)
+        assert len(samples) + spool.dropped == 200
+        assert samples[-1]['time'] == 199
+        assert len(os.listdir(path)) == len(spool.segments) + 1
+    finally:
+        shutil.rmtree(path)
+
+
+@patch("paradrop.core.agent.telemetry.reactor")
+@patch("paradrop.core.agent.telemetry.settings")
+@patch("paradrop.core.agent.telemetry.nexus")
+@patch("paradrop.core.agent.telemetry.PDServerRequest")
+def test_TelemetryService(PDServerRequest, nexus, settings, reactor):
+    settings.TELEMETRY_BATCH_SIZE = 10
+    settings.TELEMETRY_MAX_BATCHES = 2
+    settings.TELEMETRY_DRAIN_DELAY = 5
+
+    request = MagicMock()
+    PDServerRequest.return_value = request
+
+    path = tempfile.mkdtemp()
+    try:
+        spool = telemetry.TelemetrySpool(path, 100000, 1000)
+        builder = MagicMock()
+        service = telemetry.TelemetryService(spool=spool, builder=builder)
+
+        for i in range(25):
+            builder.prepare.return_value = make_sample(i)
+            service.sample()
+
+        # Upload fails, so the samples stay in the spool.
+        response = MagicMock()
+        response.success = False
+        response.code = 503
+        request.post.return_value = fake_deferred(response)
+        service.upload()
+        assert spool.read(100)[0][0]['time'] == 0
+        assert service.uploading is False
+
+        # Upload succeeds, and the next batch is scheduled.
+        response.success = True
+        response.code = 200
+        service.upload()
+        args = request.post.call_args[1]
+        assert len(args['samples']) == 10
+        assert spool.read(100)[0][0]['time'] == 10
+        reactor.callLater.assert_called_once_with(5, service.sendBatch, 1)
+
+        # Second batch uses up the batch limit for this upload.
+        service.sendBatch(1)
+        assert spool.read(100)[0][0]['time'] == 20
+        assert service.uploading is False
+    finally:
+        shutil.rmtree(path)
+
+
+def test_TelemetryService_sample():
+    path = tempfile.mkdtemp()
+    try:
+        spool = telemetry.TelemetrySpool(path, 4 * 1024 * 1024, 256 * 1024)
+
+        builder = MagicMock()
+        builder.prepare.side_effect = [make_sample(0), Exception("failed"),
+                                       make_sample(2)]
+        service = telemetry.TelemetryService(spool=spool, builder=builder)
+
+        # A failed sample is skipped without interrupting later ones.
+        for i in range(3):
+            service.sample()
+
+        samples, position = spool.read(10)
+        assert [s['time'] for s in samples] == [0.0, 2.0]
+        assert samples[1] == make_sample(2)
+    finally:
+        shutil.rmtree(path)
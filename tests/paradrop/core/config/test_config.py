@@ -152,6 +152,30 @@ def test_configservice():
     assert_raises(Exception, configservice.reloadAll, update)
 
 
+@patch("paradrop.confd.client.reloadFiles")
+def test_configservice_reloadChanged(reloadFiles):
+    """
+    Test reloading only the files changed by an update
+    """
+    from paradrop.core.config import configservice
+
+    # Nothing changed, so nothing should be reloaded.
+    update = UpdateObject({'name': 'test'})
+    assert configservice.reloadChanged(update) is None
+    assert reloadFiles.call_count == 0
+
+    reloadFiles.return_value = mockStatusStringGood()
+    update.changedConfigFiles.update(["/etc/config/network", "/etc/config/dhcp"])
+    configservice.reloadChanged(update)
+    reloadFiles.assert_called_once_with(["/etc/config/dhcp", "/etc/config/network"])
+    assert len(update.changedConfigFiles) == 0
+
+    reloadFiles.return_value = mockStatusStringBad()
+    update = UpdateObject({'name': 'BadChute'})
+    update.changedConfigFiles.add("/etc/config/network")
+    assert_raises(Exception, configservice.reloadChanged, update)
+
+
 @patch("paradrop.lib.utils.pdos.readFile", new=mockReadFile)
 @patch("paradrop.lib.utils.pdos.exists", new=mockExists)
 @patch("paradrop.lib.utils.pdos.listdir", new=mockListDir)
@@ -379,13 +403,14 @@ def test_get_network_config_wifi():
     Test generating configuration for chute WiFi interface.
     """
     from paradrop.core.config.network import getNetworkConfigWifi
+    from paradrop.core.config.reservations import SubnetReservationSet
 
     # Set up enough fake data to make call.
     update = UpdateObject({'name': 'test'})
     update.old = None
 
     update.cache_set('interfaceReservations', set())
-    update.cache_set('subnetReservations', set())
+    update.cache_set('subnetReservations', SubnetReservationSet())
 
     cfg = {
         "type": "wifi-ap",
@@ -411,7 +436,7 @@ def test_get_network_config():
     Test generating network configuration for a chute update.
     """
     from paradrop.core.config import network
-    from paradrop.core.config.reservations import DeviceReservations
+    from paradrop.core.config.reservations import DeviceReservations, SubnetReservationSet
 
     # Test normal case where key is defined and encryption is implied.
     iface = dict()
@@ -465,7 +490,7 @@ def test_get_network_config():
     update.cache_set("deviceReservations", {
         "wlan0": DeviceReservations()
     })
-    update.cache_set("subnetReservations", set())
+    update.cache_set("subnetReservations", SubnetReservationSet())
     update.cache_set("interfaceReservations", set())
 
     # Missing 'ssid' field should raise exception.
@@ -0,0 +1,98 @@
+import os
+import subprocess
+import time
+
+from mock import MagicMock
+from nose.plugins.skip import SkipTest
+
+from paradrop.core.config import device_inventory, devices
+
+
+def test_DeviceInventory():
+    scan = MagicMock()
+    scan.return_value = [{'name': 'eth0', 'type': 'wan'}]
+
+    inventory = device_inventory.DeviceInventory(scan,
+            ignore=devices.isIgnoredInterface)
+
+    # Without the watcher, every call scans.
+    inventory.get()
+    inventory.get()
+    assert scan.call_count == 2
+
+    # The watcher invalidates the inventory when it starts.
+    inventory.watching = True
+    inventory.invalidate()
+    inventory.get()
+    result = inventory.get()
+    assert scan.call_count == 3
+
+    # Callers get their own copy.
+    result[0]['type'] = 'lan'
+    assert inventory.get()[0]['type'] == 'wan'
+    assert scan.call_count == 3
+
+    # Events for virtual interfaces are ignored.
+    msg = MagicMock()
+    msg.get.return_value = "RTM_NEWLINK"
+    msg.get_attr.return_value = "veth1234"
+    inventory.handleLinkMessage(msg)
+    inventory.handleUevent({'SUBSYSTEM': 'net', 'INTERFACE': 'vwlan0.0000'})
+    inventory.handleUevent({'SUBSYSTEM': 'usb'})
+    inventory.get()
+    assert scan.call_count == 3
+
+    # Relevant events trigger a new scan.
+    msg.get_attr.return_value = "eth1"
+    inventory.handleLinkMessage(msg)
+    inventory.get()
+    assert scan.call_count == 4
+
+    inventory.handleUevent({'SUBSYSTEM': 'ieee80211'})
+    inventory.get()
+    assert scan.call_count == 5
+
+    # So does an old scan.
+    inventory.scanTime -= 10000
+    inventory.get()
+    assert scan.call_count == 6
+
+
+def test_DeviceInventory_watch():
+    """
+    Test that the watcher sees a new interface
+    """
+    if device_inventory.IPRoute is None or os.geteuid() != 0:
+        raise SkipTest("requires pyroute2 and root")
+
+    scan = MagicMock()
+    scan.return_value = []
+
+    inventory = device_inventory.DeviceInventory(scan)
+    inventory.start()
+    parent = "pdi{:x}".format(os.getpid() & 0xffff)
+    try:
+        for i in range(50):
+            if inventory.watching:
+                break
+            time.sleep(0.1)
+
+        inventory.get()
+        inventory.get()
+        assert scan.call_count == 1
+
+        try:
+            subprocess.check_call(["ip", "link", "add", parent, "type",
+                                   "veth", "peer", "name", parent + "p"])
+        except (OSError, subprocess.CalledProcessError):
+            raise SkipTest("cannot create interfaces")
+
+        for i in range(50):
+            inventory.get()
+            if scan.call_count > 1:
+                break
+            time.sleep(0.1)
+        assert scan.call_count == 2
+    finally:
+        inventory.stop()
+        subprocess.call(["ip", "link", "del", parent])
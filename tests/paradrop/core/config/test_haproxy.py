@@ -1,39 +1,185 @@
-import StringIO
+import shutil
+import socket
+import tempfile
+import threading
 
+import six
 from mock import MagicMock, patch
 from nose.tools import assert_raises
 
+from paradrop.base.exceptions import ChuteNotFound
 from paradrop.core.config import haproxy
 
 
+def make_info(ip, running=True, hostPort=None):
+    ports = {}
+    if hostPort is not None:
+        ports['80/tcp'] = [{'HostIp': '0.0.0.0', 'HostPort': hostPort}]
+    return {
+        'State': {'Running': running},
+        'NetworkSettings': {'IPAddress': ip, 'Ports': ports}
+    }
+
+
 @patch("paradrop.core.config.haproxy.ChuteContainer")
 @patch("paradrop.core.config.haproxy.ChuteStorage.getChuteList")
-def test_generateConfigSections(getChuteList, ChuteContainer):
+def test_getChuteBackends(getChuteList, ChuteContainer):
     service = MagicMock()
     service.get_container_name.return_value = "main"
 
-    chute1 = MagicMock()
-    chute1.name = "chute1"
-    chute1.get_web_port_and_service.return_value = (80, service)
-
-    getChuteList.return_value = [chute1]
+    chutes = []
+    for name in ["chute1", "chute2", "chute3", "chute4"]:
+        chute = MagicMock()
+        chute.name = name
+        chute.get_web_port_and_service.return_value = (80, service)
+        chutes.append(chute)
+    chutes[3].get_web_port_and_service.return_value = (None, None)
+    getChuteList.return_value = chutes
 
     container = MagicMock()
-    container.isRunning.return_value = True
+    container.inspect.side_effect = [
+        make_info("172.17.0.2", hostPort="32768"),
+        make_info("172.17.0.3", running=False),
+        ChuteNotFound()
+    ]
     ChuteContainer.return_value = container
 
-    sections = haproxy.generateConfigSections()
-    assert len(sections) > 0
+    backends = haproxy.getChuteBackends()
+    assert backends == {
+        'chute1': {'ip': '172.17.0.2', 'port': 80, 'hostPort': '32768'}
+    }
+
+    # Only one inspect per chute.
+    assert container.inspect.call_count == 3
+
+
+def test_ProxyManager():
+    path = tempfile.mkdtemp()
+    try:
+        manager = haproxy.ProxyManager(path, path)
+        manager.slotCount = 2
+        manager.reload = MagicMock()
+        manager.runtimeCommand = MagicMock()
+
+        chute1 = {'ip': '172.17.0.2', 'port': 80, 'hostPort': '32768'}
+        chute2 = {'ip': '172.17.0.3', 'port': 8000, 'hostPort': None}
+
+        # The first configuration loads haproxy.
+        assert manager.reconfigure({'chute1': chute1})
+        assert manager.reload.call_count == 1
+        with open(manager.confFile, "r") as source:
+            conf = source.read()
+        assert "backend chute_slot1" in conf
+        assert "server web 172.17.0.2:80 maxconn 256" in conf
+        with open(manager.hostMapFile, "r") as source:
+            assert source.read() == "chute1.chute.paradrop.org chute_slot1\n"
+        with open(manager.portMapFile, "r") as source:
+            assert source.read() == "chute1 32768\n"
+
+        # Pretend haproxy is running.
+        with open(manager.pidFile, "w") as output:
+            output.write("1234\n")
+
+        # Adding a chute uses the runtime API.
+        assert not manager.reconfigure({'chute1': chute1, 'chute2': chute2})
+        assert manager.reload.call_count == 1
+        commands = [c[0][0] for c in manager.runtimeCommand.call_args_list]
+        assert commands == [
+            "set server chute_slot2/web addr 172.17.0.3 port 8000",
+            "enable server chute_slot2/web",
+            "add map {} chute2.chute.paradrop.org chute_slot2".format(
+                manager.hostMapFile)
+        ]
+
+        # Restarting a chute at a new address and removing another.
+        manager.runtimeCommand.reset_mock()
+        chute1 = dict(chute1, ip='172.17.0.4', hostPort='32769')
+        assert not manager.reconfigure({'chute1': chute1})
+        commands = [c[0][0] for c in manager.runtimeCommand.call_args_list]
+        assert commands == [
+            "del map {} chute2.chute.paradrop.org".format(manager.hostMapFile),
+            "disable server chute_slot2/web",
+            "set server chute_slot1/web addr 172.17.0.4 port 80",
+            "set map {} chute1 32769".format(manager.portMapFile)
+        ]
+
+        # Nothing changed.
+        manager.runtimeCommand.reset_mock()
+        assert not manager.reconfigure({'chute1': chute1})
+        assert manager.runtimeCommand.call_count == 0
 
-    # Make sure one of the sections is for chute1.
-    assert any(chute1.name in v['header'] for v in sections)
+        # Running out of slots changes the structure and requires a reload.
+        chute3 = dict(chute2, ip='172.17.0.5')
+        assert manager.reconfigure({'chute1': chute1, 'chute2': chute2,
+                                    'chute3': chute3})
+        assert manager.reload.call_count == 2
+        assert manager.slotCount == 4
+        assert manager.slots == {'chute1': 1, 'chute2': 2, 'chute3': 3}
+
+        # Fall back to reloading if the runtime API fails.
+        manager.runtimeCommand.side_effect = haproxy.RuntimeAPIError("error")
+        assert manager.reconfigure({'chute1': chute1})
+        assert manager.reload.call_count == 3
+    finally:
+        shutil.rmtree(path)
+
+
+def test_ProxyManager_runtimeCommand():
+    path = tempfile.mkdtemp()
+    try:
+        manager = haproxy.ProxyManager(path, path)
+
+        # haproxy is not running.
+        assert_raises(haproxy.RuntimeAPIError, manager.runtimeCommand,
+                      "show info")
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(manager.socketPath)
+        server.listen(1)
+
+        received = []
+        responses = [
+            b"\n",
+            b"IP changed from '127.0.0.1' to '172.17.0.2' by 'stats socket command'\n",
+            b"No such server.\n"
+        ]
+
+        def serve():
+            for response in responses:
+                conn, addr = server.accept()
+                received.append(conn.recv(4096))
+                conn.sendall(response)
+                conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+
+        manager.runtimeCommand("enable server chute_slot1/web")
+        manager.runtimeCommand("set server chute_slot1/web addr 172.17.0.2")
+        assert_raises(haproxy.RuntimeAPIError, manager.runtimeCommand,
+                      "enable server nothing/web")
+
+        thread.join()
+        server.close()
+        assert received[0] == b"enable server chute_slot1/web\n"
+    finally:
+        shutil.rmtree(path)
 
 
 def test_writeConfigFile():
-    output = StringIO.StringIO()
-    haproxy.writeConfigFile(output)
+    manager = haproxy.ProxyManager("/tmp", "/tmp")
+    output = six.StringIO()
+    haproxy.writeConfigFile(output, manager.generateConfigSections({}))
 
     conf = output.getvalue()
     output.close()
 
     assert len(conf) > 0
+    assert "stats socket /tmp/haproxy.sock" in conf
+
+    # The port is stripped from the Host header before it is used to
+    # choose a backend.
+    lines = [line.strip() for line in conf.splitlines()]
+    strip = lines.index("http-request replace-value Host (.*):.* \\1")
+    assert strip < [i for i, line in enumerate(lines)
+                    if line.startswith("use_backend")][0]
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, patch
+
+from paradrop.core.chute.chute import Chute
+from paradrop.core.config import leases
+
+
+LEASES = [
+    "1480650200 00:11:22:33:44:55 192.168.128.130 android-ffeeddccbbaa9988 *",
+    "1480640500 00:22:44:66:88:aa 192.168.128.170 someones-iPod 01:00:22:44:66:88:aa"
+]
+
+
+def write_leases(path, lines):
+    with open(path, "w") as output:
+        for line in lines:
+            output.write(line + "\n")
+
+
+def test_readLeaseFile():
+    path = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(path, "dnsmasq-wifi.leases")
+        write_leases(filename, LEASES + [""])
+
+        result = leases.readLeaseFile(filename)
+        assert len(result) == 2
+        assert result[0]['expires'] == 1480650200
+        assert result[0]['hostname'] == "android-ffeeddccbbaa9988"
+        assert result[1]['client_id'] == "01:00:22:44:66:88:aa"
+    finally:
+        shutil.rmtree(path)
+
+
+@patch("paradrop.core.config.leases.settings")
+@patch("paradrop.core.config.leases.ChuteStorage")
+def test_LeaseIndex(ChuteStorage, settings):
+    path = tempfile.mkdtemp()
+    try:
+        hostDir = os.path.join(path, "pdconfd")
+        chuteDir = os.path.join(path, "chute")
+        os.makedirs(hostDir)
+        os.makedirs(chuteDir)
+
+        settings.PDCONFD_WRITE_DIR = hostDir + "/"
+
+        chute = Chute(name="test")
+        chute.setCache("externalSystemDir", chuteDir)
+        ChuteStorage.chuteList = {"test": chute}
+
+        write_leases(os.path.join(chuteDir, "dnsmasq-wifi.leases"), LEASES)
+        write_leases(os.path.join(hostDir, "dnsmasq-lan.leases"), [
+            "1480650300 00:11:22:33:44:55 10.0.0.100 android-ffeeddccbbaa9988 *"
+        ])
+
+        index = leases.LeaseIndex()
+        events = []
+        index.addObserver(lambda event, lease: events.append((event, lease)))
+
+        index.sync()
+        assert len(events) == 3
+        assert len(index.getAll()) == 3
+        assert len(index.getAll(chute="test")) == 2
+
+        # Lookups work across networks.
+        found = index.find("mac_addr", "00:11:22:33:44:55")
+        assert len(found) == 2
+        assert set(x['network'] for x in found) == set(["wifi", "lan"])
+
+        found = index.find("hostname", "SOMEONES-IPOD")
+        assert len(found) == 1
+        assert found[0]['ip_addr'] == "192.168.128.170"
+        assert found[0]['chute'] == "test"
+
+        result = index.getNetworkLeases("test", "wifi")
+        assert [x['mac_addr'] for x in result] == [
+            "00:11:22:33:44:55", "00:22:44:66:88:aa"]
+        assert index.getNetworkLeases("test", "nomatch") is None
+
+        # A new lease and a removed lease.
+        del events[:]
+        write_leases(os.path.join(chuteDir, "dnsmasq-wifi.leases"), [
+            LEASES[1],
+            "1480650900 00:33:66:99:cc:ff 192.168.128.200 laptop *"
+        ])
+        index.poll()
+        assert sorted((e, l['mac_addr']) for e, l in events) == [
+            ("add", "00:33:66:99:cc:ff"),
+            ("remove", "00:11:22:33:44:55")
+        ]
+        assert len(index.find("mac_addr", "00:11:22:33:44:55")) == 1
+        assert index.find("ip_addr", "192.168.128.130") == []
+
+        # Renewing a lease is an update.
+        del events[:]
+        write_leases(os.path.join(chuteDir, "dnsmasq-wifi.leases"), [
+            LEASES[1].replace("1480640500", "1480650500"),
+            "1480650900 00:33:66:99:cc:ff 192.168.128.200 laptop *"
+        ])
+        index.poll()
+        assert [(e, l['expires']) for e, l in events] == [("update", 1480650500)]
+
+        # Removing the chute removes its leases.
+        del events[:]
+        ChuteStorage.chuteList = {}
+        index.sync()
+        assert len(events) == 2
+        assert all(e == "remove" for e, l in events)
+        assert len(index.getAll()) == 1
+        assert index.find("hostname", "laptop") == []
+    finally:
+        shutil.rmtree(path)
+
+
+@patch("paradrop.core.config.leases.reactor")
+def test_LeaseIndex_onNotify(reactor):
+    path = tempfile.mkdtemp()
+    try:
+        index = leases.LeaseIndex()
+        index.directories[path] = "test"
+
+        filename = os.path.join(path, "dnsmasq-wifi.leases")
+        write_leases(filename, LEASES)
+
+        filepath = MagicMock()
+        filepath.path = filename
+
+        # Several notifications result in one read.
+        index.onNotify(None, filepath, 0)
+        index.onNotify(None, filepath, 0)
+        assert reactor.callLater.call_count == 1
+
+        index._delayedCheck(filename)
+        assert len(index.getAll()) == 2
+
+        # Other files are ignored.
+        filepath.path = os.path.join(path, "dnsmasq-wifi.conf")
+        index.onNotify(None, filepath, 0)
+        assert reactor.callLater.call_count == 1
+    finally:
+        shutil.rmtree(path)
@@ -8,7 +8,7 @@ from mock import MagicMock, Mock, patch
 from paradrop.core.chute.chute import Chute
 from paradrop.core.chute.service import Service
 from paradrop.core.config import network
-from paradrop.core.config.reservations import DeviceReservations
+from paradrop.core.config.reservations import DeviceReservations, SubnetReservationSet
 from paradrop.core.update.update_object import UpdateObject
 
 
@@ -37,7 +37,7 @@ def test_getNetworkConfig():
 
     update.cache_set('deviceReservations', {})
     update.cache_set('interfaceReservations', set())
-    update.cache_set('subnetReservations', set())
+    update.cache_set('subnetReservations', SubnetReservationSet())
 
     update.state = "running"
 
@@ -2,6 +2,7 @@ import ipaddress
 
 from mock import patch, MagicMock
 
+from paradrop.base import constants
 from paradrop.core.config import reservations
 
 
@@ -112,12 +113,13 @@ def test_SubnetReservationSet():
 @patch("paradrop.core.config.reservations.ChuteStorage")
 def test_getSubnetReservations(ChuteStorage, prepareHostConfig, getWirelessPhyName):
     chute1 = MagicMock()
+    chute1.name = 'chute1'
     chute1.getCache.return_value = [{
         'device': 'wlan0',
         'type': 'wifi',
         'mode': 'ap',
         'externalIntf': 'vwlan0.0000',
-        'subnet': MagicMock()
+        'subnet': ipaddress.ip_network(u'10.128.1.0/24')
     }]
 
     ChuteStorage.chuteList = {
@@ -127,5 +129,235 @@ def test_getSubnetReservations(ChuteStorage, prepareHostConfig, getWirelessPhyNa
     # First test with no hostconfig interfaces.
     prepareHostConfig.return_value = {}
 
-    resv = reservations.getSubnetReservations()
-    assert len(resv) == 1
+    with patch.object(reservations, "subnetIndex", reservations.SubnetIndex()):
+        resv = reservations.getSubnetReservations()
+        assert len(resv) == 1
+
+        resv = reservations.getSubnetReservations(exclude='chute1')
+        assert len(resv) == 0
+
+
+def test_SubnetReservationSet_nextFree():
+    resv = reservations.SubnetReservationSet()
+    pool = ipaddress.ip_network(u'10.128.0.0/9')
+
+    first = resv.nextFree(pool, 24)
+    assert first == ipaddress.ip_network(u'10.128.0.0/24')
+    resv.add(first)
+
+    # A larger reservation blocks every /24 inside of it.
+    resv.add(ipaddress.ip_network(u'10.128.0.0/22'))
+    assert resv.nextFree(pool, 24) == ipaddress.ip_network(u'10.128.4.0/24')
+
+    # Reservations are counted, so the /24 is still reserved after the /22
+    # is removed once.
+    resv.remove(ipaddress.ip_network(u'10.128.0.0/22'))
+    assert ipaddress.ip_network(u'10.128.0.0/24') in resv
+    assert ipaddress.ip_network(u'10.128.1.0/24') not in resv
+    assert resv.nextFree(pool, 24) == ipaddress.ip_network(u'10.128.1.0/24')
+
+    # Unaligned reservations from outside the pool are skipped correctly.
+    resv.add(ipaddress.ip_network(u'10.128.1.128/25'))
+    assert resv.nextFree(pool, 24) == ipaddress.ip_network(u'10.128.2.0/24')
+
+    # Exhausted pool.
+    small = ipaddress.ip_network(u'10.128.0.0/23')
+    resv.add(ipaddress.ip_network(u'10.128.2.0/24'))
+    assert resv.nextFree(small, 24) is None
+
+    # Copies are independent.
+    copy = resv.copy()
+    copy.remove(first)
+    assert first in resv
+    assert first not in copy
+
+
+@patch("paradrop.core.config.reservations.ChuteStorage")
+def test_SubnetIndex(ChuteStorage):
+    net1 = ipaddress.ip_network(u'10.128.1.0/24')
+    net2 = ipaddress.ip_network(u'10.128.2.0/24')
+
+    chute1 = MagicMock()
+    chute1.name = 'chute1'
+    chute1.getCache.return_value = [{'subnet': net1}]
+
+    ChuteStorage.chuteList = {'chute1': chute1}
+
+    index = reservations.SubnetIndex()
+    index.load()
+    index.setHost({
+        'lan': {
+            'ipaddr': '10.128.0.1',
+            'netmask': '255.255.255.0'
+        }
+    })
+    assert len(index.reservations) == 2
+    assert net1 in index.reservations
+
+    # The chute list is only read once.
+    ChuteStorage.chuteList = {}
+    index.load()
+    assert net1 in index.reservations
+
+    # Chute changed networks.
+    chute1.getCache.return_value = [{'subnet': net2}]
+    index.setChute(chute1)
+    assert net1 not in index.reservations
+    assert net2 in index.reservations
+
+    # Chute removed.
+    index.removeChute('chute1')
+    assert len(index.reservations) == 1
+    assert net2 not in index.reservations
+
+    index.setChute(chute1)
+    index.clearChutes()
+    assert list(index.owners.keys()) == [constants.RESERVED_CHUTE_NAME]
+
+
+def test_SubnetReservationView():
+    pool = ipaddress.ip_network(u'10.128.0.0/16')
+    shared = reservations.SubnetReservationSet()
+    for i in range(8):
+        shared.add(ipaddress.ip_network(u'10.128.{}.0/24'.format(i)))
+
+    # The subnets of the chute being updated are free in its view, even in
+    # the middle of a run of reservations.
+    mine = ipaddress.ip_network(u'10.128.3.0/24')
+    view = reservations.SubnetReservationView(shared, [mine])
+    assert mine not in view
+    assert len(view) == 7
+    assert view.nextFree(pool, 24) == mine
+
+    # Reservations added to the view do not change the shared set.
+    view.add(mine)
+    assert mine in view
+    assert view.nextFree(pool, 24) == ipaddress.ip_network(u'10.128.8.0/24')
+    assert len(shared) == 8
+
+    # A subnet that is also reserved by someone else is still in use.
+    shared.add(mine)
+    view = reservations.SubnetReservationView(shared, [mine])
+    assert mine in view
+    assert view.nextFree(pool, 24) == ipaddress.ip_network(u'10.128.8.0/24')
+
+    # A larger excluded network frees only the space it alone covers.
+    shared = reservations.SubnetReservationSet()
+    big = ipaddress.ip_network(u'10.128.0.0/22')
+    shared.add(big)
+    shared.add(ipaddress.ip_network(u'10.128.1.0/24'))
+    view = reservations.SubnetReservationView(shared, [big])
+    assert view.nextFree(pool, 24) == ipaddress.ip_network(u'10.128.0.0/24')
+    assert view.nextFree(pool, 23) == ipaddress.ip_network(u'10.128.2.0/23')
+
+
+def test_SubnetReservationSet_remove():
+    resv = reservations.SubnetReservationSet()
+    nets = [ipaddress.ip_network(u'10.0.{}.0/24'.format(i)) for i in range(6)]
+    for net in nets:
+        resv.add(net)
+    assert resv.intervals[4] == ([int(nets[0].network_address)],
+                                 [int(nets[5].broadcast_address)])
+
+    # Removing a network from the middle splits only its interval.
+    resv.remove(nets[2])
+    assert nets[2] not in resv
+    assert len(resv.intervals[4][0]) == 2
+    assert all(net in resv for net in nets if net != nets[2])
+
+    resv.remove(nets[2])
+    assert len(resv) == 5
+
+    for net in nets:
+        resv.remove(net)
+    assert len(resv) == 0
+    assert resv.intervals[4] == ([], [])
+
+
+def test_SubnetReservationSet_remove_nested():
+    resv = reservations.SubnetReservationSet()
+    outer = ipaddress.ip_network(u'10.0.0.0/22')
+    inner = [ipaddress.ip_network(u'10.0.1.0/24'),
+             ipaddress.ip_network(u'10.0.2.128/25')]
+    after = ipaddress.ip_network(u'10.0.4.0/24')
+    for net in [outer, after] + inner:
+        resv.add(net)
+
+    # Removing a network inside a reserved supernet changes nothing else.
+    resv.remove(inner[0])
+    assert resv.intervals[4] == ([int(outer.network_address)],
+                                 [int(after.broadcast_address)])
+    assert resv.findReserved(4, int(inner[0].network_address),
+            int(inner[0].broadcast_address)) == \
+        (int(outer.network_address), int(outer.broadcast_address))
+
+    # Removing the supernet leaves the networks inside of it and the
+    # neighbour that follows.
+    resv.remove(outer)
+    assert resv.intervals[4] == (
+        [int(inner[1].network_address), int(after.network_address)],
+        [int(inner[1].broadcast_address), int(after.broadcast_address)])
+    assert resv.findReserved(4, int(inner[0].network_address),
+            int(inner[0].broadcast_address)) is None
+
+
+def test_chooseSubnet_scaling():
+    """
+    Test allocating many chute networks from a large pool
+    """
+    from paradrop.core.config import network
+
+    host_config = {
+        'system': {
+            'chuteSubnetPool': '10.128.0.0/9',
+            'chutePrefixSize': 24
+        }
+    }
+
+    resv = reservations.SubnetReservationSet()
+    update = MagicMock()
+    update.cache_get.side_effect = lambda key: {
+        'subnetReservations': resv,
+        'hostConfig': host_config
+    }[key]
+
+    count = 5000
+    subnets = [network.chooseSubnet(update, {}, {}) for i in range(count)]
+
+    assert len(set(subnets)) == count
+    assert subnets[-1] == ipaddress.ip_network(u'10.147.135.0/24')
+
+    # Consecutive networks are merged, so the next free network is found
+    # without walking the ones already allocated.
+    assert len(resv.intervals[4][0]) == 1
+
+    # Free a network in the middle, and it should be the next one chosen.
+    resv.remove(subnets[1000])
+    assert network.chooseSubnet(update, {}, {}) == subnets[1000]
+
+
+@patch("paradrop.core.config.state.subnetIndex")
+@patch("paradrop.core.config.state.ChuteStorage")
+def test_saveChute_updates_subnetIndex(ChuteStorage, subnetIndex):
+    from paradrop.core.config import state
+
+    store = ChuteStorage.return_value
+    update = MagicMock()
+    update.updateType = "create"
+    update.old = None
+    update.new.name = "chute1"
+
+    # Only the saved chute's subnets are updated.
+    state.saveChute(update)
+    store.getChute.assert_called_once_with("chute1")
+    subnetIndex.setChute.assert_called_once_with(store.getChute.return_value)
+
+    state.revertChute(update)
+    subnetIndex.removeChute.assert_called_once_with("chute1")
+
+    update.updateType = "delete"
+    update.old = MagicMock()
+    update.old.name = "chute1"
+    subnetIndex.removeChute.reset_mock()
+    state.saveChute(update)
+    subnetIndex.removeChute.assert_called_once_with("chute1")
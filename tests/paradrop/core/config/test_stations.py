@@ -0,0 +1,130 @@
+from mock import MagicMock, patch
+from twisted.internet import defer
+
+from paradrop.core.config import stations
+
+
+IW_OUTPUT = [
+    "Station 12:34:56:78:9a:bc (on wlan0)",
+    "	inactive time:  304 ms",
+    "	rx bytes:       18816",
+    "	rx packets:     75",
+    "	tx bytes:       5386",
+    "	tx packets:     21",
+    "	signal:         -45 [-49, -48] dBm",
+    "	tx bitrate:     54.0 MBit/s",
+    "	rx bitrate:     65.0 MBit/s MCS 7",
+    "	authorized:     yes",
+    "	mfp:            no",
+    "	preamble:       short",
+    "	wmm/wme:        yes",
+    "Station 12:34:56:78:9a:bd (on wlan0)",
+    "	rx bytes:       100"
+]
+
+
+def test_parseIwStations():
+    result = stations.parseIwStations(IW_OUTPUT)
+    assert len(result) == 2
+
+    station = result[0]
+    assert station['mac_addr'] == "12:34:56:78:9a:bc"
+    assert station['inactive_time'] == 304
+    assert station['rx_bytes'] == 18816
+    assert station['signal'] == -45
+    assert station['chain_signal'] == [-49, -48]
+    assert station['tx_bitrate'] == 54.0
+    assert station['rx_bitrate'] == 65.0
+    assert station['authorized'] is True
+    assert station['mfp'] is False
+    assert station['wmm_wme'] is True
+    assert station['preamble'] == "short"
+
+    assert result[1] == {'mac_addr': "12:34:56:78:9a:bd", 'rx_bytes': 100}
+
+
+def test_parseNetlinkStation():
+    rate = MagicMock()
+    rate.get_attr.side_effect = lambda name: {
+        'NL80211_RATE_INFO_BITRATE': 540
+    }.get(name, None)
+
+    info = MagicMock()
+    info.get_attr.side_effect = lambda name: {
+        'NL80211_STA_INFO_INACTIVE_TIME': 304,
+        'NL80211_STA_INFO_RX_BYTES': 18816,
+        'NL80211_STA_INFO_SIGNAL': -45,
+        'NL80211_STA_INFO_TX_BITRATE': rate,
+        'NL80211_STA_INFO_STA_FLAGS': {
+            'AUTHORIZED': True,
+            'SHORT_PREAMBLE': False
+        }
+    }.get(name, None)
+
+    msg = MagicMock()
+    msg.get_attr.side_effect = lambda name: {
+        'NL80211_ATTR_MAC': "12:34:56:78:9a:bc",
+        'NL80211_ATTR_STA_INFO': info
+    }.get(name, None)
+
+    station = stations.parseNetlinkStation(msg)
+    assert station['mac_addr'] == "12:34:56:78:9a:bc"
+    assert station['inactive_time'] == 304
+    assert station['rx_bytes'] == 18816
+    assert station['signal'] == -45
+    assert station['tx_bitrate'] == 54.0
+    assert 'rx_bitrate' not in station
+    assert station['authorized'] is True
+    assert station['mfp'] is False
+    assert station['preamble'] == "long"
+
+
+@patch("paradrop.core.config.stations.threads.deferToThread")
+def test_StationInfoService(deferToThread):
+    queries = []
+
+    def run(func, ifname):
+        d = defer.Deferred()
+        queries.append((ifname, d))
+        return d
+    deferToThread.side_effect = run
+
+    service = stations.StationInfoService()
+
+    # Requests that arrive during a query share its result.
+    results = []
+    service.getStations("wlan0").addCallback(results.append)
+    service.getStation("wlan0", "12:34:56:78:9A:BC").addCallback(results.append)
+    assert len(queries) == 1
+
+    queries[0][1].callback([{'mac_addr': "12:34:56:78:9a:bc", 'rx_bytes': 1}])
+    assert results[0] == [{'mac_addr': "12:34:56:78:9a:bc", 'rx_bytes': 1}]
+    assert results[1] == {'mac_addr': "12:34:56:78:9a:bc", 'rx_bytes': 1}
+
+    # Callers get their own copy of cached results.
+    results[0][0]['rx_bytes'] = 2
+    service.getStations("wlan0").addCallback(results.append)
+    assert len(queries) == 1
+    assert results[2][0]['rx_bytes'] == 1
+
+    # Bulk request queries only the interfaces that are not cached.
+    service.getAllStations({'wifi': "wlan0", 'guest': "wlan1"}).addCallback(
+        results.append)
+    assert len(queries) == 2
+    queries[1][1].callback([])
+    assert results[3]['wifi'][0]['rx_bytes'] == 1
+    assert results[3]['guest'] == []
+
+    # Failures are passed to all waiters and not cached.
+    service.invalidate("wlan0")
+    errors = []
+    service.getStations("wlan0").addErrback(errors.append)
+    service.getStations("wlan0").addErrback(errors.append)
+    queries[2][1].errback(Exception("iw failed"))
+    assert len(errors) == 2
+    assert "wlan0" not in service.cache
+
+    # Expired results are queried again.
+    service.cache['wlan1'] = (0, [])
+    service.getStations("wlan1")
+    assert len(queries) == 4
@@ -0,0 +1,91 @@
+from mock import patch, MagicMock
+from nose.tools import assert_raises
+
+import docker
+
+from paradrop.base.exceptions import ChuteNotFound
+from paradrop.core.container import docker_state
+
+
+def make_info(cid, name, status):
+    return {
+        'Id': cid,
+        'Name': '/' + name,
+        'State': {
+            'Running': status == 'running',
+            'Status': status
+        }
+    }
+
+
+@patch("paradrop.core.container.docker_state.get_api_client")
+def test_ContainerStateCache(get_api_client):
+    client = MagicMock()
+    get_api_client.return_value = client
+
+    infos = {
+        'a': make_info('a', 'chute1', 'running'),
+        'b': make_info('b', 'chute2', 'exited')
+    }
+
+    def inspect_container(cid):
+        if cid not in infos:
+            raise docker.errors.NotFound("missing")
+        return infos[cid]
+
+    client.containers.return_value = [{'Id': 'a'}, {'Id': 'b'}]
+    client.inspect_container.side_effect = inspect_container
+
+    cache = docker_state.ContainerStateCache()
+
+    # Before the cache is synchronized, lookups go to Docker.
+    assert cache.inspect('a')['Id'] == 'a'
+    assert_raises(ChuteNotFound, cache.inspect, 'chute3')
+
+    cache.sync(client)
+    client.inspect_container.reset_mock()
+
+    # Now lookups are answered from memory.
+    assert cache.inspect('chute1')['State']['Status'] == 'running'
+    assert cache.inspect('chute2')['State']['Status'] == 'exited'
+    assert_raises(ChuteNotFound, cache.inspect, 'chute3')
+    assert client.inspect_container.call_count == 0
+
+    # Container started.
+    infos['b'] = make_info('b', 'chute2', 'running')
+    cache.handleEvent(client, {'Action': 'start', 'Actor': {'ID': 'b'}})
+    assert cache.inspect('chute2')['State']['Status'] == 'running'
+
+    # Exec events do not change container state.
+    cache.handleEvent(client, {'Action': 'exec_start: ls', 'Actor': {'ID': 'b'}})
+    assert client.inspect_container.call_count == 1
+
+    # Container renamed.
+    infos['b'] = make_info('b', 'chute4', 'running')
+    cache.handleEvent(client, {'Action': 'rename', 'Actor': {'ID': 'b'}})
+    assert_raises(ChuteNotFound, cache.inspect, 'chute2')
+    assert cache.inspect('chute4')['Id'] == 'b'
+
+    # Container removed.
+    del infos['a']
+    cache.handleEvent(client, {'Action': 'destroy', 'Actor': {'ID': 'a'}})
+    assert_raises(ChuteNotFound, cache.inspect, 'chute1')
+
+    # Container created by us.
+    infos['c'] = make_info('c', 'chute5', 'running')
+    client.inspect_container.side_effect = lambda name: infos['c']
+    cache.refresh('chute5')
+    assert cache.inspect('chute5')['Id'] == 'c'
+
+
+@patch("paradrop.core.container.docker_state.docker.DockerClient")
+def test_get_client(DockerClient):
+    docker_state._client = None
+    try:
+        client = docker_state.get_client()
+        assert docker_state.get_client() is client
+        assert docker_state.get_api_client() is client.api
+        DockerClient.assert_called_once_with(base_url=docker_state.DOCKER_URL,
+                version='auto')
+    finally:
+        docker_state._client = None
@@ -1,3 +1,5 @@
+import threading
+
 from mock import call, patch, MagicMock
 from nose.tools import assert_raises
 
@@ -35,7 +37,7 @@ def test_getPortList():
 @patch('paradrop.core.container.dockerapi._pull_image')
 @patch('paradrop.core.container.dockerapi._build_image')
 @patch('paradrop.core.container.dockerapi.settings')
-@patch('docker.APIClient')
+@patch('paradrop.core.container.dockerapi.docker_state.get_api_client')
 def test_prepare_image(Client, settings, _build_image, _pull_image, downloader):
     client = MagicMock()
     Client.return_value = client
@@ -65,6 +67,109 @@ def test_prepare_image(Client, settings, _build_image, _pull_image, downloader):
     assert_raises(Exception, dockerapi.prepare_image, update, service)
 
 
+def make_service(name, type, image=None):
+    service = MagicMock()
+    service.name = name
+    service.type = type
+    service.image = image
+    service.get_image_name.return_value = image or "{}:1".format(name)
+    return service
+
+
+def make_rendezvous(count):
+    """
+    Return a function that blocks until it has been called by count threads.
+    """
+    lock = threading.Lock()
+    arrived = []
+    ready = threading.Event()
+
+    def rendezvous():
+        with lock:
+            arrived.append(None)
+            if len(arrived) >= count:
+                ready.set()
+        if not ready.wait(5):
+            raise Exception("Timed out waiting for {} threads".format(count))
+
+    return rendezvous
+
+
+@patch('paradrop.core.container.dockerapi.Dockerfile')
+@patch('paradrop.core.container.dockerapi._pull_image')
+@patch('paradrop.core.container.dockerapi._build_image')
+@patch('paradrop.core.container.dockerapi.settings')
+@patch('paradrop.core.container.dockerapi.docker_state.get_api_client')
+def test_prepare_images(Client, settings, _build_image, _pull_image, Dockerfile):
+    settings.CONCURRENT_BUILDS = False
+    settings.IMAGE_PREPARE_CONCURRENCY = 3
+
+    Dockerfile.return_value.getBaseImage.return_value = "amd64/python:2.7"
+
+    services = [
+        make_service("web", "image", "nginx"),
+        make_service("cache", "image", "nginx"),
+        make_service("app", "light", "python2"),
+        make_service("worker", "light", "python2")
+    ]
+
+    # Each pull (or build) only finishes once both are running at the same
+    # time.
+    pulling = make_rendezvous(2)
+    building = make_rendezvous(2)
+
+    def pull(update, client, image_name):
+        update.progress("pulled {}".format(image_name))
+        pulling()
+    _pull_image.side_effect = pull
+
+    def build(update, service, client, inline, **buildArgs):
+        building()
+    _build_image.side_effect = build
+
+    update = MagicMock()
+
+    dockerapi.prepare_images(update, services)
+
+    # Each image is only pulled once, and the light services build without
+    # pulling the base image again.
+    pulled = sorted(c[0][2] for c in _pull_image.call_args_list)
+    assert pulled == ["amd64/python:2.7", "nginx"]
+    assert _build_image.call_count == 2
+    for c in _build_image.call_args_list:
+        assert c[1]['pull'] is False
+
+    # Progress messages are labeled with the service name.
+    update.progress.assert_any_call("[web] pulled nginx")
+
+    # One failure cancels the rest and is raised.
+    _build_image.reset_mock()
+    _pull_image.side_effect = Exception("pull failed")
+    assert_raises(Exception, dockerapi.prepare_images, update, services)
+    assert _build_image.call_count == 0
+
+    # A build waiting on its base image does not start after the pull fails,
+    # even when it is the only job left.
+    settings.IMAGE_PREPARE_CONCURRENCY = 2
+    for i in range(20):
+        assert_raises(Exception, dockerapi.prepare_images, update,
+                      [make_service("app", "light", "python2")])
+    assert _build_image.call_count == 0
+
+
+def test_ServiceProgress():
+    update = MagicMock()
+    cancelled = dockerapi.threading.Event()
+
+    progress = dockerapi.ServiceProgress(update, "main", cancelled)
+    progress.progress("hello")
+    update.progress.assert_called_once_with("[main] hello")
+    assert progress.name == update.name
+
+    cancelled.set()
+    assert_raises(Exception, progress.progress, "hello")
+
+
 def test_buildImage_worker():
     update = MagicMock()
     service = MagicMock()
@@ -83,7 +188,7 @@ def test_buildImage_worker():
     update.progress.assert_has_calls([call("Message1"), call("Message3")])
 
 
-@patch('docker.APIClient')
+@patch('paradrop.core.container.dockerapi.docker_state.get_client')
 def test_remove_image(Client):
     client = MagicMock()
     Client.return_value = client
@@ -92,11 +197,11 @@ def test_remove_image(Client):
     service = MagicMock()
 
     dockerapi.remove_image(update, service)
-    assert client.remove_image.called_once_with(image="test:1")
+    assert client.images.remove.called_once_with(image="test:1")
 
     # Current behavior is to eat the exception, so this call should not raise
     # anything.
-    client.remove_image.side_effect = Exception("Image does not exist.")
+    client.images.remove.side_effect = Exception("Image does not exist.")
     dockerapi.remove_image(update, service)
 
 
@@ -122,11 +227,15 @@ def test_prepare_environment(core):
     assert env['CUSTOM_VARIABLE'] == 42
     assert env['CHUTE_VARIABLE'] == 'test'
 
+@patch('paradrop.core.container.dockerapi.netlink.available')
 @patch('paradrop.core.container.dockerapi.subprocess')
 @patch('paradrop.core.container.dockerapi.ChuteContainer.getPID')
 @patch('paradrop.core.container.dockerapi.call_in_netns')
 @patch('paradrop.core.container.dockerapi.call_retry')
-def test_setup_net_interfaces(call_retry, call_in_netns, getPID, subprocess):
+def test_setup_net_interfaces(call_retry, call_in_netns, getPID, subprocess,
+        available):
+    available.return_value = False
+
     update = MagicMock()
     update.cache_get.return_value = [{
         'service': 'main',
@@ -159,6 +268,46 @@ def test_setup_net_interfaces(call_retry, call_in_netns, getPID, subprocess):
     assert call_retry.called
 
 
+@patch('paradrop.core.container.dockerapi.netlink')
+@patch('paradrop.core.container.dockerapi.ChuteContainer.getPID')
+@patch('paradrop.core.container.dockerapi.call_in_netns')
+@patch('paradrop.core.container.dockerapi.call_retry')
+def test_setup_net_interfaces_netlink(call_retry, call_in_netns, getPID, netlink):
+    netlink.available.return_value = True
+    session = netlink.NetlinkSession.return_value
+    getPID.return_value = 1234
+
+    update = MagicMock()
+    update.cache_get.return_value = [{
+        'service': 'main',
+        'type': 'wifi-ap',
+        'ipaddrWithPrefix': '10.0.0.1/24',
+        'internalIntf': 'wlan0',
+        'externalIntf': 'vwlan0'
+    }, {
+        'service': 'main',
+        'type': 'vlan',
+        'ipaddrWithPrefix': '10.0.1.1/24',
+        'internalIntf': 'eth1',
+        'externalIntf': 'eth0.5'
+    }]
+
+    dockerapi.setup_net_interfaces(update)
+
+    # Everything should be done in-process using one session.
+    assert session.add_macvlan.call_count == 2
+    session.add_macvlan.assert_any_call(1234, 'vwlan0', 'wlan0', '10.0.0.1/24')
+    assert not call_retry.called
+    assert not call_in_netns.called
+    session.close.assert_called_once()
+
+    # Fall back to ip commands if netlink fails.
+    session.add_macvlan.side_effect = Exception("Operation not supported")
+    dockerapi.setup_net_interfaces(update)
+    assert call_retry.called
+    assert call_in_netns.called
+
+
 @patch("paradrop.core.container.dockerapi.ChuteContainer")
 def test_prepare_port_bindings(ChuteContainer):
     chute = Chute(name="test")
@@ -191,3 +340,32 @@ def test_prepare_port_bindings(ChuteContainer):
 
     bindings = dockerapi.prepare_port_bindings(service)
     assert bindings["80/tcp"] == "32784"
+
+
+@patch('paradrop.core.container.dockerapi.docker_state')
+def test_container_changes_refresh_cache(docker_state):
+    client = docker_state.get_client.return_value
+
+    update = MagicMock()
+    update.name = "test"
+
+    dockerapi.stopChute(update)
+    client.containers.get.return_value.stop.assert_called_once_with()
+    docker_state.cache.refresh.assert_called_once_with("test")
+
+    docker_state.cache.refresh.reset_mock()
+    dockerapi.restartChute(update)
+    client.containers.get.return_value.start.assert_called_once_with()
+    docker_state.cache.refresh.assert_called_once_with("test")
+
+    # Removed containers are refreshed even if the removal failed.
+    first = MagicMock()
+    first.name = "first"
+    second = MagicMock()
+    second.name = "second"
+    second.remove.side_effect = Exception("Container is in use")
+    client.containers.list.return_value = [first, second]
+
+    docker_state.cache.refresh.reset_mock()
+    dockerapi.removeAllContainers(update)
+    docker_state.cache.refresh.assert_has_calls([call("first"), call("second")])
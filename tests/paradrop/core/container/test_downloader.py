@@ -1,7 +1,19 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+
+import pycurl
+from six.moves import BaseHTTPServer
 from mock import MagicMock, patch
 from nose.tools import assert_raises
 
-from paradrop.core.container.downloader import Downloader
+from paradrop.core.container import download_cache
+from paradrop.core.container.downloader import Downloader, GithubDownloader, \
+        WebDownloader
 
 
 def test_github_re():
@@ -36,6 +48,8 @@ def test_Downloader_extract(tarfile):
 
     badfile = MagicMock()
     badfile.name = ".."
+    badfile.issym.return_value = False
+    badfile.islnk.return_value = False
     tar.__iter__.return_value = [badfile]
 
     # Exception: Archive contains a forbidden path: ..
@@ -49,6 +63,8 @@ def test_Downloader_extract(tarfile):
 
     srcdir = MagicMock()
     srcdir.name = "project-0123456789abcdef"
+    srcdir.issym.return_value = False
+    srcdir.islnk.return_value = False
     tar.__iter__.return_value = [srcdir]
 
     # Exception: Repository does not contain a Dockerfile
@@ -56,7 +72,279 @@ def test_Downloader_extract(tarfile):
 
     dockerfile = MagicMock()
     dockerfile.name = "project-0123456789abcdef/Dockerfile"
+    dockerfile.issym.return_value = False
+    dockerfile.islnk.return_value = False
     tar.__iter__.return_value = [srcdir, dockerfile]
+    tar.extract.reset_mock()
 
     rundir = downloader.extract()
     assert rundir == "/tmp/project-0123456789abcdef"
+    assert tar.extract.call_count == 2
+
+    # Exception: Archive contains a forbidden path: ../../etc
+    link = MagicMock()
+    link.name = "project-0123456789abcdef/link"
+    link.issym.return_value = True
+    link.linkname = "../../etc"
+    tar.__iter__.return_value = [srcdir, link, dockerfile]
+    assert_raises(Exception, downloader.extract)
+
+
+def make_archive(files):
+    data = io.BytesIO()
+    tar = tarfile.open(fileobj=data, mode="w:gz")
+    for name, content in files:
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    tar.close()
+    return data.getvalue()
+
+
+def test_Downloader_extract_symlink_chain():
+    # Each link target looks harmless on its own, but d2 resolves to the
+    # parent of the work directory through d.
+    data = io.BytesIO()
+    tar = tarfile.open(fileobj=data, mode="w:gz")
+
+    info = tarfile.TarInfo("x")
+    info.type = tarfile.DIRTYPE
+    tar.addfile(info)
+
+    for name, target in [("d", "x/.."), ("d2", "d/..")]:
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.SYMTYPE
+        info.linkname = target
+        tar.addfile(info)
+
+    for name, content in [("d2/escaped.txt", b"escaped\n"),
+                          ("Dockerfile", b"FROM scratch\n")]:
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+    tar.close()
+
+    parent = tempfile.mkdtemp()
+    try:
+        workDir = os.path.join(parent, "work")
+        os.mkdir(workDir)
+
+        for stream in [False, True]:
+            downloader = Downloader("http://example.com")
+            downloader.workDir = workDir
+            downloader.tarFile = os.path.join(parent, "source.tar.gz")
+            with open(downloader.tarFile, "wb") as output:
+                output.write(data.getvalue())
+
+            if stream:
+                assert_raises(Exception, downloader.extract,
+                              io.BytesIO(data.getvalue()))
+            else:
+                assert_raises(Exception, downloader.extract)
+            assert not os.path.exists(os.path.join(parent, "escaped.txt"))
+
+            shutil.rmtree(workDir)
+            os.mkdir(workDir)
+    finally:
+        shutil.rmtree(parent)
+
+
+class ArchiveServer(object):
+    """
+    HTTP server that serves one archive with an ETag.
+    """
+    def __init__(self, archive, etag='"v1"'):
+        self.archive = archive
+        self.etag = etag
+        self.requests = []
+
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.headers.get('If-None-Match'))
+                if self.headers.get('If-None-Match') == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', server.etag)
+                self.send_header('Content-Length', str(len(server.archive)))
+                self.end_headers()
+                self.wfile.write(server.archive)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = "http://127.0.0.1:{}/source.tar.gz".format(
+                self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_DownloadCache():
+    path = tempfile.mkdtemp()
+    try:
+        cache = download_cache.DownloadCache(path, 100)
+        assert cache.lookup("a") is None
+
+        for key, size in [("a", 60), ("b", 30)]:
+            with cache.newTempFile() as output:
+                output.write(b"x" * size)
+            cache.store(key, key * 8, output.name, etag='"e"')
+
+        entry = cache.lookup("a")
+        assert entry['etag'] == '"e"'
+        assert os.path.isfile(entry['path'])
+
+        cache.alias("a2", "a")
+        cache.update("a", meta={'CommitHash': 'abc'})
+        assert cache.lookup("a")['meta'] == {'CommitHash': 'abc'}
+        assert cache.lookup("a2")['digest'] == entry['digest']
+
+        # The index survives a restart.
+        cache = download_cache.DownloadCache(path, 100)
+        assert cache.lookup("b") is not None
+
+        # Adding c goes over the limit, so the least recently used archive
+        # (a, which was looked up before b) is removed.
+        os.utime(cache.archivePath("a" * 8), (1, 1))
+        with cache.newTempFile() as output:
+            output.write(b"x" * 30)
+        cache.store("c", "c" * 8, output.name)
+
+        assert cache.lookup("a") is None
+        assert cache.lookup("a2") is None
+        assert cache.lookup("b") is not None
+        assert cache.lookup("c") is not None
+    finally:
+        shutil.rmtree(path)
+
+
+def test_WebDownloader_cache():
+    archive = make_archive([
+        ("project/Dockerfile", b"FROM scratch\n"),
+        ("project/app.py", b"print('hello')\n")
+    ])
+    server = ArchiveServer(archive)
+
+    path = tempfile.mkdtemp()
+    cache = download_cache.DownloadCache(path, 1024 * 1024)
+    try:
+        with patch("paradrop.core.container.download_cache.get_cache",
+                   return_value=cache):
+            with WebDownloader(server.url) as dl:
+                rundir, meta = dl.fetch()
+                assert os.path.isfile(os.path.join(rundir, "Dockerfile"))
+                assert os.path.isfile(os.path.join(rundir, "app.py"))
+
+            # The second download is answered with 304 and extracted from
+            # the cache.
+            with WebDownloader(server.url) as dl:
+                rundir, meta = dl.fetch()
+                assert os.path.isfile(os.path.join(rundir, "app.py"))
+
+            assert server.requests == [None, '"v1"']
+            assert len([n for n in os.listdir(path) if n.endswith(".tar")]) == 1
+
+            # A bad archive is rejected and not cached.
+            server.archive = make_archive([("../Dockerfile", b"")])
+            server.etag = '"v2"'
+            with WebDownloader(server.url) as dl:
+                assert_raises(Exception, dl.fetch)
+            assert len([n for n in os.listdir(path) if n.endswith(".tmp")]) == 0
+    finally:
+        server.stop()
+        shutil.rmtree(path)
+
+
+@patch("paradrop.core.container.downloader.pycurl.Curl")
+def test_GithubDownloader_cached_commit(Curl):
+    commit = "0123456789abcdef0123456789abcdef01234567"
+    archive = make_archive([
+        ("owner-repo-0123456/Dockerfile", b"FROM scratch\n")
+    ])
+
+    path = tempfile.mkdtemp()
+    cache = download_cache.DownloadCache(path, 1024 * 1024)
+    try:
+        with cache.newTempFile() as output:
+            output.write(archive)
+        key = "github:owner/repo@{}".format(commit)
+        cache.store(key, "digest", output.name, meta={'CommitMessage': 'test'})
+
+        # A cached commit should not touch the network.
+        Curl.side_effect = Exception("network access")
+        with patch("paradrop.core.container.download_cache.get_cache",
+                   return_value=cache):
+            with GithubDownloader("https://github.com/owner/repo",
+                    checkout=commit, repo_owner="owner",
+                    repo_name="repo") as dl:
+                rundir, meta = dl.fetch()
+                assert rundir.endswith("owner-repo-0123456")
+                assert meta['CommitMessage'] == 'test'
+    finally:
+        shutil.rmtree(path)
+
+
+def test_GithubDownloader_cacheKey():
+    from paradrop.core.container.downloader import commit_re
+
+    dl = GithubDownloader("https://github.com/owner/repo", user="owner",
+            repo_owner="owner", repo_name="repo")
+    assert dl.cacheKey("master") == "github:owner/repo@master"
+
+    # Private downloads must not be shared between users.
+    dl = GithubDownloader("https://github.com/owner/repo", user="alice",
+            secret="secret", repo_owner="owner", repo_name="repo")
+    assert dl.cacheKey("master") == "github:owner/repo@master#alice"
+
+    # Only full hashes are treated as immutable commits.
+    assert commit_re.match("0123456789abcdef0123456789abcdef01234567")
+    assert commit_re.match("0123456") is None
+    assert commit_re.match("deadbeef") is None
+
+
+@patch("paradrop.core.container.downloader.pycurl.Curl")
+def test_GithubDownloader_meta_alias(Curl):
+    commit = "0123456789abcdef0123456789abcdef01234567"
+
+    conn = MagicMock()
+    options = {}
+    conn.setopt.side_effect = lambda opt, value: options.__setitem__(opt, value)
+    conn.perform.side_effect = lambda: options[pycurl.WRITEFUNCTION](
+        json.dumps({'sha': commit, 'commit': {'message': 'test'}}))
+    conn.getinfo.return_value = 200
+    Curl.return_value = conn
+
+    path = tempfile.mkdtemp()
+    cache = download_cache.DownloadCache(path, 1024 * 1024)
+    try:
+        with cache.newTempFile() as output:
+            output.write(b"x")
+        key = "github:owner/repo@master"
+        cache.store(key, "digest", output.name)
+
+        with patch("paradrop.core.container.download_cache.get_cache",
+                   return_value=cache):
+            with GithubDownloader("https://github.com/owner/repo",
+                    repo_owner="owner", repo_name="repo") as dl:
+                dl.cacheKeys.append(key)
+                dl.commitHash = commit[:7]
+                meta = dl.meta()
+                assert meta['CommitMessage'] == 'test'
+
+        # The archive is found under the full hash, not the short one.
+        entry = cache.lookup("github:owner/repo@{}".format(commit))
+        assert entry['digest'] == "digest"
+        assert entry['meta']['CommitMessage'] == 'test'
+        assert cache.lookup("github:owner/repo@0123456") is None
+    finally:
+        shutil.rmtree(path)
@@ -4,28 +4,67 @@ from nose.tools import assert_raises
 from paradrop.core.container import log_provider
 
 
+def test_parse_log_line():
+    msg = log_provider.parse_log_line("main", b"0 MessageA\n")
+    assert msg == {'service': 'main', 'timestamp': '0', 'message': 'MessageA'}
+
+    msg = log_provider.parse_log_line("main", "MessageB")
+    assert msg == {'service': 'main', 'message': 'MessageB'}
+
+    msg = log_provider.parse_log_line("main", {"message": "MessageC"})
+    assert msg == {'service': 'main', 'message': 'MessageC'}
+
+    assert log_provider.parse_log_line("main", None) is None
+
+
+@patch("paradrop.core.container.log_provider.reactor")
 @patch("paradrop.core.container.log_provider.docker.DockerClient")
-def test_monitor_logs(DockerClient):
+def test_LogHub(DockerClient, reactor):
+    # Deliver messages immediately instead of through the reactor.
+    reactor.callFromThread.side_effect = lambda func, *args: func(*args)
+
     client = MagicMock()
     DockerClient.return_value = client
 
     container = MagicMock()
     client.containers.get.return_value = container
-
-    logs = [
-        "0 MessageA",
-        "MessageB",
-        {"message": "MessageC"}
+    container.logs.return_value = [
+        b"0 MessageA",
+        "1 MessageB"
     ]
-    container.logs.return_value = logs
 
-    output = []
-    queue = MagicMock()
-    queue.put = output.append
+    service = MagicMock()
+    service.name = "main"
+    service.get_container_name.return_value = "chute-main"
+
+    chute = MagicMock()
+    chute.name = "chute"
+    chute.get_services.return_value = [service]
+
+    first = []
+    hub = log_provider.subscribe(chute, first.append)
+    for thread in hub.threads:
+        thread.join()
+
+    assert len(first) == 2
+    assert first[0]['message'] == "MessageA"
+    assert first[1]['timestamp'] == "1"
+
+    # A second subscriber shares the same hub and receives the buffered
+    # messages without another Docker request.
+    second = []
+    assert log_provider.subscribe(chute, second.append) is hub
+    assert second == first
+    assert container.logs.call_count == 1
 
-    log_provider.monitor_logs("main", "chute-main", queue)
+    # New messages go to every subscriber.
+    hub.publish({'service': 'main', 'message': 'MessageC'})
+    assert first[-1]['message'] == "MessageC"
+    assert second[-1]['message'] == "MessageC"
 
-    assert len(output) == 3
-    assert output[0]['message'] == "MessageA"
-    assert output[1]['message'] == "MessageB"
-    assert output[2]['message'] == "MessageC"
+    # The hub is removed when the last subscriber leaves.
+    log_provider.unsubscribe(chute, first.append)
+    assert hub.running
+    log_provider.unsubscribe(chute, second.append)
+    assert not hub.running
+    assert "chute" not in log_provider.hubs
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import time
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises
+
+from paradrop.core.container import netlink
+
+
+def test_NetlinkSession_netns():
+    """
+    Test netlink interface setup against a throwaway network namespace
+    """
+    if netlink.IPRoute is None or os.geteuid() != 0:
+        raise SkipTest("requires pyroute2 and root")
+
+    suffix = "{:x}".format(os.getpid() & 0xffff)
+    nsname = "pdtest" + suffix
+    parent = "pdv" + suffix
+    peer = "pdp" + suffix
+
+    try:
+        subprocess.check_call(["ip", "netns", "add", nsname])
+    except (OSError, subprocess.CalledProcessError):
+        raise SkipTest("cannot create network namespaces")
+
+    # A process in the namespace stands in for the chute container.
+    proc = subprocess.Popen(["ip", "netns", "exec", nsname, "sleep", "30"])
+    session = None
+    try:
+        subprocess.check_call(["ip", "link", "add", parent, "type", "veth",
+                               "peer", "name", peer])
+
+        # Wait for the process to enter the namespace.
+        for i in range(50):
+            if os.stat("/proc/{}/ns/net".format(proc.pid)).st_ino == \
+                    os.stat("/var/run/netns/{}".format(nsname)).st_ino:
+                break
+            time.sleep(0.1)
+
+        session = netlink.NetlinkSession()
+        session.add_macvlan(proc.pid, parent, "eth1", "10.99.0.1/24")
+
+        output = subprocess.check_output(["ip", "netns", "exec", nsname,
+                                          "ip", "addr", "show", "eth1"])
+        assert b"10.99.0.1/24" in output
+        assert b"UP" in output
+
+        session.rename_link(proc.pid, "eth1", "mon0", "down")
+        output = subprocess.check_output(["ip", "netns", "exec", nsname,
+                                          "ip", "link", "show"])
+        assert b"mon0" in output
+        assert b"eth1" not in output
+
+        # A failed setup should not leave a temporary interface behind.
+        assert_raises(Exception, session.add_macvlan, proc.pid, parent,
+                      "mon0", "10.99.1.1/24")
+        output = subprocess.check_output(["ip", "netns", "exec", nsname,
+                                          "ip", "link", "show"])
+        assert b"tmp" not in output
+    finally:
+        if session is not None:
+            session.close()
+        proc.kill()
+        proc.wait()
+        subprocess.call(["ip", "link", "del", parent])
+        subprocess.call(["ip", "netns", "del", nsname])
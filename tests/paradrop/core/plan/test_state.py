@@ -22,3 +22,31 @@ def test_state_generatePlans():
     update.old.version = 2
     update.new.version = 1
     assert generatePlans(update) is True
+
+
+@patch("paradrop.core.plan.state.settings")
+def test_generate_service_plans(settings):
+    from paradrop.core.container import dockerapi
+    from paradrop.core.plan.state import generate_service_plans
+
+    services = [MagicMock(), MagicMock()]
+
+    update = MagicMock()
+    update.updateType = "create"
+    update.new.get_services.return_value = services
+    update.new.isRunning.return_value = False
+    update.old = None
+
+    # Images for multiple services are prepared in one parallel plan.
+    settings.IMAGE_PREPARE_CONCURRENCY = 3
+    generate_service_plans(update)
+    funcs = [c[0][1][0] for c in update.plans.addPlans.call_args_list]
+    assert funcs.count(dockerapi.prepare_images) == 1
+    assert funcs.count(dockerapi.prepare_image) == 0
+
+    update.plans.addPlans.reset_mock()
+    settings.IMAGE_PREPARE_CONCURRENCY = 1
+    generate_service_plans(update)
+    funcs = [c[0][1][0] for c in update.plans.addPlans.call_args_list]
+    assert funcs.count(dockerapi.prepare_images) == 0
+    assert funcs.count(dockerapi.prepare_image) == 2
@@ -0,0 +1,89 @@
+from mock import MagicMock, patch
+
+from paradrop.core.system import node_facts
+
+
+def test_NodeFacts():
+    compute = MagicMock()
+    compute.return_value = {'version': '1.0', 'list': [1, 2]}
+
+    facts = node_facts.NodeFacts()
+    facts.register('software', compute)
+
+    # Facts are computed once.
+    result = facts.get('software')
+    body, etag = facts.getJSON('software')
+    assert result == compute.return_value
+    assert compute.call_count == 1
+    assert body == '{"list": [1, 2], "version": "1.0"}'
+    assert etag == node_facts.makeETag(body)
+    assert etag.startswith('"') and etag.endswith('"')
+
+    # Callers get their own copy.
+    result['list'].append(3)
+    assert facts.get('software')['list'] == [1, 2]
+    assert compute.call_count == 1
+
+    compute.return_value = {'version': '2.0'}
+    facts.invalidate('software')
+    body2, etag2 = facts.getJSON('software')
+    assert compute.call_count == 2
+    assert etag2 != etag
+
+    # Facts computed while the group is invalidated are not stored.
+    def racing_compute():
+        facts.invalidate()
+        return {'version': '3.0'}
+    facts.register('software', racing_compute)
+    assert facts.get('software') == {'version': '3.0'}
+    assert 'software' not in facts.cache
+
+
+@patch("paradrop.core.system.node_facts.time")
+def test_NodeFacts_maxAge(time):
+    compute = MagicMock()
+    compute.return_value = {}
+    time.time.return_value = 100
+
+    facts = node_facts.NodeFacts()
+    facts.register('hardware', compute, maxAge=10)
+
+    facts.get('hardware')
+    time.time.return_value = 109
+    facts.get('hardware')
+    assert compute.call_count == 1
+
+    time.time.return_value = 111
+    facts.get('hardware')
+    assert compute.call_count == 2
+
+
+@patch("paradrop.core.system.node_facts.virtual_memory")
+@patch("paradrop.core.system.node_facts.devices")
+@patch("paradrop.core.system.node_facts.pdos")
+def test_getHardwareFacts(pdos, devices, virtual_memory):
+    pdos.read_sys_file.return_value = "PC Engines"
+    devices.detectSystemDevices.return_value = {
+        'wifi': [
+            {'id': 'pci-wifi-0', 'mac': '00:11:22:33:44:55', 'vendor': '0x168c',
+             'device': '0x003c', 'slot': 'pci/0000:04:00.0'},
+            {'mac': '00:11:22:33:44:56'}
+        ]
+    }
+    virtual_memory.return_value.total = 1024
+
+    hardware = node_facts.getHardwareFacts()
+    assert hardware['memory'] == 1024
+    assert len(hardware['wifi']) == 1
+    assert hardware['wifi'][0]['macAddr'] == '00:11:22:33:44:55'
+
+
+def test_facts_invalidated_by_device_inventory():
+    node_facts.facts.cache['hardware'] = {}
+    node_facts.facts.cache['software'] = {}
+
+    node_facts.devices.inventory.invalidate()
+    assert 'hardware' not in node_facts.facts.cache
+    assert 'software' in node_facts.facts.cache
+
+    node_facts.facts.invalidate()
@@ -37,3 +37,71 @@ def test_update_manager(mReload, mUpdObj, mOut):
     #assert mUpdObj.parse.call_count == 3
     #assert update.execute.call_count == 2
 
+
+
+@patch('paradrop.core.update.update_manager.out')
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_update_manager_wakeup(mReload, mOut):
+    import threading
+
+    reactor = MagicMock()
+    c = update_manager.UpdateManager(reactor)
+
+    result = []
+    def worker():
+        result.append(c._get_next_update(timeout=10))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+
+    # The waiting worker should receive the update right away rather than
+    # when its timeout expires.
+    c.add_update(name='test1', updateClass='CHUTE')
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result[0].name == 'test1'
+    assert result[0].queuedTime is None
+    assert result[0].queueWait >= 0
+
+    # Empty queue with a timeout.
+    assert c._get_next_update(timeout=0.01) is None
+
+
+@patch('paradrop.core.update.update_manager.out')
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_update_manager_history(mReload, mOut):
+    reactor = MagicMock()
+    c = update_manager.UpdateManager(reactor)
+
+    update = MagicMock()
+    update.change_id = 1
+    update.execute.return_value = None
+
+    c._perform_update(update)
+    assert c.find_change(1) is update
+    assert 1 not in c.active_changes
+
+    for i in range(2, update_manager.COMPLETED_CHANGES_HISTORY + 2):
+        update = MagicMock()
+        update.change_id = i
+        update.execute.return_value = None
+        c._perform_update(update)
+
+    assert len(c.completed_changes) == update_manager.COMPLETED_CHANGES_HISTORY
+    assert c.find_change(1) is None
+
+
+def test_update_timing():
+    update = update_object.parse(dict(name='test', updateClass='CHUTE',
+                                      updateType='create', tok=0))
+    timing = update.get_timing()
+    assert timing['created'] == update.createdTime
+    assert timing['started'] is None
+    assert timing['total_time'] is None
+
+    update.startTime = update.createdTime + 1
+    update.endTime = update.createdTime + 3
+    timing = update.get_timing()
+    assert timing['start_latency'] == 1
+    assert timing['run_time'] == 2
+    assert timing['total_time'] == 3
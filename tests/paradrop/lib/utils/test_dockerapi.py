@@ -53,7 +53,7 @@ def test_build_host_config(getBridgeGateway, ChuteContainer):
     assert res['privileged'] is True
 
 @patch('paradrop.core.container.dockerapi.out')
-@patch('docker.DockerClient')
+@patch('paradrop.core.container.dockerapi.docker_state.get_client')
 def test_restartChute(mockDocker, mockOutput):
     """
     Test that the restartChute function does it's job.
@@ -67,11 +67,11 @@ def test_restartChute(mockDocker, mockOutput):
     mockDocker.return_value = client
 
     dockerapi.restartChute(update)
-    mockDocker.assert_called_once_with(base_url='unix://var/run/docker.sock', version='auto')
+    mockDocker.assert_called_once_with()
     container.start.assert_called_once()
 
 @patch('paradrop.core.container.dockerapi.out')
-@patch('docker.DockerClient')
+@patch('paradrop.core.container.dockerapi.docker_state.get_client')
 def test_stopChute(mockDocker, mockOutput):
     """
     Test that the stopChute function does it's job.
@@ -85,11 +85,11 @@ def test_stopChute(mockDocker, mockOutput):
     mockDocker.return_value = client
 
     dockerapi.stopChute(update)
-    mockDocker.assert_called_once_with(base_url='unix://var/run/docker.sock', version='auto')
+    mockDocker.assert_called_once_with()
     container.stop.assert_called_once()
 
 @patch('paradrop.core.container.dockerapi.out')
-@patch('docker.DockerClient')
+@patch('paradrop.core.container.dockerapi.docker_state.get_client')
 def test_remove_container(mockDocker, mockOutput):
     """
     Test that the remove_container function does it's job.
@@ -105,7 +105,7 @@ def test_remove_container(mockDocker, mockOutput):
 
     mockDocker.return_value = client
     dockerapi.remove_container(update, service)
-    mockDocker.assert_called_once_with(base_url='unix://var/run/docker.sock', version='auto')
+    mockDocker.assert_called_once_with()
     container.remove.assert_called_once_with(force=True)
     #client.images.remove.assert_called_once()
     assert update.complete.call_count == 0
@@ -120,7 +120,7 @@ def test_remove_container(mockDocker, mockOutput):
 @patch('paradrop.core.container.dockerapi.prepare_environment')
 @patch('paradrop.core.container.dockerapi.build_host_config')
 @patch('paradrop.core.container.dockerapi.out')
-@patch('docker.DockerClient')
+@patch('paradrop.core.container.dockerapi.docker_state.get_client')
 def test_start_container(mockDocker, mockOutput, mockConfig, prepare_environment):
     """
     Test that the start_container function does it's job.
@@ -144,7 +144,7 @@ def test_start_container(mockDocker, mockOutput, mockConfig, prepare_environment
 
     dockerapi.start_container(update, service)
     mockConfig.assert_called_once_with(update, service)
-    mockDocker.assert_called_once_with(base_url='unix://var/run/docker.sock', version='auto')
+    mockDocker.assert_called_once_with()
     client.containers.run.assert_called_once()
 
     #Test when create or start throws exceptions
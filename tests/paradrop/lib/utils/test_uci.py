@@ -1,3 +1,9 @@
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
 from paradrop.lib.utils import uci
 
 
@@ -58,3 +64,95 @@ def test_getLineParts():
     parts = uci.getLineParts(line)
     assert len(parts) == 3
     assert parts[2] == ''
+
+
+def make_sections(chute, count):
+    sections = []
+    for i in range(count):
+        config = {'type': 'interface', 'name': '{}{}'.format(chute, i),
+                  'comment': chute}
+        options = {'ifname': 'eth{}'.format(i), 'proto': 'static',
+                   'dns': ['8.8.8.8', '8.8.4.4']}
+        sections.append((config, options))
+    return sections
+
+
+def test_chuteConfigsMatch():
+    a = make_sections("a", 3)
+    b = list(reversed(make_sections("a", 3)))
+    assert uci.chuteConfigsMatch(a, b)
+    assert uci.chuteConfigsMatch([], [])
+    assert not uci.chuteConfigsMatch(a, a[:2])
+    assert not uci.chuteConfigsMatch([], a)
+
+    # Values are compared as strings.
+    assert uci.chuteConfigsMatch([({'type': 'x'}, {'n': 1})],
+                                 [({'type': 'x'}, {'n': '1'})])
+    assert not uci.chuteConfigsMatch([({'type': 'x'}, {'n': 1})],
+                                     [({'type': 'x'}, {'n': '2'})])
+
+
+@patch("paradrop.lib.utils.uci.parseConfig", side_effect=uci.parseConfig)
+def test_UCIStore(parseConfig):
+    temp = tempfile.mkdtemp()
+    path = os.path.join(temp, "network")
+
+    config = uci.UCIConfig(path)
+    config.addConfigs(make_sections("a", 2) + make_sections("b", 3))
+    config.save(backupToken=None)
+
+    # The save does not leave a temporary file behind.
+    assert os.listdir(temp) == ["network"]
+
+    # The saved file does not need to be parsed again.
+    parseConfig.reset_mock()
+    config = uci.UCIConfig(path)
+    assert parseConfig.call_count == 0
+    assert len(config.config) == 5
+    assert [c['name'] for c, o in config.getChuteConfigs("b")] == ["b0", "b1", "b2"]
+    assert config.getChuteConfigs("c") == []
+
+    # Callers can modify their copies without affecting the cache.
+    config.config[0][1]['dns'].append('1.1.1.1')
+    config.delConfigs(config.getChuteConfigs("a"))
+    assert [c['name'] for c, o in config.getChuteConfigs("b")] == ["b0", "b1", "b2"]
+    assert len(uci.UCIConfig(path).getChuteConfigs("a")) == 2
+    assert uci.UCIConfig(path).config[0][1]['dns'] == ['8.8.8.8', '8.8.4.4']
+
+    # A change made by someone else is detected.
+    with open(path, "a") as output:
+        output.write("config interface c0 #c\n\toption ifname 'eth9'\n")
+    config = uci.UCIConfig(path)
+    assert parseConfig.call_count == 1
+    assert len(config.getChuteConfigs("c")) == 1
+
+    shutil.rmtree(temp)
+
+
+def test_UCIConfig_many_chutes():
+    """
+    Test finding one chute's sections in a file with hundreds of sections
+    """
+    temp = tempfile.mkdtemp()
+    path = os.path.join(temp, "network")
+
+    config = uci.UCIConfig(path)
+    for i in range(50):
+        config.addConfigs(make_sections("chute{}".format(i), 10))
+    config.save(backupToken=None)
+
+    new = make_sections("chute25", 10)
+
+    # The sections are found through the per-chute index of the loaded file.
+    config = uci.UCIConfig(path)
+    assert config.chutes is not None
+    assert len(config.config) == 500
+    old = config.getChuteConfigs("chute25")
+    assert uci.chuteConfigsMatch(old, new)
+    assert all(c['comment'] == "chute25" for c, o in old)
+
+    # A change to one option is detected.
+    new[3][1]['proto'] = 'dhcp'
+    assert not uci.chuteConfigsMatch(old, new)
+
+    shutil.rmtree(temp)